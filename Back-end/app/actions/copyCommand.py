@@ -1,24 +1,90 @@
+import asyncio
 import logging
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
 from uuid import UUID, uuid4
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.repositories.file_repository import FileRepository
 from app.repositories.folder_repository import FolderRepository
+from app.repositories.folder_stats_repository import FolderStatsRepository
+from app.repositories.storage_usage_repository import StorageUsageRepository, ACTIVE
 from app.security.copy_name import copy_name
 from app.security.path_sanitizer import safe_path_join, resolve_under_root
 from app.storage.local_cipherblob import cipherCloneStorage
+from app.services.chunk_store_service import ChunkStoreService
 
 logger = logging.getLogger(__name__)
 
+async def clone_file_content(session:AsyncSession, user_id:str, file, new_file_id:UUID, upload_root:str,
+                             local_storage:cipherCloneStorage, chunk_store:Optional[ChunkStoreService]) -> str:
+    """
+    Chunked files: copy only the blueprint manifest and add a reference to each chunk object.
+    Single-blob files: reflink / hard link / byte copy of the ciphertext.
+    Returns the new file_path.
+    """
+    if chunk_store is not None and chunk_store.is_manifest_key(file.file_path):
+        return await chunk_store.clone_manifest(session, user_id, file.file_path, str(new_file_id))
+
+    dest_path = safe_path_join(upload_root, f"{new_file_id}.enc")
+    src_path = resolve_under_root(upload_root, file.file_path)
+    await local_storage.clone_ciphertext(src_path, dest_path)
+    return str(dest_path)
+
+async def clone_files_content(session:AsyncSession, user_id:str, items:List[Tuple[Any, UUID]], upload_root:str,
+                              local_storage:cipherCloneStorage, chunk_store:Optional[ChunkStoreService], concurrency:int = 16) -> List[str]:
+    """
+    Batch clone_file_content for (file, new_file_id) pairs, in input order. Manifests go through
+    ChunkStoreService.clone_manifests (one refcount statement for the whole batch); blobs are
+    cloned concurrently. On failure everything already written is removed.
+    """
+    out: List[Optional[str]] = [None] * len(items)
+
+    manifest_pos = [i for i, (f, _) in enumerate(items) if chunk_store is not None and chunk_store.is_manifest_key(f.file_path)]
+    if manifest_pos:
+        keys = await chunk_store.clone_manifests(
+            session, user_id, [(items[i][0].file_path, str(items[i][1])) for i in manifest_pos], concurrency,
+        )
+        for i, key in zip(manifest_pos, keys):
+            out[i] = key
+
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def blob(i: int) -> None:
+        async with sem:
+            out[i] = await clone_file_content(session, user_id, items[i][0], items[i][1], upload_root, local_storage, None)
+
+    blob_pos = [i for i in range(len(items)) if out[i] is None]
+    results = await asyncio.gather(*(blob(i) for i in blob_pos), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        for path in out:
+            if path is not None:
+                await discard_file_content(user_id, path, upload_root, chunk_store)
+        raise errors[0]
+
+    return out
+
+async def discard_file_content(user_id:str, new_file_path:str, upload_root:str, chunk_store:Optional[ChunkStoreService]) -> None:
+    # the references taken by clone_manifest roll back with the transaction; only the file itself is ours to remove
+    try:
+        if chunk_store is not None and chunk_store.is_manifest_key(new_file_path):
+            await chunk_store.storage.delete_key(new_file_path)
+        else:
+            resolve_under_root(upload_root, new_file_path).unlink(missing_ok=True)
+    except Exception:
+        logger.exception("copy cleanup failed", extra={"user_id": user_id, "dest": new_file_path})
+
 @dataclass(frozen=True)
 class CopyFileCommand:
     filerepo : FileRepository
     folderrepo : FolderRepository
     local_storage : cipherCloneStorage
     upload_root : str
+    chunk_store : Optional[ChunkStoreService] = None
+    stats : FolderStatsRepository = field(default_factory=FolderStatsRepository)
+    usage : StorageUsageRepository = field(default_factory=StorageUsageRepository)
 
     action_type : str = "copy_file"
 
@@ -41,40 +107,41 @@ class CopyFileCommand:
             new_file = copy_name(res.file_name,num)
 
         new_id = uuid4()
-        dest_path = safe_path_join(self.upload_root, f"{new_id}.enc")
-        src_path = resolve_under_root(self.upload_root, res.file_path)
-
-        await self.local_storage.clone_ciphertext(src_path, dest_path)
+        new_path = await clone_file_content(session, user_id, res, new_id, self.upload_root, self.local_storage, self.chunk_store)
 
         try:
-            create_new_file = self.filerepo.copy(
+            create_new_file = await self.filerepo.copy(
                 session, user_id=user_id, file=res , 
                 new_file_id=new_id, new_file_name=new_file, new_folder_id=target_folder_id,
-                new_file_path=str(dest_path),
+                new_file_path=new_path,
             )            
         except Exception:
-            try:
-                dest_path.unlink(missing_ok=True)
-            except Exception:
-                logger.exception("copy cleanup failed", extra={"user_id": user_id, "dest": str(dest_path)})
+            await discard_file_content(user_id, new_path, self.upload_root, self.chunk_store)
             raise 
 
+        await self.stats.apply(session, user_id, [(target_folder_id, int(res.file_size or 0), 1)])
+        await self.usage.apply(session, user_id, StorageUsageRepository.deltas([res], ACTIVE, +1))
+
         return {
             "source_file_id": str(file_id),
-            "new_file_id": str(create_new_file.new_file_id),
-            "new_name": create_new_file.new_file_name,
+            "new_file_id": str(create_new_file.file_id),
+            "new_name": create_new_file.file_name,
             "to_folderId": target_folder_id,
-            "file_path": create_new_file.new_file_path,
+            "file_path": create_new_file.file_path,
         }
         
 
     async def undo(self, session: AsyncSession, user_id: str, data: Dict[str, Any]) -> None:
         new_id = UUID(data["new_file_id"])
-        await self.filerepo.soft_delete(session, user_id=user_id, file=data)
+        changed = await self.filerepo.set_deleted(session, user_id=user_id, file_ids=[new_id], is_deleted=True)
+        await self.stats.apply(session, user_id, FolderStatsRepository.file_deltas(changed, -1))
+        await self.usage.apply(session, user_id, StorageUsageRepository.deltas(changed, ACTIVE, -1))
 
     async def redo(self, session:AsyncSession, user_id:str, data: Dict[str,Any]) -> None:
         new_id = UUID(data["new_file_id"])
-        await self.filerepo.soft_delete(session, user_id=user_id, file=data)
+        changed = await self.filerepo.set_deleted(session, user_id=user_id, file_ids=[new_id], is_deleted=False)
+        await self.stats.apply(session, user_id, FolderStatsRepository.file_deltas(changed, +1))
+        await self.usage.apply(session, user_id, StorageUsageRepository.deltas(changed, ACTIVE, +1))
 
         target_folder_id = data.get("to_folderId")
         desire_name = data.get("new_name")
@@ -134,16 +201,27 @@ class CopyFolderCommand:
     filerepo: FileRepository
     local_storage: cipherCloneStorage
     upload_root: str
+    chunk_store: Optional[ChunkStoreService] = None
+    clone_concurrency: int = 16
+    stats: FolderStatsRepository = field(default_factory=FolderStatsRepository)
+    usage: StorageUsageRepository = field(default_factory=StorageUsageRepository)
 
     action_type : str = "copy_folder"
 
     async def execute(self, session:AsyncSession, user_id:str, folder_id:int, to_folderId:Optional[int]) -> Dict[str, Any]:
+        """
+        Set-based copy: one prefix scan for the subtree, one query for its files, names resolved
+        in memory, folder ids reserved up front so the whole tree is a single INSERT, files copied
+        with a single INSERT .. SELECT, blobs/manifests cloned concurrently. The statement count
+        does not depend on the size of the tree.
+        """
         root_folder = await self.folderrepo.get_active_folder(session, user_id=user_id, folder_id=int(folder_id))
         if not root_folder:
             raise LookupError("Folder not found.")
         
         target_folder_id = to_folderId if to_folderId is not None else root_folder.parent_folder_id
 
+        target_folder = None
         if target_folder_id is not None:
             target_folder = await self.folderrepo.get_active_folder(session, user_id=user_id, folder_id=target_folder_id)
             if not target_folder:
@@ -151,109 +229,121 @@ class CopyFolderCommand:
             
             if await self.folderrepo.is_ancestor_of(session, user_id=user_id, root_id=int(folder_id), node_id=int(target_folder_id)):
                 raise ValueError("Folder cannot copy into it's own subtree.")
+
+        siblings = await self.folderrepo.child_folder_names(session, user_id=user_id, parent_folder_id=target_folder_id)
         num = 1
         new_name = f"{root_folder.folder_name} (copy)"
-        while await self.folderrepo.name_exists_in_parent_folder(session,
-                                                                 user_id=user_id,
-                                                                 parent_folder_id=target_folder_id,
-                                                                 folder_name=new_name):
+        while new_name.lower() in siblings:
             num += 1 
             new_name = f"{root_folder.folder_name} (copy {num})"
 
-        depth = 0
-        if target_folder_id is not None:
-            parent = await self.folderrepo.get_active_folder(session, user_id=user_id, folder_id=int(target_folder_id))
-            depth = (parent.depth_level + 1) if parent else 0
-
-        new_root_folder = self.folderrepo.copy(
-            session,
-            user_id=user_id,
-            folder_name=new_name,
-            parent_folder_id=target_folder_id,
-            depth=depth,
+        subtree = await self.folderrepo.list_subtree_folders_by_roots(session, user_id=user_id, root_folder_ids=[int(folder_id)])
+        files = await self.filerepo.list_files_in_folder(session, user_id=user_id, folder_ids=[int(r[1]) for r in subtree], include_deleted=False)
+
+        # parents before children (the CTE gives no ordering guarantee)
+        children: Dict[int, list] = {}
+        for row in subtree:
+            if int(row[1]) != int(folder_id):
+                children.setdefault(int(row[2]), []).append(row)
+        ordered = [r for r in subtree if int(r[1]) == int(folder_id)]
+        for row in ordered:
+            ordered.extend(children.get(int(row[1]), []))
+        subtree = ordered
+
+        new_ids = await self.folderrepo.allocate_ids(session, len(subtree))
+        id_map: Dict[int, int] = {}
+        path_map: Dict[int, str] = {}
+        child_names: Dict[int, set] = {}
+
+        folder_rows: List[Dict[str, Any]] = []
+        for (_, src_id, src_parent, src_name, _, _), new_id in zip(subtree, new_ids):
+            src_id = int(src_id)
+            if src_id == int(folder_id):
+                parent_id, name = target_folder_id, new_name
+                path = self.folderrepo.child_path(target_folder, new_id)
+            else:
+                parent_id = id_map[int(src_parent)]
+                taken = child_names.setdefault(parent_id, set())
+                name, n = src_name, 1
+                while name.lower() in taken:
+                    n += 1
+                    name = f"{src_name} (copy {n})"
+                taken.add(name.lower())
+                path = f"{path_map[parent_id]}/{new_id}"
+
+            id_map[src_id] = new_id
+            path_map[new_id] = path
+            folder_rows.append({
+                "folder_id": new_id,
+                "folder_uid": uuid4(),
+                "folder_name": name,
+                "parent_folder_id": parent_id,
+                "depth_level": path.count("/"),
+                "heirarchy_path": path,
+            })
+
+        file_names: Dict[int, set] = {}
+        file_items: List[Dict[str, Any]] = []
+        for file in files:
+            target_id = id_map[int(file.folder_id)]
+            taken = file_names.setdefault(target_id, set())
+            name, n = file.file_name, 0
+            while name.lower() in taken:
+                n += 1
+                name = copy_name(file.file_name, n)
+            taken.add(name.lower())
+            file_items.append({"src": file, "src_file_id": file.file_id, "new_file_id": uuid4(), "new_file_name": name, "new_folder_id": target_id})
+
+        created_folder_ids = await self.folderrepo.bulk_create(session, user_id=user_id, rows=folder_rows)
+
+        new_paths = await clone_files_content(
+            session, user_id, [(i["src"], i["new_file_id"]) for i in file_items],
+            self.upload_root, self.local_storage, self.chunk_store, self.clone_concurrency,
         )
+        for item, path in zip(file_items, new_paths):
+            item["new_file_path"] = path
+
+        try:
+            created_file_ids = await self.filerepo.bulk_copy(session, user_id=user_id, items=file_items)
+        except Exception:
+            for path in new_paths:
+                await discard_file_content(user_id, path, self.upload_root, self.chunk_store)
+            raise
+
+        await self.stats.apply(session, user_id, [(i["new_folder_id"], int(i["src"].file_size or 0), 1) for i in file_items])
+        await self.usage.apply(session, user_id, StorageUsageRepository.deltas([i["src"] for i in file_items], ACTIVE, +1))
 
-        created_folder_ids : List[int] = [int(new_root_folder.folder_id)]
-        created_file_ids : List[UUID] = []
-
-        queue : List[tuple[int,int]] = [(int(root_folder.folder_id),int(new_root_folder.folder_id))]
-
-        while queue:
-            curr_id , target_id = queue.pop(0)
-            children = await self.folderrepo.list_child_folder(session,
-                                                            user_id=user_id,
-                                                            parent_folder_id=curr_id)
-            for child in children:
-                new_child = await self.folderrepo.copy(
-                    session,user_id=user_id,folder_name=child.folder_name,
-                    parent_folder_id=target_id,
-                    depth=depth+1
-                )
-                created_folder_ids.append(int(new_child.folder_id))
-                queue.append(int(child.folder_id),int(new_child.folder_id))
-
-            files = await self.folderrepo.list_file_in_folder(session,
-                                                              user_id=user_id,
-                                                              folder_id=curr_id)
-            for file in files:
-                if await self.filerepo.name_exist_or_not_in_folder(session, user_id=user_id, folder_id=target_id, file_name=file.file_name):
-                    num = 1
-                    new_name = copy_name(file.file_name,num)
-                    while await self.filerepo.name_exist_or_not_in_folder(session, user_id=user_id, folder_id=target_id,file_name=new_name):
-                        num =+ 1 
-                        new_name = copy_name(file.file_name,num)
-
-
-                new_file_id = uuid4()
-                dest_path = safe_path_join(self.upload_root, f"{new_file_id}.enc")
-                src_path = resolve_under_root(self.upload_root, file.file_path)
-
-                await self.local_storage.clone_ciphertext(src_path,dest_path)
-
-                try:
-                    created = await self.filerepo.copy(
-                        session,
-                        user_id=user_id,
-                        file=file,
-                        new_file_id=new_file_id,
-                        new_file_name=new_name,
-                        new_folder_id=target_id,
-                        new_file_path=str(dest_path),
-                    )
-                except Exception:
-                    try:
-                        dest_path.unlink(missing_ok=True)
-                    except Exception:
-                        logger.exception("folder copy cleanup failed", extra={"user_id": user_id})
-                    raise
-
-                created_file_ids.append(str(created.file_id))
+        logger.info("copy_folder", extra={"user_id": user_id, "folders": len(created_folder_ids), "files": len(created_file_ids)})
 
         return {
             "source_folder_id": int(folder_id),
-            "new_folder_id": int(new_root_folder.folder_id),
-            "new_name": new_root_folder.folder_name,
+            "new_folder_id": int(id_map[int(folder_id)]),
+            "new_name": new_name,
             "to_parentId": target_folder_id,
-            "created_folder_ids": created_folder_ids,
-            "created_file_ids": created_file_ids,
+            "created_folder_ids": [int(f) for f in created_folder_ids],
+            "created_file_ids": [str(f) for f in created_file_ids],
         }
         
     async def undo(self, session:AsyncSession, user_id:str, data:Dict[str,Any]) -> None:
         folder_ids = [int(f) for f in data.get("created_folder_ids", [])]
         file_ids = [UUID(f) for f in data.get("created_file_ids", [])]
             
-        await self.filerepo.soft_delete(session,user_id=user_id,file=data)
+        changed = await self.filerepo.set_deleted(session, user_id=user_id, file_ids=file_ids, is_deleted=True)
+        await self.stats.apply(session, user_id, FolderStatsRepository.file_deltas(changed, -1))
+        await self.usage.apply(session, user_id, StorageUsageRepository.deltas(changed, ACTIVE, -1))
         await self.folderrepo.delete_file(session,user_id=user_id,folder_ids=folder_ids,is_deleted=True)
 
     async def redo(self,session:AsyncSession, user_id:str, data:Dict[str,Any]) -> None:
         folder_ids = [int(f) for f in data.get("created_folder_ids", [])]
         file_ids = [UUID(f) for f in data.get("created_file_ids", [])]
 
-        await self.filerepo.soft_delete(session,user_id=user_id,file=data)
+        changed = await self.filerepo.set_deleted(session, user_id=user_id, file_ids=file_ids, is_deleted=False)
+        await self.stats.apply(session, user_id, FolderStatsRepository.file_deltas(changed, +1))
+        await self.usage.apply(session, user_id, StorageUsageRepository.deltas(changed, ACTIVE, +1))
         await self.folderrepo.delete_file(session,user_id=user_id,folder_ids=folder_ids,is_deleted=False)
 
         new_root_id = int(data["new_folder_id"])
-        target_folder_id = int(data["to_folderId"])
+        target_folder_id = data.get("to_parentId")
         desire_name = data.get("new_name")
 
         if desire_name and await self.folderrepo.name_exists_in_parent_folder(
@@ -274,7 +364,7 @@ class CopyFolderCommand:
                     user_id=user_id,
                     parent_folder_id=target_folder_id,
                     folder_name=candidate,
-                    exclude_folder_id=new_root_id,
+                    exclude_curr_folder_id=new_root_id,
                 ):
                     num += 1
                     candidate = f"{stem} (copy {num})"
@@ -1,8 +1,9 @@
 import asyncio
 import logging
-from dataclasses import dataclass
+import os
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from uuid import UUID
 
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -10,8 +11,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.repositories.folder_repository import FolderRepository
 from app.repositories.file_repository import FileRepository
 from app.repositories.trash_repository import RecyclebinRepository
-from app.actions.trashCommand import auto_rename_when_restore
+from app.repositories.folder_stats_repository import FolderStatsRepository
+from app.repositories.storage_usage_repository import StorageUsageRepository, ACTIVE, BIN
+from app.actions.trashCommand import split_name_ext
 from app.security.path_sanitizer import resolve_cipher_path
+from app.services.chunk_store_service import ChunkStoreService
+from app.storage.storage_io import get_storage_io
 
 logger = logging.getLogger(__name__)
 
@@ -31,13 +36,58 @@ def auto_folder_name(base: str, n: int) -> str:
     return f"{base} (restored)" if n == 1 else f"{base} (restored {n})"
 
 
-# def _auto_file_name(base: str, n: int) -> str:
-#     return f"{base} (restored)" if n == 1 else f"{base} (restored {n})"
-
-
-async def move_path(src: Path, dest: Path) -> None:
-    dest.parent.mkdir(parents=True, exist_ok=True)
-    await asyncio.to_thread(src.replace, dest)
+def auto_file_name(name: str, n: int) -> str:
+    base, ext = split_name_ext(name)
+    return f"{base} (restored){ext}" if n == 1 else f"{base} (restored {n}){ext}"
+
+
+def move_if_exists(src: Path, dest: Path) -> bool:
+    try:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(src, dest)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+async def move_blobs(user_id: str, moves: List[Tuple[UUID, Path, Path]], concurrency: int) -> Tuple[Dict[UUID, bool], List[UUID]]:
+    """
+    Moves (file_id, src, dest) blobs concurrently on the storage I/O pool, at most `concurrency`
+    at a time. Returns ({file_id: moved}, failed file_ids); a missing source is not a failure.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+    io = get_storage_io()
+
+    async def one(file_id: UUID, src: Path, dest: Path) -> bool:
+        async with sem:
+            return await io.run(move_if_exists, src, dest)
+
+    results = await asyncio.gather(*(one(*m) for m in moves), return_exceptions=True)
+
+    moved: Dict[UUID, bool] = {}
+    failed: List[UUID] = []
+    for (file_id, _, _), res in zip(moves, results):
+        if isinstance(res, BaseException):
+            logger.error("move ciphertext failed", exc_info=res, extra={"user_id": user_id, "file_id": str(file_id)})
+            failed.append(file_id)
+        else:
+            moved[file_id] = res
+    return moved, failed
+
+
+def blob_moves(files, upload_root: str, recycle_root: str, to_recycle: bool) -> List[Tuple[UUID, Path, Path]]:
+    """
+    (file_id, src, dest) for files whose content is a .enc blob. Manifest-backed files have nothing
+    to move: their chunks stay in the object store and keep their references while in the trash.
+    """
+    moves = []
+    for f in files:
+        if ChunkStoreService.is_manifest_key(f.file_path):
+            continue
+        live = resolve_cipher_path(upload_root, file_id=f.file_id, db_path=f.file_path)
+        trashed = resolve_cipher_path(recycle_root, file_id=f.file_id)
+        moves.append((f.file_id, live, trashed) if to_recycle else (f.file_id, trashed, live))
+    return moves
 
 
 async def unlink_path(p: Path) -> None:
@@ -76,6 +126,9 @@ class TrashFolderCommand:
     trashrepo: RecyclebinRepository
     upload_root: str
     recycle_root: str
+    move_concurrency: int = 32
+    stats: FolderStatsRepository = field(default_factory=FolderStatsRepository)
+    usage: StorageUsageRepository = field(default_factory=StorageUsageRepository)
 
     action_type: str = "trash_folder"
 
@@ -96,29 +149,26 @@ class TrashFolderCommand:
         file_ids = [f.file_id for f in files]
 
         existing_rb = await self.trashrepo.list_existing_files_ids(session, user_id=user_id, file_ids=file_ids)
+        new_items = [f for f in files if f.file_id not in existing_rb]
+        moves = blob_moves(new_items, self.upload_root, self.recycle_root, to_recycle=True)
 
-        for file in files:
-            if file.file_id in existing_rb:
-                continue
-
-            try:
-                src = resolve_cipher_path(self.upload_root, file.file_path, file_id=file.file_id)
-                dest = resolve_cipher_path(self.recycle_root, None, file_id=file.file_id)
-                if src.exists():
-                    await move_path(src, dest)
-            except Exception:
-                logger.exception("trash folder: move ciphertext failed", extra={"user_id": user_id, "file_id": str(file.file_id)})
-
-            await self.trashrepo.add_file(
-                session,
-                user_id=user_id,
-                file=file,
-                parent_folder_id=file.folder_id,
-                deleted_by_action="trash_folder",
-                recycle_item_path=str(resolve_cipher_path(self.recycle_root, None, file_id=file.file_id)),
-            )
+        await self.trashrepo.add_files(
+            session,
+            user_id=user_id,
+            files=new_items,
+            deleted_by_action="trash_folder",
+            item_paths={file_id: str(dest) for file_id, _, dest in moves},
+        )
+        changed = await self.filerepo.set_deleted(session, user_id=user_id, file_ids=file_ids, is_deleted=True)
+        await self.stats.apply(session, user_id, FolderStatsRepository.file_deltas(changed, -1))
+        await self.usage.apply(
+            session, user_id,
+            StorageUsageRepository.deltas(changed, ACTIVE, -1) + StorageUsageRepository.deltas(new_items, BIN, +1),
+        )
 
-        await self.filerepo.soft_delete(session, user_id=user_id, file_ids=file_ids)
+        # rows first: if they fail nothing has moved on disk yet
+        await session.flush()
+        await move_blobs(user_id, moves, self.move_concurrency)
 
         return {
             "folder_id": folder_id,
@@ -127,7 +177,7 @@ class TrashFolderCommand:
         }
 
     async def undo(self, session: AsyncSession,user_id: str, data: Dict[str, Any]) -> None:
-        restore = RestoreFolderCommand(self.folderrepo, self.filerepo, self.trashrepo, self.upload_root, self.recycle_root)
+        restore = RestoreFolderCommand(self.folderrepo, self.filerepo, self.trashrepo, self.upload_root, self.recycle_root, self.move_concurrency)
         await restore.execute(session, user_id=user_id, folder_id=int(data["folder_id"]), preferred_parent_id=data.get("old_parent_folder_id"))
 
     async def redo(self, session: AsyncSession,user_id: str, data: Dict[str, Any]) -> None:
@@ -141,6 +191,9 @@ class RestoreFolderCommand:
     trashrepo: RecyclebinRepository
     upload_root: str
     recycle_root: str
+    move_concurrency: int = 32
+    stats: FolderStatsRepository = field(default_factory=FolderStatsRepository)
+    usage: StorageUsageRepository = field(default_factory=StorageUsageRepository)
 
     action_type: str = "restore_folder"
 
@@ -178,7 +231,9 @@ class RestoreFolderCommand:
 
         await self.folderrepo.restore_folders(session, user_id=user_id, folder_ids=folder_ids)
 
-        folder.parent_folder_id = restore_parent
+        # the parent may have changed (original one gone): re-root the subtree's paths
+        old_path = await self.folderrepo.move(session, folder=folder, new_parent_id=restore_parent)
+        await self.stats.move_subtree(session, user_id, folder.folder_id, old_path, folder.heirarchy_path)
         folder.folder_name = new_root_name
         folder.is_deleted = False
         folder.deleted_at = None
@@ -187,38 +242,43 @@ class RestoreFolderCommand:
         files = await self.filerepo.list_files_in_folder(session, user_id=user_id, folder_ids=folder_ids, include_deleted=True)
         deleted_files = [f for f in files if f.is_deleted]
 
-        restored_ids: List[UUID] = []
-        for file in deleted_files:
-            safe_name = await auto_rename_when_restore(
-                session,
-                file_repo=self.filerepo,
-                user_id=user_id,
-                folder_id=file.folder_id,
-                file_id=file.file_id,
-                desired_name=file.file_name,
-            )
-            if safe_name != file.file_name:
-                await self.filerepo.rename(session, file, safe_name)
-
-            try:
-                src = resolve_cipher_path(self.recycle_root, None, file_id=file.file_id)
-                dst = resolve_cipher_path(self.upload_root, file.file_path, file_id=file.file_id)
-                if src.exists():
-                    await move_path(src, dst)
-            except Exception:
-                logger.exception("restore folder: move ciphertext failed", extra={"user_id": user_id, "file_id": str(file.file_id)})
-                continue
-
-            restored_ids.append(file.file_id)
-
-        if restored_ids:
-            await self.filerepo.restore(session, user_id=user_id, file_ids=restored_ids)
-            await self.trashrepo.delete_file_item(session, user_id=user_id, file_ids=restored_ids)
+        moves = blob_moves(deleted_files, self.upload_root, self.recycle_root, to_recycle=False)
+        _, failed = await move_blobs(user_id, moves, self.move_concurrency)
+        skipped = set(failed)
+        to_restore = [f for f in deleted_files if f.file_id not in skipped]
+
+        # one query for clashing names, resolved in memory (also against each other)
+        taken = await self.filerepo.active_names_in_folders(session, user_id=user_id, folder_ids=folder_ids)
+        for file in to_restore:
+            names = taken.setdefault(file.folder_id, set())
+            name, n = file.file_name, 0
+            while name.lower() in names:
+                n += 1
+                name = auto_file_name(file.file_name, n)
+            names.add(name.lower())
+            if name != file.file_name:
+                await self.filerepo.rename(session, file, name)
+
+        restored_ids: List[UUID] = [f.file_id for f in to_restore]
+        try:
+            if restored_ids:
+                changed = await self.filerepo.set_deleted(session, user_id=user_id, file_ids=restored_ids, is_deleted=False)
+                await self.stats.apply(session, user_id, FolderStatsRepository.file_deltas(changed, +1))
+                removed = await self.trashrepo.delete_file_item(session, user_id=user_id, file_ids=restored_ids)
+                await self.usage.apply(
+                    session, user_id,
+                    StorageUsageRepository.deltas(changed, ACTIVE, +1) + StorageUsageRepository.deltas(removed, BIN, -1),
+                )
+            await session.flush()
+        except Exception:
+            # put the blobs back where the still-trashed rows expect them
+            await move_blobs(user_id, [(i, dst, src) for i, src, dst in moves if i not in skipped], self.move_concurrency)
+            raise
 
         return {"folder_id": folder_id, "new_name": new_root_name, "restored_parent_id": restore_parent}
 
     async def undo(self, session: AsyncSession,user_id: str, data: Dict[str, Any]) -> None:
-        trash = TrashFolderCommand(self.folderrepo, self.filerepo, self.trashrepo, self.upload_root, self.recycle_root)
+        trash = TrashFolderCommand(self.folderrepo, self.filerepo, self.trashrepo, self.upload_root, self.recycle_root, self.move_concurrency)
         await trash.execute(session, user_id=user_id, folder_id=int(data["folder_id"]))
 
     async def redo(self, session: AsyncSession,user_id: str, data: Dict[str, Any]) -> None:
@@ -264,6 +324,8 @@ class PermanentDeleteFolderCommand:
     trashrepo: RecyclebinRepository
     upload_root: str
     recycle_root: str
+    chunk_store: Optional[ChunkStoreService] = None
+    usage: StorageUsageRepository = field(default_factory=StorageUsageRepository)
     action_type: str = "perm_delete_folder"
 
     async def execute(self, session: AsyncSession, user_id: str, folder_id: int) -> Dict[str, Any]:
@@ -274,7 +336,7 @@ class PermanentDeleteFolderCommand:
             raise ValueError("Folder must be in trash before permanent delete")
 
         folder_ids = await self.folderrepo.list_subtree_folder_ids(
-            session, user_id=user_id, root_folder_id=folder_id, include_deleted=True,include_root=True
+            session, user_id=user_id, root_id=folder_id, include_deleted=True,include_root=True
         )
 
         files = await self.filerepo.list_files_in_folder(session, user_id=user_id, folder_ids=folder_ids, include_deleted=True)
@@ -282,21 +344,28 @@ class PermanentDeleteFolderCommand:
 
         # delete ciphertext from both locations (safe + tolerant)
         for file in files:
+            if self.chunk_store is not None:
+                await self.chunk_store.release_file(session, user_id, file)
             try:
-                up = resolve_cipher_path(self.upload_root, file.file_path, file_id=file.file_id)
+                up = resolve_cipher_path(self.upload_root, file_id=file.file_id, db_path=file.file_path)
                 if up.exists():
                     await unlink_path(up)
             except Exception:
                 logger.exception("perm delete: upload unlink failed", extra={"user_id": user_id, "file_id": str(file.file_id)})
             try:
-                rb = resolve_cipher_path(self.recycle_root, None, file_id=file.file_id)
+                rb = resolve_cipher_path(self.recycle_root, file_id=file.file_id)
                 if rb.exists():
                     await unlink_path(rb)
             except Exception:
                 logger.exception("perm delete: recycle unlink failed", extra={"user_id": user_id, "file_id": str(file.file_id)})
 
-        await self.trashrepo.delete_file_item(session, user_id=user_id, file_ids=file_ids)
+        removed = await self.trashrepo.delete_file_item(session, user_id=user_id, file_ids=file_ids)
         await self.filerepo.hard_delete(session, user_id=user_id, file_ids=file_ids)
+        await self.usage.apply(
+            session, user_id,
+            StorageUsageRepository.deltas(removed, BIN, -1)
+            + StorageUsageRepository.deltas([f for f in files if not f.is_deleted], ACTIVE, -1),
+        )
         await self.folderrepo.delete_folders_hard(session, user_id=user_id, folder_ids=folder_ids)
 
         return {"folder_id": folder_id, "deleted_files": len(file_ids), "deleted_folders": len(folder_ids)}
@@ -1,9 +1,10 @@
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Any, Dict, Optional, List
 from app.repositories.file_repository import FileRepository 
 from app.repositories.folder_repository import FolderRepository
+from app.repositories.folder_stats_repository import FolderStatsRepository
 from uuid import UUID
 
 logger = logging.getLogger(__name__)
@@ -12,6 +13,7 @@ logger = logging.getLogger(__name__)
 class MoveFileCommand:
     filerepo : FileRepository
     folderrepo : FolderRepository
+    stats : FolderStatsRepository = field(default_factory=FolderStatsRepository)
 
     action_type : str = "move_file"
 
@@ -30,18 +32,24 @@ class MoveFileCommand:
                 raise LookupError("Folder is not Found.")
             
         conflict = await self.filerepo.name_exist_or_not_in_folder(
-            session,user_id=user_id, file_name=file.file_name, folder_id=from_folderId,exclude_curr_file_id=file.file_id
+            session,user_id=user_id, file_name=file.file_name, folder_id=to_folderId,exclude_curr_file_id=file.file_id
         )
         if conflict:
-            raise FileExistsError("Cannot undo move: name already exists in the original folder")
+            raise FileExistsError("Cannot move: name already exists in the destination folder")
 
-        await self.filerepo.move(session, file=file, new_folder_id=from_folderId)
+        await self.filerepo.move(session, file=file, new_folder_id=to_folderId)
+        await self.stats.apply(session, user_id, self.moved(file, from_folderId, to_folderId))
 
         return {
             "file_id": str(file.file_id),
-            "from_folder_id": from_folderId,
-            "to_folder_id": to_folderId,
+            "from_folderId": from_folderId,
+            "to_folderId": to_folderId,
         }
+
+    @staticmethod
+    def moved(file, from_folderId: Optional[int], to_folderId: Optional[int]):
+        size = int(file.file_size or 0)
+        return [(from_folderId, -size, -1), (to_folderId, size, 1)]
     
     async def undo(self, session:AsyncSession, user_id:str, data:Dict[str,Any]) -> None :
         file_id = UUID(data["file_id"])
@@ -62,7 +70,9 @@ class MoveFileCommand:
         if conflict:
             raise FileExistsError("Cannot undo move: name already exists in the original folder")
 
+        current_folderId = file.folder_id
         await self.filerepo.move(session, file=file, new_folder_id=from_folderId)
+        await self.stats.apply(session, user_id, self.moved(file, current_folderId, from_folderId))
 
     async def redo(self, session:AsyncSession, user_id:str, data:Dict[str,Any]) -> None:
         file_id = UUID(data["file_id"])
@@ -81,14 +91,17 @@ class MoveFileCommand:
             session, user_id=user_id, file_name=file.file_name, folder_id=to_folderId, exclude_curr_file_id=file.file_id
         )
         if conflict:
-            raise FileExistsError("Cannot undo move: name already exists in the original folder")
+            raise FileExistsError("Cannot redo move: name already exists in the destination folder")
 
+        current_folderId = file.folder_id
         await self.filerepo.move(session, file=file, new_folder_id=to_folderId)
+        await self.stats.apply(session, user_id, self.moved(file, current_folderId, to_folderId))
 
 
 @dataclass(frozen=True)
 class MoveFolderCommand:
-    folderrepo = FolderRepository
+    folderrepo: FolderRepository
+    stats: FolderStatsRepository = field(default_factory=FolderStatsRepository)
     action_type: str = "move_folder"
 
     async def execute(self, session:AsyncSession, user_id:str, folder_id:int, to_parentId: Optional[int]) -> Optional[Dict[str, Any]]:
@@ -105,30 +118,32 @@ class MoveFolderCommand:
             raise ValueError("Cannot move a folder into itself")
         
         #dest must exist
+        parent = None
         if to_parentId is not None:
-            result = await self.folderrepo.get_active_folder(session, user_id=user_id, folder_id=to_parentId)
-            if not result:
+            parent = await self.folderrepo.get_active_folder(session, user_id=user_id, folder_id=to_parentId)
+            if not parent:
                 raise LookupError("Folder is not Found.")
             
         # canmot move into it's own descentant
         if to_parentId is not None:
-            res = await self.folderrepo.is_ancestor_of(session, user_id=user_id, ancestor_id=folder_id, node_id=to_parentId)
+            res = await self.folderrepo.is_ancestor_of(session, user_id=user_id, root_id=folder_id, node_id=to_parentId)
             if res:
                 raise ValueError("Cannot move into it's own subfolder.")
             
 
         conflict = await self.folderrepo.name_exists_in_parent_folder(
-            session,user_id=user_id, fodler_name=folder.folder_name, folder_id=to_parentId, exclude_curr_folder_id=folder.folder_id
+            session,user_id=user_id, folder_name=folder.folder_name, parent_folder_id=to_parentId, exclude_curr_folder_id=folder.folder_id
         )
         if conflict:
-            raise FileExistsError("Cannot undo move: name already exists in the original folder")
+            raise FileExistsError("Cannot move: name already exists in the destination folder")
 
-        await self.folderrepo.move(session, folder=folder, new_folder_id=to_parentId)
+        old_path = await self.folderrepo.move(session, folder=folder, new_parent_id=to_parentId, new_parent=parent)
+        await self.stats.move_subtree(session, user_id, folder.folder_id, old_path, folder.heirarchy_path)
 
         return {
             "folder_id": str(folder.folder_id),
-            "from_folder_id": from_folderId,
-            "to_folder_id": to_parentId,
+            "from_parentId": from_folderId,
+            "to_parentId": to_parentId,
         }
 
     async def undo(self, session:AsyncSession, user_id:str, data:Dict[str,Any]) -> None:
@@ -150,12 +165,13 @@ class MoveFolderCommand:
             user_id=user_id,
             parent_folder_id=from_parentId,
             folder_name=folder.folder_name,
-            exclude_folder_id=folder.folder_id,
+            exclude_curr_folder_id=folder.folder_id,
         )
         if conflict:
             raise FileExistsError("Cannot undo move: name already exists in the original location")
 
-        await self.folderrepo.move(session, folder=folder, new_parent_id=from_parentId)
+        old_path = await self.folderrepo.move(session, folder=folder, new_parent_id=from_parentId)
+        await self.stats.move_subtree(session, user_id, folder.folder_id, old_path, folder.heirarchy_path)
 
     async def redo(self, session:AsyncSession, user_id:str, data:Dict[str,Any]) -> None:
         folder_id = int(data["folder_id"])
@@ -170,7 +186,7 @@ class MoveFolderCommand:
             if not res:
                 raise LookupError("Original parent folder not found")
             
-            res = await self.folderrepo.is_ancestor_of(session, user_id=user_id, ancestor_id=folder_id, node_id=int(to_parentId))
+            res = await self.folderrepo.is_ancestor_of(session, user_id=user_id, root_id=folder_id, node_id=int(to_parentId))
             if res:
                 raise ValueError("Cannot redo move: would create a cycle")
 
@@ -180,12 +196,13 @@ class MoveFolderCommand:
             user_id=user_id,
             parent_folder_id=to_parentId,
             folder_name=folder.folder_name,
-            exclude_folder_id=folder.folder_id,
+            exclude_curr_folder_id=folder.folder_id,
         )
         if conflict:
             raise FileExistsError("Cannot undo move: name already exists in the original location")
 
-        await self.folderrepo.move(session, folder=folder, new_parent_id=to_parentId)
+        old_path = await self.folderrepo.move(session, folder=folder, new_parent_id=to_parentId)
+        await self.stats.move_subtree(session, user_id, folder.folder_id, old_path, folder.heirarchy_path)
 
 
 @dataclass(frozen=True)
@@ -209,11 +226,11 @@ class MoveFolderBulkCommand():
     action_type : str = "move_bulk_folders"
 
     async def undo(self, session:AsyncSession, user_id:str, data:Dict[str,Any]) -> None:
-        folders : List[Dict[str,Any]] = data["folders"]
+        folders : List[Dict[str,Any]] = data.get("items") or data.get("folders") or []
         for folder in reversed(folders):
             await self.single_folder.undo(session, user_id=user_id, data=folder)
 
     async def redo(self, session:AsyncSession, user_id:str, data:Dict[str,Any]) -> None:
-        folders : List[Dict[str,Any]] = data["folders"]
+        folders : List[Dict[str,Any]] = data.get("items") or data.get("folders") or []
         for folder in folders:
             await self.single_folder.redo(session, user_id=user_id, data=folder)
\ No newline at end of file
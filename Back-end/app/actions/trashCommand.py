@@ -1,5 +1,5 @@
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 from uuid import UUID
@@ -9,7 +9,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.repositories.file_repository import FileRepository
 from app.repositories.folder_repository import FolderRepository
 from app.repositories.trash_repository import RecyclebinRepository
+from app.repositories.folder_stats_repository import FolderStatsRepository
+from app.repositories.storage_usage_repository import StorageUsageRepository, ACTIVE, BIN
 from app.security.path_sanitizer import resolve_under_root, UnsafePathError
+from app.services.chunk_store_service import ChunkStoreService
 
 logger = logging.getLogger(__name__)
 
@@ -31,19 +34,19 @@ async def auto_rename_when_restore(session:AsyncSession, user_id:str, file_repo:
     
     for i in range(1,50):
         if i == 1:
-            name = f"{base} (restored) {ext}"
+            name = f"{base} (restored){ext}"
         else:
-            name = f"{base} (restored {i}) {ext}"
-
-    conflict = await file_repo.name_exist_or_not_in_folder(
-            session,
-            user_id=user_id,
-            file_name=name,
-            folder_id=folder_id,
-            exclude_curr_file_id=file_id,
-        )
-    if not conflict:
-        return name
+            name = f"{base} (restored {i}){ext}"
+
+        conflict = await file_repo.name_exist_or_not_in_folder(
+                session,
+                user_id=user_id,
+                file_name=name,
+                folder_id=folder_id,
+                exclude_curr_file_id=file_id,
+            )
+        if not conflict:
+            return name
 
     raise FileExistsError("Too many name conflicts while restoring")
 
@@ -52,6 +55,8 @@ class TrashFileCommand:
     filerepo : FileRepository
     folderrepo : FolderRepository
     recyclerepo : RecyclebinRepository
+    stats : FolderStatsRepository = field(default_factory=FolderStatsRepository)
+    usage : StorageUsageRepository = field(default_factory=StorageUsageRepository)
 
     action_type: str = "delete_file"
 
@@ -63,6 +68,8 @@ class TrashFileCommand:
         from_folderId = file.folder_id
         await self.filerepo.soft_delete(session, file, user_id=user_id)
         await self.recyclerepo.add_file(session, user_id=user_id,file=file,parent_folder_id=from_folderId,deleted_by_action="api")
+        await self.stats.apply(session, user_id, [(from_folderId, -int(file.file_size or 0), -1)])
+        await self.usage.apply(session, user_id, StorageUsageRepository.moved([file], ACTIVE, BIN))
 
         return {
             "file_id": str(file.file_id),
@@ -88,11 +95,18 @@ class TrashFileCommand:
             folder_id=to_folderId,original_name=file.file_name
         )
 
+        usage = []
         recycle = await self.recyclerepo.get_file(session, user_id=user_id, file_id=file_id)
         if recycle:
             await self.recyclerepo.delete_item(session, item=recycle)
+            usage += StorageUsageRepository.deltas([recycle], BIN, -1)
 
+        was_deleted = bool(file.is_deleted)
         await self.filerepo.restore(session, file=file, folder_id=to_folderId, file_name=restore_name)
+        if was_deleted:
+            await self.stats.apply(session, user_id, [(to_folderId, int(file.file_size or 0), 1)])
+            usage += StorageUsageRepository.deltas([file], ACTIVE, +1)
+        await self.usage.apply(session, user_id, usage)
 
     async def redo(self, session: AsyncSession, user_id: str, data: Dict[str, Any]) -> None:
         file_id = UUID(data["file_id"])
@@ -109,12 +123,16 @@ class TrashFileCommand:
             parent_folder_id=from_folderId,
             deleted_by_action="redo",
         )
+        await self.stats.apply(session, user_id, [(from_folderId, -int(file.file_size or 0), -1)])
+        await self.usage.apply(session, user_id, StorageUsageRepository.moved([file], ACTIVE, BIN))
 
 @dataclass(frozen=True)
 class RestoreFileCommand:
     filerepo : FileRepository
     folderrepo : FolderRepository
     recyclerepo : RecyclebinRepository
+    stats : FolderStatsRepository = field(default_factory=FolderStatsRepository)
+    usage : StorageUsageRepository = field(default_factory=StorageUsageRepository)
 
     action_type : str = "restore_file"
 
@@ -129,7 +147,7 @@ class RestoreFileCommand:
         
         to_folderId : Optional[int] = None
         if recycle.parent_folder_id is not None:
-            folder = await self.folderrepo.get_active_folder(session, user_id=user_id, folder_id=to_folderId)
+            folder = await self.folderrepo.get_active_folder(session, user_id=user_id, folder_id=int(recycle.parent_folder_id))
             to_folderId = folder.folder_id if folder else None
 
         restored_name = await auto_rename_when_restore(
@@ -141,8 +159,14 @@ class RestoreFileCommand:
             original_name=file.file_name,
         )
 
+        was_deleted = bool(file.is_deleted)
         await self.filerepo.restore(session, file=file, folder_id=to_folderId, file_name=restored_name)
         await self.recyclerepo.delete_item(session, item=recycle)
+        usage = StorageUsageRepository.deltas([recycle], BIN, -1)
+        if was_deleted:
+            await self.stats.apply(session, user_id, [(to_folderId, int(file.file_size or 0), 1)])
+            usage += StorageUsageRepository.deltas([file], ACTIVE, +1)
+        await self.usage.apply(session, user_id, usage)
 
         return {
             "file_id": str(file.file_id),
@@ -165,6 +189,8 @@ class RestoreFileCommand:
             parent_folder_id=from_folderId,
             deleted_by_action="undo",
         )
+        await self.stats.apply(session, user_id, [(from_folderId, -int(file.file_size or 0), -1)])
+        await self.usage.apply(session, user_id, StorageUsageRepository.moved([file], ACTIVE, BIN))
 
     async def redo(self, session:AsyncSession, user_id:str , data:Dict[str,Any]) -> None:
         file_id = UUID(data["file_id"])
@@ -190,14 +216,23 @@ class RestoreFileCommand:
             original_name=file.file_name,
         )
 
+        was_deleted = bool(file.is_deleted)
         await self.filerepo.restore(session, file=file, folder_id=to_folderId, file_name=restored_name)
         await self.recyclerepo.delete_item(session, item=recycle)
+        usage = StorageUsageRepository.deltas([recycle], BIN, -1)
+        if was_deleted:
+            await self.stats.apply(session, user_id, [(to_folderId, int(file.file_size or 0), 1)])
+            usage += StorageUsageRepository.deltas([file], ACTIVE, +1)
+        await self.usage.apply(session, user_id, usage)
 
 @dataclass(frozen=True)
 class PermanentDeleteFileCommand:
     filerepo : FileRepository
     recyclerepo : RecyclebinRepository
     storage_root : str
+    chunk_store : Optional[ChunkStoreService] = None
+    stats : FolderStatsRepository = field(default_factory=FolderStatsRepository)
+    usage : StorageUsageRepository = field(default_factory=StorageUsageRepository)
 
     action_type : str = "permanent_delete_file"
 
@@ -212,16 +247,25 @@ class PermanentDeleteFileCommand:
             logger.warning("perm delete blocked unsafe path", extra={"user_id": user_id, "file_id": str(file_id)})
             raise ValueError(str(e))
 
+        file = await self.filerepo.get_file_any_state(session, user_id=user_id, file_id=file_id)
+        if file and self.chunk_store is not None:
+            # drop this manifest's references; the chunk GC reclaims objects nobody else uses
+            await self.chunk_store.release_file(session, user_id, file)
+
         try:
             path.unlink(missing_ok=True)
         except Exception as e:
             raise RuntimeError(f"Failed to delete file bytes: {e}")
 
-        file = await self.filerepo.get_file_any_state(session, user_id=user_id, file_id=file_id)
+        usage = StorageUsageRepository.deltas([recycle], BIN, -1)
         if file:
-            await self.filerepo.hard_delete(session, file=file)
+            if not file.is_deleted:
+                await self.stats.apply(session, user_id, [(file.folder_id, -int(file.file_size or 0), -1)])
+                usage += StorageUsageRepository.deltas([file], ACTIVE, -1)
+            await self.filerepo.hard_delete(session, user_id=user_id, file_ids=[file_id])
 
         await self.recyclerepo.delete_item(session, item=recycle)
+        await self.usage.apply(session, user_id, usage)
 
         return {"file_id": str(file_id)}
     
@@ -7,10 +7,12 @@ from app.schemas.auth_schema import User , ActivityType
 from supabase import AsyncClient
 from typing import Dict , Optional
 from app.repositories.key_bundle_repository import UserKeyBundleRepository
+from app.services.key_bundle_service import KeybundleService
+from app.security.token_verifier import AuthTokenError, get_token_verifier
 
 security = HTTPBearer()
 
-_keybundle_repo = UserKeyBundleRepository()
+_keybundle_service = KeybundleService(UserKeyBundleRepository())
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security) , supabase :AsyncClient = Depends(get_async_supabase)) -> User:
     """
@@ -35,23 +37,10 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
                                 headers={"WWW-Authenticate": "Bearer"})
         
         try:
-            response = await supabase.auth.get_user(credentials.credentials)
-
-            if not response.user:
-                raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED, detail = "Invalid token or user not found")
-            
-            auth_user = response.user
-
-            user = User(
-                user_id=auth_user.id,
-                email = auth_user.email,
-                name=auth_user.user_metadata.get("name") if auth_user.user_metadata else None,
-                created_at = auth_user.created_at,
-                last_login = auth_user.last_sign_in_at,
-                access_token = credentials.credentials
-            )
-
-            return user
+            # local JWT check + per-token cache; Supabase is only asked when that can't decide
+            return await get_token_verifier().authenticate(credentials.credentials, supabase)
+        except AuthTokenError:
+            raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED, detail = "Invalid token or user not found")
         except HTTPException as e:
             raise e
     except Exception as e:
@@ -91,8 +80,11 @@ async def require_keybundle(
     current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_db),
 ):
+    # hot path (every chunk PUT): users with a bundle are answered from the in-process cache
+    if _keybundle_service.known(current_user.user_id):
+        return True
     async with session.begin():
-        exists = await _keybundle_repo.check_bundle(session, current_user.user_id)
+        exists = await _keybundle_service.has_bundle(session, current_user.user_id)
     if not exists:
             # 428 is ideal for precondition-required
         raise HTTPException(status_code=428, detail={"code": "KEYBUNDLE_MISSING"})
@@ -6,6 +6,9 @@ from app.api.dependencies import get_current_user
 from app.domain.persistance.database import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.security.rate_limit import limiter
+from app.security.token_verifier import get_token_verifier
+from app.services.key_bundle_service import KeybundleService
+from app.repositories.key_bundle_repository import UserKeyBundleRepository
 from app.services.auth_services import auth_service
 from app.services.auth_security_service import auth_security_service
 import logging
@@ -15,6 +18,8 @@ log = logging.getLogger("auth")
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+_kb_service = KeybundleService(UserKeyBundleRepository())
+
 @router.post("/signup")
 @limiter.limit("3/minute")
 async def signup(request : Request,user: UserSignUp , supabase : AsyncClient = Depends(get_async_supabase)) -> AuthResponse:
@@ -107,6 +112,7 @@ async def logout(current_user : User = Depends(get_current_user), supabase : Asy
             supabase
         )
         response = await supabase.auth.sign_out()
+        await get_token_verifier().revoke_token(current_user.access_token.get_secret_value())
 
         return AuthResponse(message="Logged out successfully")
     except Exception as e:
@@ -140,6 +146,8 @@ async def delete_account(current_user : User = Depends(get_current_user), supaba
         response = await supabase.auth.admin.delete_user(current_user.user_id)
         if response.error:
             raise HTTPException(status_code=http_status.HTTP_400_BAD_REQUEST, detail="Failed to Delete Account")
+        await get_token_verifier().revoke_user(current_user.user_id)
+        _kb_service.forget(current_user.user_id)
 
         return AuthResponse(message="Account deleted successfully")
     except Exception as e:
@@ -543,6 +551,8 @@ async def delete_user_account(request : Request,current_user: User = Depends(get
                 status_code=400,
                 detail="Failed to delete account"
             )
+        await get_token_verifier().revoke_user(current_user.user_id)
+        _kb_service.forget(current_user.user_id)
         
         log.info("Account deleted successfully", 
                    user_id=current_user.user_id)
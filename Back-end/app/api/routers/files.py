@@ -14,7 +14,8 @@ from app.schemas.dash_schema import (FileRenameRequest, FileRenameResponse, Mult
                                      MultipleFileCopyRequest,MultipleFileCopyResponse, MultipleFileDeleteRequest,MultipleFileDeleteResponse,
                                      MultipleFileRestoreRequest,MultipleFileRestoreResponse,MultipleFilePermDeleteRequest,MultipleFilePermDeleteResponse,
                                      FileVersionResponse,UploadResponse,UploadRequest,UploadStatusResponse,FolderDownloadPlanResponse,
-                                     FinalUploadResponse, FileDownloadRequest,MultiFilePlanRequest,)
+                                     FinalUploadResponse, FileDownloadRequest,MultiFilePlanRequest,FinalUploadRequest,
+                                     PackFinalizeRequest,PackFinalizeResponse,PackFinalizedFile,)
 
 from app.repositories.file_repository import FileRepository
 from app.repositories.folder_repository import FolderRepository
@@ -23,14 +24,16 @@ from app.repositories.trash_repository import RecyclebinRepository
 from app.repositories.version_repository import VersionRepository
 from app.repositories.upload_session_repository import UploadSessionRepository
 from app.repositories.upload_chunk_repository import UploadChunkRepository
+from app.repositories.chunk_object_repository import ChunkObjectRepository
 
 from app.security.server_wrapup import ServerCipherWrap
 
 from app.services.file_services import FileService
 from app.services.preview_services import PreviewService
 from app.services.version_service import VersionService
-from app.services.upload_service import UploadServices, UploadConflictError
-from app.services.download_services import DownloadService,DownloadNotFoundError,DownloadCorruptionError
+from app.services.upload_service import UploadServices, UploadConflictError, QuotaExceededError
+from app.services.download_services import DownloadService,DownloadNotFoundError,DownloadCorruptionError,DownloadRangeError, RANGE_UNIT
+from app.services.chunk_store_service import ChunkStoreService
 
 from app.storage.chunk_storage import ChunkStorage
 from app.security.server_wrapup import ServerCipherWrap
@@ -41,9 +44,10 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/file", tags=["files"])
 
-_file_service = FileService(FileRepository(), UndoRedoRepository(),FolderRepository(),RecyclebinRepository())
+_chunk_store = ChunkStoreService(ChunkObjectRepository(), ChunkStorage())
+_file_service = FileService(FileRepository(), UndoRedoRepository(),FolderRepository(),RecyclebinRepository(),chunk_store=_chunk_store)
 _preview_service = PreviewService(FileRepository(),RecyclebinRepository())
-_version_service = VersionService(FileRepository(), VersionRepository())
+_version_service = VersionService(FileRepository(), VersionRepository(), chunk_store=_chunk_store)
 _download_service = DownloadService(storage=ChunkStorage(), wrapper=ServerCipherWrap(),file_repo=FileRepository(),folder_repo=FolderRepository())
 _upload_service = UploadServices(
     session_repo=UploadSessionRepository(),
@@ -54,6 +58,7 @@ _upload_service = UploadServices(
     folder_repo=FolderRepository(),
     file_repo=FileRepository(),
     settings=None,
+    chunk_store=_chunk_store,
 )
 
 def _user_id(user: User) -> str:
@@ -293,6 +298,8 @@ async def stream_cipher(
             version_id=version_id,
         )
         file_size = meta.cipher_size
+        # everything below reads the ciphertext file only: give the connection back before streaming
+        await session.close()
 
         range_header = request.headers.get("range") or request.headers.get("Range")
         headers = {
@@ -303,13 +310,13 @@ async def stream_cipher(
 
         if not range_header:
             return StreamingResponse(
-                _preview_service.iterate_range(cipher_path, 0, file_size - 1),
+                _preview_service.iterate_range(0, file_size - 1, cipher_path),
                 media_type="application/octet-stream",
                 headers={**headers, "Content-Length": str(file_size)},
                 status_code=status.HTTP_200_OK,
             )
 
-        start, end = _preview_service.parse_range(range_header, file_size)
+        start, end = _preview_service.parse_range(file_size, range_header)
         content_length = end - start + 1
 
         headers.update({
@@ -318,14 +325,14 @@ async def stream_cipher(
         })
 
         return StreamingResponse(
-            _preview_service.iterate_range(cipher_path, start, end),
+            _preview_service.iterate_range(start, end, cipher_path),
             media_type="application/octet-stream",
             headers=headers,
             status_code=status.HTTP_206_PARTIAL_CONTENT,
         )
 
     except ValueError as e:
-        raise HTTPException(status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE, detail=str(e))
+        raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, detail=str(e))
     except LookupError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
     except RuntimeError as e:
@@ -418,6 +425,8 @@ async def init_upload(payload:UploadRequest,
             total_chunks=up.total_chunks,
             expires_at=up.expires_at.isoformat(),
         )
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
     except FileNotFoundError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
     except Exception as e:
@@ -435,13 +444,12 @@ async def upload_chunk(upload_id: UUID,
 ):
     uid = _user_id(current_user)
     try:
-        body = await request.body()
-        res = await _upload_service.put_chunk(
+        res = await _upload_service.put_chunk_stream(
             session=session,
             user_id=uid,
             upload_id=upload_id,
             chunk_idx=chunk_index,
-            ciphertext=body,
+            body=request.stream(),
             nonce_b64=x_chunk_nonce,
             tag_b64=x_chunk_tag,
         )
@@ -455,6 +463,32 @@ async def upload_chunk(upload_id: UUID,
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Chunk upload failed: {e}")
 
+@router.put("/{upload_id}/chunks")
+async def upload_chunk_batch(upload_id: UUID,
+    request: Request,
+    session: AsyncSession = Depends(get_db_tx),
+    current_user: User = Depends(get_current_user),
+    _kb_required: bool = Depends(require_keybundle),
+):
+    # body: back-to-back SDC1 packages (chunk index, nonce and tag travel in each package header)
+    uid = _user_id(current_user)
+    try:
+        res = await _upload_service.put_chunk_batch(
+            session=session,
+            user_id=uid,
+            upload_id=upload_id,
+            body=request.stream(),
+        )
+        return {"ok": True, **res}
+    except UploadConflictError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Chunk batch upload failed: {e}")
+
 @router.get("/{upload_id}/status", response_model=UploadStatusResponse)
 async def upload_status(
     upload_id: UUID,
@@ -472,7 +506,7 @@ async def upload_status(
 @router.post("/{upload_id}/finalize", response_model=FinalUploadResponse)
 async def finalize_upload(
     upload_id: UUID,
-    payload: UploadRequest,
+    payload: FinalUploadRequest,
     session: AsyncSession = Depends(get_db_tx),
     user: User = Depends(get_current_user),
     kb_required: bool = Depends(require_keybundle),
@@ -505,23 +539,80 @@ async def finalize_upload(
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Finalize failed: {e}")
 
+@router.post("/{upload_id}/finalize-pack", response_model=PackFinalizeResponse)
+async def finalize_pack_upload(
+    upload_id: UUID,
+    payload: PackFinalizeRequest,
+    session: AsyncSession = Depends(get_db_tx),
+    user: User = Depends(get_current_user),
+    kb_required: bool = Depends(require_keybundle),
+):
+    try:
+        files = await _upload_service.finalize_pack(
+            session=session,
+            user_id=user.user_id,
+            upload_id=upload_id,
+            files=[f.model_dump() for f in payload.files],
+        )
+        return PackFinalizeResponse(
+            upload_id=upload_id,
+            files=[PackFinalizedFile(pack_index=f["pack_index"], file_id=f["file_id"], version_id=f["version_id"],
+                                     integrity_hash=f["integrity_hash"]) for f in files],
+        )
+    except UploadConflictError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Finalize failed: {e}")
+
+@router.post("/{upload_id}/abort")
+async def abort_upload(
+    upload_id: UUID,
+    session: AsyncSession = Depends(get_db_tx),
+    user: User = Depends(get_current_user),
+):
+    try:
+        released = await _upload_service.abort(session=session, user_id=user.user_id, upload_id=upload_id)
+        return {"success": True, "message": "Upload aborted", "upload_id": str(upload_id), "released_bytes": released}
+    except UploadConflictError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except Exception:
+        logger.exception("abort_upload failed", extra={"user_id": user.user_id, "upload_id": str(upload_id)})
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="abort failed")
+
 @router.get("/download/{file_id}")
 async def download_file(
     request:FileDownloadRequest,
     file_id:UUID,
+    range_header: str | None = Header(default=None, alias="Range"),
+    if_range: str | None = Header(default=None, alias="If-Range"),
     session:AsyncSession = Depends(get_db),
     current_user : User = Depends(get_current_user)
 ):
     uid = _user_id(current_user)
     try:
-        target, headers, iterator = await _download_service.get_download_file(
-        session=session,
-        user_id=uid,
-        file_id=file_id,
-        version_id=request.version_id,
-        verify_sha256=request.verify_sha,
-    )
-        return StreamingResponse(iterator, headers=headers, media_type="application/octet-stream")
+        target = await _download_service.get_download_file(session, uid, file_id, request.version_id)
+        # the rest only touches chunk storage: release the pooled connection before the
+        # manifest is opened and the body streams, not when the response finishes
+        await session.close()
+        status_code, headers, iterator = await _download_service.stream_target(
+            target,
+            verify_sha256=request.verify_sha,
+            range_header=range_header,
+            if_range=if_range,
+        )
+        return StreamingResponse(iterator, status_code=status_code, headers=headers, media_type="application/octet-stream")
+    except DownloadRangeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail=str(e),
+            headers={"Content-Range": f"{RANGE_UNIT} */{e.total_chunks}"},
+        )
     except DownloadNotFoundError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
     except DownloadCorruptionError as e:
@@ -2,7 +2,7 @@ import logging
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
-from app.api.dependencies import get_current_user
+from app.api.dependencies import get_current_user, require_keybundle
 from app.domain.persistance.database import get_db , get_db_tx
 from uuid import UUID
 import os
@@ -13,7 +13,7 @@ from app.schemas.dash_schema import (FolderRenameRequest, FolderRenameResponse,
                                      , MultipleFolderCopyRequest, MultipleFolderCopyResponse, MultipleFolderDeleteRequest, MultipleFolderDeleteResponse
                                      ,MultipleFolderPermDeleteRequest,MultipleFolderPermDeleteResponse,MultipleFolderRestoreRequest,MultipleFolderRestoreResponse
                                      ,FolderUploadChildFile,FolderUploadChildStatus,FolderUploadRequest,FolderUploadResponse
-                                     ,FolderUploadStatusResponse,FolderDownloadPlanRequest, FolderDownloadPlanResponse,BootstrapDefaultsRequest, BootstrapDefaultsResponse)
+                                     ,FolderUploadStatusResponse,FolderFinalizeRequest,FolderFinalizeResponse,FolderFinalizedFile,FolderDownloadPlanRequest, FolderDownloadPlanResponse,BootstrapDefaultsRequest, BootstrapDefaultsResponse)
 
 from app.repositories.folder_repository import FolderRepository
 from app.repositories.undo_redo_repository import UndoRedoRepository
@@ -23,10 +23,14 @@ from app.repositories.upload_chunk_repository import UploadChunkRepository
 from app.repositories.file_repository import FileRepository
 from app.repositories.trash_repository import RecyclebinRepository
 from app.repositories.folder_key_repository import FolderKeysRepository
+from app.repositories.chunk_object_repository import ChunkObjectRepository
+from app.repositories.version_repository import VersionRepository
 from app.storage.chunk_storage import ChunkStorage
 
 from app.services.folder_services import FolderService
 from app.services.folder_upload_services import FolderUploadServices
+from app.services.upload_service import UploadServices, UploadConflictError, QuotaExceededError
+from app.services.chunk_store_service import ChunkStoreService
 from app.services.download_services import DownloadService
 
 from app.security.server_wrapup import ServerCipherWrap
@@ -39,7 +43,9 @@ router = APIRouter(prefix="/folder", tags=["folders"])
 UPLOAD_ROOT = os.getenv("UPLOAD_ROOT", str(Path("storage/uploads").resolve()))
 RECYCLE_ROOT = os.getenv("RECYCLE_ROOT", str(Path("storage/recyclebin").resolve()))
 
-_folder_service = FolderService(FolderRepository(),UndoRedoRepository(),FileRepository(),RecyclebinRepository(),FolderKeysRepository(),upload_root=UPLOAD_ROOT,recycle_root=RECYCLE_ROOT)
+_chunk_store = ChunkStoreService(ChunkObjectRepository(), ChunkStorage())
+_folder_service = FolderService(FolderRepository(),UndoRedoRepository(),FileRepository(),RecyclebinRepository(),FolderKeysRepository(),upload_root=UPLOAD_ROOT,recycle_root=RECYCLE_ROOT,
+                                chunk_store=_chunk_store)
 
 folder_repo = FolderRepository()
 tree_repo = FolderTreeRepository(folder_repo)
@@ -58,6 +64,20 @@ _folder_folder_service = FolderUploadServices(
     settings=None
 )
 
+_upload_service = UploadServices(
+    session_repo=upload_repo,
+    chunk_repo=chunk_repo,
+    ver_repo=VersionRepository(),
+    storage=ChunkStorage(),
+    serverwrap=ServerCipherWrap(),
+    folder_repo=folder_repo,
+    file_repo=FileRepository(),
+    settings=None,
+    chunk_store=_chunk_store,
+    item_repo=fu_item_repo,
+    folder_upload_repo=fu_session_repo,
+)
+
 
 _download_service = DownloadService(folder_repo=FolderRepository(), file_repo=FileRepository(),storage=ChunkStorage(),wrapper=ServerCipherWrap())
 
@@ -297,6 +317,7 @@ async def init_folder_upload(
                 parent_folder_id=payload.parent_folder_id or 0,
                 entries=payload.entries,
                 chunk_size=payload.chunk_size,
+                pack=payload.pack,
             )
 
         return FolderUploadResponse(
@@ -313,10 +334,13 @@ async def init_folder_upload(
                     upload_id=p.upload_id,
                     chunk_size=p.chunk_size,
                     total_chunks=p.total_chunks,
+                    pack_index=p.pack_index,
                 )
                 for p in plans
             ],
         )
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
     except FileNotFoundError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
     except ValueError as e:
@@ -325,7 +349,39 @@ async def init_folder_upload(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Folder upload init failed: {e}")
     
 
-@router.get("/{folder_id}/status",response_model=FolderUploadStatusResponse)
+@router.post("/upload/{folder_upload_id}/finalize", response_model=FolderFinalizeResponse)
+async def finalize_folder_upload(
+    folder_upload_id: UUID,
+    payload: FolderFinalizeRequest,
+    session: AsyncSession = Depends(get_db_tx),
+    user: User = Depends(get_current_user),
+    kb_required: bool = Depends(require_keybundle),
+):
+    try:
+        res = await _upload_service.finalize_folder(
+            session=session,
+            user_id=user.user_id,
+            folder_upload_id=folder_upload_id,
+            files=[f.model_dump() for f in payload.files],
+        )
+        return FolderFinalizeResponse(
+            folder_upload_id=res["folder_upload_id"],
+            status=res["status"],
+            total_files=res["total_files"],
+            completed_files=res["completed_files"],
+            files=[FolderFinalizedFile(upload_id=f["upload_id"], pack_index=f["pack_index"], file_id=f["file_id"],
+                                       version_id=f["version_id"], integrity_hash=f["integrity_hash"]) for f in res["files"]],
+        )
+    except UploadConflictError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Folder finalize failed: {e}")
+
+@router.get("/{folder_upload_id}/status",response_model=FolderUploadStatusResponse)
 async def folder_upload_status(folder_upload_id: UUID,
     limit: int = Query(default=200, ge=1, le=1000),
     offset: int = Query(default=0, ge=0),
@@ -333,7 +389,7 @@ async def folder_upload_status(folder_upload_id: UUID,
     user: User = Depends(get_current_user),
 ):
     try:
-        folder_user_session = await fu_session_repo.get_folder(session, user_id=_user_id,folder_upload_id=folder_upload_id)
+        folder_user_session = await fu_session_repo.get_folder(session, user_id=user.user_id,folder_upload_id=folder_upload_id)
         if not folder_user_session:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Folder upload session not found")
         
@@ -341,13 +397,15 @@ async def folder_upload_status(folder_upload_id: UUID,
         upload_ids = [it.upload_id for it in items if it.upload_id]
 
         status_map = await upload_repo.get_status_bulk(session, user.user_id, upload_ids)
-        count_map = await chunk_repo.count_bulk(session, upload_ids)
+        # counts come from the sessions; only ones created before the bitmap need the receipts counted
+        legacy_ids = [uid for uid, (_, _, received) in status_map.items() if received is None]
+        count_map = await chunk_repo.count_bulk(session, legacy_ids)
 
         completed = await fu_item_repo.complete(session, user.user_id, folder_upload_id)
 
         res_items = []
         for it in items:
-            st, total = status_map.get(it.upload_id, ("UNKNOWN", 0))
+            st, total, received = status_map.get(it.upload_id, ("UNKNOWN", 0, None))
             res_items.append(
                 FolderUploadChildStatus(
                     rel_path=it.rel_path,
@@ -355,7 +413,7 @@ async def folder_upload_status(folder_upload_id: UUID,
                     upload_id=it.upload_id,
                     folder_id=int(it.folder_id),
                     total_chunks=int(total),
-                    received_count=int(count_map.get(it.upload_id, 0)),
+                    received_count=int(received if received is not None else count_map.get(it.upload_id, 0)),
                     upload_status=st,
                 )
             )
@@ -367,7 +425,7 @@ async def folder_upload_status(folder_upload_id: UUID,
             total_files=int(folder_user_session.total_files),
             completed_files=int(completed),
             expires_at=folder_user_session.expires_at.isoformat(),
-            items=res_items,
+            childs=res_items,
         )
     except HTTPException:
         raise
@@ -8,17 +8,21 @@ from app.schemas.auth_schema import User
 from app.schemas.dash_schema import (
     FileStorageStatsResponse, FileStorageBreakdownResponse,
     CheckStorageRequest, CheckStorageResponse,
-    FolderStorageRequest, FolderStorageResponse
+    FolderStorageRequest, FolderStorageResponse, DedupReportResponse
 )
 from app.services.storage_services import StorageServices
+from app.services.chunk_store_service import ChunkStoreService
 
 from app.repositories.file_repository import FileRepository
 from app.repositories.folder_repository import FolderRepository
 from app.repositories.storage_repo import StorageRepository
 from app.repositories.trash_repository import RecyclebinRepository
+from app.repositories.chunk_object_repository import ChunkObjectRepository
+from app.storage.chunk_storage import ChunkStorage
 
 router = APIRouter(prefix="/storage", tags=["storage"])
 service = StorageServices(FileRepository(),FolderRepository(),StorageRepository(),RecyclebinRepository())
+chunk_store = ChunkStoreService(ChunkObjectRepository(), ChunkStorage())
 
 @router.get("/stats", response_model=FileStorageStatsResponse)
 async def stats(
@@ -78,6 +82,21 @@ async def breakdown(
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
+@router.get("/dedup", response_model=DedupReportResponse)
+async def dedup(
+    session: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    try:
+        report = await chunk_store.dedup_report(session, current_user.user_id)
+        return DedupReportResponse(
+            success=True,
+            message="Successfully fetched chunk dedup report",
+            **report,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
 @router.post("/check-storage", response_model=CheckStorageResponse)
 async def check_storage(
     payload: CheckStorageRequest,
@@ -11,6 +11,15 @@ logger = logging.getLogger(__name__)
 class Settings(BaseSettings):
     # Database Configuration
     database_postgres_url: str = Field(..., description="PostgreSQL database URL" , alias="DATABASE_POSTGRES_URL")
+    # Engine / connection pool (pool_recycle -1 = never); prepared statement caches 0 behind PgBouncer-style poolers
+    db_echo: bool = Field(default=False, alias="SD_DB_ECHO")
+    db_pool_size: int = Field(default=20, ge=1, le=500, alias="SD_DB_POOL_SIZE")
+    db_max_overflow: int = Field(default=10, ge=0, le=500, alias="SD_DB_MAX_OVERFLOW")
+    db_pool_timeout_seconds: float = Field(default=30, gt=0, le=600, alias="SD_DB_POOL_TIMEOUT_SECONDS")
+    db_pool_recycle_seconds: int = Field(default=1800, ge=-1, le=24 * 3600, alias="SD_DB_POOL_RECYCLE_SECONDS")
+    db_pool_pre_ping: bool = Field(default=True, alias="SD_DB_POOL_PRE_PING")
+    db_query_cache_size: int = Field(default=500, ge=0, le=100_000, alias="SD_DB_QUERY_CACHE_SIZE")
+    db_prepared_statement_cache_size: int = Field(default=100, ge=0, le=10_000, alias="SD_DB_PREPARED_STATEMENT_CACHE_SIZE")
     
     # Supabase Configuration
     supabase_url: str = Field(..., description="Supabase project URL" , alias="SUPABASE_URL")
@@ -20,6 +29,17 @@ class Settings(BaseSettings):
     jwt_secret_key: str = Field(default_factory=lambda: secrets.token_urlsafe(32), alias="SECURITY_JWT_SECRET_KEY")
     jwt_algorithm: str = Field(default="HS256", description="JWT signing algorithm", alias="SECURITY_JWT_ALGORITHM")
     # jwt_expiration_hours: int = Field(default=24, ge=1, le=168)  # 1 hour to 1 week
+    # Bearer tokens: verified locally (JWKS / jwt_secret_key) and cached per token until exp or the TTL (0 = no cache)
+    auth_local_verify: bool = Field(default=True, alias="SD_AUTH_LOCAL_VERIFY")
+    auth_jwt_audience: str = Field(default="authenticated", alias="SD_AUTH_JWT_AUDIENCE")
+    auth_cache_ttl_seconds: int = Field(default=300, ge=0, le=3600, alias="SD_AUTH_CACHE_TTL_SECONDS")
+    auth_cache_max_entries: int = Field(default=10_000, ge=1, le=1_000_000, alias="SD_AUTH_CACHE_MAX_ENTRIES")
+    auth_jwks_ttl_seconds: int = Field(default=600, ge=30, le=24 * 3600, alias="SD_AUTH_JWKS_TTL_SECONDS")
+    # Logout / account deletion are shared through the auth_revocations table, which every worker polls at
+    # this interval: a revoked token keeps working on other workers for at most this long (not the cache TTL)
+    auth_revocation_poll_seconds: int = Field(default=5, ge=1, le=300, alias="SD_AUTH_REVOCATION_POLL_SECONDS")
+    # require_keybundle: users known to have a key bundle, cached per process (0 = always ask the DB)
+    keybundle_cache_max_users: int = Field(default=100_000, ge=0, le=10_000_000, alias="SD_KEYBUNDLE_CACHE_MAX_USERS")
     
     # File Upload Configuration    
     upload_folder: str = Field(default="uploads", description="Upload directory path", alias="FILE_UPLOAD_FOLDER")
@@ -31,9 +51,59 @@ class Settings(BaseSettings):
     folder_min_chunk_bytes: int = Field(default=256 * 1024, ge=64 * 1024, le=4 * 1024 * 1024,alias="SD_FOLDER_MIN_CHUNK_BYTES")
     folder_max_chunk_bytes: int = Field(default=16 * 1024 * 1024, ge=1024 * 1024, le=128 * 1024 * 1024,alias="SD_FOLDER_MAX_CHUNK_BYTES")
     folder_default_chunk_bytes: int = Field(default=4 * 1024 * 1024, ge=64 * 1024, le=128 * 1024 * 1024,alias="SD_FOLDER_DEFAULT_CHUNK_BYTES")
+    # Chunk bodies larger than this are spooled to a temp file while they are received
+    chunk_spool_threshold_bytes: int = Field(default=1024 * 1024, ge=64 * 1024, le=128 * 1024 * 1024, alias="SD_CHUNK_SPOOL_THRESHOLD_BYTES")
+    # Batch chunk upload (PUT /file/{upload_id}/chunks): request body and package count limits; bodies
+    # past the spool threshold above are parsed from a temp file, not held in memory
+    upload_batch_max_bytes: int = Field(default=64 * 1024 * 1024, ge=1024 * 1024, le=128 * 1024 * 1024, alias="SD_UPLOAD_BATCH_MAX_BYTES")
+    upload_batch_max_chunks: int = Field(default=256, ge=1, le=1024, alias="SD_UPLOAD_BATCH_MAX_CHUNKS")
+    # Folder uploads: files up to this size share one pack session and pack objects (0 = off)
+    pack_max_file_bytes: int = Field(default=64 * 1024, ge=0, le=4 * 1024 * 1024, alias="SD_PACK_MAX_FILE_BYTES")
+    # Bulk finalize (folder uploads / packs): manifests written at once
+    finalize_concurrency: int = Field(default=16, ge=1, le=256, alias="SD_FINALIZE_CONCURRENCY")
     folder_session_ttl_hours: int = Field(default=24, ge=1, le=168,alias="SD_FOLDER_SESSION_TTL_HOURS")
     folder_max_entries: int = Field(default=10_000, ge=100, le=1_000_000,alias="SD_FOLDER_MAX_ENTRIES")
 
+    # Download read-ahead: how many chunks may be read/unwrapped/verified ahead of the socket
+    download_prefetch_chunks: int = Field(default=4, ge=1, le=64, alias="SD_DOWNLOAD_PREFETCH_CHUNKS")
+    download_prefetch_max_bytes: int = Field(default=64 * 1024 * 1024, ge=1024 * 1024, le=1024 * 1024 * 1024, alias="SD_DOWNLOAD_PREFETCH_MAX_BYTES")
+
+    # Chunk/blueprint writes: dedicated bounded thread pool, fsync off|always|batch
+    storage_io_workers: int = Field(default=4, ge=1, le=64, alias="SD_STORAGE_IO_WORKERS")
+    storage_io_max_pending: int = Field(default=64, ge=1, le=4096, alias="SD_STORAGE_IO_MAX_PENDING")
+    storage_fsync: str = Field(default="off", pattern="^(off|always|batch)$", alias="SD_STORAGE_FSYNC")
+    storage_fsync_batch_ms: int = Field(default=5, ge=0, le=1000, alias="SD_STORAGE_FSYNC_BATCH_MS")
+    storage_fsync_batch_max: int = Field(default=32, ge=1, le=1024, alias="SD_STORAGE_FSYNC_BATCH_MAX")
+
+    # Server wrap/unwrap (AES-GCM) worker threads; 0 = one per CPU
+    crypto_workers: int = Field(default=0, ge=0, le=64, alias="SD_CRYPTO_WORKERS")
+
+    # Content-addressed chunk objects: unreferenced objects are deleted after the grace period
+    chunk_gc_grace_seconds: int = Field(default=3600, ge=0, le=30 * 24 * 3600, alias="SD_CHUNK_GC_GRACE_SECONDS")
+    chunk_gc_interval_seconds: int = Field(default=300, ge=5, le=24 * 3600, alias="SD_CHUNK_GC_INTERVAL_SECONDS")
+    chunk_gc_batch: int = Field(default=500, ge=1, le=100_000, alias="SD_CHUNK_GC_BATCH")
+
+    # Upload sessions past expires_at: sweep interval and batch (releases quota reservations + chunk refs)
+    upload_sweep_interval_seconds: int = Field(default=300, ge=5, le=24 * 3600, alias="SD_UPLOAD_SWEEP_INTERVAL_SECONDS")
+    upload_sweep_batch: int = Field(default=200, ge=1, le=10_000, alias="SD_UPLOAD_SWEEP_BATCH")
+
+    # JSON -> binary manifest migration: blueprints converted per pass (0 = off); replaced JSON files are removed a pass later
+    manifest_migrate_batch: int = Field(default=1000, ge=0, le=100_000, alias="SD_MANIFEST_MIGRATE_BATCH")
+    manifest_migrate_interval_seconds: int = Field(default=30, ge=1, le=24 * 3600, alias="SD_MANIFEST_MIGRATE_INTERVAL_SECONDS")
+
+    # Folder copy: how many manifests / blobs are cloned at once
+    copy_clone_concurrency: int = Field(default=16, ge=1, le=256, alias="SD_COPY_CLONE_CONCURRENCY")
+    # Folder trash/restore: ciphertext blobs moved at once
+    blob_move_concurrency: int = Field(default=32, ge=1, le=256, alias="SD_BLOB_MOVE_CONCURRENCY")
+
+    # Folder size rollups + per-user usage counters: full rebuild interval (0 = only fill missing ones at startup)
+    usage_reconcile_seconds: int = Field(default=86400, ge=0, le=7 * 86400, alias="SD_USAGE_RECONCILE_SECONDS")
+
+    # GET /metrics (Prometheus text format), off unless enabled; with a token set, scrapers must send
+    # "Authorization: Bearer <token>" (leave it empty only where the port is not publicly reachable)
+    metrics_enabled: bool = Field(default=False, alias="SD_METRICS_ENABLED")
+    metrics_token: str = Field(default="", alias="SD_METRICS_TOKEN")
+
     # Application Configuration
     debug: bool = Field(default=False, description="Debug mode")
     log_level: str = Field(default="INFO", pattern="^(DEBUG|INFO|WARNING|ERROR|CRITICAL)$")
@@ -1,15 +1,94 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+from dotenv import load_dotenv
+
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-import os
-from dotenv import load_dotenv
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.config.config import Settings, get_settings
 
 load_dotenv()
 
-DATABASE_POSTGRES_URL = os.getenv("DATABASE_POSTGRES_URL")
+logger = logging.getLogger(__name__)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool that records how long each checkout waited for a connection
+    (queueing behind a full pool, plus the connect itself when the pool grows) and how
+    many gave up after pool_timeout. An upload storm that is short of connections shows
+    up here instead of only as slow requests.
+    """
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            conn = super()._do_get()
+        except sa_exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - started
+        self.checkouts += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return conn
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "pool_size": self.size(),
+            "max_overflow": self._max_overflow,
+            "in_use": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow_in_use": max(0, self.overflow()),
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_checkout_wait_ms": round(self.wait_total / max(1, self.checkouts) * 1000, 3),
+            "max_checkout_wait_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+def create_engine_from_settings(cfg: Settings) -> AsyncEngine:
+    url = make_url(cfg.database_postgres_url)
+    connect_args: Dict[str, Any] = {}
+    if url.get_driver_name() == "asyncpg":
+        # asyncpg's server-side statement cache and SQLAlchemy's adapter cache; both 0 behind
+        # PgBouncer / the Supabase pooler in transaction mode
+        connect_args["statement_cache_size"] = cfg.db_prepared_statement_cache_size
+        connect_args["prepared_statement_cache_size"] = cfg.db_prepared_statement_cache_size
+
+    return create_async_engine(
+        url,
+        echo=cfg.db_echo,
+        poolclass=TimedQueuePool,
+        pool_size=cfg.db_pool_size,
+        max_overflow=cfg.db_max_overflow,
+        pool_timeout=cfg.db_pool_timeout_seconds,
+        pool_recycle=cfg.db_pool_recycle_seconds,
+        pool_pre_ping=cfg.db_pool_pre_ping,
+        query_cache_size=cfg.db_query_cache_size,
+        connect_args=connect_args,
+    )
+
 
 # Create async engine
-engine = create_async_engine(DATABASE_POSTGRES_URL, echo=True)
+engine = create_engine_from_settings(get_settings())
 
 # Async session
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
@@ -17,6 +96,10 @@ async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False
 # Declarative base
 Base = declarative_base()
 
+
+def pool_stats() -> Dict[str, float]:
+    return engine.pool.stats()
+
 # streaming purpose
 async def get_db() -> AsyncSession:
     async with async_session() as session:
@@ -25,11 +108,33 @@ async def get_db() -> AsyncSession:
         finally:
             await session.close()
 
-# database operation Dependency
+def after_commit(session: AsyncSession, callback: Callable[[], Awaitable[Any]]) -> None:
+    # storage side effects that must wait for the transaction, e.g. unlinking a file the old row pointed at
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+def after_rollback(session: AsyncSession, callback: Callable[[], Awaitable[Any]]) -> None:
+    # undo storage writes no committed row will ever reference
+    session.info.setdefault("after_rollback", []).append(callback)
+
+
+async def run_session_hooks(session: AsyncSession, committed: bool) -> None:
+    hooks = session.info.pop("after_commit" if committed else "after_rollback", [])
+    session.info.pop("after_rollback" if committed else "after_commit", None)
+    for hook in hooks:
+        try:
+            await hook()
+        except Exception:
+            logger.exception("db:session hook failed", extra={"committed": committed})
+
+
+# database operation Dependency: commits when the request succeeds, rolls back when it raises
 async def get_db_tx() -> AsyncSession:
     async with async_session() as session:
-        async with session.begin():
-            try:
+        try:
+            async with session.begin():
                 yield session
-            finally:
-                await session.close()
+        except BaseException:
+            await run_session_hooks(session, committed=False)
+            raise
+        await run_session_hooks(session, committed=True)
@@ -40,3 +40,13 @@ class KeyBundle(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+
+class AuthRevocation(Base):
+    __tablename__ = "auth_revocations"
+
+    # "user:<user_id>" refuses every token issued up to revoked_at, "session:<session_id>" every token
+    # of that login session, "token:<sha256>" a single token (no session_id claim)
+    key = Column(String, primary_key=True, nullable=False)
+    revoked_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    # past this the revoked tokens have expired anyway and the row can go; NULL = kept
+    expires_at = Column(DateTime, nullable=True, index=True)
@@ -157,6 +157,8 @@ class Folder(Base):
         Index('idx_folders_user_parent', 'user_id', 'parent_folder_id'),
         Index('idx_folders_user', 'user_id', 'folder_id'),
         Index('idx_folders_user_deleted', 'user_id', 'is_deleted'),
+        # prefix scans on the materialized path (subtree / ancestor queries)
+        Index('idx_folders_user_path', 'user_id', 'heirarchy_path', postgresql_ops={'heirarchy_path': 'text_pattern_ops'}),
 
         CheckConstraint('depth_level >= 0', name='check_depth_level_non_negative'),
         CheckConstraint('length(folder_name) <= 255', name='check_folder_name_length'),
@@ -191,6 +193,46 @@ class Folder(Base):
 
         return data
     
+class FolderStats(Base):
+    """
+    Size / file-count rollup of active files per folder: direct = files in the folder itself,
+    total = the whole subtree. Maintained incrementally by FolderStatsRepository.apply();
+    rebuild() recomputes it from files + heirarchy_path.
+    """
+    __tablename__ = "folder_stats"
+
+    folder_id = Column(Integer, ForeignKey("folders.folder_id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(String, nullable=False, index=True)
+
+    direct_bytes = Column(BigInteger, nullable=False, default=0)
+    direct_files = Column(Integer, nullable=False, default=0)
+    total_bytes = Column(BigInteger, nullable=False, default=0)
+    total_files = Column(Integer, nullable=False, default=0)
+
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class StorageUsage(Base):
+    """
+    Per-user usage counters by bucket ("active" files / recycle "bin") and file_type.
+    Maintained incrementally by StorageUsageRepository.apply(); rebuild() recomputes them.
+    """
+    __tablename__ = "storage_usage"
+
+    user_id = Column(String, primary_key=True)
+    bucket = Column(String(8), primary_key=True)
+    file_type = Column(String(128), primary_key=True)
+
+    files = Column(BigInteger, nullable=False, default=0)
+    bytes = Column(BigInteger, nullable=False, default=0)
+
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        CheckConstraint("bucket IN ('active', 'bin')", name="check_storage_usage_bucket"),
+    )
+
+
 class FolderKeys(Base):
     __tablename__ = "folder_keys"
 
@@ -374,7 +416,8 @@ class Storage(Base):
     user_id = Column(String, nullable=False, index=True)
 
     total_storage = Column(BigInteger, nullable=False)
-    storage_used = Column(Integer, nullable=False)
+    storage_used = Column(BigInteger, nullable=False)  # active + recycle bin bytes, kept by StorageUsageRepository
+    reserved_bytes = Column(BigInteger, nullable=False, default=0)  # held by unfinished upload sessions
 
     plan_type = Column(Enum("free", "basic", "premium" , name = "storage_plans"), default="free") # free, basic, premium
     is_premium = Column(Boolean, default=False)
@@ -392,7 +435,7 @@ class Storage(Base):
 
         CheckConstraint('total_storage > 0', name='check_total_storage_positive'),
         CheckConstraint('storage_used >= 0', name='check_storage_used_positive'),
-        CheckConstraint('storage_used <= total_storage', name='check_storage_within_limit')
+        CheckConstraint('reserved_bytes >= 0', name='check_storage_reserved_non_negative'),
     )
 
     @hybrid_property
@@ -4,8 +4,9 @@ import uuid
 
 from sqlalchemy import (
     Column, String, DateTime, Integer, BigInteger, ForeignKey,
-    CheckConstraint, Index, UniqueConstraint, Text
+    CheckConstraint, Index, UniqueConstraint, Text, LargeBinary, Boolean
 )
+from sqlalchemy.orm import deferred
 
 from app.domain.persistance.database import Base
 from sqlalchemy.dialects.postgresql import UUID
@@ -28,6 +29,16 @@ class UploadSession(Base):
 
     status = Column(String(32), nullable=False, default="UPLOADING", index=True)
     replace_of_file_id = Column(UUID(as_uuid=True), nullable=True, index=True)
+    reserved_bytes = Column(BigInteger, nullable=False, default=0)  # quota held on storage.reserved_bytes until finalize/abort/expiry
+
+    # bit i (byte i // 8, bit i % 8) set once chunk i is stored; NULL for sessions created before it existed.
+    # Deferred: only status/resume reads it, not every chunk PUT.
+    received_bitmap = deferred(Column(LargeBinary, nullable=True))
+    received_count = Column(Integer, nullable=False, default=0)
+
+    # pack session: every "chunk" is one whole small file of a folder upload (chunk_index = the
+    # item's pack_index, file_size/file_type = the pack totals; members are upload_folder_items)
+    is_pack = Column(Boolean, nullable=False, default=False)
 
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
@@ -36,11 +47,16 @@ class UploadSession(Base):
     __table_args__ = (CheckConstraint("file_size >=0 ", name="check_upload_file_size_non_negative"),
                       CheckConstraint("chunk_size >=0", name="check_upload_chunk_size_positive"),
                       CheckConstraint("total_chunks >0", name="check_total_chunks_size_positive"),
-                      Index("idx_sessions_user_status", "user_id", "status"))
+                      Index("idx_sessions_user_status", "user_id", "status"),
+                      Index("idx_sessions_status_expiry", "status", "expires_at"))
     
     @staticmethod
     def default_expiry(hours: int = 24) -> datetime:
         return datetime.utcnow() + timedelta(hours=hours)
+
+    @staticmethod
+    def empty_bitmap(total_chunks: int) -> bytes:
+        return bytes((int(total_chunks) + 7) // 8)
     
 class UploadChunk(Base):
     __tablename__ = "upload_chunks"
@@ -102,6 +118,7 @@ class UploadItems(Base):
     file_size = Column(Integer, nullable=False)
 
     upload_id = Column(UUID(as_uuid=True), ForeignKey("upload_sessions.upload_id", ondelete="SET NULL"), nullable=True, index=True)
+    pack_index = Column(Integer, nullable=True)  # set when upload_id is a pack session: this file's chunk index in it
 
     status = Column(String(32), nullable=False, default="PENDING", index=True)  # PENDING/UPLOADING/COMPLETE/FAILED
 
@@ -110,4 +127,27 @@ class UploadItems(Base):
     __table_args__ = (
         Index("idx_folder_upload_items_fu", "folder_upload_id"),
         Index("idx_folder_upload_items_fu_status", "folder_upload_id", "status"),
-    )
\ No newline at end of file
+    )
+
+class ChunkObject(Base):
+    """
+    One stored .c2 object, addressed by the chunk receipt SHA-256.
+    ref_count = receipts of unfinalized uploads + manifest entries (files, copies, versions)
+    pointing at it; rows at 0 are reclaimed by the chunk GC after a grace period.
+    """
+    __tablename__ = "chunk_objects"
+
+    user_id = Column(String, primary_key=True)
+    sha256 = Column(String(64), primary_key=True)
+
+    storage_key = Column(String(2048), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        CheckConstraint("size >= 0", name="check_chunk_object_size_non_negative"),
+        Index("idx_chunk_objects_gc", "ref_count", "updated_at"),
+    )
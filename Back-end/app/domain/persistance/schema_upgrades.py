@@ -0,0 +1,75 @@
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# create_all doesn't alter existing tables: storage_used outgrew int4, quota is enforced by upload
+# reservations rather than a constraint that would fail copies/restores of an account over its plan,
+# and upload reservations / progress bitmaps / small-file packs need their columns.
+# (table, column) -> ADD COLUMN definition
+ADDED_COLUMNS = {
+    ("storage", "reserved_bytes"): "BIGINT NOT NULL DEFAULT 0",
+    ("upload_sessions", "reserved_bytes"): "BIGINT NOT NULL DEFAULT 0",
+    ("upload_sessions", "received_bitmap"): "BYTEA",
+    ("upload_sessions", "received_count"): "INTEGER NOT NULL DEFAULT 0",
+    ("upload_sessions", "is_pack"): "BOOLEAN NOT NULL DEFAULT false",
+    ("upload_folder_items", "pack_index"): "INTEGER",
+}
+# index name -> CREATE INDEX statement
+ADDED_INDEXES = {
+    "idx_sessions_status_expiry": "CREATE INDEX IF NOT EXISTS idx_sessions_status_expiry ON upload_sessions (status, expires_at)",
+}
+DROPPED_CONSTRAINTS = [("storage", "check_storage_within_limit")]
+
+# every ALTER takes ACCESS EXCLUSIVE (CREATE INDEX a SHARE lock) before looking at the catalog, even
+# with IF [NOT] EXISTS, so only the statements that are still needed run; a worker that can't get the
+# lock quickly leaves the upgrade to the next start instead of queueing every query behind it
+LOCK_TIMEOUT = "5s"
+
+
+async def pending_upgrades(conn: AsyncConnection) -> List[str]:
+    tables = sorted({t for t, _ in ADDED_COLUMNS} | {t for t, _ in DROPPED_CONSTRAINTS} | {"storage"})
+    columns = {
+        (r[0], r[1]): r[2]
+        for r in (await conn.execute(text("""
+            SELECT table_name, column_name, data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = ANY(:tables)
+        """), {"tables": tables})).all()
+    }
+    constraints = {
+        (r[0], r[1])
+        for r in (await conn.execute(text("""
+            SELECT table_name, constraint_name FROM information_schema.table_constraints
+            WHERE table_schema = current_schema() AND table_name = ANY(:tables)
+        """), {"tables": tables})).all()
+    }
+    indexes = set((await conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND indexname = ANY(:names)"
+    ), {"names": list(ADDED_INDEXES)})).scalars().all())
+
+    out: List[str] = []
+    if columns.get(("storage", "storage_used"), "bigint") != "bigint":
+        out.append("ALTER TABLE storage ALTER COLUMN storage_used TYPE BIGINT")
+    for table, name in DROPPED_CONSTRAINTS:
+        if (table, name) in constraints:
+            out.append(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}")
+    for (table, column), ddl in ADDED_COLUMNS.items():
+        if (table, column) not in columns:
+            out.append(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {ddl}")
+    for name, ddl in ADDED_INDEXES.items():
+        if name not in indexes:
+            out.append(ddl)
+    return out
+
+
+async def upgrade_schema(conn: AsyncConnection) -> List[str]:
+    """
+    Applies the upgrades create_all can't make, in the caller's transaction. On an up to date
+    database this is three catalog reads and no locks on the tables. Returns what ran.
+    """
+    statements = await pending_upgrades(conn)
+    if statements:
+        await conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+        for stmt in statements:
+            await conn.execute(text(stmt))
+    return statements
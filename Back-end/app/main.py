@@ -1,22 +1,37 @@
 from fastapi import FastAPI, Request , status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
 import time
 import asyncio
+import hmac
+from sqlalchemy import text
 
 # Routers
 from app.api.routers.auth import router
 from app.api.routers.routes import dashboard_router
 
 # DB & models (keep your existing SQLAlchemy for files/dashboard)
-from app.domain.persistance.database import engine, Base , async_session 
+from app.domain.persistance.database import engine, Base , async_session, pool_stats
 from app.domain.persistance.models import dash_models
+from app.domain.persistance.schema_upgrades import upgrade_schema
 
 # Supabase integration
 from app.config.auth.supabase_client import supabase_manager
 from app.config.config import settings
 
+from app.services.chunk_store_service import run_chunk_gc_loop, run_manifest_migration_loop
+from app.repositories.folder_repository import FolderRepository
+from app.api.routers.storage import chunk_store, service as storage_service
+from app.services.storage_services import run_usage_reconcile_loop
+from app.services.upload_service import run_upload_expiry_loop
+from app.api.routers.files import _upload_service as upload_service
+from app.observability.metrics import (REGISTRY, HTTP_REQUEST_SECONDS, UPLOAD_SESSIONS, DB_POOL, STORAGE_IO,
+                                       WS_CONNECTIONS, set_stats)
+from app.repositories.upload_session_repository import UploadSessionRepository
+from app.services.event.websocket_manager import websocket_manager
+from app.storage.storage_io import get_storage_io
+
 # Async lifespan for proper Supabase initialization
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -43,6 +58,29 @@ async def lifespan(app: FastAPI):
         print("Local database tables checked/created")
     except Exception as e:
         print(f"Database table creation failed: {e}")
+
+    # create_all skips indexes on tables that already exist; fill paths of rows written before they were maintained
+    try:
+        async with engine.begin() as conn:
+            for index in dash_models.Folder.__table__.indexes:
+                if index.name == "idx_folders_user_path":
+                    await conn.run_sync(lambda c: index.create(c, checkfirst=True))
+        async with async_session() as session:
+            async with session.begin():
+                if await FolderRepository().missing_paths(session):
+                    fixed = await FolderRepository().backfill_paths(session)
+                    print(f"Folder paths backfilled: {fixed}")
+    except Exception as e:
+        print(f"Folder path index/backfill failed: {e}")
+
+    # columns/constraints/indexes create_all can't add to existing tables; a no-op (no table locks) once applied
+    try:
+        async with engine.begin() as conn:
+            applied = await upgrade_schema(conn)
+        if applied:
+            print(f"Schema upgrades applied: {len(applied)}")
+    except Exception as e:
+        print(f"Storage table upgrade failed: {e}")
     
     # Start background tasks
     # print("Starting background tasks...")
@@ -58,6 +96,29 @@ async def lifespan(app: FastAPI):
     # except Exception as e:
     #     print(f"Background task startup failed: {e}")
     
+    # Reclaim chunk objects whose reference count dropped to zero
+    chunk_gc_task = asyncio.create_task(
+        run_chunk_gc_loop(chunk_store, async_session, settings.chunk_gc_interval_seconds)
+    )
+    print("Chunk GC task started")
+
+    # Rewrite JSON blueprints from before binary manifests (stops once none are left)
+    manifest_task = None
+    if settings.manifest_migrate_batch:
+        manifest_task = asyncio.create_task(
+            run_manifest_migration_loop(chunk_store, async_session, settings.manifest_migrate_interval_seconds)
+        )
+
+    # Expired upload sessions give back their quota reservation and chunk references
+    upload_expiry_task = asyncio.create_task(
+        run_upload_expiry_loop(upload_service, async_session, settings.upload_sweep_interval_seconds)
+    )
+
+    # Folder size rollups and usage counters: fill missing ones now, then rebuild periodically
+    usage_task = asyncio.create_task(
+        run_usage_reconcile_loop(storage_service, async_session, settings.usage_reconcile_seconds)
+    )
+
     # List all routes
     await list_routes()
     
@@ -67,6 +128,12 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     print("Shutting down StormdDrive API...")
+
+    chunk_gc_task.cancel()
+    usage_task.cancel()
+    upload_expiry_task.cancel()
+    if manifest_task is not None:
+        manifest_task.cancel()
     
     # Cancel background tasks
     # try:
@@ -116,6 +183,10 @@ async def add_process_time_header(request: Request, call_next):
     response = await call_next(request)
     process_time = time.time() - start_time
     response.headers["X-Process-Time"] = str(process_time)
+    # label by route template (/file/{file_id}), not the raw path, so series stay bounded;
+    # for streamed bodies this is time to the first byte
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(process_time, request.method, getattr(route, "path", "unmatched"), str(response.status_code))
     response.headers["X-Supabase-Integration"] = "active"
     return response
 
@@ -184,7 +255,7 @@ async def health_check():
         # Check local database connection
         try:
             async with async_session() as session:
-                await session.execute("SELECT 1")
+                await session.execute(text("SELECT 1"))
             local_db_health = "healthy"
         except Exception as e:
             local_db_health = f"error: {str(e)}"
@@ -197,6 +268,7 @@ async def health_check():
                 "local_database": local_db_health,
                 "api": "healthy"
             },
+            "database_pool": pool_stats(),
             "integration_type": "hybrid"
         }
     except Exception as e:
@@ -211,6 +283,35 @@ async def health_check():
             }
         }
 
+# Prometheus text format; gauges are refreshed by the collectors below on every scrape
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    if not settings.metrics_enabled:
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"detail": "Not Found"})
+    if settings.metrics_token:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), settings.metrics_token.encode()):
+            return JSONResponse(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                content={"detail": "Not authenticated"},
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+    return PlainTextResponse(await REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@REGISTRY.on_collect
+async def collect_upload_sessions():
+    async with async_session() as session:
+        counts = await UploadSessionRepository().count_by_status(session)
+    UPLOAD_SESSIONS.replace({(k,): v for k, v in counts.items()})
+
+
+@REGISTRY.on_collect
+def collect_runtime_stats():
+    set_stats(DB_POOL, pool_stats())
+    set_stats(STORAGE_IO, get_storage_io().stats())
+    WS_CONNECTIONS.set(websocket_manager.connection_count())
+
 # Utility functions
 async def list_routes():
     print("\n--- ROUTES REGISTERED ---")
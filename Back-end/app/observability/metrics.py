@@ -0,0 +1,242 @@
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# seconds; wide enough for a chunk PUT on a slow link and a sub-millisecond AES-GCM wrap
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Metric:
+    """
+    One metric family in the Prometheus text format (0.0.4). Label values are given
+    positionally in `labelnames` order. Updates take a lock: they come from the event
+    loop as well as the crypto and storage I/O pools.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def label_text(self, values: LabelValues, extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = [*zip(self.labelnames, values), *extra]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{self.label_text(k)} {_num(v)}" for k, v in values]
+
+
+class Gauge(Metric):
+    """Point-in-time values; usually refreshed by a collector right before a scrape."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def replace(self, values: Dict[LabelValues, float]) -> None:
+        # drops label sets that disappeared (e.g. a status with no sessions left)
+        with self._lock:
+            self._values = dict(values)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{self.label_text(k)} {_num(v)}" for k, v in values]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (+Inf last)], sum
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][i] += 1
+            series[1][0] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((k, (list(c), s[0])) for k, (c, s) in self._series.items())
+        out: List[str] = []
+        for labels, (counts, total) in series:
+            running = 0
+            for bound, n in zip(self.buckets, counts):
+                running += n
+                out.append(f"{self.name}_bucket{self.label_text(labels, [('le', _num(bound))])} {running}")
+            running += counts[-1]
+            out.append(f"{self.name}_bucket{self.label_text(labels, [('le', '+Inf')])} {running}")
+            out.append(f"{self.name}_sum{self.label_text(labels)} {_num(total)}")
+            out.append(f"{self.name}_count{self.label_text(labels)} {running}")
+        return out
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "started")
+
+    def __init__(self, hist: Histogram, labels: LabelValues):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.hist.observe(time.perf_counter() - self.started, *self.labels)
+
+
+Collector = Callable[[], Union[None, Awaitable[None]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Collector] = []
+
+    def register(self, metric: Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def on_collect(self, fn: Collector) -> Collector:
+        """fn (sync or async) runs before every render, typically to refresh gauges."""
+        self._collectors.append(fn)
+        return fn
+
+    async def render(self) -> str:
+        for fn in self._collectors:
+            try:
+                out = fn()
+                if inspect.isawaitable(out):
+                    await out
+            except Exception:
+                logger.exception("metrics:collect_failed", extra={"collector": getattr(fn, "__name__", repr(fn))})
+        return "\n".join(line for m in self._metrics.values() for line in m.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS: Histogram = REGISTRY.register(Histogram(
+    "sd_http_request_duration_seconds", "Time to response start per route template", ("method", "route", "status")))
+
+CHUNK_PUT_SECONDS: Histogram = REGISTRY.register(Histogram(
+    "sd_chunk_put_seconds", "Chunk upload handling time (hash, wrap, store, receipt)", ("mode",)))
+CHUNK_PUT_BYTES: Counter = REGISTRY.register(Counter(
+    "sd_chunk_put_bytes_total", "Ciphertext bytes accepted by chunk uploads", ("mode",)))
+
+DOWNLOAD_CHUNK_SECONDS: Histogram = REGISTRY.register(Histogram(
+    "sd_download_chunk_seconds", "Per-chunk download work: read, server unwrap, receipt check"))
+DOWNLOAD_BYTES: Counter = REGISTRY.register(Counter(
+    "sd_download_bytes_total", "Chunk package bytes handed to download streams"))
+
+SERVER_WRAP_SECONDS: Histogram = REGISTRY.register(Histogram(
+    "sd_server_wrap_seconds", "ServerCipherWrap AES-GCM time", ("op",)))
+SERVER_WRAP_BYTES: Counter = REGISTRY.register(Counter(
+    "sd_server_wrap_bytes_total", "Bytes through ServerCipherWrap", ("op",)))
+
+STORAGE_SECONDS: Histogram = REGISTRY.register(Histogram(
+    "sd_storage_seconds", "ChunkStorage read/write latency", ("op",)))
+STORAGE_BYTES: Counter = REGISTRY.register(Counter(
+    "sd_storage_bytes_total", "Bytes read/written by ChunkStorage", ("op",)))
+
+DB_REPOSITORY_SECONDS: Histogram = REGISTRY.register(Histogram(
+    "sd_db_repository_seconds", "Wall time of repository methods (connection wait + queries)", ("repository", "method")))
+
+WS_FANOUT_SECONDS: Histogram = REGISTRY.register(Histogram(
+    "sd_ws_fanout_seconds", "Time to deliver one websocket broadcast to every target connection", ("scope",)))
+WS_CONNECTIONS: Gauge = REGISTRY.register(Gauge(
+    "sd_ws_connections", "Open websocket connections"))
+
+UPLOAD_SESSIONS: Gauge = REGISTRY.register(Gauge(
+    "sd_upload_sessions", "Upload sessions per status", ("status",)))
+DB_POOL: Gauge = REGISTRY.register(Gauge(
+    "sd_db_pool", "Connection pool state (see database.pool_stats)", ("stat",)))
+STORAGE_IO: Gauge = REGISTRY.register(Gauge(
+    "sd_storage_io", "Storage I/O pool state (see StorageIO.stats)", ("stat",)))
+
+
+def set_stats(gauge: Gauge, stats: Dict[str, float]) -> None:
+    gauge.replace({(k,): float(v) for k, v in stats.items()})
+
+
+def timed_repository(cls):
+    """
+    Class decorator for repositories: every public coroutine method records its wall time
+    in sd_db_repository_seconds{repository, method}.
+    """
+    for name, fn in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(fn):
+            continue
+        setattr(cls, name, _timed_method(fn, (cls.__name__, name)))
+    return cls
+
+
+def _timed_method(fn, labels: LabelValues):
+    @functools.wraps(fn)
+    async def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            DB_REPOSITORY_SECONDS.observe(time.perf_counter() - started, *labels)
+    return timed
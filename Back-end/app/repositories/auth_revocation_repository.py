@@ -0,0 +1,40 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.domain.persistance.models.auth_models import AuthRevocation
+from app.observability.metrics import timed_repository
+
+# (key, revoked_at, expires_at)
+RevocationRow = Tuple[str, datetime, Optional[datetime]]
+
+
+@timed_repository
+class AuthRevocationRepository:
+    """
+    Token revocations shared by every worker: logout / account deletion write a row here and
+    each TokenVerifier polls for rows newer than the last ones it saw.
+    """
+
+    async def revoke(self, session: AsyncSession, key: str, revoked_at: datetime, expires_at: Optional[datetime]) -> None:
+        stmt = insert(AuthRevocation).values(key=key, revoked_at=revoked_at, expires_at=expires_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={"revoked_at": stmt.excluded.revoked_at, "expires_at": stmt.excluded.expires_at},
+        )
+        await session.execute(stmt)
+
+    async def revoked_since(self, session: AsyncSession, since: Optional[datetime], now: datetime) -> List[RevocationRow]:
+        stmt = select(AuthRevocation.key, AuthRevocation.revoked_at, AuthRevocation.expires_at).where(
+            or_(AuthRevocation.expires_at.is_(None), AuthRevocation.expires_at > now)
+        )
+        if since is not None:
+            stmt = stmt.where(AuthRevocation.revoked_at > since)
+        return [tuple(r) for r in (await session.execute(stmt)).all()]
+
+    async def delete_expired(self, session: AsyncSession, now: datetime) -> int:
+        res = await session.execute(delete(AuthRevocation).where(AuthRevocation.expires_at <= now))
+        return res.rowcount or 0
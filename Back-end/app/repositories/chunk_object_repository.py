@@ -0,0 +1,163 @@
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, update, delete, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.domain.persistance.models.upload_models import ChunkObject
+from app.observability.metrics import timed_repository
+
+class ChunkObjectMissingError(RuntimeError):
+    pass
+
+
+@timed_repository
+class ChunkObjectRepository:
+    async def lock_objects(self, session:AsyncSession, user_id:str, sha256s:Iterable[str]) -> None:
+        """
+        Transaction-scoped advisory lock per (user, sha), taken in sha order so batches can't
+        deadlock. A writer holds it from the dedup lookup until its reference commits, and GC
+        holds it while it unlinks, so a file is never removed after a writer chose to
+        reference or recreate it (objects live at a content-addressed path).
+        """
+        keys = [f"{user_id}:{sha}" for sha in sorted(set(sha256s))]
+        if not keys:
+            return
+        stmt = text("""
+            SELECT pg_advisory_xact_lock(hashtextextended(k, 0))
+            FROM unnest(CAST(:keys AS text[])) WITH ORDINALITY AS t(k, n)
+            ORDER BY n
+        """)
+        await session.execute(stmt, {"keys": keys})
+
+    async def get(self, session:AsyncSession, user_id:str, sha256:str) -> Optional[ChunkObject]:
+        stmt = select(ChunkObject).where(ChunkObject.user_id == user_id, ChunkObject.sha256 == sha256)
+        res = await session.execute(stmt)
+        return res.scalar_one_or_none()
+
+    async def retain(self, session:AsyncSession, user_id:str, sha256:str, storage_key:str, size:int) -> int:
+        """
+        Insert the object with one reference, or add a reference if it already exists.
+        Returns the new ref_count.
+        """
+        stmt = (
+            insert(ChunkObject)
+            .values(user_id=user_id, sha256=sha256, storage_key=storage_key, size=int(size), ref_count=1,
+                    created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+            .on_conflict_do_update(
+                index_elements=["user_id", "sha256"],
+                set_={"ref_count": ChunkObject.ref_count + 1, "updated_at": datetime.utcnow()},
+            )
+            .returning(ChunkObject.ref_count)
+        )
+        res = await session.execute(stmt)
+        return int(res.scalar_one())
+
+    async def get_many(self, session:AsyncSession, user_id:str, sha256s:Iterable[str]) -> Dict[str, Tuple[str, int]]:
+        # sha -> (storage_key, size) for the objects that already exist
+        shas = list(set(sha256s))
+        if not shas:
+            return {}
+        stmt = select(ChunkObject.sha256, ChunkObject.storage_key, ChunkObject.size).where(
+            ChunkObject.user_id == user_id, ChunkObject.sha256.in_(shas))
+        res = await session.execute(stmt)
+        return {r[0]: (r[1], int(r[2])) for r in res.all()}
+
+    async def retain_many(self, session:AsyncSession, user_id:str, objects:Iterable[Tuple[str, str, int]]) -> int:
+        """
+        retain() for several (sha256, storage_key, size) objects in one upsert; an object listed
+        n times takes n references (pack members share their pack's row). Rows go in sha
+        order so concurrent batches lock them in the same order. Returns rows written.
+        """
+        now = datetime.utcnow()
+        counts = Counter(objects)
+        values = [
+            {"user_id": user_id, "sha256": sha, "storage_key": key, "size": int(size), "ref_count": times,
+             "created_at": now, "updated_at": now}
+            for (sha, key, size), times in sorted(counts.items())
+        ]
+        if not values:
+            return 0
+        stmt = insert(ChunkObject).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "sha256"],
+            set_={"ref_count": ChunkObject.ref_count + stmt.excluded.ref_count, "updated_at": now},
+        )
+        await session.execute(stmt)
+        return len(values)
+
+    async def adjust(self, session:AsyncSession, user_id:str, sha256s:Iterable[str], delta:int) -> int:
+        """
+        Add `delta` references per occurrence of each sha (a sha listed twice moves twice).
+        One UPDATE per distinct multiplicity, so a manifest is normally a single statement.
+        Returns the number of rows touched. Taking references (delta > 0) on objects that
+        don't exist raises ChunkObjectMissingError instead of silently taking none.
+        """
+        counts = Counter(sha256s)
+        by_times: Dict[int, List[str]] = {}
+        for sha, times in counts.items():
+            by_times.setdefault(times, []).append(sha)
+
+        touched = 0
+        for times, shas in by_times.items():
+            stmt = (
+                update(ChunkObject)
+                .where(ChunkObject.user_id == user_id, ChunkObject.sha256.in_(shas))
+                .values(ref_count=ChunkObject.ref_count + delta * times, updated_at=datetime.utcnow())
+            )
+            res = await session.execute(stmt)
+            touched += int(res.rowcount or 0)
+        if delta > 0 and touched < len(counts):
+            raise ChunkObjectMissingError(f"{len(counts) - touched} of {len(counts)} chunk objects missing for user {user_id}")
+        return touched
+
+    async def delete_unreferenced(self, session:AsyncSession, older_than:datetime, limit:int) -> List[Tuple[str, str, str, int]]:
+        """
+        Removes up to `limit` objects whose count reached zero before `older_than`.
+        Returns (user_id, sha256, storage_key, size) so the caller can unlink after commit.
+        """
+        victims = (
+            select(ChunkObject.user_id, ChunkObject.sha256)
+            .where(ChunkObject.ref_count <= 0, ChunkObject.updated_at < older_than)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        rows = (await session.execute(victims)).all()
+        if not rows:
+            return []
+
+        out: List[Tuple[str, str, str, int]] = []
+        for user_id, shas in _group(rows).items():
+            stmt = (
+                delete(ChunkObject)
+                .where(ChunkObject.user_id == user_id, ChunkObject.sha256.in_(shas), ChunkObject.ref_count <= 0)
+                .returning(ChunkObject.user_id, ChunkObject.sha256, ChunkObject.storage_key, ChunkObject.size)
+            )
+            res = await session.execute(stmt)
+            out.extend((r[0], r[1], r[2], int(r[3])) for r in res.all())
+        return out
+
+    async def usage(self, session:AsyncSession, user_id:str) -> Tuple[int, int, int, int]:
+        """
+        (objects, physical_bytes, references, logical_bytes) over live objects.
+        """
+        stmt = (
+            select(
+                func.count(),
+                func.coalesce(func.sum(ChunkObject.size), 0),
+                func.coalesce(func.sum(ChunkObject.ref_count), 0),
+                func.coalesce(func.sum(ChunkObject.size * ChunkObject.ref_count), 0),
+            )
+            .where(ChunkObject.user_id == user_id, ChunkObject.ref_count > 0)
+        )
+        row = (await session.execute(stmt)).one()
+        return int(row[0]), int(row[1]), int(row[2]), int(row[3])
+
+
+def _group(rows) -> Dict[str, List[str]]:
+    out: Dict[str, List[str]] = {}
+    for user_id, sha in rows:
+        out.setdefault(user_id, []).append(sha)
+    return out
@@ -1,19 +1,23 @@
-from typing import Optional , List
+from typing import Optional , List, Dict, Any
 from uuid import UUID
 import logging , re
 
-from sqlalchemy import select, func , update , delete
+from sqlalchemy import select, func , update , delete, text, insert, union
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.expression import false
 
 from datetime import datetime
 
 from app.domain.persistance.models.dash_models import File, FileVersioning, Storage
+from app.observability.metrics import timed_repository
 
 logger = logging.getLogger(__name__)
 
 _word = re.compile(r"[A-Za-z0-9_]+")
 
+# multi-row INSERTs are split so one statement stays under the driver's 32767 bind-parameter limit
+ROWS_PER_INSERT = 1000
+
 def build_prefix_tsquery(q: str) -> str:
     # "hello world" -> "hello:* & world:*"
     terms = _word.findall(q.lower())
@@ -21,6 +25,7 @@ def build_prefix_tsquery(q: str) -> str:
         return ""
     return " & ".join(f"{t}:*" for t in terms[:8])
 
+@timed_repository
 class FileRepository:
     async def create_file(self,session: AsyncSession,user_id: str,file_name: str,
                           file_path: str,file_size: int,file_type: str,folder_id: Optional[int],
@@ -196,32 +201,151 @@ class FileRepository:
         await session.flush()
         return new_file
     
-    # soft delete
-    async def soft_delete(self, session:AsyncSession, user_id:str, file : File) -> None:
-        file_ids = UUID(file["file_ids"])
-        if not file_ids:
+    async def create_files(self, session:AsyncSession, user_id:str, items:List[Dict[str, Any]]) -> int:
+        """
+        create_file() for many new uploads in one multi-row INSERT. items: file_id (chosen by the
+        caller, so manifests can be written first), file_name, file_path, file_size, file_type,
+        folder_id, integrity_hash, encryption_metadata.
+        """
+        if not items:
             return 0
-        stmt = (update(File).where(File.user_id == user_id).where(File.file_id.in_(file_ids)).where(File.is_deleted.is_(False))
-                .values(is_deleted = True,
-                        deleted_at = datetime.utcnow(),
-                        updated_at = datetime.utcnow(),))
-        
-        res = await session.execute(stmt)
+        now = datetime.utcnow()
+        rows = [{
+            "user_id": user_id,
+            "file_id": i["file_id"],
+            "file_name": i["file_name"],
+            "file_path": i["file_path"],
+            "file_size": i["file_size"],
+            "file_type": i["file_type"],
+            "folder_id": i.get("folder_id"),
+            "is_shared": False,
+            "is_deleted": False,
+            "is_encrypted": True,
+            "uploaded_at": now,
+            "updated_at": now,
+            "integrity_hash": i["integrity_hash"],
+            "encryption_metadata": i.get("encryption_metadata"),
+            "tags": [],
+            "search_vector": "",
+            "version_number": 1,
+        } for i in items]
+        for i in range(0, len(rows), ROWS_PER_INSERT):
+            await session.execute(insert(File).values(rows[i:i + ROWS_PER_INSERT]))
+        return len(rows)
+
+    async def set_head_versions(self, session:AsyncSession, user_id:str, heads:Dict[UUID, int]) -> int:
+        # set_head_version() for many files: one UPDATE .. FROM unnest(file_ids, version_ids)
+        if not heads:
+            return 0
+        stmt = text("""
+            UPDATE files f SET parent_file_version_id = m.version_id
+            FROM unnest(CAST(:file_ids AS uuid[]), CAST(:version_ids AS integer[])) AS m(file_id, version_id)
+            WHERE f.file_id = m.file_id AND f.user_id = :user_id
+        """)
+        res = await session.execute(stmt, {"user_id": user_id, "file_ids": list(heads), "version_ids": list(heads.values())})
         return int(res.rowcount or 0)
 
-    #restore
-    async def restore(self, session:AsyncSession, user_id:str, file_ids: List[UUID], file_name:str) -> None:
-        if not file_ids:
+    async def legacy_manifest_paths(self, session:AsyncSession, after:str, limit:int) -> List[str]:
+        # JSON blueprints still referenced by a file or version row, in key order after `after` (all users)
+        legacy = "blueprint/%.json"
+        paths = union(select(File.file_path.label("path")).where(File.file_path.like(legacy)),
+                      select(FileVersioning.file_path.label("path")).where(FileVersioning.file_path.like(legacy))).subquery()
+        stmt = select(paths.c.path).where(paths.c.path > after).order_by(paths.c.path).limit(limit)
+        res = await session.execute(stmt)
+        return list(res.scalars().all())
+
+    async def replace_paths(self, session:AsyncSession, paths:Dict[str, str]) -> int:
+        # old file_path -> new, for files and file_versioning rows alike
+        if not paths:
             return 0
-        stmt = (
-            update(File)
-            .where(File.user_id == user_id)
-            .where(File.file_id.in_(file_ids))
-            .where(File.is_deleted.is_(True))
-            .values(is_deleted=False, delete_at=None)
-        )
+        params = {"old": list(paths), "new": list(paths.values())}
+        changed = 0
+        for table in ("files", "file_versioning"):
+            res = await session.execute(text(f"""
+                UPDATE {table} t SET file_path = m.new
+                FROM unnest(CAST(:old AS text[]), CAST(:new AS text[])) AS m(old, new)
+                WHERE t.file_path = m.old
+            """), params)
+            changed += int(res.rowcount or 0)
+        return changed
+
+    async def bulk_copy(self, session:AsyncSession, user_id:str, items:List[Dict[str, Any]]) -> List[UUID]:
+        """
+        items: src_file_id, new_file_id, new_file_name, new_file_path, new_folder_id.
+        Copies every other column server-side in one INSERT .. SELECT FROM unnest(..) JOIN files.
+        """
+        if not items:
+            return []
+        stmt = text("""
+            INSERT INTO files (user_id, file_id, file_name, file_path, file_size, file_type, folder_id,
+                               is_shared, is_deleted, is_encrypted, uploaded_at, updated_at, deleted_at,
+                               integrity_hash, encryption_metadata, tags, search_vector,
+                               version_number, parent_file_version_id)
+            SELECT :user_id, m.new_id, m.new_name, m.new_path, f.file_size, f.file_type, m.new_folder_id,
+                   false, false, f.is_encrypted, :now, :now, NULL,
+                   f.integrity_hash, f.encryption_metadata, f.tags, f.search_vector,
+                   1, NULL
+            FROM unnest(CAST(:src_ids AS uuid[]), CAST(:new_ids AS uuid[]), CAST(:names AS text[]),
+                        CAST(:paths AS text[]), CAST(:folder_ids AS integer[]))
+                 AS m(src_id, new_id, new_name, new_path, new_folder_id)
+            JOIN files f ON f.file_id = m.src_id AND f.user_id = :user_id
+            RETURNING file_id
+        """)
+        res = await session.execute(stmt, {
+            "user_id": user_id,
+            "now": datetime.utcnow(),
+            "src_ids": [i["src_file_id"] for i in items],
+            "new_ids": [i["new_file_id"] for i in items],
+            "names": [i["new_file_name"] for i in items],
+            "paths": [i["new_file_path"] for i in items],
+            "folder_ids": [i.get("new_folder_id") for i in items],
+        })
+        return [r[0] for r in res.all()]
+
+    async def active_names_in_folders(self, session:AsyncSession, user_id:str, folder_ids:List[int]) -> Dict[int, set]:
+        # folder_id -> lower-cased names of its active files, for resolving name clashes in memory
+        if not folder_ids:
+            return {}
+        stmt = (select(File.folder_id, func.lower(File.file_name)).where(File.user_id == user_id)
+                .where(File.is_deleted.is_(False)).where(File.folder_id.in_(folder_ids)))
         res = await session.execute(stmt)
-        return int(res.rowcount or 0)
+        out: Dict[int, set] = {}
+        for folder_id, name in res.all():
+            out.setdefault(folder_id, set()).add(name)
+        return out
+
+    async def set_deleted(self, session:AsyncSession, user_id:str, file_ids:List[UUID], is_deleted:bool) -> List[tuple]:
+        """
+        Flips is_deleted for the files not already in that state.
+        Returns (folder_id, file_size, file_type) of the rows that changed, for the rollups/usage counters.
+        """
+        if not file_ids:
+            return []
+        stmt = (update(File).where(File.user_id == user_id)
+                .where(File.file_id.in_(file_ids))
+                .where(File.is_deleted.is_(not is_deleted))
+                .values(is_deleted=is_deleted,
+                        deleted_at=(datetime.utcnow() if is_deleted else None),
+                        updated_at=datetime.utcnow())
+                .returning(File.folder_id, File.file_size, File.file_type))
+        res = await session.execute(stmt)
+        return res.all()
+
+    # soft delete
+    async def soft_delete(self, session:AsyncSession, file : File, user_id:Optional[str] = None) -> None:
+        file.is_deleted = True
+        file.deleted_at = datetime.utcnow()
+        file.updated_at = datetime.utcnow()
+        session.add(file)
+
+    #restore
+    async def restore(self, session:AsyncSession, file:File, folder_id:Optional[int], file_name:str) -> None:
+        file.folder_id = folder_id
+        file.file_name = file_name
+        file.is_deleted = False
+        file.deleted_at = None
+        file.updated_at = datetime.utcnow()
+        session.add(file)
 
     #hard-delete
     async def hard_delete(self, session:AsyncSession, user_id : str,file_ids:List[UUID]) -> None:
@@ -5,7 +5,9 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.domain.persistance.models.dash_models import FolderKeys
+from app.observability.metrics import timed_repository
 
+@timed_repository
 class FolderKeysRepository:
     async def get(self, session: AsyncSession, user_id: str, folder_id: int) -> Optional[FolderKeys]:
         res = await session.execute(
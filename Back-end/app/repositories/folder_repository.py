@@ -1,7 +1,7 @@
 import logging
-from typing import Optional , List, Tuple
+from typing import Optional , List, Tuple, Set, Dict, Any
 
-from sqlalchemy import select, func, update, delete, Text, or_
+from sqlalchemy import select, func, update, delete, text, or_, and_, literal, union_all
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import false
 from datetime import datetime
@@ -9,11 +9,31 @@ from datetime import datetime
 from app.domain.persistance.models.dash_models import Folder , File
 
 import uuid
+from app.observability.metrics import timed_repository
 
 logger = logging.getLogger(__name__)
 
 
+@timed_repository
 class FolderRepository:
+    """
+    heirarchy_path is a materialized path of folder ids ("root/child/grandchild"), kept correct on
+    create, copy, move and restore. Subtree and ancestor queries are prefix range scans on
+    idx_folders_user_path (text_pattern_ops) instead of recursive CTEs.
+    """
+
+    @staticmethod
+    def child_path(parent: Optional[Folder], folder_id: int) -> str:
+        if parent is None:
+            return str(int(folder_id))
+        return f"{parent.heirarchy_path or int(parent.folder_id)}/{int(folder_id)}"
+
+    @staticmethod
+    def under_path(path: str):
+        # strict descendants of `path`: ["path/", "path0") in byte order ('0' follows '/'),
+        # written with the text_pattern_ops operators so the index is used even with bound params
+        return and_(Folder.heirarchy_path.op("~>=~")(f"{path}/"), Folder.heirarchy_path.op("~<~")(f"{path}0"))
+
     async def get_by_uid(self, session: AsyncSession, user_id: str, folder_uid: uuid.UUID) -> Optional[Folder]:
         res = await session.execute(
             select(Folder)
@@ -107,30 +127,50 @@ class FolderRepository:
         folder.updated_at = datetime.utcnow()
         session.add(folder)
 
-    async def move(self, session:AsyncSession, folder: Folder, new_parent_id: Optional[int]) -> None:
-        folder.parent_folder_id= new_parent_id
+    async def move(self, session:AsyncSession, folder: Folder, new_parent_id: Optional[int], new_parent: Optional[Folder] = None) -> str:
+        """
+        Re-parents `folder` and rewrites heirarchy_path / depth_level of its whole subtree in one UPDATE.
+        Returns the folder's previous path.
+        """
+        if new_parent is None and new_parent_id is not None:
+            new_parent = await self.get_folder_any_state(session, user_id=folder.user_id, folder_id=int(new_parent_id))
+            if new_parent is None:
+                raise LookupError("Folder not found")
+
+        old_path = folder.heirarchy_path or str(int(folder.folder_id))
+        new_path = self.child_path(new_parent, folder.folder_id)
+        new_depth = int(new_parent.depth_level or 0) + 1 if new_parent is not None else 0
+        delta = new_depth - int(folder.depth_level or 0)
+
+        if new_path != old_path or delta:
+            stmt = (
+                update(Folder)
+                .where(Folder.user_id == folder.user_id)
+                .where(self.under_path(old_path))
+                .values(
+                    heirarchy_path=new_path + func.substr(Folder.heirarchy_path, len(old_path) + 1),
+                    depth_level=Folder.depth_level + delta,
+                )
+                .execution_options(synchronize_session="fetch")
+            )
+            await session.execute(stmt)
+
+        folder.parent_folder_id = new_parent_id
+        folder.heirarchy_path = new_path
+        folder.depth_level = new_depth
         folder.updated_at = datetime.utcnow()
         session.add(folder)
+        return old_path
 
     async def is_ancestor_of(self, session:AsyncSession, user_id:str, root_id: int, node_id:int) -> bool:
-        t = Folder.__table__
-        root = (
-            select(t.c.folder_id, t.c.parent_folder_id)
-            .where(t.c.folder_id == node_id)
-            .where(t.c.user_id == user_id)
-            .where(t.c.is_deleted.is_(False))
-            .cte(name="root", recursive=True)
-        )
-        root = root.union_all(
-            select(t.c.folder_id, t.c.parent_folder_id)
-            .where(t.c.folder_id == root.c.parent_folder_id)
-            .where(t.c.user_id == user_id)
-            .where(t.c.is_deleted.is_(False))
-        )
-        stmt = select(root.c.folder_id).where(root.c.folder_id == root_id).limit(1)
+        # True when root_id is node_id or one of its ancestors: a lookup in node's path
+        stmt = (select(Folder.heirarchy_path).where(Folder.user_id == user_id)
+                .where(Folder.folder_id == node_id).where(Folder.is_deleted.is_(False)))
         res = await session.execute(stmt)
-
-        return res.scalar_one_or_none() is not None
+        path = res.scalar_one_or_none()
+        if path is None:
+            return int(root_id) == int(node_id)
+        return str(int(root_id)) in path.split("/")
 
     async def copy(self, session:AsyncSession, user_id:str, folder_name:str, parent_folder_id :Optional[int],
                     heirarchy_path: Optional[str] = None,
@@ -154,6 +194,53 @@ class FolderRepository:
         await session.flush()
         return new_folder
     
+    async def child_folder_names(self, session:AsyncSession, user_id:str, parent_folder_id:Optional[int]) -> Set[str]:
+        # lower-cased names of active folders directly under parent (None = root level)
+        stmt = select(func.lower(Folder.folder_name)).where(Folder.user_id == user_id).where(Folder.is_deleted.is_(False))
+        if parent_folder_id is None:
+            stmt = stmt.where(Folder.parent_folder_id.is_(None))
+        else:
+            stmt = stmt.where(Folder.parent_folder_id == parent_folder_id)
+        res = await session.execute(stmt)
+        return {r[0] for r in res.all()}
+
+    async def allocate_ids(self, session:AsyncSession, count:int) -> List[int]:
+        # reserve folder_ids up front so a whole tree (children pointing at new parents) goes in one INSERT
+        if count <= 0:
+            return []
+        stmt = text("SELECT nextval(pg_get_serial_sequence('folders', 'folder_id')) FROM generate_series(1, :n)")
+        res = await session.execute(stmt, {"n": int(count)})
+        return [int(r[0]) for r in res.all()]
+
+    async def bulk_create(self, session:AsyncSession, user_id:str, rows:List[Dict[str, Any]]) -> List[int]:
+        """
+        rows: folder_id (from allocate_ids), folder_uid, folder_name, parent_folder_id, depth_level, heirarchy_path.
+        One INSERT .. SELECT FROM unnest(..) RETURNING, whatever the number of rows.
+        """
+        if not rows:
+            return []
+        stmt = text("""
+            INSERT INTO folders (folder_id, folder_uid, user_id, folder_name, parent_folder_id, depth_level,
+                                 heirarchy_path, is_shared, is_deleted, created_at, updated_at)
+            SELECT n.folder_id, n.folder_uid, :user_id, n.folder_name, n.parent_folder_id, n.depth_level,
+                   n.heirarchy_path, false, false, :now, :now
+            FROM unnest(CAST(:ids AS integer[]), CAST(:uids AS uuid[]), CAST(:names AS text[]),
+                        CAST(:parents AS integer[]), CAST(:depths AS integer[]), CAST(:paths AS text[]))
+                 AS n(folder_id, folder_uid, folder_name, parent_folder_id, depth_level, heirarchy_path)
+            RETURNING folder_id
+        """)
+        res = await session.execute(stmt, {
+            "user_id": user_id,
+            "now": datetime.utcnow(),
+            "ids": [int(r["folder_id"]) for r in rows],
+            "uids": [r.get("folder_uid") or uuid.uuid4() for r in rows],
+            "names": [r["folder_name"] for r in rows],
+            "parents": [r.get("parent_folder_id") for r in rows],
+            "depths": [int(r.get("depth_level") or 0) for r in rows],
+            "paths": [r.get("heirarchy_path") for r in rows],
+        })
+        return [int(r[0]) for r in res.all()]
+
     async def list_child_folder(self,
                                 session: AsyncSession,
                                 user_id : str,
@@ -239,52 +326,36 @@ class FolderRepository:
         if not root_folder_ids:
             return []
 
-        t = Folder.__table__
-
-        base = (
-            select(
-                t.c.folder_id.label("folder_id"),
-                t.c.parent_folder_id.label("parent_folder_id"),
-                t.c.folder_name.label("folder_name"),
-                t.c.depth_level.label("depth_level"),
-                t.c.heirarchy_path.label("heirarchy_path"),
-                t.c.folder_id.label("root_id"),
-            )
-            .where(t.c.user_id == user_id)
-            .where(t.c.is_deleted.is_(False))
-            .where(t.c.folder_id.in_(root_folder_ids))
+        res = await session.execute(
+            select(Folder.folder_id, Folder.heirarchy_path)
+            .where(Folder.user_id == user_id)
+            .where(Folder.is_deleted.is_(False))
+            .where(Folder.folder_id.in_(root_folder_ids))
         )
+        roots = res.all()
+        if not roots:
+            return []
 
-        tree = base.cte(name="folder_tree", recursive=True)
-
-        step = (
-            select(
-                t.c.folder_id.label("folder_id"),
-                t.c.parent_folder_id.label("parent_folder_id"),
-                t.c.folder_name.label("folder_name"),
-                t.c.depth_level.label("depth_level"),
-                t.c.heirarchy_path.label("heirarchy_path"),
-                tree.c.root_id.label("root_id"),
+        parts = []
+        for root_id, path in roots:
+            cond = self.under_path(path or str(int(root_id)))
+            if include_roots:
+                cond = or_(Folder.folder_id == root_id, cond)
+            parts.append(
+                select(
+                    literal(int(root_id)).label("root_id"),
+                    Folder.folder_id,
+                    Folder.parent_folder_id,
+                    Folder.folder_name,
+                    Folder.depth_level,
+                    Folder.heirarchy_path,
+                )
+                .where(Folder.user_id == user_id)
+                .where(Folder.is_deleted.is_(False))
+                .where(cond)
             )
-            .where(t.c.user_id == user_id)
-            .where(t.c.is_deleted.is_(False))
-            .where(t.c.parent_folder_id == tree.c.folder_id)
-        )
-
-        tree = tree.union_all(step)
-
-        stmt = select(
-            tree.c.root_id,
-            tree.c.folder_id,
-            tree.c.parent_folder_id,
-            tree.c.folder_name,
-            tree.c.depth_level,
-            tree.c.heirarchy_path,
-        )
-
-        if not include_roots:
-            stmt = stmt.where(tree.c.folder_id.notin_(root_folder_ids))
 
+        stmt = parts[0] if len(parts) == 1 else union_all(*parts)
         res = await session.execute(stmt)
         return list(res.all())
 
@@ -296,34 +367,21 @@ class FolderRepository:
         include_deleted: bool,
         include_root: bool = True,
     ) -> List[int]:
-        t = Folder.__table__
-
-        base = (
-            select(t.c.folder_id)
-            .where(t.c.user_id == user_id)
-            .where(t.c.folder_id == int(root_id))
-        )
+        stmt = select(Folder.heirarchy_path).where(Folder.user_id == user_id).where(Folder.folder_id == int(root_id))
         if not include_deleted:
-            base = base.where(t.c.is_deleted.is_(False))
-
-        tree = base.cte(name="folder_tree", recursive=True)
+            stmt = stmt.where(Folder.is_deleted.is_(False))
+        res = await session.execute(stmt)
+        row = res.first()
+        if row is None:
+            return []
 
-        step = (
-            select(t.c.folder_id)
-            .where(t.c.user_id == user_id)
-            .where(t.c.parent_folder_id == tree.c.folder_id)
-        )
+        stmt = select(Folder.folder_id).where(Folder.user_id == user_id).where(self.under_path(row[0] or str(int(root_id))))
         if not include_deleted:
-            step = step.where(t.c.is_deleted.is_(False))
-
-        tree = tree.union_all(step)
-
-        stmt = select(tree.c.folder_id)
-        if not include_root:
-            stmt = stmt.where(tree.c.folder_id != int(root_id))
+            stmt = stmt.where(Folder.is_deleted.is_(False))
 
         res = await session.execute(stmt)
-        return [int(r[0]) for r in res.all()]
+        ids = [int(r[0]) for r in res.all()]
+        return ([int(root_id)] + ids) if include_root else ids
     
     async def get_folder(self,session:AsyncSession,user_id:str,folder_id:int) -> Folder | None:
         res = await session.execute(
@@ -336,29 +394,52 @@ class FolderRepository:
         return res.scalar_one_or_none()
     
     async def folder_tree_size_bytes(self, session: AsyncSession, user_id: str, root_folder_id: int) -> int:
-        stmt = Text("""
-            WITH RECURSIVE subtree AS (
-                    SELECT folder_id 
-                    from folders
-                    WHERE folder_id = :root_id
-                        AND user_id = :user_id
-                        AND is_deleted = false
-                    UNION ALL
-                    SELECT f.folder_id
-                    FROM folders f
-                    JOIN subtree s ON f.parent_folder_id = s.folder_id
-                    WHERE f.user_id = :user_id
-                        AND f.is_deleted = false
-                    )
-                    SELECT COALESCE(SUM(fl.file_size), 0) AS total_size
-                    FROM files fl
-                    JOIN subtree s ON fl.folder_id = s.folder_id
-                    WHERE fl.user_id = :user_id
-                        AND fl.is_deleted = false
-            """)
-        res = await session.execute(stmt, {"root_id": root_folder_id, "user_id": user_id})
+        res = await session.execute(
+            select(Folder.heirarchy_path).where(Folder.user_id == user_id)
+            .where(Folder.folder_id == root_folder_id).where(Folder.is_deleted.is_(False))
+        )
+        row = res.first()
+        if row is None:
+            return 0
+
+        stmt = (
+            select(func.coalesce(func.sum(File.file_size), 0))
+            .select_from(File)
+            .join(Folder, Folder.folder_id == File.folder_id)
+            .where(File.user_id == user_id)
+            .where(File.is_deleted.is_(False))
+            .where(Folder.user_id == user_id)
+            .where(Folder.is_deleted.is_(False))
+            .where(or_(Folder.folder_id == root_folder_id, self.under_path(row[0] or str(int(root_folder_id)))))
+        )
+        res = await session.execute(stmt)
         return int(res.scalar() or 0)
 
+    async def missing_paths(self, session: AsyncSession) -> bool:
+        res = await session.execute(select(Folder.folder_id).where(Folder.heirarchy_path.is_(None)).limit(1))
+        return res.first() is not None
+
+    async def backfill_paths(self, session: AsyncSession) -> int:
+        """
+        Recomputes heirarchy_path / depth_level from parent_folder_id for every row that disagrees
+        (rows written before paths were maintained). One statement.
+        """
+        stmt = text("""
+            WITH RECURSIVE t AS (
+                SELECT folder_id, CAST(folder_id AS text) AS path, 0 AS depth
+                FROM folders WHERE parent_folder_id IS NULL
+                UNION ALL
+                SELECT f.folder_id, t.path || '/' || f.folder_id, t.depth + 1
+                FROM folders f JOIN t ON f.parent_folder_id = t.folder_id
+            )
+            UPDATE folders f SET heirarchy_path = t.path, depth_level = t.depth
+            FROM t
+            WHERE f.folder_id = t.folder_id
+              AND (f.heirarchy_path IS DISTINCT FROM t.path OR f.depth_level <> t.depth)
+        """)
+        res = await session.execute(stmt)
+        return int(res.rowcount or 0)
+
     async def search_name_ilike(self, session: AsyncSession, user_id: str, q: str, limit: int):
         pattern = f"%{q}%"
         stmt = (
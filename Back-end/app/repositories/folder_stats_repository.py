@@ -0,0 +1,157 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, delete, distinct, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.domain.persistance.models.dash_models import Folder, FolderStats, File
+from app.observability.metrics import timed_repository
+
+# (folder_id, bytes, files): change in the active files directly inside a folder
+Delta = Tuple[Optional[int], int, int]
+
+
+@timed_repository
+class FolderStatsRepository:
+    """
+    Incremental folder rollups. A change in a folder's own files is added to its direct counts
+    and to the totals of every folder on its heirarchy_path, in one upsert.
+    """
+
+    @staticmethod
+    def file_deltas(rows: Iterable[Any], sign: int) -> List[Delta]:
+        # rows with folder_id / file_size, for files that became active (+1) or inactive (-1)
+        return [(r.folder_id, sign * int(r.file_size or 0), sign) for r in rows]
+
+    async def get(self, session: AsyncSession, user_id: str, folder_id: int) -> Optional[FolderStats]:
+        stmt = select(FolderStats).where(FolderStats.user_id == user_id).where(FolderStats.folder_id == folder_id)
+        res = await session.execute(stmt)
+        return res.scalar_one_or_none()
+
+    async def folder_with_stats(self, session: AsyncSession, user_id: str, folder_id: int) -> Optional[Tuple[Folder, Optional[FolderStats]]]:
+        stmt = (
+            select(Folder, FolderStats)
+            .outerjoin(FolderStats, FolderStats.folder_id == Folder.folder_id)
+            .where(Folder.user_id == user_id)
+            .where(Folder.folder_id == folder_id)
+            .where(Folder.is_deleted.is_(False))
+        )
+        res = await session.execute(stmt)
+        row = res.first()
+        return (row[0], row[1]) if row else None
+
+    async def apply(self, session: AsyncSession, user_id: str, deltas: Iterable[Delta]) -> int:
+        direct: Dict[int, List[int]] = {}
+        for folder_id, size, files in deltas:
+            if folder_id is None or (not size and not files):
+                continue
+            d = direct.setdefault(int(folder_id), [0, 0])
+            d[0] += size
+            d[1] += files
+        if not direct:
+            return 0
+
+        res = await session.execute(
+            select(Folder.folder_id, Folder.heirarchy_path)
+            .where(Folder.user_id == user_id)
+            .where(Folder.folder_id.in_(list(direct)))
+        )
+
+        # folder_id -> [direct_bytes, direct_files, total_bytes, total_files]
+        rows: Dict[int, List[int]] = {}
+        for folder_id, path in res.all():
+            size, files = direct[int(folder_id)]
+            for anc in (path or str(int(folder_id))).split("/"):
+                r = rows.setdefault(int(anc), [0, 0, 0, 0])
+                r[2] += size
+                r[3] += files
+            r = rows.setdefault(int(folder_id), [0, 0, 0, 0])
+            r[0] += size
+            r[1] += files
+
+        return await self.add(session, user_id, rows)
+
+    async def move_subtree(self, session: AsyncSession, user_id: str, folder_id: int, old_path: str, new_path: str) -> int:
+        """
+        A moved folder's totals leave its old ancestors and join the new ones; the subtree's own rows are unchanged.
+        """
+        res = await session.execute(
+            select(FolderStats.total_bytes, FolderStats.total_files).where(FolderStats.folder_id == folder_id)
+        )
+        row = res.first()
+        if row is None or (not row[0] and not row[1]):
+            return 0
+
+        rows: Dict[int, List[int]] = {}
+        for path, sign in ((old_path, -1), (new_path, +1)):
+            for anc in (path or "").split("/")[:-1]:
+                r = rows.setdefault(int(anc), [0, 0, 0, 0])
+                r[2] += sign * int(row[0])
+                r[3] += sign * int(row[1])
+
+        return await self.add(session, user_id, {k: v for k, v in rows.items() if v[2] or v[3]})
+
+    async def add(self, session: AsyncSession, user_id: str, rows: Dict[int, List[int]]) -> int:
+        if not rows:
+            return 0
+        now = datetime.utcnow()
+        # fixed lock order, so concurrent updates of shared ancestors can't deadlock
+        values = [
+            {"folder_id": folder_id, "user_id": user_id, "direct_bytes": r[0], "direct_files": r[1],
+             "total_bytes": r[2], "total_files": r[3], "updated_at": now}
+            for folder_id, r in sorted(rows.items())
+        ]
+        stmt = insert(FolderStats).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["folder_id"],
+            set_={
+                "direct_bytes": FolderStats.direct_bytes + stmt.excluded.direct_bytes,
+                "direct_files": FolderStats.direct_files + stmt.excluded.direct_files,
+                "total_bytes": FolderStats.total_bytes + stmt.excluded.total_bytes,
+                "total_files": FolderStats.total_files + stmt.excluded.total_files,
+                "updated_at": now,
+            },
+        )
+        await session.execute(stmt)
+        return len(values)
+
+    async def rebuild(self, session: AsyncSession, user_id: str) -> int:
+        """
+        Recomputes a user's rollups from files + heirarchy_path (reconciliation). Returns rows written.
+        """
+        await session.execute(delete(FolderStats).where(FolderStats.user_id == user_id))
+        stmt = text("""
+            INSERT INTO folder_stats (folder_id, user_id, direct_bytes, direct_files, total_bytes, total_files, updated_at)
+            SELECT a.anc, :user_id,
+                   SUM(CASE WHEN a.anc = d.folder_id THEN d.bytes ELSE 0 END),
+                   SUM(CASE WHEN a.anc = d.folder_id THEN d.files ELSE 0 END),
+                   SUM(d.bytes), SUM(d.files), :now
+            FROM (
+                SELECT folder_id, SUM(file_size) AS bytes, COUNT(*) AS files
+                FROM files
+                WHERE user_id = :user_id AND is_deleted = false AND folder_id IS NOT NULL
+                GROUP BY folder_id
+            ) d
+            JOIN folders f ON f.folder_id = d.folder_id AND f.user_id = :user_id
+            CROSS JOIN LATERAL (
+                SELECT CAST(p AS integer) AS anc
+                FROM unnest(string_to_array(COALESCE(f.heirarchy_path, CAST(f.folder_id AS text)), '/')) AS p
+            ) a
+            GROUP BY a.anc
+        """)
+        res = await session.execute(stmt, {"user_id": user_id, "now": datetime.utcnow()})
+        return int(res.rowcount or 0)
+
+    async def list_user_ids(self, session: AsyncSession, missing_only: bool = False) -> List[str]:
+        # users owning folders; missing_only -> those with active files but no rollup rows yet
+        stmt = select(distinct(Folder.user_id))
+        if missing_only:
+            stmt = (
+                select(distinct(File.user_id))
+                .where(File.is_deleted.is_(False))
+                .where(File.folder_id.isnot(None))
+                .where(~select(FolderStats.folder_id).where(FolderStats.user_id == File.user_id).exists())
+            )
+        res = await session.execute(stmt)
+        return [r[0] for r in res.all()]
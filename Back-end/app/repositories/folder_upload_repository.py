@@ -1,16 +1,18 @@
 from uuid import UUID
-from typing import List, Optional, Tuple, Dict
+from typing import Iterable, List, Optional, Tuple, Dict
 
-from sqlalchemy import select, func
+from sqlalchemy import select, func, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.domain.persistance.models.upload_models import UploadFolderSession, UploadItems
+from app.domain.persistance.models.upload_models import UploadFolderSession, UploadItems, UploadSession
 from app.domain.persistance.models.dash_models import Folder 
 
 from app.repositories.folder_repository import FolderRepository
 
-from app.services.file_services import _validate_name
+from app.security.name_validator import _validate_name
+from app.observability.metrics import timed_repository
 
+@timed_repository
 class UploadFolderRepository:
     async def create(self, session:AsyncSession, folder_obj:UploadFolderSession) -> UploadFolderSession:
         session.add(folder_obj)
@@ -18,7 +20,7 @@ class UploadFolderRepository:
         return folder_obj
     
     async def set_status(self,session:AsyncSession, user_id:str, status:str, folder_upload_id:UUID) -> int:
-        stmt = (select(UploadFolderSession).where(UploadFolderSession.user_id == user_id)
+        stmt = (update(UploadFolderSession).where(UploadFolderSession.user_id == user_id)
                 .where(UploadFolderSession.folder_upload_id == folder_upload_id)
                 .values(status = status))
         res = await session.execute(stmt)
@@ -30,23 +32,41 @@ class UploadFolderRepository:
         res = await session.execute(stmt)
         return res.scalar_one_or_none()
     
+@timed_repository
 class UploadFolderItemRepository:
     async def add(self, session:AsyncSession, childs:List[UploadItems]) -> None:
         session.add_all(childs)
         await session.flush()
 
     async def complete(self,session:AsyncSession,user_id:str,folder_upload_id:UUID) -> int:
-        stmt = stmt = (
+        # items whose upload session (own or pack) is finalized
+        stmt = (
             select(func.count())
-            .select_from(UploadFolderSession)
-            .join(UploadItems, UploadItems.upload_id == UploadFolderSession.upload_id)
+            .select_from(UploadItems)
+            .join(UploadSession, UploadSession.upload_id == UploadItems.upload_id)
             .where(UploadItems.user_id == user_id)
             .where(UploadItems.folder_upload_id == folder_upload_id)
-            .where(UploadFolderSession.status == "COMPLETE")
+            .where(UploadSession.status == "COMPLETE")
         )
         res = await session.execute(stmt)
         return int(res.scalar_one() or 0)
 
+    async def pack_members(self, session: AsyncSession, user_id: str, upload_id: UUID, pack_idxs: Optional[Iterable[int]] = None) -> Dict[int, UploadItems]:
+        # pack_index -> item for a pack session (all members when pack_idxs is None)
+        stmt = (select(UploadItems).where(UploadItems.user_id == user_id)
+            .where(UploadItems.upload_id == upload_id)
+            .where(UploadItems.pack_index.isnot(None)))
+        if pack_idxs is not None:
+            stmt = stmt.where(UploadItems.pack_index.in_(list(pack_idxs)))
+        res = await session.execute(stmt)
+        return {int(it.pack_index): it for it in res.scalars().all()}
+
+    async def items_of(self, session: AsyncSession, user_id: str, folder_upload_id: UUID) -> List[UploadItems]:
+        stmt = (select(UploadItems).where(UploadItems.user_id == user_id)
+            .where(UploadItems.folder_upload_id == folder_upload_id))
+        res = await session.execute(stmt)
+        return list(res.scalars().all())
+
     async def list_items(self, session: AsyncSession, user_id: str, folder_upload_id: UUID, limit: int, offset: int):
         stmt = (select(UploadItems).where(UploadItems.user_id == user_id)
             .where(UploadItems.folder_upload_id == folder_upload_id)
@@ -54,6 +74,7 @@ class UploadFolderItemRepository:
         res = await session.execute(stmt)
         return list(res.scalars().all())
 
+@timed_repository
 class FolderTreeRepository:
     def __init__(self, folder_repo:FolderRepository):
         self.folder_repo = folder_repo
@@ -70,9 +91,7 @@ class FolderTreeRepository:
         raise ValueError("Same Name Folder is Already Uploaded.")
     
     def compute_path(self, parent: Optional[Folder], folder_id: int) -> str:
-        if parent and parent.heirarchy_path:
-            return f"{parent.heirarchy_path}/{folder_id}"
-        return str(folder_id)
+        return self.folder_repo.child_path(parent, folder_id)
     
     async def create_folder(self, session:AsyncSession,user_id:str,parent_folder:Optional[Folder],fname:str) -> Folder:
         parent_folder_id = parent_folder.folder_id if parent_folder else None
@@ -118,7 +137,7 @@ class FolderTreeRepository:
                 heirarchy_path=None,
                 depth=depth,
             )
-            created.heirarchy_path = f"{parent_folder.heirarchy_path}/{int(created.folder_id)}"
+            created.heirarchy_path = self.compute_path(parent_folder, int(created.folder_id))
             mapping[parts] = created
             map[key] = created
             children_by_parent[parts] = {}
@@ -4,7 +4,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
 from app.domain.persistance.models.auth_models import KeyBundle
+from app.observability.metrics import timed_repository
 
+@timed_repository
 class UserKeyBundleRepository:
     async def get_bundle(self,session:AsyncSession,user_id:str) -> Optional[KeyBundle]:
         stmt = (select(KeyBundle).where(KeyBundle.user_id == user_id))
@@ -12,7 +14,7 @@ class UserKeyBundleRepository:
         return res.scalar_one_or_none()
     
     async def check_bundle(self,session:AsyncSession,user_id:str) ->bool:
-        stmt = (select(KeyBundle).where(KeyBundle.user_id == user_id)).limit(1)
+        stmt = (select(KeyBundle.user_id).where(KeyBundle.user_id == user_id)).limit(1)
         res = await session.execute(stmt)
         return res.scalar_one_or_none() is not None
     
@@ -3,7 +3,9 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.security.utils import Security
 from app.domain.persistance.models.auth_models import UserServerShare
+from app.observability.metrics import timed_repository
 
+@timed_repository
 class ServerShareRepository:
     async def ensure_ss_master(self, db: AsyncSession, user_id: str) -> None:
         row = (await db.execute(select(UserServerShare).where(UserServerShare.user_id == user_id))).scalar_one_or_none()
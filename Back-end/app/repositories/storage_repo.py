@@ -1,27 +1,69 @@
-from sqlalchemy import select
+from sqlalchemy import select, func, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.domain.persistance.models.dash_models import Storage
+from app.domain.persistance.models.dash_models import Storage, StorageUsage
+from app.observability.metrics import timed_repository
 
 DEFAULT_TOTAL = 15 * 1024 * 1024 * 1024 
 
+@timed_repository
 class StorageRepository:
     async def get_user(self,session:AsyncSession,user_id:str) -> Storage | None:
         stmt = await session.execute(select(Storage).where(Storage.user_id == user_id))
-        return stmt.scalas().first()
+        return stmt.scalars().first()
     
     async def get_or_create(self, session: AsyncSession, user_id: str) -> Storage:
         st = await self.get_user(session, user_id)
         if st:
             return st
 
+        # usage may have been counted before the first stats call created this row
+        used = await session.execute(
+            select(func.coalesce(func.sum(StorageUsage.bytes), 0)).where(StorageUsage.user_id == user_id)
+        )
+
         st = Storage(
             user_id=user_id,
             total_storage=DEFAULT_TOTAL,
-            storage_used=0,
+            storage_used=max(0, int(used.scalar() or 0)),
             is_premium=False,
             plan_type="free",
         )
         session.add(st)
         await session.flush()     
         await session.refresh(st)
-        return st
\ No newline at end of file
+        return st
+
+    async def reserve(self, session: AsyncSession, user_id: str, nbytes: int) -> bool:
+        """
+        Holds `nbytes` of quota for an upload. A single conditional UPDATE: concurrent
+        reservations for one user only queue on the row for that statement, and can never
+        together exceed total_storage. False when the quota can't cover it.
+        """
+        if nbytes <= 0:
+            return True
+
+        for _ in range(2):
+            stmt = (
+                update(Storage)
+                .where(Storage.user_id == user_id)
+                .where(Storage.storage_used + Storage.reserved_bytes + nbytes <= Storage.total_storage)
+                .values(reserved_bytes=Storage.reserved_bytes + nbytes)
+                .returning(Storage.id)
+            )
+            res = await session.execute(stmt)
+            if res.first() is not None:
+                return True
+            if await self.get_user(session, user_id) is not None:
+                return False
+            await self.get_or_create(session, user_id)
+        return False
+
+    async def release(self, session: AsyncSession, user_id: str, nbytes: int) -> None:
+        if nbytes <= 0:
+            return
+        stmt = (
+            update(Storage)
+            .where(Storage.user_id == user_id)
+            .values(reserved_bytes=func.greatest(Storage.reserved_bytes - nbytes, 0))
+        )
+        await session.execute(stmt)
\ No newline at end of file
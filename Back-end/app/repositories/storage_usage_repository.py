@@ -0,0 +1,125 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sqlalchemy import select, delete, distinct, func, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.domain.persistance.models.dash_models import File, RecycleBin, Storage, StorageUsage
+from app.observability.metrics import timed_repository
+
+ACTIVE = "active"
+BIN = "bin"
+
+# (bucket, file_type, bytes, files)
+UsageDelta = Tuple[str, str, int, int]
+
+
+@timed_repository
+class StorageUsageRepository:
+    """
+    Per-user usage counters. Every change to the active files or the recycle bin adds its
+    delta to storage_usage (per bucket + file_type) and to storage.storage_used, in the
+    caller's transaction, so stats and quota checks never scan files.
+    """
+
+    @staticmethod
+    def deltas(items: Iterable[Any], bucket: str, sign: int) -> List[UsageDelta]:
+        # items: anything with file_type / file_size (File, RecycleBin, RETURNING rows)
+        return [(bucket, item.file_type or "unknown", sign * int(item.file_size or 0), sign) for item in items]
+
+    @staticmethod
+    def moved(items: Iterable[Any], from_bucket: str, to_bucket: str) -> List[UsageDelta]:
+        items = list(items)
+        return StorageUsageRepository.deltas(items, from_bucket, -1) + StorageUsageRepository.deltas(items, to_bucket, +1)
+
+    async def apply(self, session: AsyncSession, user_id: str, deltas: Iterable[UsageDelta]) -> int:
+        rows: Dict[Tuple[str, str], List[int]] = {}
+        for bucket, file_type, size, files in deltas:
+            r = rows.setdefault((bucket, file_type or "unknown"), [0, 0])
+            r[0] += size
+            r[1] += files
+        rows = {k: v for k, v in rows.items() if v[0] or v[1]}
+        if not rows:
+            return 0
+
+        now = datetime.utcnow()
+        # fixed lock order (usage rows by key, then the storage row) so concurrent writers can't deadlock
+        values = [
+            {"user_id": user_id, "bucket": bucket, "file_type": file_type, "bytes": r[0], "files": r[1], "updated_at": now}
+            for (bucket, file_type), r in sorted(rows.items())
+        ]
+        stmt = insert(StorageUsage).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "bucket", "file_type"],
+            set_={
+                "bytes": StorageUsage.bytes + stmt.excluded.bytes,
+                "files": StorageUsage.files + stmt.excluded.files,
+                "updated_at": now,
+            },
+        )
+        await session.execute(stmt)
+
+        used = sum(r[0] for r in rows.values())
+        if used:
+            await session.execute(
+                update(Storage)
+                .where(Storage.user_id == user_id)
+                .values(storage_used=func.greatest(Storage.storage_used + used, 0), updated_at=now)
+            )
+        return len(values)
+
+    async def totals(self, session: AsyncSession, user_id: str) -> Dict[str, Tuple[int, int]]:
+        # bucket -> (files, bytes)
+        res = await session.execute(
+            select(StorageUsage.bucket, func.sum(StorageUsage.files), func.sum(StorageUsage.bytes))
+            .where(StorageUsage.user_id == user_id)
+            .group_by(StorageUsage.bucket)
+        )
+        return {bucket: (int(files or 0), int(size or 0)) for bucket, files, size in res.all()}
+
+    async def by_type(self, session: AsyncSession, user_id: str, bucket: str) -> List[Tuple[str, int, int]]:
+        # (file_type, files, bytes) rows, the shape of the old GROUP BY breakdowns
+        res = await session.execute(
+            select(StorageUsage.file_type, StorageUsage.files, StorageUsage.bytes)
+            .where(StorageUsage.user_id == user_id)
+            .where(StorageUsage.bucket == bucket)
+            .where(StorageUsage.files > 0)
+        )
+        return res.all()
+
+    async def rebuild(self, session: AsyncSession, user_id: str) -> int:
+        """
+        Recomputes a user's counters (and storage_used) from files + recycle_bin. Returns rows written.
+        """
+        now = datetime.utcnow()
+        await session.execute(delete(StorageUsage).where(StorageUsage.user_id == user_id))
+        res = await session.execute(
+            text("""
+                INSERT INTO storage_usage (user_id, bucket, file_type, files, bytes, updated_at)
+                SELECT :user_id, 'active', COALESCE(file_type, 'unknown'), COUNT(*), COALESCE(SUM(file_size), 0), :now
+                FROM files
+                WHERE user_id = :user_id AND is_deleted = false
+                GROUP BY COALESCE(file_type, 'unknown')
+                UNION ALL
+                SELECT :user_id, 'bin', COALESCE(file_type, 'unknown'), COUNT(*), COALESCE(SUM(file_size), 0), :now
+                FROM recycle_bin
+                WHERE user_id = :user_id AND item_type = 'file'
+                GROUP BY COALESCE(file_type, 'unknown')
+            """),
+            {"user_id": user_id, "now": now},
+        )
+        written = int(res.rowcount or 0)
+
+        used = select(func.coalesce(func.sum(StorageUsage.bytes), 0)).where(StorageUsage.user_id == user_id).scalar_subquery()
+        await session.execute(update(Storage).where(Storage.user_id == user_id).values(storage_used=used, updated_at=now))
+        return written
+
+    async def list_user_ids(self, session: AsyncSession, missing_only: bool = False) -> List[str]:
+        # users with files or bin items; missing_only -> those without any counter rows yet
+        users = select(File.user_id).union(select(RecycleBin.user_id)).subquery()
+        stmt = select(distinct(users.c.user_id))
+        if missing_only:
+            stmt = stmt.where(~select(StorageUsage.user_id).where(StorageUsage.user_id == users.c.user_id).exists())
+        res = await session.execute(stmt)
+        return [r[0] for r in res.all()]
@@ -3,13 +3,15 @@ from datetime import datetime, timedelta
 from typing import List , Dict, Optional, Any, Iterable, Set
 from uuid import UUID
 
-from sqlalchemy import select, func
+from sqlalchemy import select, func, insert, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.domain.persistance.models.dash_models import RecycleBin, Folder, File
+from app.observability.metrics import timed_repository
 
 logger = logging.getLogger(__name__)
 
+@timed_repository
 class RecyclebinRepository:
     async def add_file(self, session:AsyncSession, user_id:str, file:File, parent_folder_id:Optional[int],deleted_by_action: Optional[str] = None) -> RecycleBin:
         item = RecycleBin(
@@ -33,6 +35,40 @@ class RecyclebinRepository:
         session.add(item)
         return item
     
+    async def add_files(self, session:AsyncSession, user_id:str, files:List[File], deleted_by_action:Optional[str] = None,
+                        item_paths:Optional[Dict[UUID, str]] = None) -> int:
+        """
+        add_file for many files in one multi-row INSERT. item_paths overrides item_path per file_id
+        (e.g. the recycle-bin location of a moved blob).
+        """
+        if not files:
+            return 0
+        now = datetime.utcnow()
+        item_paths = item_paths or {}
+        rows = [
+            {
+                "user_id": user_id,
+                "item_type": "file",
+                "file_id": f.file_id,
+                "folder_id": None,
+                "parent_folder_id": f.folder_id,
+                "item_name": f.file_name,
+                "item_path": item_paths.get(f.file_id) or f.file_path,
+                "file_size": f.file_size,
+                "file_type": f.file_type,
+                "integrity_hash": f.integrity_hash or "",
+                "tags": f.tags or [],
+                "deleted_at": now,
+                "deleted_by_action": deleted_by_action,
+                "scheduled_deletion_at": now + timedelta(days=30),
+                "search_vector": f.search_vector,
+                "restore_attempts": 0,
+            }
+            for f in files
+        ]
+        await session.execute(insert(RecycleBin), rows)
+        return len(rows)
+
     async def get_file(self, session:AsyncSession, user_id:str, file_id: UUID) -> Optional[RecycleBin]:
         stmt = (select(RecycleBin).where(RecycleBin.user_id == user_id)
                 .where(RecycleBin.item_type == "file")
@@ -41,7 +77,7 @@ class RecyclebinRepository:
         return res.scalar_one_or_none()
     
     async def delete_item(self, session:AsyncSession, item:RecycleBin)->None:
-        session.delete(item)
+        await session.delete(item)
 
     async def list_file(self, session:AsyncSession, user_id:str, parent_folder_id: Optional[int] = None) -> List[Dict[str,Any]]:
         stmt = (
@@ -85,15 +121,17 @@ class RecyclebinRepository:
         result = await session.execute(stmt)
         return set([res[0] for res in result.all() if res and res[0] is not None])
         
-    async def delete_file_item(self, session:AsyncSession, user_id:str,file_ids:Iterable[UUID]) -> Set[UUID]: 
+    async def delete_file_item(self, session:AsyncSession, user_id:str,file_ids:Iterable[UUID]) -> List[Any]: 
+        # returns (file_id, file_size, file_type) of the removed items, for the usage counters
         ids = [i for i in file_ids if i is not None]
         if not ids:
-            return set()
+            return []
             
-        stmt = (select(RecycleBin).where(RecycleBin.user_id == user_id).where(RecycleBin.item_type == "file")
-                .where(RecycleBin.file_id.in_(ids)))
+        stmt = (delete(RecycleBin).where(RecycleBin.user_id == user_id).where(RecycleBin.item_type == "file")
+                .where(RecycleBin.file_id.in_(ids))
+                .returning(RecycleBin.file_id, RecycleBin.file_size, RecycleBin.file_type))
         res = await session.execute(stmt)
-        return int(res.rowcount or 0)
+        return res.all()
     
     async def aggregate(self, session: AsyncSession, user_id: str) -> tuple[int, int]:
         res = await session.execute(
@@ -7,10 +7,12 @@ from sqlalchemy import select, desc
 
 
 from app.domain.persistance.models.dash_models import undoRedoActions
+from app.observability.metrics import timed_repository
 
 logger = logging.getLogger(__name__)
 
 
+@timed_repository
 class UndoRedoRepository:
     async def add_action(
         self,
@@ -1,22 +1,36 @@
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterable, Tuple
 from uuid import UUID
 
-from sqlalchemy import select, func
+from sqlalchemy import select, func, delete, insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.domain.persistance.models.upload_models import UploadChunk
+from app.observability.metrics import timed_repository
 
+@timed_repository
 class UploadChunkRepository:
     async def get_chunk(self, session:AsyncSession, upload_id:UUID, chunk_idx:int) -> Optional[UploadChunk]:
         stmt = (select(UploadChunk).where(UploadChunk.upload_id == upload_id).where(UploadChunk.chunk_index == chunk_idx))
         res = await session.execute(stmt)
         return res.scalar_one_or_none()
     
+    async def sha_by_index(self, session:AsyncSession, upload_id:UUID, chunk_idxs:Iterable[int]) -> Dict[int, str]:
+        # receipts already present among `chunk_idxs` (batch uploads check them in one query)
+        idxs = list(chunk_idxs)
+        if not idxs:
+            return {}
+        stmt = (select(UploadChunk.chunk_index, UploadChunk.sha256)
+                .where(UploadChunk.upload_id == upload_id)
+                .where(UploadChunk.chunk_index.in_(idxs)))
+        res = await session.execute(stmt)
+        return {int(r[0]): r[1] for r in res.all()}
+
     async def last_indices(self, session:AsyncSession, upload_id:UUID) -> List[int]:
-        stmt = (select(UploadChunk).where(UploadChunk.upload_id == upload_id).order_by(UploadChunk.chunk_index.asc()))
+        # chunk_index only: served from the (upload_id, chunk_index) primary key, no receipt rows hydrated
+        stmt = (select(UploadChunk.chunk_index).where(UploadChunk.upload_id == upload_id).order_by(UploadChunk.chunk_index.asc()))
         res = await session.execute(stmt)
-        return [int(i) for i in res.scalars().all()]
+        return list(res.scalars().all())
     
     async def count(self, session: AsyncSession, upload_id: UUID) -> int:
         stmt = select(func.count()).select_from(UploadChunk).where(UploadChunk.upload_id == upload_id)
@@ -31,12 +45,37 @@ class UploadChunkRepository:
         except IntegrityError:
             raise 
 
+    async def insert_many(self, session: AsyncSession, rows: List[Dict]) -> int:
+        # one multi-row INSERT; a receipt that already exists fails the whole statement (IntegrityError)
+        if not rows:
+            return 0
+        await session.execute(insert(UploadChunk).values(rows))
+        return len(rows)
+
     async def list_receipts_ordered(self, session: AsyncSession, upload_id: UUID) -> List[UploadChunk]:
         ## Returns all chunk receipts for this upload, sorted by chunk_index (needed for finalize + download ordering).
         stmt = (select(UploadChunk).where(UploadChunk.upload_id == upload_id).order_by(UploadChunk.chunk_index.asc()))
         res = await session.execute(stmt)
         return list(res.scalars().all())
     
+    async def receipts_for_uploads(self, session: AsyncSession, upload_ids: List[UUID]) -> Dict[UUID, List[UploadChunk]]:
+        # list_receipts_ordered() for many sessions in one query (bulk finalize)
+        out: Dict[UUID, List[UploadChunk]] = {uid: [] for uid in upload_ids}
+        if not upload_ids:
+            return out
+        stmt = (select(UploadChunk).where(UploadChunk.upload_id.in_(upload_ids))
+                .order_by(UploadChunk.upload_id.asc(), UploadChunk.chunk_index.asc()))
+        res = await session.execute(stmt)
+        for r in res.scalars().all():
+            out[r.upload_id].append(r)
+        return out
+
+    async def delete_receipts(self, session: AsyncSession, upload_id: UUID) -> List[Tuple[str, str]]:
+        # returns (sha256, storage_key) of every removed receipt (each one held a chunk object reference)
+        stmt = delete(UploadChunk).where(UploadChunk.upload_id == upload_id).returning(UploadChunk.sha256, UploadChunk.storage_key)
+        res = await session.execute(stmt)
+        return [(r[0], r[1]) for r in res.all()]
+
     async def count_bulk(self, session: AsyncSession, upload_ids: List[UUID]) -> Dict[UUID, int]:
         if not upload_ids:
             return {}
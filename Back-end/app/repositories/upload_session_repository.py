@@ -1,11 +1,17 @@
+from datetime import datetime
 from typing import Optional, List, Dict
 from uuid import UUID
 
-from sqlalchemy import select, update
+from sqlalchemy import select, update, func
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, undefer
 
 from app.domain.persistance.models.upload_models import UploadSession
+from app.observability.metrics import timed_repository
 
+MARK_BITS_PER_UPDATE = 32
+
+@timed_repository
 class UploadSessionRepository:
     async def create_session(self, session:AsyncSession, obj:UploadSession) -> UploadSession:
         session.add(obj)
@@ -17,6 +23,51 @@ class UploadSessionRepository:
         res = await session.execute(stmt)
         return res.scalar_one_or_none()
     
+    async def get_sessions(self, session:AsyncSession, user_id:str, upload_ids:List[UUID]) -> Dict[UUID, UploadSession]:
+        if not upload_ids:
+            return {}
+        stmt = select(UploadSession).where(UploadSession.user_id == user_id).where(UploadSession.upload_id.in_(upload_ids))
+        res = await session.execute(stmt)
+        return {s.upload_id: s for s in res.scalars().all()}
+
+    async def get_progress(self, session:AsyncSession, user_id:str, upload_id:UUID) -> Optional[UploadSession]:
+        # get_session plus the received bitmap: one row, whatever the chunk count
+        stmt = (select(UploadSession).options(undefer(UploadSession.received_bitmap))
+                .where(UploadSession.user_id == user_id).where(UploadSession.upload_id == upload_id))
+        res = await session.execute(stmt)
+        return res.scalar_one_or_none()
+
+    async def mark_received(self, session:AsyncSession, upload_id:UUID, chunk_idx:int) -> None:
+        """
+        Sets the chunk's bit and counts it once, in one statement (the SET expressions see the
+        row as it was, so a bit that was already set adds 0).
+        """
+        stmt = (update(UploadSession)
+                .where(UploadSession.upload_id == upload_id)
+                .where(UploadSession.received_bitmap.isnot(None))
+                .values(received_bitmap=func.set_bit(UploadSession.received_bitmap, chunk_idx, 1),
+                        received_count=UploadSession.received_count + 1 - func.get_bit(UploadSession.received_bitmap, chunk_idx)))
+        await session.execute(stmt)
+
+    async def mark_received_many(self, session:AsyncSession, upload_id:UUID, chunk_idxs:List[int]) -> None:
+        """
+        Batch form of mark_received. Only for indices whose receipts were just inserted in the
+        same transaction: none of their bits can be set yet, so the count moves by len().
+        Bits are set as nested set_bit() calls, MARK_BITS_PER_UPDATE per statement (deeper
+        expressions exceed the SQL compiler's recursion limit).
+        """
+        idxs = sorted(set(chunk_idxs))
+        for i in range(0, len(idxs), MARK_BITS_PER_UPDATE):
+            part = idxs[i:i + MARK_BITS_PER_UPDATE]
+            bitmap = UploadSession.received_bitmap
+            for idx in part:
+                bitmap = func.set_bit(bitmap, idx, 1)
+            stmt = (update(UploadSession)
+                    .where(UploadSession.upload_id == upload_id)
+                    .where(UploadSession.received_bitmap.isnot(None))
+                    .values(received_bitmap=bitmap, received_count=UploadSession.received_count + len(part)))
+            await session.execute(stmt)
+
     async def set_status(self, session: AsyncSession, user_id: str, upload_id: UUID, status: str) -> int:
         stmt = (update(UploadSession).where(UploadSession.user_id == user_id)
                 .where(UploadSession.upload_id == upload_id)
@@ -25,12 +76,95 @@ class UploadSessionRepository:
         res = await session.execute(stmt)
         return int(res.rowcount or 0)
     
-    async def get_status_bulk(self, session: AsyncSession, user_id: str, upload_ids: List[UUID]) -> Dict[UUID, tuple[str, int]]:
+    async def transition(self, session: AsyncSession, user_id: str, upload_id: UUID, from_status: str, to_status: str) -> bool:
+        # compare-and-set on status: only one of finalize / abort / expiry can claim a session
+        stmt = (update(UploadSession).where(UploadSession.user_id == user_id)
+                .where(UploadSession.upload_id == upload_id)
+                .where(UploadSession.status == from_status)
+                .values(status=to_status)
+                )
+        res = await session.execute(stmt)
+        return int(res.rowcount or 0) == 1
+
+    async def transition_many(self, session: AsyncSession, user_id: str, upload_ids: List[UUID], from_status: str, to_status: str) -> int:
+        # transition() for a set of sessions in one statement; returns how many were claimed
+        if not upload_ids:
+            return 0
+        stmt = (update(UploadSession).where(UploadSession.user_id == user_id)
+                .where(UploadSession.upload_id.in_(upload_ids))
+                .where(UploadSession.status == from_status)
+                .values(status=to_status)
+                )
+        res = await session.execute(stmt)
+        return int(res.rowcount or 0)
+
+    async def set_status_many(self, session: AsyncSession, user_id: str, upload_ids: List[UUID], status: str) -> int:
+        if not upload_ids:
+            return 0
+        stmt = (update(UploadSession).where(UploadSession.user_id == user_id)
+                .where(UploadSession.upload_id.in_(upload_ids))
+                .values(status=status)
+                )
+        res = await session.execute(stmt)
+        return int(res.rowcount or 0)
+
+    async def take_reservation(self, session: AsyncSession, user_id: str, upload_id: UUID) -> int:
+        """
+        Zeroes the session's quota reservation and returns what it was, so it is released
+        (or converted) exactly once even if abort/expiry/finalize race.
+        """
+        before = aliased(UploadSession)
+        stmt = (update(UploadSession)
+                .where(UploadSession.user_id == user_id)
+                .where(UploadSession.upload_id == upload_id)
+                .where(UploadSession.reserved_bytes > 0)
+                .where(before.upload_id == UploadSession.upload_id)
+                .values(reserved_bytes=0)
+                .returning(before.reserved_bytes))
+        res = await session.execute(stmt)
+        row = res.first()
+        return int(row[0]) if row else 0
+
+    async def take_reservations(self, session: AsyncSession, user_id: str, upload_ids: List[UUID]) -> int:
+        # take_reservation() for a set of sessions; returns the sum
+        if not upload_ids:
+            return 0
+        before = aliased(UploadSession)
+        stmt = (update(UploadSession)
+                .where(UploadSession.user_id == user_id)
+                .where(UploadSession.upload_id.in_(upload_ids))
+                .where(UploadSession.reserved_bytes > 0)
+                .where(before.upload_id == UploadSession.upload_id)
+                .values(reserved_bytes=0)
+                .returning(before.reserved_bytes))
+        res = await session.execute(stmt)
+        return sum(int(r[0]) for r in res.all())
+
+    async def list_expired(self, session: AsyncSession, now: datetime, limit: int) -> List[UploadSession]:
+        # SKIP LOCKED: several workers can sweep without blocking each other or a racing finalize
+        stmt = (select(UploadSession)
+                .where(UploadSession.status == "UPLOADING")
+                .where(UploadSession.expires_at < now)
+                .order_by(UploadSession.expires_at)
+                .limit(limit)
+                .with_for_update(skip_locked=True))
+        res = await session.execute(stmt)
+        return list(res.scalars().all())
+
+    async def get_status_bulk(self, session: AsyncSession, user_id: str, upload_ids: List[UUID]) -> Dict[UUID, tuple[str, int, Optional[int]]]:
+        # (status, total_chunks, received_count); received_count is None for sessions without a bitmap
         if not upload_ids:
             return {}
-        stmt = (select(UploadSession.upload_id, UploadSession.status, UploadSession.total_chunks)
+        stmt = (select(UploadSession.upload_id, UploadSession.status, UploadSession.total_chunks, UploadSession.received_count,
+                       UploadSession.received_bitmap.isnot(None))
                 .where(UploadSession.user_id == user_id)
                 .where(UploadSession.upload_id.in_(upload_ids))
             )
         res = await session.execute(stmt)
-        return {row[0]: (row[1], int(row[2])) for row in res.all()}
\ No newline at end of file
+        return {row[0]: (row[1], int(row[2]), int(row[3]) if row[4] else None) for row in res.all()}
+
+    async def count_by_status(self, session: AsyncSession) -> Dict[str, int]:
+        # one GROUP BY over idx_sessions_status_expiry, for the metrics scrape
+        stmt = select(UploadSession.status, func.count()).group_by(UploadSession.status)
+        res = await session.execute(stmt)
+        return {row[0]: int(row[1]) for row in res.all()}
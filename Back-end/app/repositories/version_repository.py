@@ -1,15 +1,18 @@
 import logging
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from uuid import UUID
 
 from datetime import datetime
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.domain.persistance.models.dash_models import FileVersioning
+from app.repositories.file_repository import ROWS_PER_INSERT
+from app.observability.metrics import timed_repository
 
 logger = logging.getLogger(__name__)
 
+@timed_repository
 class VersionRepository:
     async def list_versions_of_file(self, session:AsyncSession, user_id:str, original_file_id:UUID) -> List[FileVersioning]:
         stmt = (select(FileVersioning).where(FileVersioning.user_id == user_id).where(FileVersioning.original_file_id == original_file_id)
@@ -28,6 +31,7 @@ class VersionRepository:
                              file_type :str,file_size:int, integrity_hash:str,
                              encryption_metadata: Optional[str] = None,version_number: Optional[int] = None,) -> FileVersioning:
         version = FileVersioning(
+            user_id=user_id,
             original_file_id=original_file_id,
             file_name=file_name,
             file_path=file_path,
@@ -42,6 +46,35 @@ class VersionRepository:
         await session.flush()
         return version
     
+    async def create_versions(self, session:AsyncSession, user_id:str, items:List[Dict[str, Any]]) -> Dict[UUID, int]:
+        """
+        create_version() for many files in one multi-row INSERT. items: original_file_id, file_name,
+        file_path, file_type, file_size, integrity_hash, encryption_metadata, version_number.
+        Returns original_file_id -> new version_id.
+        """
+        if not items:
+            return {}
+        now = datetime.utcnow()
+        rows = [{
+            "user_id": user_id,
+            "original_file_id": i["original_file_id"],
+            "file_name": i["file_name"],
+            "file_path": i["file_path"],
+            "file_size": i["file_size"],
+            "file_type": i["file_type"],
+            "integrity_hash": i["integrity_hash"],
+            "encryption_metadata": i.get("encryption_metadata"),
+            "version_number": i.get("version_number"),
+            "created_at": now,
+        } for i in items]
+        out: Dict[UUID, int] = {}
+        for i in range(0, len(rows), ROWS_PER_INSERT):
+            stmt = (insert(FileVersioning).values(rows[i:i + ROWS_PER_INSERT])
+                    .returning(FileVersioning.original_file_id, FileVersioning.version_id))
+            res = await session.execute(stmt)
+            out.update({r[0]: int(r[1]) for r in res.all()})
+        return out
+
     async def delete_version(self,session:AsyncSession,user_id:str,original_file_id:UUID,version_id:int)->int:
         stmt = (delete(FileVersioning).where(FileVersioning.user_id == user_id)
                 .where(FileVersioning.original_file_id == original_file_id).where(FileVersioning.version_id == version_id))
@@ -46,7 +46,10 @@ class FinalUploadResponse(BaseModel):
     integrity_hash: str
 
 class FolderUploadEntry(BaseModel):
-    folder_path: str 
+    model_config = ConfigDict(populate_by_name=True)
+
+    path: str = Field(alias="folder_path")
+    start: str = "file"  # "file" | "dir"
     file_size: Optional[int] 
     file_type: Optional[str]
 
@@ -56,6 +59,7 @@ class FolderUploadRequest(BaseModel):
 
     entries: List[FolderUploadEntry] 
     chunk_size: Optional[int] 
+    pack: bool = False  # small files share one pack session (see SD_PACK_MAX_FILE_BYTES)
 
 class FolderUploadChildFile(BaseModel):
     rel_path: str
@@ -64,6 +68,48 @@ class FolderUploadChildFile(BaseModel):
     upload_id: UUID
     chunk_size: int
     total_chunks: int
+    pack_index: Optional[int] = None  # packed file: send it as chunk pack_index of upload_id
+
+class PackFileFinalize(BaseModel):
+    pack_index: int
+    wrapped_fk_b64: str
+    encryption_metadata: Optional[Dict[str, Any]] = None
+
+class PackFinalizeRequest(BaseModel):
+    files: List[PackFileFinalize]
+
+class PackFinalizedFile(BaseModel):
+    pack_index: int
+    file_id: UUID
+    version_id: int
+    integrity_hash: str
+
+class PackFinalizeResponse(BaseModel):
+    upload_id: UUID
+    files: List[PackFinalizedFile]
+
+class FolderFileFinalize(BaseModel):
+    upload_id: UUID
+    pack_index: Optional[int] = None
+    wrapped_fk_b64: str
+    encryption_metadata: Optional[Dict[str, Any]] = None
+
+class FolderFinalizeRequest(BaseModel):
+    files: List[FolderFileFinalize]
+
+class FolderFinalizedFile(BaseModel):
+    upload_id: UUID
+    pack_index: Optional[int] = None
+    file_id: UUID
+    version_id: int
+    integrity_hash: str
+
+class FolderFinalizeResponse(BaseModel):
+    folder_upload_id: UUID
+    status: str
+    total_files: int
+    completed_files: int
+    files: List[FolderFinalizedFile]
 
 class FolderUploadResponse(BaseModel):
     folder_upload_id: UUID
@@ -286,6 +332,16 @@ class CheckStorageResponse(BaseModel):
     allow_upload: bool
     storage_info: Dict[str, Any]
 
+class DedupReportResponse(BaseModel):
+    success: bool
+    message: str
+    objects: int
+    references: int
+    physical_bytes: int
+    logical_bytes: int
+    saved_bytes: int
+    dedup_ratio: float
+
 class FolderStorageRequest(BaseModel):
     folder_id: int
 
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, TypeVar, Union
+
+from app.config.config import get_settings
+from app.security.server_wrapup import ServerCipherWrap
+
+T = TypeVar("T")
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+class CryptoEngine:
+    """
+    Runs server wrap/unwrap (AES-GCM) and other chunk-sized CPU work off the event loop
+    on a pool sized to the machine. cryptography and hashlib release the GIL for large
+    buffers, so chunks are sealed/opened in parallel across cores.
+
+    *_many() split a batch into one contiguous slice per worker, so a batch of N
+    chunks costs `workers` thread hops instead of N.
+    """
+
+    def __init__(self, wrap: ServerCipherWrap, executor: ThreadPoolExecutor, workers: int):
+        self.wrap = wrap
+        self.executor = executor
+        self.workers = workers
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def seal(self, plaintext: BytesLike, aad: Optional[bytes] = None) -> bytes:
+        return await self.run(self.wrap.wrapper, plaintext, aad)
+
+    async def open(self, cipher2: BytesLike, aad: Optional[bytes] = None) -> bytes:
+        return await self.run(self.wrap.unwrapper, cipher2, aad)
+
+    async def map(self, fn: Callable[[BytesLike], T], items: Sequence[BytesLike]) -> List[T]:
+        if not items:
+            return []
+        if len(items) == 1:
+            return [await self.run(fn, items[0])]
+
+        step = -(-len(items) // min(self.workers, len(items)))
+        slices = [items[i:i + step] for i in range(0, len(items), step)]
+
+        def run_slice(part: Sequence[BytesLike]) -> List[T]:
+            return [fn(item) for item in part]
+
+        parts = await asyncio.gather(*(self.run(run_slice, part) for part in slices))
+        return [out for part in parts for out in part]
+
+    async def seal_many(self, plaintexts: Sequence[BytesLike], aad: Optional[bytes] = None) -> List[bytes]:
+        return await self.map(lambda p: self.wrap.wrapper(p, aad), plaintexts)
+
+    async def open_many(self, blobs: Sequence[BytesLike], aad: Optional[bytes] = None) -> List[bytes]:
+        return await self.map(lambda c: self.wrap.unwrapper(c, aad), blobs)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def crypto_executor(settings=None) -> ThreadPoolExecutor:
+    global _executor, _executor_workers
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                cfg = settings or get_settings()
+                _executor_workers = cfg.crypto_workers or min(32, os.cpu_count() or 1)
+                _executor = ThreadPoolExecutor(max_workers=_executor_workers, thread_name_prefix="sd-crypto")
+    return _executor
+
+
+def get_crypto_engine(wrap: Optional[ServerCipherWrap] = None, settings=None) -> CryptoEngine:
+    """
+    Engines are cheap views over one process-wide pool; the cipher objects themselves
+    are cached by ServerCipherWrap per key value.
+    """
+    executor = crypto_executor(settings)
+    return CryptoEngine(wrap or ServerCipherWrap(), executor, _executor_workers)
@@ -1,45 +1,136 @@
 import base64
 import os
+import threading
 from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple, Union
 
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+from app.observability.metrics import SERVER_WRAP_BYTES, SERVER_WRAP_SECONDS
+
 class ServerWrapError(RuntimeError):
     pass
 
+
+NONCE_LEN = 12
+TAG_LEN = 16
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+# env var name -> (raw env value it was built from, AESGCM objects: current first, then previous keys, current key)
+_AEAD_CACHE: Dict[str, Tuple[str, List[AESGCM], bytes]] = {}
+_AEAD_LOCK = threading.Lock()
+
+
+def parse_key(b64: str, env_name: str) -> bytes:
+    try:
+        key = base64.b64decode(b64)
+    except Exception as e:
+        raise ServerWrapError(f"Invalid base64 in {env_name}: {e}")
+
+    if len(key) != 32:
+        raise ServerWrapError(f"{env_name} must decode to 32 bytes, got {len(key)}")
+
+    return key
+
+
 @dataclass(frozen=True)
 class ServerCipherWrap:
 
-    # re-encrypt the the client ciphertext 
+    # re-encrypt the the client ciphertext
     key_b64_env: str = "SD_SERVER_STORAGE_KEY_B64"
+    # comma-separated retired keys, still accepted by unwrapper during a rotation
+    prev_keys_b64_env: str = "SD_SERVER_STORAGE_PREV_KEYS_B64"
     AAD_WRAP: bytes = b"sd:chunkwrap:v1" # must match upload
 
     def get_key(self) -> bytes:
         b64 = os.getenv(self.key_b64_env)
         if not b64:
             raise ServerWrapError(f"Missing {self.key_b64_env}. Set a base64-encoded 32-byte AESGCM key for Production.")
-        
-        try:
-            key = base64.b64decode(b64)
-        except Exception as e:
-            raise ServerWrapError(f"Invalid base64 in {self.key_b64_env}: {e}")
-        
-        if len(key) != 32:
-            raise ServerWrapError(f"{self.key_b64_env} must decode to 32 bytes, got {len(key)}")
-        
-        return key
-
-    def wrapper(self, plaintext:bytes, aad:bytes | None = None) -> bytes:
-        key = self.get_key()
-        aes = AESGCM(key)
-        nonce = os.urandom(12)
-        ciphertext = aes.encrypt(nonce, plaintext, aad if aad is not None else self.AAD_WRAP)
-        return nonce + ciphertext
+
+        return parse_key(b64, self.key_b64_env)
+
+    def keyring(self) -> Tuple[str, List[AESGCM], bytes]:
+        """
+        Key parsing and AESGCM construction happen once per key value, not per chunk.
+        The env is re-read on every call (a dict lookup), so rotating the key in the
+        process environment takes effect on the next chunk without a restart.
+        """
+        b64 = os.getenv(self.key_b64_env) or ""
+        prev = os.getenv(self.prev_keys_b64_env) or ""
+        raw = f"{b64}|{prev}"
+
+        cached = _AEAD_CACHE.get(self.key_b64_env)
+        if cached is not None and cached[0] == raw:
+            return cached
+
+        with _AEAD_LOCK:
+            cached = _AEAD_CACHE.get(self.key_b64_env)
+            if cached is not None and cached[0] == raw:
+                return cached
+
+            key = self.get_key()
+            aeads = [AESGCM(key)]
+            for old in (p.strip() for p in prev.split(",")):
+                if old:
+                    aeads.append(AESGCM(parse_key(old, self.prev_keys_b64_env)))
+
+            cached = _AEAD_CACHE[self.key_b64_env] = (raw, aeads, key)
+            return cached
+
+    def aeads(self) -> List[AESGCM]:
+        return self.keyring()[1]
+
+    @staticmethod
+    def wrapped_size(plaintext_len: int) -> int:
+        return NONCE_LEN + plaintext_len + TAG_LEN
+
+    def wrapper(self, plaintext:BytesLike, aad:bytes | None = None) -> bytearray:
+        return self.wrap_pieces([plaintext], len(plaintext), aad)
+
+    def wrap_pieces(self, pieces:Iterable[BytesLike], size:int, aad:bytes | None = None) -> bytearray:
+        """
+        nonce | AES-GCM(pieces joined) | tag, encrypted piece by piece straight into one
+        preallocated buffer: the plaintext is never joined and the result never re-copied.
+        Same layout as AESGCM.encrypt, so unwrapper reads it unchanged.
+        """
+        nonce = os.urandom(NONCE_LEN)
+        out = bytearray(self.wrapped_size(size))
+        view = memoryview(out)
+        view[:NONCE_LEN] = nonce
+        end = NONCE_LEN + size
+
+        SERVER_WRAP_BYTES.inc("wrap", amount=size)
+        with SERVER_WRAP_SECONDS.time("wrap"):
+            enc = Cipher(algorithms.AES(self.keyring()[2]), modes.GCM(nonce)).encryptor()
+            enc.authenticate_additional_data(aad if aad is not None else self.AAD_WRAP)
+            off = NONCE_LEN
+            for piece in pieces:
+                n = len(piece)
+                if off + n > end:
+                    raise ServerWrapError("Wrap input longer than declared")
+                off += enc.update_into(piece, view[off:off + n])
+            if off != end:
+                raise ServerWrapError("Wrap input shorter than declared")
+            enc.finalize()
+            view[end:] = enc.tag
+        return out
 
     def unwrapper(self,cipher2:bytes, aad:bytes | None = None) -> bytes:
-        if not cipher2 or len(cipher2) < 12 + 16:
+        if not cipher2 or len(cipher2) < NONCE_LEN + TAG_LEN:
             raise ServerWrapError("Invalid C2 blob")
-        key = self.get_key()
-        aesgcm = AESGCM(key)
-        nonce, ct = cipher2[:12], cipher2[12:]
-        return aesgcm.decrypt(nonce, ct, aad if aad is not None else self.AAD_WRAP) 
\ No newline at end of file
+        aeads = self.aeads()
+        view = memoryview(cipher2)
+        nonce, ct = view[:NONCE_LEN], view[NONCE_LEN:]  # views: no copy of the ciphertext
+        aad = aad if aad is not None else self.AAD_WRAP
+
+        SERVER_WRAP_BYTES.inc("unwrap", amount=len(cipher2))
+        with SERVER_WRAP_SECONDS.time("unwrap"):
+            for aesgcm in aeads[:-1]:
+                try:
+                    return aesgcm.decrypt(nonce, ct, aad)
+                except InvalidTag:
+                    continue  # written before a rotation, try the older key
+            return aeads[-1].decrypt(nonce, ct, aad)
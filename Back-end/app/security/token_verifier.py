@@ -0,0 +1,308 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import httpx
+import jwt
+from jwt import PyJWK, PyJWKSet
+from supabase import AsyncClient
+
+from app.config.config import get_settings
+from app.domain.persistance.database import async_session
+from app.repositories.auth_revocation_repository import AuthRevocationRepository
+from app.schemas.auth_schema import User
+
+logger = logging.getLogger(__name__)
+
+
+class AuthTokenError(RuntimeError):
+    pass
+
+
+class _NoLocalKey(Exception):
+    # the token can't be checked locally (no secret / unknown signing key): ask Supabase
+    pass
+
+
+class _TokenRef(NamedTuple):
+    # what revocations match on, from the unverified claims (only ever used to refuse a token)
+    user_id: str
+    session_key: str
+    issued_at: float
+    expires_at: float
+
+
+def _epoch(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _utc(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None)
+
+
+class TokenVerifier:
+    """
+    Resolves bearer tokens to Users without a Supabase round trip per request.
+
+    Supabase access tokens are JWTs: HS256 ones are checked against the configured
+    jwt_secret_key (only when it is set explicitly), asymmetric ones against the project's
+    JWKS, fetched once and refreshed every `jwks_ttl`. Signature, exp, aud, iss and sub are
+    validated. Tokens that can't be checked locally fall back to auth.get_user.
+
+    Either way the resulting User is cached per token until the token expires or
+    `cache_ttl` passes, whichever is first, so a large upload authenticates once rather
+    than once per chunk. revoke_token / revoke_user block a login session / a user at once
+    in this process and record it in auth_revocations; the other workers poll that table
+    every `revocation_poll` seconds and refuse the tokens from then on, cached or not.
+    """
+
+    LEEWAY_SECONDS = 30
+    # an unknown kid can trigger a JWKS refetch at most this often
+    JWKS_RETRY_SECONDS = 30
+    # revocations are stamped before they commit, by each worker's clock: polls re-read this much
+    REVOCATION_OVERLAP_SECONDS = 60
+
+    def __init__(self, settings=None, http: Optional[httpx.AsyncClient] = None, sessions=None):
+        cfg = settings or get_settings()
+        self.local = cfg.auth_local_verify
+        self.cache_ttl = cfg.auth_cache_ttl_seconds
+        self.max_entries = cfg.auth_cache_max_entries
+        self.jwks_ttl = cfg.auth_jwks_ttl_seconds
+        self.audience = cfg.auth_jwt_audience
+        self.issuer = cfg.supabase_url.rstrip("/") + "/auth/v1"
+        self.jwks_url = self.issuer + "/.well-known/jwks.json"
+        self.api_key = cfg.supabase_service_key
+        # the default jwt_secret_key is random per process, so it can't have signed anything
+        self.secret = cfg.jwt_secret_key if "jwt_secret_key" in cfg.model_fields_set else None
+        self.secret_algorithm = cfg.jwt_algorithm
+        self.http = http
+        self.revocation_poll = cfg.auth_revocation_poll_seconds
+        self.sessions = sessions or async_session
+        self.revocations = AuthRevocationRepository()
+
+        self._tokens: "OrderedDict[str, Tuple[User, float, _TokenRef]]" = OrderedDict()
+        # session / token key -> when its tokens expire; user id -> tokens issued up to then are refused
+        self._revoked: Dict[str, float] = {}
+        self._revoked_users: Dict[str, float] = {}
+        self._revocations_since: Optional[datetime] = None
+        self._revocations_at = float("-inf")
+        self._revocations_lock = asyncio.Lock()
+        self._jwks: Dict[str, PyJWK] = {}
+        self._jwks_at = 0.0
+        self._jwks_checked = 0.0
+        self._jwks_lock = asyncio.Lock()
+
+    async def authenticate(self, token: str, supabase: AsyncClient) -> User:
+        await self.sync_revocations()
+        now = time.time()
+        hit = self._tokens.get(token)
+        if hit is not None:
+            user, until, ref = hit
+            if until > now and not self.revoked(ref):
+                self._tokens.move_to_end(token)
+                return user
+            del self._tokens[token]
+
+        ref = self.token_ref(token)
+        if self.revoked(ref):
+            raise AuthTokenError("Token revoked")
+
+        found = None
+        if self.local:
+            try:
+                found = await self.verify_local(token)
+            except _NoLocalKey:
+                pass
+        if found is None:
+            found = await self.verify_remote(token, supabase)
+
+        user, exp = found
+        self.remember(token, user, exp, now, ref)
+        return user
+
+    async def verify_local(self, token: str) -> Tuple[User, float]:
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError as e:
+            raise AuthTokenError(f"Malformed token: {e}") from e
+
+        alg = str(header.get("alg") or "")
+        if alg.startswith("HS"):
+            if not self.secret:
+                raise _NoLocalKey()
+            key, algorithms = self.secret, [self.secret_algorithm]
+        else:
+            jwk = await self.signing_key(header.get("kid"))
+            if jwk is None:
+                raise _NoLocalKey()
+            key, algorithms = jwk.key, [jwk.algorithm_name]
+
+        try:
+            claims = jwt.decode(
+                token, key, algorithms=algorithms, audience=self.audience, issuer=self.issuer,
+                leeway=self.LEEWAY_SECONDS, options={"require": ["exp", "iat", "sub"]},
+            )
+        except jwt.InvalidTokenError as e:
+            raise AuthTokenError(f"Invalid token: {e}") from e
+
+        return self.user_from_claims(token, claims), float(claims["exp"])
+
+    async def verify_remote(self, token: str, supabase: AsyncClient) -> Tuple[User, float]:
+        response = await supabase.auth.get_user(token)
+        if not response or not response.user:
+            raise AuthTokenError("Invalid token or user not found")
+
+        auth_user = response.user
+        user = User(
+            user_id=auth_user.id,
+            email=auth_user.email,
+            name=auth_user.user_metadata.get("name") if auth_user.user_metadata else None,
+            created_at=auth_user.created_at,
+            last_login=auth_user.last_sign_in_at,
+            access_token=token,
+        )
+        try:
+            exp = float(jwt.decode(token, options={"verify_signature": False})["exp"])
+        except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+            exp = 0.0  # Supabase accepted it but we can't tell for how long: don't cache
+        return user, exp
+
+    @staticmethod
+    def token_ref(token: str) -> _TokenRef:
+        try:
+            claims = jwt.decode(token, options={"verify_signature": False})
+        except jwt.InvalidTokenError:
+            claims = {}
+        # Supabase tokens carry the login session, so a logout covers the tokens refreshed from it
+        session_id = claims.get("session_id")
+        key = f"session:{session_id}" if session_id else "token:" + hashlib.sha256(token.encode()).hexdigest()
+        try:
+            issued_at, expires_at = float(claims.get("iat") or 0), float(claims.get("exp") or 0)
+        except (TypeError, ValueError):
+            issued_at, expires_at = 0.0, 0.0
+        return _TokenRef(str(claims.get("sub") or ""), key, issued_at, expires_at)
+
+    def revoked(self, ref: _TokenRef) -> bool:
+        return ref.session_key in self._revoked or ref.issued_at <= self._revoked_users.get(ref.user_id, float("-inf"))
+
+    @staticmethod
+    def user_from_claims(token: str, claims: Dict[str, Any]) -> User:
+        meta = claims.get("user_metadata") or {}
+        # amr holds the sign-in method(s) of the session with their unix timestamps
+        signed_in = max((a.get("timestamp") or 0 for a in claims.get("amr") or [] if isinstance(a, dict)), default=0)
+        return User(
+            user_id=str(claims["sub"]),
+            email=claims.get("email") or "",
+            name=meta.get("name"),
+            last_login=datetime.fromtimestamp(signed_in, tz=timezone.utc) if signed_in else None,
+            access_token=token,
+        )
+
+    async def signing_key(self, kid: Optional[str]) -> Optional[PyJWK]:
+        now = time.monotonic()
+        key = self._jwks.get(kid) if kid else None
+        if key is not None and now - self._jwks_at < self.jwks_ttl:
+            return key
+
+        async with self._jwks_lock:
+            now = time.monotonic()
+            stale = now - self._jwks_at >= self.jwks_ttl
+            if (stale or kid not in self._jwks) and now - self._jwks_checked >= self.JWKS_RETRY_SECONDS:
+                self._jwks_checked = now
+                await self.refresh_jwks()
+        # on a failed refresh the previous keys keep serving
+        return self._jwks.get(kid) if kid else None
+
+    async def refresh_jwks(self) -> None:
+        try:
+            if self.http is not None:
+                resp = await self.http.get(self.jwks_url, headers={"apikey": self.api_key})
+            else:
+                async with httpx.AsyncClient(timeout=5.0) as client:
+                    resp = await client.get(self.jwks_url, headers={"apikey": self.api_key})
+            resp.raise_for_status()
+            data = resp.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning("auth:jwks fetch failed", extra={"url": self.jwks_url, "error": str(e)})
+            return
+
+        keys: Dict[str, PyJWK] = {}
+        if data.get("keys"):
+            try:
+                keys = {k.key_id: k for k in PyJWKSet.from_dict(data).keys if k.key_id}
+            except jwt.PyJWKSetError as e:
+                logger.warning("auth:jwks unusable", extra={"url": self.jwks_url, "error": str(e)})
+                return
+        self._jwks = keys
+        self._jwks_at = time.monotonic()
+
+    def remember(self, token: str, user: User, exp: float, now: float, ref: _TokenRef) -> None:
+        until = min(exp, now + self.cache_ttl)
+        if self.cache_ttl <= 0 or until <= now:
+            return
+        self._tokens[token] = (user, until, ref)
+        self._tokens.move_to_end(token)
+        while len(self._tokens) > self.max_entries:
+            self._tokens.popitem(last=False)
+
+    async def sync_revocations(self) -> None:
+        """Picks up the revocations other workers made, at most once per `revocation_poll`."""
+        if time.monotonic() - self._revocations_at < self.revocation_poll or self._revocations_lock.locked():
+            return
+        async with self._revocations_lock:
+            self._revocations_at = time.monotonic()
+            try:
+                async with self.sessions() as session:
+                    rows = await self.revocations.revoked_since(session, self._revocations_since, datetime.utcnow())
+            except Exception as e:
+                # keep serving on what is known; the next poll catches up
+                logger.warning("auth:revocation poll failed", extra={"error": str(e)})
+                return
+
+            for key, revoked_at, expires_at in rows:
+                self.apply_revocation(key, _epoch(revoked_at), _epoch(expires_at) if expires_at else float("inf"))
+            if rows:
+                newest = max(r[1] for r in rows) - timedelta(seconds=self.REVOCATION_OVERLAP_SECONDS)
+                self._revocations_since = max(self._revocations_since or newest, newest)
+            now = time.time()
+            self._revoked = {k: e for k, e in self._revoked.items() if e + self.LEEWAY_SECONDS > now}
+
+    def apply_revocation(self, key: str, revoked_at: float, expires_at: float) -> None:
+        kind, _, value = key.partition(":")
+        if kind == "user":
+            self._revoked_users[value] = max(revoked_at, self._revoked_users.get(value, float("-inf")))
+        else:
+            self._revoked[key] = max(expires_at, self._revoked.get(key, float("-inf")))
+
+    async def publish_revocation(self, key: str, revoked_at: float, expires_at: Optional[float]) -> None:
+        async with self.sessions() as session:
+            async with session.begin():
+                await self.revocations.revoke(session, key, _utc(revoked_at), _utc(expires_at) if expires_at is not None else None)
+                await self.revocations.delete_expired(session, datetime.utcnow())
+
+    async def revoke_token(self, token: str) -> None:
+        """Logout: the token's login session stops working everywhere, though its tokens are still validly signed."""
+        ref = self.token_ref(token)
+        now = time.time()
+        exp = ref.expires_at or now + self.cache_ttl
+        self._tokens.pop(token, None)
+        self.apply_revocation(ref.session_key, now, exp)
+        await self.publish_revocation(ref.session_key, now, exp)
+
+    async def revoke_user(self, user_id: str) -> None:
+        """Account deletion: every token issued to the user up to now is refused, on every worker."""
+        now = time.time()
+        self.apply_revocation(f"user:{user_id}", now, float("inf"))
+        for token in [t for t, (u, _, _) in self._tokens.items() if u.user_id == user_id]:
+            del self._tokens[token]
+        await self.publish_revocation(f"user:{user_id}", now, None)
+
+
+@lru_cache
+def get_token_verifier() -> TokenVerifier:
+    return TokenVerifier()
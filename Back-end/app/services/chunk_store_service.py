@@ -0,0 +1,390 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.config import get_settings
+from app.domain.persistance.database import after_commit, after_rollback
+from app.repositories.chunk_object_repository import ChunkObjectRepository
+from app.repositories.version_repository import VersionRepository
+from app.repositories.file_repository import FileRepository
+from app.storage.chunk_storage import ChunkStorage, MANIFEST_SUFFIX, LEGACY_MANIFEST_SUFFIX
+from app.storage.chunk_manifest import ManifestView, encode_manifest
+
+logger = logging.getLogger(__name__)
+
+OBJECTS_PREFIX = "objects/"
+PACKS_PREFIX = "packs/"
+BLUEPRINT_PREFIX = "blueprint/"
+
+
+class ChunkStoreService:
+    """
+    Reference-counted, content-addressed chunk objects.
+
+    Objects are keyed by the chunk receipt SHA-256, so an identical wrapped package is
+    written once; every receipt, manifest, copy and version snapshot pointing at it holds
+    one reference. Objects whose count reaches zero are deleted by collect_garbage()
+    after `gc_grace` so in-flight readers and rolled-back releases are not affected.
+    Chunks stored under the legacy chunks/<user>/<upload>/ layout are not tracked.
+
+    Small files of a folder upload can be packed: their wrapped chunks are written back to
+    back into one packs/<user>/<sha>.pk object, each addressed as "<pack key>#<offset>:<len>".
+    The pack is a single object row keyed by its own SHA; every member receipt / manifest
+    entry holds one reference on it (object_sha maps a member to its pack).
+
+    Manifests are copy-on-write at the file level: every files / file_versioning row owns
+    its own manifest, and copying one (clone_manifest) writes a small binary table and bumps
+    the chunk counts instead of copying chunk bytes. Manifests are binary (.sdm, see
+    chunk_manifest); JSON blueprints from before are still read and are rewritten by
+    migrate_manifests().
+    """
+
+    def __init__(self, object_repo: ChunkObjectRepository, storage: ChunkStorage, version_repo: VersionRepository = None, settings=None,
+                 file_repo: FileRepository = None):
+        self.object_repo = object_repo
+        self.storage = storage
+        self.version_repo = version_repo or VersionRepository()
+        self.file_repo = file_repo or FileRepository()
+
+        cfg = settings or get_settings()
+        self.gc_grace = timedelta(seconds=cfg.chunk_gc_grace_seconds)
+        self.gc_batch = cfg.chunk_gc_batch
+        self.migrate_batch = cfg.manifest_migrate_batch
+
+    @staticmethod
+    def is_object_key(storage_key: str) -> bool:
+        return bool(storage_key) and storage_key.startswith((OBJECTS_PREFIX, PACKS_PREFIX))
+
+    @staticmethod
+    def object_sha(sha256: str, storage_key: str) -> str:
+        # the object row a receipt / manifest entry references: its own SHA, or its pack's
+        if storage_key and storage_key.startswith(PACKS_PREFIX):
+            key, _ = ChunkStorage.split_key(storage_key)
+            return key.rsplit("/", 1)[-1].split(".", 1)[0]
+        return sha256
+
+    async def write_pack(self, user_id: str, sha256: str, parts: List[bytes]) -> Tuple[str, int, List[str]]:
+        """
+        Writes `parts` as one pack object (one file, one fsync). Returns (pack key, pack size,
+        member keys in `parts` order). References are taken by the caller, one per member.
+        """
+        blob = b"".join(parts)
+        pack_key = await self.storage.save_pack_object(user_id, sha256, blob)
+        keys: List[str] = []
+        offset = 0
+        for part in parts:
+            keys.append(self.storage.member_key(pack_key, offset, len(part)))
+            offset += len(part)
+        return pack_key, len(blob), keys
+
+    async def locate(self, session: AsyncSession, user_id: str, sha256: str, seal: Callable[[], Awaitable[bytes]]) -> Tuple[str, int, bool]:
+        """
+        Returns (storage_key, size, written). `seal` only runs when no object with this SHA
+        exists yet; the reference itself is taken by retain() in the caller's transaction.
+        The object's lock (lock_objects) is held from here until that transaction ends, so GC
+        can't unlink the file in between, even if it deletes a zero-count row meanwhile
+        (retain() then inserts it again).
+        """
+        await self.object_repo.lock_objects(session, user_id, [sha256])
+        obj = await self.object_repo.get(session, user_id, sha256)
+        if obj is not None:
+            return obj.storage_key, int(obj.size), False
+
+        cipher2 = await seal()
+        storage_key = await self.storage.save_chunk_object(user_id, sha256, cipher2)
+        return storage_key, len(cipher2), True
+
+    async def locate_many(self, session: AsyncSession, user_id: str,
+                          seals: Dict[str, Callable[[], Awaitable[bytes]]]) -> Dict[str, Tuple[str, int, bool]]:
+        """
+        locate() for a batch: one lookup for every SHA, then the missing objects are sealed
+        and written concurrently (each write starts as soon as its own seal finishes).
+        """
+        await self.object_repo.lock_objects(session, user_id, seals.keys())
+        found = await self.object_repo.get_many(session, user_id, seals.keys())
+        out: Dict[str, Tuple[str, int, bool]] = {sha: (key, size, False) for sha, (key, size) in found.items()}
+
+        async def write(sha: str) -> Tuple[str, int]:
+            cipher2 = await seals[sha]()
+            key = await self.storage.save_chunk_object(user_id, sha, cipher2)
+            return key, len(cipher2)
+
+        missing = [sha for sha in seals if sha not in found]
+        written = await asyncio.gather(*(write(sha) for sha in missing))
+        for sha, (key, size) in zip(missing, written):
+            out[sha] = (key, size, True)
+        return out
+
+    async def retain(self, session: AsyncSession, user_id: str, sha256: str, storage_key: str, size: int) -> int:
+        return await self.object_repo.retain(session, user_id, sha256, storage_key, size)
+
+    async def retain_objects(self, session: AsyncSession, user_id: str, objects: Iterable[Tuple[str, str, int]]) -> int:
+        # retain() for (sha256, storage_key, size) triples, one statement; a triple listed n times takes n references
+        return await self.object_repo.retain_many(session, user_id, objects)
+
+    async def retain_many(self, session: AsyncSession, user_id: str, sha256s: Iterable[str]) -> int:
+        return await self.object_repo.adjust(session, user_id, sha256s, +1)
+
+    async def release_many(self, session: AsyncSession, user_id: str, sha256s: Iterable[str]) -> int:
+        return await self.object_repo.adjust(session, user_id, sha256s, -1)
+
+    @staticmethod
+    def manifest_objects(manifest: Union[Dict[str, Any], ManifestView]) -> List[str]:
+        if isinstance(manifest, ManifestView):
+            pairs = manifest.objects()
+        else:
+            pairs = [(c.get("h") or c.get("sha256"), c.get("k") or c.get("c2_rel")) for c in manifest.get("chunks") or []]
+        out: List[str] = []
+        for sha, key in pairs:
+            if sha and ChunkStoreService.is_object_key(key or ""):
+                out.append(ChunkStoreService.object_sha(sha, key))
+        return out
+
+    async def read_manifest(self, manifest_key: str) -> Tuple[bytes, List[str]]:
+        # encoded (binary) manifest and the objects it references; legacy JSON comes back converted
+        view = await self.storage.open_manifest(manifest_key)
+        try:
+            return bytes(view.mv), self.manifest_objects(view)
+        finally:
+            view.close()
+
+    async def read_manifest_objects(self, manifest_key: str) -> List[str]:
+        if not self.is_manifest_key(manifest_key):
+            return []
+        try:
+            _, shas = await self.read_manifest(manifest_key)
+        except FileNotFoundError:
+            return []
+        return shas
+
+    async def release_manifest(self, session: AsyncSession, user_id: str, manifest_key: str) -> int:
+        shas = await self.read_manifest_objects(manifest_key)
+        if not shas:
+            return 0
+        return await self.release_many(session, user_id, shas)
+
+    @staticmethod
+    def is_manifest_key(storage_key: str) -> bool:
+        return bool(storage_key) and storage_key.startswith(BLUEPRINT_PREFIX) and storage_key.endswith((MANIFEST_SUFFIX, LEGACY_MANIFEST_SUFFIX))
+
+    async def write_manifest(self, user_id: str, manifest: Dict[str, Any], name: str) -> str:
+        # blueprint/<user>/<name>.sdm, no references taken
+        return await self.storage.save_manifest(user_id, name, encode_manifest(manifest))
+
+    async def copy_manifest(self, session: AsyncSession, user_id: str, manifest: Dict[str, Any], name: str) -> str:
+        """
+        Stores `manifest` as blueprint/<user>/<name>.sdm and takes one reference per chunk for it.
+        """
+        key = await self.write_manifest(user_id, manifest, name)
+        await self.retain_many(session, user_id, self.manifest_objects(manifest))
+        return key
+
+    async def save_manifests(self, user_id: str, pairs: List[Tuple[Dict[str, Any], str]], concurrency: int = 16) -> List[str]:
+        """
+        Writes (manifest, name) pairs as blueprints concurrently; no references are taken.
+        If any write fails the ones that succeeded are removed and the error is raised.
+        """
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(manifest: Dict[str, Any], name: str) -> str:
+            async with sem:
+                return await self.write_manifest(user_id, manifest, name)
+
+        return await self.gather_writes([one(m, name) for m, name in pairs])
+
+    async def copy_manifests(self, session: AsyncSession, user_id: str, pairs: List[Tuple[Dict[str, Any], str]], concurrency: int = 16) -> List[str]:
+        # batch copy_manifest: concurrent writes, all chunk references in one adjust() call
+        keys = await self.save_manifests(user_id, pairs, concurrency)
+        await self.retain_many(session, user_id, [sha for manifest, _ in pairs for sha in self.manifest_objects(manifest)])
+        return keys
+
+    async def clone_manifest(self, session: AsyncSession, user_id: str, src_key: str, name: str) -> str:
+        # binary manifests are copied byte for byte; a legacy JSON source is written out converted
+        data, shas = await self.read_manifest(src_key)
+        key = await self.storage.save_manifest(user_id, name, data)
+        await self.retain_many(session, user_id, shas)
+        return key
+
+    async def clone_manifests(self, session: AsyncSession, user_id: str, pairs: List[Tuple[str, str]], concurrency: int = 16) -> List[str]:
+        """
+        Batch clone_manifest for (src_key, name) pairs: manifests are read/written concurrently
+        and all chunk references are taken in one adjust() call.
+        """
+        sem = asyncio.Semaphore(max(1, concurrency))
+        shas: List[str] = []
+
+        async def one(src_key: str, name: str) -> str:
+            async with sem:
+                data, objs = await self.read_manifest(src_key)
+                key = await self.storage.save_manifest(user_id, name, data)
+            shas.extend(objs)
+            return key
+
+        keys = await self.gather_writes([one(src, name) for src, name in pairs])
+        await self.retain_many(session, user_id, shas)
+        return keys
+
+    async def gather_writes(self, writes: List[Awaitable[str]]) -> List[str]:
+        # runs writes returning storage keys; on any failure removes the ones that landed and re-raises
+        results = await asyncio.gather(*writes, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            await self.delete_keys([r for r in results if isinstance(r, str)])
+            raise errors[0]
+        return list(results)
+
+    async def delete_keys(self, storage_keys: Iterable[str]) -> None:
+        for key in storage_keys:
+            try:
+                await self.storage.delete_key(key)
+            except Exception:
+                logger.exception("chunk_store: unlink failed", extra={"storage_key": key})
+
+    async def discard_manifest(self, session: AsyncSession, user_id: str, manifest_key: str) -> int:
+        """
+        Releases a manifest's references and removes the manifest itself.
+        """
+        released = await self.release_manifest(session, user_id, manifest_key)
+        try:
+            await self.storage.delete_key(manifest_key)
+        except Exception:
+            logger.exception("chunk_store: manifest unlink failed", extra={"user_id": user_id, "manifest": manifest_key})
+        return released
+
+    @staticmethod
+    def live_manifest_name(file_id) -> str:
+        # a replaced live manifest is written under a fresh name, never over the one the committed row reads
+        return f"{file_id}.{uuid.uuid4().hex}"
+
+    def swap_manifest(self, session: AsyncSession, old_key: str, new_key: str) -> None:
+        """
+        The files row moves from `old_key` to `new_key`, written in this transaction. The old
+        manifest is unlinked only once that commits; on rollback the row (and its references)
+        stay on the old one and the new manifest is removed instead.
+        """
+        if self.is_manifest_key(old_key) and old_key != new_key:
+            after_commit(session, lambda: self.delete_keys([old_key]))
+        after_rollback(session, lambda: self.delete_keys([new_key]))
+
+    async def release_file(self, session: AsyncSession, user_id: str, file) -> int:
+        """
+        Permanent delete of a file: its live manifest plus every version manifest
+        (file_versioning rows go with the file via ON DELETE CASCADE).
+        """
+        released = await self.release_manifest(session, user_id, file.file_path)
+        versions = await self.version_repo.list_versions_of_file(session, user_id=user_id, original_file_id=file.file_id)
+        for ver in versions:
+            if self.is_manifest_key(ver.file_path) and ver.file_path != file.file_path:
+                released += await self.discard_manifest(session, user_id, ver.file_path)
+        return released
+
+    async def collect_garbage(self, session: AsyncSession) -> Tuple[int, int]:
+        """
+        One GC pass. Rows are deleted in the caller's transaction; files are unlinked only
+        after it commits, so a crash leaves an orphan file (harmless) rather than a dangling row.
+        A writer may have referenced or recreated an object since (same content-addressed
+        path), so each file is unlinked under the object's lock and only if no row came back.
+        """
+        cutoff = datetime.utcnow() - self.gc_grace
+        async with session.begin():
+            victims = await self.object_repo.delete_unreferenced(session, older_than=cutoff, limit=self.gc_batch)
+
+        by_user: Dict[str, List[Tuple[str, str, int]]] = {}
+        for user_id, sha256, storage_key, size in victims:
+            by_user.setdefault(user_id, []).append((sha256, storage_key, size))
+
+        freed = 0
+        for user_id, objects in by_user.items():
+            async with session.begin():
+                shas = [sha for sha, _, _ in objects]
+                await self.object_repo.lock_objects(session, user_id, shas)
+                revived = await self.object_repo.get_many(session, user_id, shas)
+                for sha256, storage_key, size in objects:
+                    if sha256 in revived:
+                        continue
+                    try:
+                        if await self.storage.delete_key(storage_key):
+                            freed += size
+                    except Exception:
+                        logger.exception("chunk_gc: unlink failed", extra={"user_id": user_id, "storage_key": storage_key})
+
+        if victims:
+            logger.info("chunk_gc: pass", extra={"objects": len(victims), "bytes": freed})
+        return len(victims), freed
+
+    async def migrate_manifests(self, session: AsyncSession, after: str = "") -> Tuple[Optional[str], List[str]]:
+        """
+        One pass of the JSON -> binary manifest migration, over the next `migrate_batch`
+        JSON blueprint keys after `after`. Each one is rewritten as blueprint/<user>/<name>.sdm
+        and every files / file_versioning row pointing at it is repointed; chunk references
+        don't change. Returns (key to continue after, or None when done; the replaced JSON
+        keys). The caller removes those later, so a request that read a row before the switch
+        can still open its manifest.
+        """
+        async with session.begin():
+            paths = await self.file_repo.legacy_manifest_paths(session, after=after, limit=self.migrate_batch)
+            moved: Dict[str, str] = {}
+            for old in paths:
+                _, user_id, name = old.split("/", 2)
+                try:
+                    data, _ = await self.read_manifest(old)
+                except Exception:
+                    logger.exception("manifest_migrate: unreadable manifest skipped", extra={"storage_key": old})
+                    continue
+                moved[old] = await self.storage.save_manifest(user_id, name[:-len(LEGACY_MANIFEST_SUFFIX)], data)
+            await self.file_repo.replace_paths(session, moved)
+
+        if moved:
+            logger.info("manifest_migrate: pass", extra={"manifests": len(moved)})
+        return (paths[-1] if len(paths) >= self.migrate_batch else None), list(moved)
+
+    async def dedup_report(self, session: AsyncSession, user_id: str) -> Dict[str, Any]:
+        objects, physical, references, logical = await self.object_repo.usage(session, user_id)
+        return {
+            "objects": objects,
+            "references": references,
+            "physical_bytes": physical,
+            "logical_bytes": logical,
+            "saved_bytes": max(0, logical - physical),
+            "dedup_ratio": round(logical / physical, 4) if physical else 1.0,
+        }
+
+
+async def run_manifest_migration_loop(service: ChunkStoreService, session_factory, interval_seconds: int) -> None:
+    after: Optional[str] = ""
+    pending: List[str] = []
+    while True:
+        replaced: List[str] = []
+        if after is not None:
+            try:
+                async with session_factory() as session:
+                    after, replaced = await service.migrate_manifests(session, after)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("manifest_migrate: pass failed")
+        # JSON files replaced one pass ago: readers have had a full interval to move on
+        await service.delete_keys(pending)
+        pending = replaced
+        if after is None and not pending:
+            logger.info("manifest_migrate: done")
+            return
+        await asyncio.sleep(interval_seconds)
+
+
+async def run_chunk_gc_loop(service: ChunkStoreService, session_factory, interval_seconds: int) -> None:
+    while True:
+        try:
+            async with session_factory() as session:
+                removed, _ = await service.collect_garbage(session)
+            if removed >= service.gc_batch:
+                continue  # backlog: go again without sleeping
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("chunk_gc: pass failed")
+        await asyncio.sleep(interval_seconds)
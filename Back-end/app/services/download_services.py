@@ -1,11 +1,14 @@
+import asyncio
 import hashlib
-import json
-import logging , struct, anyio
+import logging , struct
+import re
+from collections import deque
 from dataclasses import dataclass
-from typing import AsyncIterator, Optional, Dict, Tuple, List, Set, Iterable 
+from typing import AsyncIterator, Optional, Dict, Tuple, List, Set, Iterable, Callable, Deque, Sequence
 from datetime import datetime
-from uuid import UUID
+from uuid import UUID, uuid4
 
+from cryptography.exceptions import InvalidTag
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -13,21 +16,38 @@ from app.repositories.file_repository import FileRepository
 from app.repositories.folder_repository import FolderRepository
 
 from app.security.server_wrapup import ServerCipherWrap, ServerWrapError
+from app.security.crypto_engine import get_crypto_engine
 from app.storage.chunk_storage import ChunkStorage
 from app.storage.chunk_package import decode_chunk_package
+from app.storage.chunk_manifest import ManifestView
 
 from app.schemas.dash_schema import DownloadPlanItem,DownloadRoot,FolderDownloadPlanResponse
 
 from app.security.name_validator import _validate_name
 
+from app.config.config import get_settings
+from app.observability.metrics import DOWNLOAD_BYTES, DOWNLOAD_CHUNK_SECONDS
+
 logger = logging.getLogger(__name__)
 
+# Range requests address chunks, not bytes: a package stream's byte offsets can't be known
+# without reading every package (nonce/tag lengths are per chunk), so "bytes" ranges would
+# describe plaintext offsets that aren't the body's. "chunks" is a custom range unit
+# (RFC 9110 14.1); clients map a plaintext offset to chunk offset // X-StormDrive-Chunk-Size.
+RANGE_UNIT = "chunks"
+_RANGE_SPEC = re.compile(r"(\d*)\s*-\s*(\d*)")
+
 class DownloadNotFoundError(FileNotFoundError):
     pass
 
 class DownloadCorruptionError(RuntimeError):
     pass
 
+class DownloadRangeError(ValueError):
+    def __init__(self, message: str, total_chunks: int):
+        super().__init__(message)
+        self.total_chunks = total_chunks
+
 @dataclass(frozen=True)
 class DownloadTarget:
     file_id: UUID
@@ -38,6 +58,13 @@ class DownloadTarget:
     integrity_hash: str
     encryption_metadata: Optional[str]
 
+@dataclass(frozen=True)
+class ChunkRef:
+    chunk_index: int
+    storage_key: str
+    sha256: Optional[str]
+    size: int
+
 @dataclass(frozen=True)
 class FolderNode:
     folder_id: int
@@ -46,13 +73,51 @@ class FolderNode:
     root_id: int
 
 
+@dataclass(frozen=True)
+class ChunkSpan:
+    # chunks [first, last] (manifest positions) of one range
+    first: int
+    last: int
+
+
+class ManifestPlan(Sequence):
+    """
+    The chunk plan of a manifest (or of chunks [start, stop) of it), read entry by entry as
+    the stream reaches it (no list of every chunk is built up front).
+    """
+
+    def __init__(self, manifest: ManifestView, verify_sha256: bool = True, start: int = 0, stop: Optional[int] = None):
+        self.manifest = manifest
+        self.verify_sha256 = verify_sha256
+        self.start = start
+        self.stop = len(manifest) if stop is None else min(stop, len(manifest))
+
+    def __len__(self) -> int:
+        return max(0, self.stop - self.start)
+
+    def __getitem__(self, i: int) -> ChunkRef:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        pos = self.start + i
+        c = self.manifest.chunk(pos)
+        if self.verify_sha256 and not c.sha256:
+            raise DownloadCorruptionError(f"Missing sha256 receipt for chunk {pos}")
+        # chunk_index is the chunk's index in its upload stream (a packed file is chunk pack_index of its pack)
+        return ChunkRef(chunk_index=c.chunk_index, storage_key=c.storage_key, sha256=c.sha256, size=c.size)
+
+
 class DownloadService:
-    def __init__(self,file_repo :FileRepository, storage: ChunkStorage, wrapper: ServerCipherWrap,folder_repo:FolderRepository):
+    def __init__(self,file_repo :FileRepository, storage: ChunkStorage, wrapper: ServerCipherWrap,folder_repo:FolderRepository,settings=None):
         self.filerepo = file_repo
         self.storage = storage
         self.wrapper = wrapper
         self.folder_repo = folder_repo
 
+        cfg = settings or get_settings()
+        self.prefetch_chunks = cfg.download_prefetch_chunks
+        self.prefetch_max_bytes = cfg.download_prefetch_max_bytes
+        self.crypto = get_crypto_engine(wrapper, cfg)
+
     C1_SCHEMA_VERSION = 1
 
     def aad_bytes(self, upload_id:str,chunk_size:str,file_size: int,file_type: str, chunk_idx:int)->bytes:
@@ -181,6 +246,63 @@ class DownloadService:
         )
 
 
+    # Range requests: more ranges than this are served as the whole file
+    MAX_RANGES = 32
+
+    @staticmethod
+    def parse_chunk_ranges(range_header: Optional[str], total_chunks: int) -> Optional[List[Tuple[int, int]]]:
+        """
+        Parses "chunks=a-b, c-, -n" against total_chunks into inclusive (first, last) chunk
+        pairs in request order. None means the header should be ignored (absent, another
+        unit such as bytes, malformed or too many ranges); DownloadRangeError means no range
+        is satisfiable.
+        """
+        if not range_header or total_chunks <= 0:
+            return None
+        unit, sep, spec = range_header.partition("=")
+        if not sep or unit.strip().lower() != RANGE_UNIT:
+            return None
+
+        parts = [p.strip() for p in spec.split(",") if p.strip()]
+        if not parts or len(parts) > DownloadService.MAX_RANGES:
+            return None
+
+        ranges: List[Tuple[int, int]] = []
+        for part in parts:
+            m = _RANGE_SPEC.fullmatch(part)
+            if m is None or not (m.group(1) or m.group(2)):
+                return None
+            first, last = m.group(1), m.group(2)
+            if not first:
+                # suffix range: the last n chunks
+                n = int(last)
+                if n == 0:
+                    continue
+                ranges.append((max(0, total_chunks - n), total_chunks - 1))
+                continue
+            start = int(first)
+            end = int(last) if last else total_chunks - 1
+            if last and end < start:
+                return None
+            if start >= total_chunks:
+                continue
+            ranges.append((start, min(end, total_chunks - 1)))
+
+        if not ranges:
+            raise DownloadRangeError("Range not satisfiable", total_chunks)
+        return ranges
+
+    @staticmethod
+    def chunk_spans(ranges: List[Tuple[int, int]]) -> List[ChunkSpan]:
+        # overlapping or touching ranges are merged, so each chunk is sent once; spans in file order
+        spans: List[List[int]] = []
+        for first, last in sorted(ranges):
+            if spans and first <= spans[-1][1] + 1:
+                spans[-1][1] = max(spans[-1][1], last)
+            else:
+                spans.append([first, last])
+        return [ChunkSpan(first=a, last=b) for a, b in spans]
+
     async def stream_encrypted_packages(
         self,
         session: AsyncSession,
@@ -188,106 +310,202 @@ class DownloadService:
         file_id: UUID,
         version_id: Optional[int] = None,
         verify_sha256: bool = True,
-    ) -> tuple[DownloadTarget, Dict[str, str], AsyncIterator[bytes]]:
+        range_header: Optional[str] = None,
+        if_range: Optional[str] = None,
+    ) -> tuple[DownloadTarget, int, Dict[str, str], AsyncIterator[bytes]]:
+        """
+        Streams the file's chunk packages. With a "chunks" Range header (see RANGE_UNIT) only
+        the requested chunks are read and unwrapped: the answer is a 206 with
+        "Content-Range: chunks a-b/<total>" and those chunks' packages as the body, or
+        multipart/byteranges with one such part per span when ranges aren't adjacent.
+        Byte ranges are ignored (full 200). Returns (target, status code, headers, body).
+        """
         target = await self.get_download_file(session, user_id, file_id, version_id)
+        status_code, headers, body = await self.stream_target(target, verify_sha256, range_header, if_range)
+        return target, status_code, headers, body
 
-        # Read and parse manifest JSON (created at upload finalize)
-        manifest_text = await self.storage.read_text(target.file_path)
+    async def stream_target(
+        self,
+        target: DownloadTarget,
+        verify_sha256: bool = True,
+        range_header: Optional[str] = None,
+        if_range: Optional[str] = None,
+    ) -> tuple[int, Dict[str, str], AsyncIterator[bytes]]:
+        """
+        The storage half of stream_encrypted_packages: needs no DB session, so callers can
+        release their connection once get_download_file has returned.
+        """
+        # Binary manifest (mmapped; legacy JSON blueprints are converted on open)
         try:
-            manifest = json.loads(manifest_text)
-        except Exception:
-            # If you still have legacy single-path files, you can support them later.
+            manifest = await self.storage.open_manifest(target.file_path)
+        except ValueError:
             raise DownloadNotFoundError("Not a chunked manifest file")
 
-        required = {"upload_id", "chunk_size", "total_chunks", "file_size", "file_type", "chunks"}
-        if not required.issubset(manifest.keys()):
-            raise DownloadNotFoundError("Invalid manifest")
-
-        upload_id = str(manifest["upload_id"])
-        chunk_size = int(manifest["chunk_size"])
-        total_chunks = int(manifest["total_chunks"])
-        file_size = int(manifest["file_size"])
-        file_type = str(manifest["file_type"])
-        chunks = list(manifest["chunks"])
-
-        if not isinstance(chunks, list):
-            raise DownloadNotFoundError("Invalid manifest: chunks must be a list")
-        # Basic sanity
-        if total_chunks <= 0 or len(chunks) != total_chunks:
-            raise DownloadNotFoundError("Manifest chunk count mismatch")
-        
-        if verify_sha256 and target.integrity_hash:
-            manifest_bytes = manifest_text.encode("utf-8") if isinstance(manifest_text, str) else manifest_text
-            manifest_hash = hashlib.sha256(manifest_bytes).hexdigest()
-            if manifest_hash != target.integrity_hash:
+        upload_id = manifest.upload_id
+        chunk_size = manifest.chunk_size
+        total_chunks = manifest.total_chunks
+        file_size = manifest.file_size
+        file_type = manifest.file_type
+
+        try:
+            # integrity_hash is sha256 over the receipt digests (see finalize), so a swapped
+            # chunk table is caught here and a swapped chunk by the per-chunk receipt check
+            if verify_sha256 and target.integrity_hash and manifest.receipts_digest() != target.integrity_hash:
                 raise DownloadCorruptionError("Manifest integrity hash mismatch (storage may be tampered)")
 
+            etag = f'"{target.integrity_hash}"' if target.integrity_hash else None
+            spans: Optional[List[ChunkSpan]] = None
+            # a range is only honoured while the client's If-Range (if any) still names this content
+            if if_range is None or (etag is not None and if_range.strip() == etag):
+                ranges = self.parse_chunk_ranges(range_header, total_chunks)
+                if ranges is not None:
+                    spans = self.chunk_spans(ranges)
+        except BaseException:
+            manifest.close()
+            raise
+
         # Stream headers (client can use these)
         headers = {
             "X-StormDrive-Upload-Id": upload_id,
             "X-StormDrive-Chunk-Size": str(chunk_size),
             "X-StormDrive-Total-Chunks": str(total_chunks),
             "X-StormDrive-File-Size": str(file_size),
-            "X-StormDrive-Integrity-Hash": str(manifest.get("integrity_hash") or target.integrity_hash or ""),
+            "X-StormDrive-Integrity-Hash": str(manifest.integrity_hash or target.integrity_hash or ""),
+            "Accept-Ranges": RANGE_UNIT,
         }
+        if etag:
+            headers["ETag"] = etag
+
+        def aad_for(chunk_idx: int) -> bytes:
+            return self.aad_bytes(
+                upload_id=upload_id,
+                chunk_idx=chunk_idx,
+                chunk_size=chunk_size,
+                file_size=file_size,
+                file_type=file_type,
+            )
 
-        async def iterator() -> AsyncIterator[bytes]:
-            # Stream chunks in order (manifest already ordered, but we enforce)
-            async def iterator() -> AsyncIterator[bytes]:
-                for chunk_idx in range(total_chunks):
-                    chunk_meta = chunks[chunk_idx]
-                    rel_path = chunk_meta.get("c2_rel")
-                    expected_sha = chunk_meta.get("sha256")
-
-                    if not rel_path:
-                        raise DownloadCorruptionError(f"Missing c2_rel for chunk {chunk_idx}")
-
-                    # Read C2 from disk
-                    c2 = await self.storage.read_bytes(rel_path)
-
-                    try:
-                        package = await anyio.to_thread.run_sync(self.wrapper.unwrapper, c2)
-                    except ServerWrapError as e:
-                        raise DownloadCorruptionError(f"Server unwrap failed at chunk {chunk_idx}: {e}") from e
-
-                    # Parse + sanity-check the package
-                    parsed = decode_chunk_package(package)
-                    if int(parsed["chunk_index"]) != int(chunk_idx):
-                        raise DownloadCorruptionError(
-                            f"Chunk index mismatch: expected {chunk_idx}, got {parsed['chunk_index']}"
-                        )
-
-                    nonce = parsed["nonce"]
-                    tag = parsed["tag"]
-                    ciphertext = parsed["ciphertext"]
-
-                    # Verify SHA-256 receipt (optional but recommended to enforce)
-                    if verify_sha256:
-                        if not expected_sha:
-                            raise DownloadCorruptionError(f"Missing sha256 receipt for chunk {chunk_idx}")
-
-                        aad = self.aad_bytes(
-                            file_id=file_id,
-                            chunk_idx=chunk_idx,
-                            chunk_size=chunk_size,
-                            file_size=file_size,
-                            file_type=file_type,
-                        )
-
-                        h = hashlib.sha256()
-                        h.update(aad)
-                        h.update(nonce)
-                        h.update(ciphertext)
-                        h.update(tag)
-                        computed = h.hexdigest()
-
-                        if computed != expected_sha:
-                            raise DownloadCorruptionError(
-                                f"SHA256 mismatch at chunk {chunk_idx}: expected {expected_sha}, got {computed}"
-                            )
+        def span_plan(span: ChunkSpan) -> ManifestPlan:
+            return ManifestPlan(manifest, verify_sha256, start=span.first, stop=span.last + 1)
+
+        if spans is None:
+            status_code = 200
+            body = self.iter_chunk_packages(ManifestPlan(manifest, verify_sha256), aad_for, verify_sha256)
+        elif len(spans) == 1:
+            span = spans[0]
+            status_code = 206
+            headers.update({
+                "Content-Range": f"{RANGE_UNIT} {span.first}-{span.last}/{total_chunks}",
+                "X-StormDrive-First-Chunk": str(span.first),
+                "X-StormDrive-Chunk-Count": str(span.last - span.first + 1),
+            })
+            body = self.iter_chunk_packages(span_plan(span), aad_for, verify_sha256)
+        else:
+            status_code = 206
+            boundary = uuid4().hex
+            headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+
+            async def multipart() -> AsyncIterator[bytes]:
+                for span in spans:
+                    yield (
+                        f"\r\n--{boundary}\r\n"
+                        "Content-Type: application/octet-stream\r\n"
+                        f"Content-Range: {RANGE_UNIT} {span.first}-{span.last}/{total_chunks}\r\n\r\n"
+                    ).encode("ascii")
+                    async for package in self.iter_chunk_packages(span_plan(span), aad_for, verify_sha256):
+                        yield package
+                yield f"\r\n--{boundary}--\r\n".encode("ascii")
+
+            body = multipart()
+
+        async def packages() -> AsyncIterator[bytes]:
+            try:
+                async for package in body:
                     yield package
+            finally:
+                manifest.close()
+
+        return status_code, headers, packages()
+
+    def open_chunk_package(self, c2: bytes, ref: ChunkRef, aad: Optional[bytes]) -> bytes:
+        """
+        CPU-bound part of serving one chunk: server unwrap, package parse and
+        receipt check. Runs on the crypto pool (AES-GCM and hashlib release the GIL).
+        """
+        try:
+            package = self.wrapper.unwrapper(c2)
+        except (ServerWrapError, InvalidTag) as e:
+            raise DownloadCorruptionError(f"Server unwrap failed at chunk {ref.chunk_index}: {e}") from e
+
+        parsed = decode_chunk_package(package)
+        if int(parsed.chunk_index) != int(ref.chunk_index):
+            raise DownloadCorruptionError(
+                f"Chunk index mismatch: expected {ref.chunk_index}, got {parsed.chunk_index}"
+            )
+
+        if aad is not None:
+            h = hashlib.sha256()
+            h.update(aad)
+            h.update(parsed.nonce)
+            h.update(parsed.ciphertext)
+            h.update(parsed.tag)
+            computed = h.hexdigest()
+            if computed != ref.sha256:
+                raise DownloadCorruptionError(
+                    f"SHA256 mismatch at chunk {ref.chunk_index}: expected {ref.sha256}, got {computed}"
+                )
+        return package
+
+    async def load_chunk_package(self, ref: ChunkRef, aad: Optional[bytes]) -> bytes:
+        with DOWNLOAD_CHUNK_SECONDS.time():
+            c2 = await self.storage.read_bytes(ref.storage_key)
+            package = await self.crypto.run(self.open_chunk_package, c2, ref, aad)
+        DOWNLOAD_BYTES.inc(amount=len(package))
+        return package
+
+    async def iter_chunk_packages(
+        self,
+        chunk_plan: Sequence[ChunkRef],
+        aad_for: Callable[[int], bytes],
+        verify_sha256: bool = True,
+    ) -> AsyncIterator[bytes]:
+        """
+        Bounded read-ahead over the chunk plan. Up to `prefetch_chunks` chunks (and
+        at most `prefetch_max_bytes` of estimated package bytes) are read, unwrapped
+        and verified while earlier chunks are being written to the socket. Packages
+        are always yielded in plan order; the first failure cancels the window.
+        """
+        window: Deque[Tuple[asyncio.Task, int]] = deque()
+        in_flight_bytes = 0
+        next_pos = 0
+
+        def can_schedule(size: int) -> bool:
+            if not window:
+                return True  # always make progress, even if one chunk exceeds the cap
+            if len(window) >= self.prefetch_chunks:
+                return False
+            return in_flight_bytes + size <= self.prefetch_max_bytes
+
+        try:
+            while next_pos < len(chunk_plan) or window:
+                while next_pos < len(chunk_plan) and can_schedule(chunk_plan[next_pos].size):
+                    ref = chunk_plan[next_pos]
+                    aad = aad_for(ref.chunk_index) if verify_sha256 else None
+                    task = asyncio.ensure_future(self.load_chunk_package(ref, aad))
+                    window.append((task, ref.size))
+                    in_flight_bytes += ref.size
+                    next_pos += 1
+
+                task, size = window.popleft()
+                package = await task
+                in_flight_bytes -= size
+                yield package
+        finally:
+            for task, _ in window:
+                task.cancel()
+            if window:
+                await asyncio.gather(*(t for t, _ in window), return_exceptions=True)
 
-        return target, headers, iterator()
     
     def dedupe_roots(self, xs: Iterable[int]) -> List[int]:
         out: List[int] = []
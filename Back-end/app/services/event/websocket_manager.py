@@ -2,6 +2,8 @@ from fastapi import WebSocket
 from typing import Dict, List, Any
 import asyncio
 
+from app.observability.metrics import WS_FANOUT_SECONDS
+
 
 class WebSocketManager:
     def __init__(self):
@@ -27,7 +29,8 @@ class WebSocketManager:
         if not conns:
             return
         tasks = [ws.send_json(message) for ws in conns]
-        await asyncio.gather(*tasks, return_exceptions=True)
+        with WS_FANOUT_SECONDS.time("user"):
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     async def broadcast(self, message: Any):
         tasks = [
@@ -36,7 +39,12 @@ class WebSocketManager:
             for ws in conns
         ]
         if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+            with WS_FANOUT_SECONDS.time("all"):
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+
+    def connection_count(self) -> int:
+        return sum(len(conns) for conns in self.active_connections.values())
 
 
 websocket_manager = WebSocketManager()
@@ -21,6 +21,7 @@ from app.actions.trashCommand import (
 )
 
 from app.storage.local_cipherblob import cipherCloneStorage
+from app.services.chunk_store_service import ChunkStoreService
 
 from app.security.name_validator import _validate_name
 
@@ -29,8 +30,10 @@ logger = logging.getLogger(__name__)
 
 
 class FileService:
-    def __init__(self, file_repo: FileRepository, undo_repo: UndoRedoRepository, folder_repo: FolderRepository, recycle_repo: RecyclebinRepository, storage_root: str | None = None):
+    def __init__(self, file_repo: FileRepository, undo_repo: UndoRedoRepository, folder_repo: FolderRepository, recycle_repo: RecyclebinRepository, storage_root: str | None = None,
+                 chunk_store: Optional[ChunkStoreService] = None):
         self.file_repo = file_repo
+        self.chunk_store = chunk_store
         self.undo_repo = undo_repo 
         self.folder_repo = folder_repo
         self.recycle_repo = recycle_repo
@@ -141,6 +144,7 @@ class FileService:
             folderrepo=self.folder_repo,
             local_storage=cipherCloneStorage(),
             upload_root=upload_root,
+            chunk_store=self.chunk_store,
         )
         bulk_files = CopyFilesBulkCommand(single_file=single_file)
 
@@ -268,10 +272,10 @@ class FileService:
         
         file_ids = list(dict.fromkeys(file_ids))
 
-        deleted_ids = List[dict] = []
-        failed_ids = List[dict] = []
+        deleted_ids: List[dict] = []
+        failed_ids: List[dict] = []
 
-        item = PermanentDeleteFileCommand(self.file_repo, self.recycle_repo, self.storage_root)
+        item = PermanentDeleteFileCommand(self.file_repo, self.recycle_repo, self.storage_root, chunk_store=self.chunk_store)
 
         async with session.begin():
             for fileid in file_ids:
@@ -16,6 +16,8 @@ from app.actions.copyCommand import CopyFolderCommand, CopyFoldersBulkCommand
 from app.actions.foldertrashCommand import TrashFolderCommand, TrashFolderBulkCommand, RestoreFolderCommand, RestoreFolderBulkCommand, PermanentDeleteFolderCommand
 
 from app.storage.local_cipherblob import cipherCloneStorage
+from app.services.chunk_store_service import ChunkStoreService
+from app.config.config import get_settings
 
 from app.security.name_validator import _validate_name
 
@@ -24,8 +26,9 @@ logger = logging.getLogger(__name__)
 
 class FolderService:
     def __init__(self, folder_repo: FolderRepository, undo_repo: UndoRedoRepository, file_repo: FileRepository, trash_repo:RecyclebinRepository, 
-                 key_repo : FolderKeysRepository,upload_root:str, recycle_root:str):
+                 key_repo : FolderKeysRepository,upload_root:str, recycle_root:str, chunk_store: Optional[ChunkStoreService] = None):
         self.folder_repo = folder_repo
+        self.chunk_store = chunk_store
         self.undo_repo = undo_repo
         self.file_repo = file_repo
         self.trash_repo = trash_repo
@@ -82,7 +85,7 @@ class FolderService:
                         depth=0,
                         heirarchy_path=None,
                     )
-                    root_folder.heirarchy_path = str(int(root_folder.folder_id))
+                    root_folder.heirarchy_path = self.folder_repo.child_path(None, root_folder.folder_id)
                     session.add(root_folder)
                     created.append(str(root_uid))
 
@@ -142,8 +145,7 @@ class FolderService:
                             heirarchy_path=None,
                         )
                         # update hierarchy path after we have folder_id
-                        parent_path = parent.heirarchy_path or str(int(parent.folder_id))
-                        ch_folder.heirarchy_path = f"{parent_path}/{int(ch_folder.folder_id)}"
+                        ch_folder.heirarchy_path = self.folder_repo.child_path(parent, ch_folder.folder_id)
                         session.add(ch_folder)
                         created.append(str(ch_uid))
 
@@ -237,8 +239,7 @@ class FolderService:
                             moved_ids.append({"fodler_ids" : str(folder_id), "success": True, "message":"No Change"})
                         else:
                             moved_ids.append({"folder_ids": str(folder_id), "success":True, **res})
-
-                        action_items.append(res)
+                            action_items.append(res)
                 except Exception as e:
                     failed_ids.append({"folder_ids": str(folder_id), "success":True, "error":str(e)})
 
@@ -282,6 +283,8 @@ class FolderService:
             folderrepo=self.folder_repo,
             local_storage=cipherCloneStorage(),
             upload_root=upload_root,
+            chunk_store=self.chunk_store,
+            clone_concurrency=get_settings().copy_clone_concurrency,
         )
         bulk_folder = CopyFoldersBulkCommand(single_folder=single_folder)
 
@@ -305,7 +308,7 @@ class FolderService:
                         is_done=True,
                     )
         except Exception as e:
-            logger.exception("copy_folders failed", extra={"user_id": user_id}, error=str(e))
+            logger.exception("copy_folders failed", extra={"user_id": user_id, "error": str(e)})
             raise
 
         try:
@@ -328,7 +331,8 @@ class FolderService:
         failed_ids: List[dict] = []
         action_items: List[dict] = []
 
-        single_folder = TrashFolderCommand(self.folder_repo, self.file_repo, self.trash_repo,self.upload_root,self.recycle_root)
+        single_folder = TrashFolderCommand(self.folder_repo, self.file_repo, self.trash_repo,self.upload_root,self.recycle_root,
+                                     move_concurrency=get_settings().blob_move_concurrency)
         bulk_folder = TrashFolderBulkCommand(single_folder)
 
         try:
@@ -355,7 +359,7 @@ class FolderService:
                     is_done=True,
                 )    
         except Exception as e:
-            logger.exception("trash_folders failed", extra={"user_id": user_id}, error=str(e))
+            logger.exception("trash_folders failed", extra={"user_id": user_id, "error": str(e)})
             raise 
         
         try:
@@ -378,7 +382,8 @@ class FolderService:
         failed_ids: List[dict] = []
         action_items: List[dict] = []
 
-        single_folder = RestoreFolderCommand(self.folder_repo, self.file_repo, self.trash_repo,self.upload_root,self.recycle_root)
+        single_folder = RestoreFolderCommand(self.folder_repo, self.file_repo, self.trash_repo,self.upload_root,self.recycle_root,
+                                     move_concurrency=get_settings().blob_move_concurrency)
         bulk_folder = RestoreFolderBulkCommand(single_folder)
 
         try:
@@ -405,7 +410,7 @@ class FolderService:
                     is_done=True,
                 )    
         except Exception as e:
-            logger.exception("restore_folders failed", extra={"user_id": user_id}, error=str(e))
+            logger.exception("restore_folders failed", extra={"user_id": user_id, "error": str(e)})
             raise 
         
         try:
@@ -427,7 +432,7 @@ class FolderService:
         deleted_ids: List[dict] = []
         failed_ids: List[dict] = []
         
-        single_folder = PermanentDeleteFolderCommand(self.folder_repo, self.file_repo, self.trash_repo, self.upload_root, self.recycle_root)
+        single_folder = PermanentDeleteFolderCommand(self.folder_repo, self.file_repo, self.trash_repo, self.upload_root, self.recycle_root, chunk_store=self.chunk_store)
 
         try:
             async with session.begin():
@@ -444,7 +449,7 @@ class FolderService:
                         failed_ids.append({"folder_id":int(folderid), "success": False, "error": str(e)})
     
         except Exception as e:
-            logger.exception("delete_folders failed", extra={"user_id": user_id}, error=str(e))
+            logger.exception("delete_folders failed", extra={"user_id": user_id, "error": str(e)})
             raise 
         
         try:
@@ -13,6 +13,8 @@ from app.repositories.folder_upload_repository import UploadFolderItemRepository
 from app.repositories.upload_chunk_repository import UploadChunkRepository
 from app.repositories.upload_session_repository import UploadSessionRepository
 from app.repositories.folder_repository import FolderRepository
+from app.repositories.storage_repo import StorageRepository
+from app.services.upload_service import QuotaExceededError
 
 from app.security.name_validator import _validate_name
 
@@ -30,13 +32,15 @@ class FolderUploadError(RuntimeError):
 class FolderUploadServices:
 
     def __init__(self, item_repo:UploadFolderItemRepository, session_repo:UploadFolderRepository,chunk_repo:UploadChunkRepository,
-                 folder_repo:FolderRepository, tree_repo:FolderTreeRepository, upload_repo:UploadSessionRepository,settings:None):
+                 folder_repo:FolderRepository, tree_repo:FolderTreeRepository, upload_repo:UploadSessionRepository,settings:None,
+                 storage_repo:Optional[StorageRepository] = None):
         self.session_repo = session_repo
         self.chunk_repo = chunk_repo
         self.item_reppo = item_repo
         self.folder_repo = folder_repo
         self.tree_repo = tree_repo
         self.upload_repo = upload_repo
+        self.storage_repo = storage_repo or StorageRepository()
 
         cfg = settings or get_settings()
         self.min_chunk = cfg.folder_min_chunk_bytes
@@ -44,6 +48,7 @@ class FolderUploadServices:
         self.default_chunk = cfg.folder_default_chunk_bytes
         self.session_ttl_hours = cfg.folder_session_ttl_hours
         self.max_entries = cfg.folder_max_entries
+        self.pack_max_file = cfg.pack_max_file_bytes
 
     def chunk_size(self, requested: Optional[int]) -> int:
         if requested is None:
@@ -65,14 +70,23 @@ class FolderUploadServices:
             return f"{stem} ({counter}).{ext}"
         return f"{base} ({counter})"
     
-    async def init_folder_upload(self, session:AsyncSession, user_id:str, parent_folder_id:int, folder_name:str, entries:list,chunk_size: Optional[int]) -> Tuple[UploadSession, int, str, List[FolderUploadChildFile]]:
+    def packable(self, file_size: int) -> bool:
+        return 0 < file_size <= self.pack_max_file
+
+    async def init_folder_upload(self, session:AsyncSession, user_id:str, parent_folder_id:int, folder_name:str, entries:list,chunk_size: Optional[int],
+                                 pack: bool = False) -> Tuple[UploadSession, int, str, List[FolderUploadChildFile]]:
+        """
+        pack=True: files up to SD_PACK_MAX_FILE_BYTES get no session of their own. They become the
+        chunks of one pack session (chunk_index = pack_index), so the whole set is sent with a few
+        batch PUTs, lands in a few pack objects and is finalized with one finalize-pack call.
+        """
         if len(entries) > self.max_entries:
             raise ValueError("Too many entries in one folder upload")
 
         chunk_s =  self.chunk_size(chunk_size)
 
         parent_folder: Optional[Folder] = None
-        if parent_folder is not (None,0):
+        if parent_folder_id not in (None, 0):
             parent_folder = await self.folder_repo.get_active_folder(session, user_id=user_id,folder_id=parent_folder_id)
             if not parent_folder:
                 raise FileNotFoundError("Parent folder not found.")
@@ -93,7 +107,7 @@ class FolderUploadServices:
             if entry.file_size is None or entry.file_type is None:
                 raise ValueError("file_size and file_type required for file entries.")
 
-            rel_dir = Tuple(parts[:-1])
+            rel_dir = tuple(parts[:-1])
             fname = parts[-1]
             rel_path = "/".join(parts)
             file_entries.append((rel_dir, fname, int(entry.file_size), str(entry.file_type), rel_path))   
@@ -101,11 +115,15 @@ class FolderUploadServices:
             for i in range(1, len(rel_dir) + 1):
                 dir_paths.append(rel_dir[:i])
 
+        # one reservation for the whole tree; each child session carries its own share
+        if not await self.storage_repo.reserve(session, user_id, sum(e[2] for e in file_entries)):
+            raise QuotaExceededError("Not enough storage for this folder upload.")
+
         root = await self.tree_repo.create_folder(session, user_id, parent_folder, folder_name)
         folder_map = await self.tree_repo.create_subfolders(session, user_id, root, dir_paths)
 
         name_used : Dict[Tuple[int,str],int] = {}
-        fileplan = List[FolderUploadChildFile] = []
+        fileplan: List[FolderUploadChildFile] = []
         items: List[UploadItems] = []
 
         folder_session = UploadFolderSession(
@@ -119,6 +137,28 @@ class FolderUploadServices:
         )
         await self.session_repo.create(session, folder_session)
 
+        packed = [e for e in file_entries if self.packable(e[2])] if pack else []
+        pack_upload: Optional[UploadSession] = None
+        if packed:
+            pack_bytes = sum(e[2] for e in packed)
+            pack_upload = UploadSession(
+                user_id=user_id,
+                folder_id=int(root.folder_id),
+                file_name=f"{root.folder_name}.pack",
+                file_type="application/x-stormdrive-pack",
+                file_size=pack_bytes,
+                chunk_size=self.pack_max_file,
+                total_chunks=len(packed),
+                status="UPLOADING",
+                is_pack=True,
+                reserved_bytes=pack_bytes,
+                received_bitmap=UploadSession.empty_bitmap(len(packed)),
+                expires_at=folder_session.expires_at,
+            )
+            await self.upload_repo.create_session(session, pack_upload)
+        packed_rel = {e[4] for e in packed}
+        next_pack_index = 0
+
         for rel_dir, base_name, fsize, ftype, rel_path in file_entries:
             target_folder = folder_map.get(rel_dir) or root
             folder_id = int(target_folder.folder_id)
@@ -127,22 +167,32 @@ class FolderUploadServices:
             name_used[key] = name_used.get(key, -1) + 1
             resolved_name = self._rename_file_in_folder(base_name, name_used[key])
 
-            total_chunks = self.total_chunk_size(fsize, chunk_s)
-
-            upload = UploadSession(
-                user_id=user_id,
-                folder_id=folder_id,
-                file_name=resolved_name,
-                file_type=ftype,
-                file_size=fsize,
-                chunk_size=chunk_s,
-                total_chunks=total_chunks,
-                status="UPLOADING",
-                expires_at=folder_session.expires_at,
-            )
-            await self.upload_repo.create_session(session, upload)
+            pack_index: Optional[int] = None
+            if pack_upload is not None and rel_path in packed_rel:
+                upload = pack_upload
+                pack_index = next_pack_index
+                next_pack_index += 1
+                fileplan.append(FolderUploadChildFile(rel_path=rel_path, file_name=resolved_name, folder_id=folder_id, upload_id=upload.upload_id,
+                                                      chunk_size=upload.chunk_size, total_chunks=1, pack_index=pack_index))
+            else:
+                total_chunks = self.total_chunk_size(fsize, chunk_s)
+
+                upload = UploadSession(
+                    user_id=user_id,
+                    folder_id=folder_id,
+                    file_name=resolved_name,
+                    file_type=ftype,
+                    file_size=fsize,
+                    chunk_size=chunk_s,
+                    total_chunks=total_chunks,
+                    status="UPLOADING",
+                    reserved_bytes=max(0, fsize),
+                    received_bitmap=UploadSession.empty_bitmap(total_chunks),
+                    expires_at=folder_session.expires_at,
+                )
+                await self.upload_repo.create_session(session, upload)
 
-            fileplan.append(FolderUploadChildFile(rel_path=rel_path,file_name=resolved_name, folder_id=folder_id, upload_id=upload.upload_id, chunk_size=chunk_s, total_chunks=total_chunks))
+                fileplan.append(FolderUploadChildFile(rel_path=rel_path,file_name=resolved_name, folder_id=folder_id, upload_id=upload.upload_id, chunk_size=chunk_s, total_chunks=total_chunks))
 
             items.append(
                 UploadItems(
@@ -154,6 +204,7 @@ class FolderUploadServices:
                     file_type=ftype,
                     file_size=fsize,
                     upload_id=upload.upload_id,
+                    pack_index=pack_index,
                 )
             )
 
@@ -1,4 +1,6 @@
 import json
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Optional
 from fastapi import HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -6,10 +8,59 @@ from sqlalchemy.exc import IntegrityError
 
 from app.repositories.key_bundle_repository import UserKeyBundleRepository
 from app.schemas.keybundle_schema import KeybundleInitRequest, KeybundleResponse
+from app.config.config import get_settings
+
+
+class KeybundlePresenceCache:
+    """
+    Users known to have a key bundle, per process. Only positive answers are kept: a
+    bundle, once created, stays, while a missing one may be created on another worker
+    at any moment. LRU-bounded; max_users = 0 disables it.
+    """
+
+    def __init__(self, max_users: int):
+        self.max_users = max_users
+        self._users: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._users
+
+    def add(self, user_id: str) -> None:
+        if self.max_users <= 0:
+            return
+        self._users[user_id] = None
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def discard(self, user_id: str) -> None:
+        self._users.pop(user_id, None)
+
+
+@lru_cache
+def get_keybundle_cache() -> KeybundlePresenceCache:
+    return KeybundlePresenceCache(get_settings().keybundle_cache_max_users)
+
 
 class KeybundleService:
-    def __init__(self, bundle_repo: UserKeyBundleRepository):
+    def __init__(self, bundle_repo: UserKeyBundleRepository, cache: Optional[KeybundlePresenceCache] = None):
         self.bundle_repo = bundle_repo
+        self.cache = cache or get_keybundle_cache()
+
+    def known(self, user_id: str) -> bool:
+        return user_id in self.cache
+
+    async def has_bundle(self, session: AsyncSession, user_id: str) -> bool:
+        if user_id in self.cache:
+            return True
+        exists = await self.bundle_repo.check_bundle(session, user_id)
+        if exists:
+            self.cache.add(user_id)
+        return exists
+
+    def forget(self, user_id: str) -> None:
+        # the bundle was removed or replaced (account deletion / rotation): re-check on next use
+        self.cache.discard(user_id)
 
     async def get(self, session: AsyncSession, user_id: str) -> KeybundleResponse:
         kb = await self.bundle_repo.get_bundle(session, user_id)
@@ -44,4 +95,7 @@ class KeybundleService:
         except IntegrityError:
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail={"code": "KEYBUNDLE_EXISTS"})
 
+        if not created:
+            # already committed; a new bundle is cached by the next guard check once this transaction commits
+            self.cache.add(user_id)
         return await self.get(session, user_id)
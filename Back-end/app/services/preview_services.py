@@ -59,7 +59,8 @@ class PreviewService:
             return {"raw" : raw}
         
 
-    def resolve_path(self, root_path : Path , segment:str)->Path:
+    @staticmethod
+    def resolve_path(root_path : Path , segment:str)->Path:
         try:
             return resolve_under_root(root_path, segment)
         except UnsafePathError:
@@ -161,7 +162,7 @@ class PreviewService:
         if "," in rh:
             raise ValueError("Multiple ranges are not supported.")
         
-        if "-" in rh:
+        if "-" not in rh:
             raise ValueError("Invalid range format")
         
         start , end = rh.split("-",1)
@@ -181,7 +182,7 @@ class PreviewService:
         return s , e
     
     async def iterate_range(self, start:int, end:int, path: Path):
-        rem = start - end + 1
+        rem = end - start + 1
         if rem > MAX_RANGE_BYTES:
             raise ValueError(f"Range too large (max {MAX_RANGE_BYTES} bytes)")
         
@@ -2,21 +2,33 @@ from app.repositories.storage_repo import StorageRepository
 from app.repositories.file_repository import FileRepository
 from app.repositories.trash_repository import RecyclebinRepository
 from app.repositories.folder_repository import FolderRepository
+from app.repositories.folder_stats_repository import FolderStatsRepository
+from app.repositories.storage_usage_repository import StorageUsageRepository, ACTIVE, BIN
+
+import asyncio
+import logging
+from typing import Optional
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
+logger = logging.getLogger(__name__)
+
 class StorageServices:
-    def __init__(self,file_repo:FileRepository,folder_repo:FolderRepository,storage_repo:StorageRepository,trash_repo:RecyclebinRepository):
+    def __init__(self,file_repo:FileRepository,folder_repo:FolderRepository,storage_repo:StorageRepository,trash_repo:RecyclebinRepository,
+                 folder_stats:Optional[FolderStatsRepository] = None, usage:Optional[StorageUsageRepository] = None):
         self.file_repo = file_repo
         self.folder_repo = folder_repo
         self.storage_repo = storage_repo
         self.trash_repo = trash_repo
+        self.folder_stats = folder_stats or FolderStatsRepository()
+        self.usage = usage or StorageUsageRepository()
 
     async def get_stats(self,session:AsyncSession,user_id:str):
         storage = await self.storage_repo.get_or_create(session, user_id)
 
-        active_count, active_size = await self.file_repo.aggregate_active(session, user_id)
-        bin_count, bin_size = await self.trash_repo.aggregate(session, user_id)
+        totals = await self.usage.totals(session, user_id)
+        active_count, active_size = totals.get(ACTIVE, (0, 0))
+        bin_count, bin_size = totals.get(BIN, (0, 0))
 
         total_used = active_size + bin_size
         total_storage = int(storage.total_storage)
@@ -26,8 +38,8 @@ class StorageServices:
         return storage, active_count, active_size, bin_count, bin_size, total_used, available, pct
 
     async def get_breakdown(self, session, user_id: str):
-        active_rows = await self.file_repo.breakdown_by_type(session, user_id)
-        bin_rows = await self.trash_repo.breakdown_by_type(session, user_id)
+        active_rows = await self.usage.by_type(session, user_id, ACTIVE)
+        bin_rows = await self.usage.by_type(session, user_id, BIN)
 
         def normalize(rows):
             out = {}
@@ -57,7 +69,10 @@ class StorageServices:
         if file_size < 0:
             raise ValueError("file_size must be >= 0")
 
-        storage, _, _, _, _, total_used, available, pct = await self.get_stats(session, user_id)
+        # storage_used is the maintained active + bin counter, reserved_bytes what open uploads hold: one row
+        storage = await self.storage_repo.get_or_create(session, user_id)
+        total_used = int(storage.storage_used) + int(storage.reserved_bytes or 0)
+        available = max(0, int(storage.total_storage) - total_used)
 
         new_total_used = total_used + file_size
         allow = new_total_used <= int(storage.total_storage)
@@ -67,8 +82,57 @@ class StorageServices:
         return storage, allow, remaining, new_pct, total_used, available
     
     async def folder_size(self, session, user_id: str, folder_id: int):
-        folder = await self.folder_repo.get_folder(session, user_id, folder_id)
-        if not folder:
+        # single-row read of the maintained rollup (no row yet = no files ever landed in the subtree)
+        found = await self.folder_stats.folder_with_stats(session, user_id, folder_id)
+        if not found:
             return None, 0
-        size = await self.folder_repo.folder_tree_size_bytes(session, user_id, folder_id)
-        return folder, size
\ No newline at end of file
+        folder, stats = found
+        return folder, int(stats.total_bytes) if stats else 0
+
+    async def reconcile_folder_stats(self, session: AsyncSession, missing_only: bool = False) -> int:
+        """
+        Rebuilds folder rollups user by user, one transaction each. missing_only limits it to
+        users with files but no rollup rows (first start after the table was added).
+        """
+        async with session.begin():
+            user_ids = await self.folder_stats.list_user_ids(session, missing_only=missing_only)
+        return await self.rebuild_each(session, user_ids, self.folder_stats.rebuild, "folder_stats")
+
+    async def reconcile_usage(self, session: AsyncSession, missing_only: bool = False) -> int:
+        """
+        Drift repair for the per-user usage counters; same shape as reconcile_folder_stats.
+        """
+        async with session.begin():
+            user_ids = await self.usage.list_user_ids(session, missing_only=missing_only)
+        return await self.rebuild_each(session, user_ids, self.usage.rebuild, "storage_usage")
+
+    @staticmethod
+    async def rebuild_each(session: AsyncSession, user_ids, rebuild, name: str) -> int:
+        rebuilt = 0
+        for user_id in user_ids:
+            try:
+                async with session.begin():
+                    await rebuild(session, user_id)
+                rebuilt += 1
+            except Exception:
+                logger.exception(f"{name}: rebuild failed", extra={"user_id": user_id})
+        return rebuilt
+
+
+async def run_usage_reconcile_loop(service: StorageServices, session_factory, interval_seconds: int) -> None:
+    missing_only = True  # first pass only fills users that have no counters yet
+    while True:
+        for name, reconcile in (("folder_stats", service.reconcile_folder_stats), ("storage_usage", service.reconcile_usage)):
+            try:
+                async with session_factory() as session:
+                    rebuilt = await reconcile(session, missing_only=missing_only)
+                if rebuilt:
+                    logger.info(f"{name}: reconciled", extra={"users": rebuilt, "missing_only": missing_only})
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"{name}: reconcile pass failed")
+        if not interval_seconds:
+            return
+        missing_only = False
+        await asyncio.sleep(interval_seconds)
\ No newline at end of file
@@ -1,10 +1,13 @@
+import asyncio
 import base64
 import hashlib
 import json , struct
 import logging
+import time
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional, Dict, Any
-from uuid import UUID
+from typing import Optional, Dict, Any, AsyncIterator, Callable, Iterable, List, Tuple
+from uuid import UUID, uuid4
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
@@ -14,27 +17,60 @@ from app.repositories.upload_chunk_repository import UploadChunkRepository
 from app.repositories.folder_repository import FolderRepository
 from app.repositories.file_repository import FileRepository
 from app.repositories.version_repository import VersionRepository
+from app.repositories.folder_stats_repository import FolderStatsRepository
+from app.repositories.storage_usage_repository import StorageUsageRepository, ACTIVE
+from app.repositories.storage_repo import StorageRepository
+from app.repositories.folder_upload_repository import UploadFolderItemRepository, UploadFolderRepository
 
-from app.domain.persistance.models.upload_models import UploadSession, UploadChunk
+from app.domain.persistance.models.upload_models import UploadSession, UploadChunk, UploadItems
 from app.security.server_wrapup import ServerCipherWrap
+from app.security.crypto_engine import get_crypto_engine
 from app.storage.chunk_storage import ChunkStorage
-from app.storage.chunk_package import encode_chunk_package
+from app.storage.chunk_package import BytesLike, DecodedChunkPackage, encode_chunk_header, iter_chunk_packages, package_size
+from app.storage.chunk_ingest import ChunkIngest
+from app.services.chunk_store_service import ChunkStoreService
 from app.services.event.websocket_manager import websocket_manager
 from app.security.name_validator import _validate_name
 
 from app.config.config import get_settings
+from app.observability.metrics import CHUNK_PUT_BYTES, CHUNK_PUT_SECONDS
 
 logger = logging.getLogger(__name__)
 
 class UploadConflictError(RuntimeError):
     pass
 
+class QuotaExceededError(RuntimeError):
+    pass
+
+@dataclass(frozen=True)
+class FinishedFile:
+    # one file of a bulk finalize: its session, the receipts that make it up, and where it lands
+    upload: UploadSession
+    receipts: List[UploadChunk]
+    file_name: str
+    file_type: str
+    folder_id: Optional[int]
+    file_size: int
+    wrapped_fk_b64: str
+    encryption_metadata: Optional[Dict[str, Any]] = None
+    pack_index: Optional[int] = None
+
 class UploadServices:
     C1_SCHEMA_VERSION = 1
 
     def __init__(self,session_repo:UploadSessionRepository, chunk_repo:UploadChunkRepository,ver_repo:VersionRepository,
-                 storage:ChunkStorage,serverwrap:ServerCipherWrap,folder_repo:FolderRepository,file_repo:FileRepository,settings:None):
+                 storage:ChunkStorage,serverwrap:ServerCipherWrap,folder_repo:FolderRepository,file_repo:FileRepository,settings:None,
+                 chunk_store:ChunkStoreService, folder_stats:Optional[FolderStatsRepository] = None,
+                 usage:Optional[StorageUsageRepository] = None, storage_repo:Optional[StorageRepository] = None,
+                 item_repo:Optional[UploadFolderItemRepository] = None, folder_upload_repo:Optional[UploadFolderRepository] = None):
         self.session_repo = session_repo
+        self.chunk_store = chunk_store
+        self.folder_stats = folder_stats or FolderStatsRepository()
+        self.usage = usage or StorageUsageRepository()
+        self.storage_repo = storage_repo or StorageRepository()
+        self.item_repo = item_repo or UploadFolderItemRepository()
+        self.folder_upload_repo = folder_upload_repo or UploadFolderRepository()
         self.chunk_repo = chunk_repo
         self.storage = storage
         self.serverwrap = serverwrap
@@ -47,6 +83,12 @@ class UploadServices:
         self.max_chunk = cfg.folder_max_chunk_bytes
         self.default_chunk = cfg.folder_default_chunk_bytes
         self.session_ttl_hours = cfg.folder_session_ttl_hours
+        self.spool_threshold = cfg.chunk_spool_threshold_bytes
+        self.sweep_batch = cfg.upload_sweep_batch
+        self.batch_max_bytes = cfg.upload_batch_max_bytes
+        self.batch_max_chunks = cfg.upload_batch_max_chunks
+        self.finalize_concurrency = cfg.finalize_concurrency
+        self.crypto = get_crypto_engine(serverwrap, cfg)
 
     def chunk_size(self, requested: Optional[int]) -> int:
         if requested is None:
@@ -59,14 +101,21 @@ class UploadServices:
         return (file_size + chunk_size - 1) // chunk_size
 
     def aad_bytes(self, upload:UploadSession, chunk_idx:int)->bytes:
-        enc_stream_id = str(upload.upload_id).encode("utf-8")
+        return self.c1_aad(upload.upload_id, chunk_idx, upload.chunk_size, upload.file_size, upload.file_type)
+
+    def member_aad(self, upload:UploadSession, item:UploadItems)->bytes:
+        # a packed file is chunk `pack_index` of the pack session's stream, bound to its own size/type
+        return self.c1_aad(upload.upload_id, item.pack_index, upload.chunk_size, item.file_size, item.file_type)
+
+    def c1_aad(self, upload_id:UUID, chunk_idx:int, chunk_size:int, file_size:int, file_type:str)->bytes:
+        enc_stream_id = str(upload_id).encode("utf-8")
         prefix = f"SD:C1|v{self.C1_SCHEMA_VERSION}|".encode("utf-8")
         sep = b"|"
 
         idx_be = struct.pack(">I", int(chunk_idx))          
-        cs_be  = struct.pack(">I", int(upload.chunk_size))    
-        fs_utf8 = str(int(upload.file_size)).encode("utf-8") #file_size
-        ft_utf8 = upload.file_type.encode("utf-8") #file_type
+        cs_be  = struct.pack(">I", int(chunk_size))    
+        fs_utf8 = str(int(file_size)).encode("utf-8") #file_size
+        ft_utf8 = file_type.encode("utf-8") #file_type
 
         return b"".join([prefix, enc_stream_id, sep, idx_be, cs_be, fs_utf8, sep, ft_utf8])
 
@@ -79,6 +128,9 @@ class UploadServices:
         return base64.b64encode(bytes(b)).decode("ascii") 
         
 
+    def bitmap_indices(self, total_chunks: int, bitmap: bytes) -> list[int]:
+        return [i for i in range(min(total_chunks, len(bitmap) * 8)) if bitmap[i // 8] & (1 << (i % 8))]
+
     async def init_session(self, session:AsyncSession,user_id:str,
                            file_name:str,file_size:int,file_type:str,
                            folder_id:Optional[int],chunk_size:Optional[int],replace_of_file_id:Optional[UUID] = None) -> UploadSession:
@@ -90,6 +142,10 @@ class UploadServices:
             folder_obj = await self.folder_repo.get_active_folder(session, user_id=user_id, folder_id=folder_id)
             if folder_obj is None:
                 raise FileNotFoundError("Folder not found.")
+
+        # quota is held from init, so parallel uploads can't all pass a check and overshoot together
+        if not await self.storage_repo.reserve(session, user_id, int(file_size)):
+            raise QuotaExceededError("Not enough storage for this upload.")
             
         upload = UploadSession(
             user_id = user_id,
@@ -101,13 +157,16 @@ class UploadServices:
             total_chunks=total_size,
             status="UPLOADING",
             replace_of_file_id=replace_of_file_id,
+            reserved_bytes=max(0, int(file_size)),
+            received_bitmap=UploadSession.empty_bitmap(total_size),
             expires_at=UploadSession.default_expiry(self.session_ttl_hours),
         )
         await self.session_repo.create_session(session, upload)
         logger.info("upload:init", extra={"user_id": user_id, "upload_id": str(upload.upload_id), "total_chunks": total_size})
         return upload
     
-    async def put_chunk(self, session:AsyncSession, user_id:str,upload_id:UUID,chunk_idx:int, ciphertxt:bytes, nonce_b64:str, tag_b64:str) -> Dict[str,Any]:
+    async def accepting_upload(self, session:AsyncSession, user_id:str, upload_id:UUID, chunk_idx:Optional[int]) -> UploadSession:
+        # chunk_idx=None: session checks only (batch uploads bound-check every package themselves)
         upload = await self.session_repo.get_session(session,user_id=user_id,upload_id=upload_id)
         if not upload:
             raise FileNotFoundError("File not Found.")
@@ -115,18 +174,14 @@ class UploadServices:
         if upload.status != "UPLOADING":
             raise UploadConflictError(f"Upload session not accepting chunks (status={upload.status})")
         
-        if chunk_idx < 0 or chunk_idx >= upload.total_chunks:
+        if chunk_idx is not None and (chunk_idx < 0 or chunk_idx >= upload.total_chunks):
             raise ValueError("Chunk idx is out of bound.")
         
-        if len(ciphertxt) > upload.chunk_size:
-            raise ValueError("Chunk is too large.")
-        
-        if ciphertxt is None or len(ciphertxt) == 0:
-            raise ValueError("Empty chunk body")
-        
         if datetime.utcnow() > upload.expires_at:
             raise UploadConflictError("Upload session expired.")
-        
+        return upload
+
+    def nonce_tag(self, nonce_b64:str, tag_b64:str) -> tuple[bytes, bytes]:
         try:
             nonce = base64.b64decode(nonce_b64)
             tag = base64.b64decode(tag_b64)
@@ -135,25 +190,97 @@ class UploadServices:
         
         if len(tag) not in (16,32):
             raise ValueError("Invalid tag length")
-        
-        aad = self.aad_bytes(upload,chunk_idx=chunk_idx)
-        sha_hash = hashlib.sha256(aad + nonce + ciphertxt + tag).hexdigest()
+        return nonce, tag
 
+    @staticmethod
+    def observe_put(mode:str, started:float, size:int) -> None:
+        # successful chunk uploads only; rejected ones would skew the throughput
+        CHUNK_PUT_SECONDS.observe(time.perf_counter() - started, mode)
+        CHUNK_PUT_BYTES.inc(mode, amount=size)
+
+    async def put_chunk(self, session:AsyncSession, user_id:str,upload_id:UUID,chunk_idx:int, ciphertxt:bytes, nonce_b64:str, tag_b64:str) -> Dict[str,Any]:
+        started = time.perf_counter()
+        upload = await self.accepting_upload(session, user_id, upload_id, chunk_idx)
+        if upload.is_pack:
+            raise ValueError("Pack sessions take chunks through the batch endpoint.")
+        
+        if len(ciphertxt) > upload.chunk_size:
+            raise ValueError("Chunk is too large.")
+        
+        if ciphertxt is None or len(ciphertxt) == 0:
+            raise ValueError("Empty chunk body")
+        
+        nonce, tag = self.nonce_tag(nonce_b64, tag_b64)
+        
+        h = hashlib.sha256(self.aad_bytes(upload,chunk_idx=chunk_idx))
+        h.update(nonce)
+        h.update(ciphertxt)
+        h.update(tag)
+        sha_hash = h.hexdigest()
+
+        header = encode_chunk_header(chunk_idx, nonce, tag, len(ciphertxt))
+        result = await self.store_chunk(
+            session, user_id, upload_id, chunk_idx, sha_hash, len(ciphertxt),
+            lambda: self.seal_package([header, ciphertxt], len(header) + len(ciphertxt)),
+        )
+        self.observe_put("single", started, len(ciphertxt))
+        return result
+
+    async def put_chunk_stream(self, session:AsyncSession, user_id:str, upload_id:UUID, chunk_idx:int,
+                               body:AsyncIterator[bytes], nonce_b64:str, tag_b64:str) -> Dict[str,Any]:
+        """
+        Streaming variant of put_chunk: the body is hashed as it arrives and spooled
+        to disk past `chunk_spool_threshold`, so the request never holds the whole
+        chunk plus a concatenated copy of it.
+        """
+        started = time.perf_counter()
+        upload = await self.accepting_upload(session, user_id, upload_id, chunk_idx)
+        if upload.is_pack:
+            raise ValueError("Pack sessions take chunks through the batch endpoint.")
+        nonce, tag = self.nonce_tag(nonce_b64, tag_b64)
+
+        prefix = self.aad_bytes(upload, chunk_idx=chunk_idx) + nonce
+        with ChunkIngest(max_bytes=upload.chunk_size, spool_threshold=self.spool_threshold, prefix=prefix) as ingest:
+            await ingest.consume(body)
+            if ingest.size == 0:
+                raise ValueError("Empty chunk body")
+
+            sha_hash = ingest.hexdigest(tag)
+            result = await self.store_chunk(
+                session, user_id, upload_id, chunk_idx, sha_hash, ingest.size,
+                lambda: self.seal_package(ingest.package_pieces(chunk_idx, nonce=nonce, tag=tag),
+                                          package_size(len(nonce), len(tag), ingest.size)),
+            )
+            self.observe_put("stream", started, ingest.size)
+            return result
+
+    def seal_package(self, pieces:Iterable[BytesLike], size:int) -> bytearray:
+        # worker thread: pieces may be read back from a spooled body, wrapping is AES-GCM
+        # straight into the stored blob's buffer (the package itself is never assembled)
+        return self.serverwrap.wrap_pieces(pieces, size, aad=self.serverwrap.AAD_WRAP)
+
+    async def store_chunk(self, session:AsyncSession, user_id:str, upload_id:UUID, chunk_idx:int, sha_hash:str,
+                          ct_len:int, seal:Callable[[], bytearray]) -> Dict[str,Any]:
         existing = await self.chunk_repo.get_chunk(session, upload_id, chunk_idx)
         if existing:
             if existing.sha256 == sha_hash:
                 return {"chunk_index": chunk_idx, "status": "duplicate-ok"}
             raise UploadConflictError("Chunk data mismatch for this index (restart upload)")
         
-        package = encode_chunk_package(chunk_idx, nonce=nonce, tag=tag, ciphertext=ciphertxt)
-        cipher2 = self.serverwrap.wrapper(package, aad=self.serverwrap.AAD_WRAP)
+        # identical receipt => identical package: reuse the stored object instead of writing it again
+        storageKey, stored_size, _ = await self.chunk_store.locate(
+            session, user_id, sha_hash, lambda: self.crypto.run(seal),
+        )
 
-        storageKey = await self.storage.save_chunk_c2(user_id=user_id,upload_id=str(upload_id),chunk_index=chunk_idx,sha256_hex=sha_hash,cipher2_bytes=cipher2)
+        return await self.record_chunk(session, user_id, upload_id, chunk_idx, sha_hash, ct_len, storageKey, (sha_hash, storageKey, stored_size))
 
+    async def record_chunk(self, session:AsyncSession, user_id:str, upload_id:UUID, chunk_idx:int, sha_hash:str,
+                           ct_len:int, storageKey:str, stored:Tuple[str, str, int]) -> Dict[str,Any]:
+        # stored: (sha256, storage_key, size) of the object row the receipt references (the chunk's own, or its pack)
         obj = UploadChunk(
             upload_id = upload_id,
             chunk_index = chunk_idx,
-            total_size = len(ciphertxt),
+            total_size = ct_len,
             sha256 = sha_hash,
             storage_key = storageKey,
             created_at = datetime.utcnow() 
@@ -162,6 +289,8 @@ class UploadServices:
         try:
             async with session.begin_nested():
                 await self.chunk_repo.insert(session, obj)
+                await self.chunk_store.retain(session, user_id, *stored)
+                await self.session_repo.mark_received(session, upload_id, chunk_idx)
         except IntegrityError:
             existing2 = await self.chunk_repo.get_chunk(session, upload_id, chunk_idx)
             if existing2 and existing2.sha256 == sha_hash:
@@ -169,14 +298,157 @@ class UploadServices:
             raise UploadConflictError("Chunk index already exists with different data")
 
         return {"chunk_index": chunk_idx, "status": "stored"}
+
+    async def read_batch(self, body:AsyncIterator[bytes]) -> BytesLike:
+        """
+        The batch body for in-place parsing: in memory up to the spool threshold, otherwise
+        spooled to a temp file (written off the event loop) and mapped read-only, so a
+        concurrent batch doesn't pin up to batch_max_bytes of heap.
+        """
+        with ChunkIngest(max_bytes=self.batch_max_bytes, spool_threshold=self.spool_threshold,
+                         digest=False, too_large="Batch body is too large.") as ingest:
+            await ingest.consume(body)
+            return await ingest.contents()
+
+    def batch_packages(self, upload:UploadSession, blob:BytesLike) -> List[Tuple[DecodedChunkPackage, memoryview]]:
+        # every package is checked before anything is stored, so a bad batch writes nothing
+        packages = []
+        seen = set()
+        for pkg, framed in iter_chunk_packages(blob):
+            idx = pkg.chunk_index
+            if len(packages) >= self.batch_max_chunks:
+                raise ValueError(f"Too many chunks in one batch (max {self.batch_max_chunks}).")
+            if idx >= upload.total_chunks:
+                raise ValueError(f"Chunk idx {idx} is out of bound.")
+            if idx in seen:
+                raise ValueError(f"Chunk idx {idx} appears twice in the batch.")
+            if len(pkg.ciphertext) == 0:
+                raise ValueError(f"Empty chunk body (chunk {idx}).")
+            if len(pkg.ciphertext) > upload.chunk_size:
+                raise ValueError(f"Chunk {idx} is too large.")
+            if len(pkg.tag) not in (16, 32):
+                raise ValueError(f"Invalid tag length (chunk {idx}).")
+            seen.add(idx)
+            packages.append((pkg, framed))
+        if not packages:
+            raise ValueError("Empty batch body")
+        return packages
+
+    def receipt_sha(self, aad:bytes, pkg:DecodedChunkPackage) -> str:
+        h = hashlib.sha256(aad)
+        h.update(pkg.nonce)
+        h.update(pkg.ciphertext)
+        h.update(pkg.tag)
+        return h.hexdigest()
+
+    async def put_chunk_batch(self, session:AsyncSession, user_id:str, upload_id:UUID, body:AsyncIterator[bytes]) -> Dict[str,Any]:
+        """
+        Several chunks in one request: the body is back-to-back SDC1 packages (the same
+        framing the server stores, so each package is wrapped as received). One session
+        check, one receipt lookup, one object lookup; hashing and wrapping run on the
+        crypto pool and object writes overlap; receipts, object references and the
+        received bitmap are written in one nested transaction.
+        For a pack session every package is one small file (chunk_index = pack_index) and
+        the new ones are written together as a single pack object.
+        """
+        started = time.perf_counter()
+        upload = await self.accepting_upload(session, user_id, upload_id, None)
+        blob = await self.read_batch(body)
+        packages = self.batch_packages(upload, blob)
+        idxs = [pkg.chunk_index for pkg, _ in packages]
+
+        if upload.is_pack:
+            members = await self.item_repo.pack_members(session, user_id, upload_id, idxs)
+            for idx in idxs:
+                if idx not in members:
+                    raise ValueError(f"Chunk idx {idx} is not a file of this pack.")
+            aads = [self.member_aad(upload, members[idx]) for idx in idxs]
+        else:
+            aads = [self.aad_bytes(upload, idx) for idx in idxs]
+
+        shas = await self.crypto.map(lambda a: self.receipt_sha(a[0], a[1][0]), list(zip(aads, packages)))
+        existing = await self.chunk_repo.sha_by_index(session, upload_id, idxs)
+
+        statuses: Dict[int, str] = {}
+        fresh: List[Tuple[DecodedChunkPackage, memoryview, str]] = []
+        for (pkg, framed), sha in zip(packages, shas):
+            prev = existing.get(pkg.chunk_index)
+            if prev is None:
+                fresh.append((pkg, framed, sha))
+            elif prev == sha:
+                statuses[pkg.chunk_index] = "duplicate-ok"
+            else:
+                raise UploadConflictError(f"Chunk data mismatch for index {pkg.chunk_index} (restart upload)")
+
+        if upload.is_pack:
+            placed = await self.place_packed(user_id, fresh)
+        else:
+            placed = await self.place_objects(session, user_id, fresh)
+
+        now = datetime.utcnow()
+        rows = [
+            {"upload_id": upload_id, "chunk_index": pkg.chunk_index, "total_size": len(pkg.ciphertext),
+             "sha256": sha, "storage_key": placed[sha][0], "created_at": now}
+            for pkg, _, sha in fresh
+        ]
+        try:
+            async with session.begin_nested():
+                await self.chunk_repo.insert_many(session, rows)
+                await self.chunk_store.retain_objects(session, user_id, [placed[sha][1] for _, _, sha in fresh])
+                await self.session_repo.mark_received_many(session, upload_id, [pkg.chunk_index for pkg, _, _ in fresh])
+            for pkg, _, _ in fresh:
+                statuses[pkg.chunk_index] = "stored"
+        except IntegrityError:
+            # another request stored some of these indices meanwhile: settle them one by one
+            for pkg, _, sha in fresh:
+                key, stored = placed[sha]
+                res = await self.record_chunk(session, user_id, upload_id, pkg.chunk_index, sha, len(pkg.ciphertext), key, stored)
+                statuses[pkg.chunk_index] = res["status"]
+
+        chunks = [{"chunk_index": pkg.chunk_index, "status": statuses[pkg.chunk_index]} for pkg, _ in packages]
+        stored = sum(1 for c in chunks if c["status"] == "stored")
+        logger.info("upload:batch", extra={"user_id": user_id, "upload_id": str(upload_id), "chunks": len(chunks), "stored": stored})
+        self.observe_put("batch", started, len(blob))
+        return {"chunks": chunks, "stored": stored, "duplicates": len(chunks) - stored}
     
+    async def place_objects(self, session:AsyncSession, user_id:str,
+                            fresh:List[Tuple[DecodedChunkPackage, memoryview, str]]) -> Dict[str, Tuple[str, Tuple[str, str, int]]]:
+        # receipt sha -> (storage_key, object to reference): one content-addressed object per chunk
+        located = await self.chunk_store.locate_many(session, user_id, {
+            sha: (lambda framed=framed: self.crypto.run(self.seal_package, [framed], len(framed)))
+            for _, framed, sha in fresh
+        })
+        return {sha: (key, (sha, key, size)) for sha, (key, size, _) in located.items()}
+
+    async def place_packed(self, user_id:str,
+                           fresh:List[Tuple[DecodedChunkPackage, memoryview, str]]) -> Dict[str, Tuple[str, Tuple[str, str, int]]]:
+        # receipt sha -> (member key, pack object): every member is wrapped on its own, then all go into one file
+        if not fresh:
+            return {}
+        sealed = await self.crypto.seal_many([framed for _, framed, _ in fresh], aad=self.serverwrap.AAD_WRAP)
+        pack_sha = await self.crypto.run(self.pack_digest, sealed)
+        pack_key, pack_size, keys = await self.chunk_store.write_pack(user_id, pack_sha, sealed)
+        return {sha: (key, (pack_sha, pack_key, pack_size)) for (_, _, sha), key in zip(fresh, keys)}
+
+    @staticmethod
+    def pack_digest(parts:List[bytes]) -> str:
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(part)
+        return h.hexdigest()
+
     async def status(self, session: AsyncSession, user_id: str, upload_id: UUID) -> Dict[str, Any]:
-        upload = await self.session_repo.get_session(session, user_id, upload_id)
+        upload = await self.session_repo.get_progress(session, user_id, upload_id)
         if not upload:
             raise FileNotFoundError("Upload session not found")
 
-        indices = await self.chunk_repo.last_indices(session, upload_id)
-        received_count = len(indices)
+        bitmap = upload.received_bitmap
+        if bitmap is not None:
+            received_count = int(upload.received_count)
+        else:
+            # session created before the bitmap existed: rebuild it from the receipts
+            indices = await self.chunk_repo.last_indices(session, upload_id)
+            received_count = len(indices)
 
         res: Dict[str, Any] = {
             "upload_id": upload_id,
@@ -187,7 +459,9 @@ class UploadServices:
         }
 
         if upload.total_chunks <= 5000:
-            res["received_indices"] = indices
+            res["received_indices"] = self.bitmap_indices(upload.total_chunks, bitmap) if bitmap is not None else indices
+        elif bitmap is not None:
+            res["received_bitmap_b64"] = base64.b64encode(bytes(bitmap)).decode("ascii")
         else:
             res["received_bitmap_b64"] = self.bitmap_b64(upload.total_chunks, indices)
 
@@ -201,8 +475,9 @@ class UploadServices:
         if not upload:
             raise FileNotFoundError("Upload session not found")
 
-        if datetime.utcnow() > upload.expires_at:
-            raise UploadConflictError("Upload session expired")
+        if upload.is_pack:
+            raise ValueError("Pack sessions are finalized with finalize-pack.")
+        self.open_for_finalize(upload)
 
         replace_id = replace_of_file_id or getattr(upload, "replace_of_file_id", None)
 
@@ -240,11 +515,15 @@ class UploadServices:
             "file_size": upload.file_size,
             "file_type": final_type,
             "integrity_hash": integrity_hash,
-            "chunks": [{"i": r.chunk_index, "k": r.storage_key, "h": r.sha256, "s": r.size} for r in receipts],
+            "chunks": [{"i": r.chunk_index, "k": r.storage_key, "h": r.sha256, "s": r.total_size} for r in receipts],
         }
 
         async with session.begin_nested():
-            await self.session_repo.set_status(session, user_id=user_id, upload_id=upload_id, status="FINALIZING")
+            if not await self.session_repo.transition(session, user_id, upload_id, "UPLOADING", "FINALIZING"):
+                raise UploadConflictError("Upload session is no longer open")
+            # the reservation turns into real usage below (usage.apply moves storage_used)
+            reserved = await self.session_repo.take_reservation(session, user_id, upload_id)
+            await self.storage_repo.release(session, user_id, reserved)
 
             if replace_id:
                 file_obj = await self.file_repo.get_active_file(session,user_id=user_id,file_id=replace_id)
@@ -253,8 +532,16 @@ class UploadServices:
 
                 curr_ver_num = int(getattr(file_obj, "version_number", 1) or 1)
                 new_version_number = curr_ver_num + 1
+                replaced = (file_obj.folder_id, -int(file_obj.file_size or 0), -1)
+                replaced_usage = StorageUsageRepository.deltas([file_obj], ACTIVE, -1)
 
-                manifest_path = await self.storage.save_blueprint(user_id=user_id, file_id=str(file_obj.file_id), manifest_json=json.dumps(manifest))
+                # the live manifest is replaced: drop its chunk references (the previous content stays
+                # referenced through its own version manifest) and write the new one beside it, so a
+                # rollback leaves the row on an intact manifest; the old file goes after commit
+                await self.chunk_store.release_manifest(session, user_id, file_obj.file_path)
+                manifest_path = await self.chunk_store.write_manifest(user_id, manifest, self.chunk_store.live_manifest_name(file_obj.file_id))
+                version_path = await self.chunk_store.copy_manifest(session, user_id, manifest, f"{file_obj.file_id}.v{new_version_number}")
+                self.chunk_store.swap_manifest(session, file_obj.file_path, manifest_path)
 
                 await self.file_repo.update_file_after_upload_complete(
                         session,
@@ -271,14 +558,18 @@ class UploadServices:
                     )
 
                 ver = await self.ver_repo.create_version(session,
+                                               user_id=user_id,
                                                original_file_id=file_obj.file_id,
-                                               file_name=file_obj.file_name,
-                                               file_path=file_obj.file_path,file_type=file_obj.file_type,
-                                               integrity_hash=file_obj.integrity_hash,
-                                               encryption_metadata=file_obj.encryption_metadata,
+                                               file_name=final_name,
+                                               file_path=version_path,file_type=final_type,
+                                               file_size=upload.file_size,
+                                               integrity_hash=integrity_hash,
+                                               encryption_metadata=json.dumps(meta),
                                                version_number=new_version_number)
 
                 await self.file_repo.set_head_version(session,file_obj=file_obj,version_id=ver.version_id)
+                await self.folder_stats.apply(session, user_id, [replaced, (final_folder_id, int(upload.file_size), 1)])
+                await self.usage.apply(session, user_id, replaced_usage + [(ACTIVE, final_type, int(upload.file_size), 1)])
                 await self.session_repo.set_status(session, user_id, upload_id, "COMPLETE")
 
                 try:
@@ -292,37 +583,11 @@ class UploadServices:
                 return file_obj.file_id, ver.version_id, new_version_number, integrity_hash
             
             else:
-                file_obj = await self.file_repo.create_file(
-                        session,
-                        user_id=user_id,
-                        file_name=final_name,
-                        file_path="",  # set after blueprint write
-                        file_size=upload.file_size,
-                        file_type=final_type,
-                        folder_id=final_folder_id,
-                        integrity_hash=integrity_hash,
-                        encryption_metadata=json.dumps(meta),
-                        is_encrypted=True,
-                        version_number=1,
+                file_obj, ver = await self.create_uploaded_file(
+                    session, user_id, final_name, final_type, final_folder_id, int(upload.file_size), integrity_hash, meta, manifest,
                 )
-
-                manifest_path = await self.storage.save_blueprint(user_id=user_id, file_id=str(file_obj.file_id), manifest_json=json.dumps(manifest))
-                await self.file_repo.set_file_path(session, file_obj, file_path=manifest_path)
-
-                ver = await self.ver_repo.create_version(
-                        session,
-                        user_id=user_id,
-                        original_file_id=file_obj.file_id,
-                        file_name=final_name,
-                        file_path=manifest_path,
-                        file_type=final_type,
-                        file_size=upload.file_size,
-                        integrity_hash=integrity_hash,
-                        encryption_metadata=json.dumps(meta),
-                        version_number=1,
-                )
-
-                await self.file_repo.set_head_version(session, file_obj, version_id=ver.version_id)
+                await self.folder_stats.apply(session, user_id, [(final_folder_id, int(upload.file_size), 1)])
+                await self.usage.apply(session, user_id, [(ACTIVE, final_type, int(upload.file_size), 1)])
                 await self.session_repo.set_status(session, user_id, upload_id, "COMPLETE")
 
             try:
@@ -333,4 +598,304 @@ class UploadServices:
             except Exception:
                 logger.exception("upload:finalize websocket failed", extra={"user_id": user_id})
 
-            return file_obj.file_id, ver.version_id, 1, integrity_hash
\ No newline at end of file
+            return file_obj.file_id, ver.version_id, 1, integrity_hash
+
+    async def create_uploaded_file(self, session:AsyncSession, user_id:str, file_name:str, file_type:str, folder_id:Optional[int],
+                                   file_size:int, integrity_hash:str, meta:Dict[str, Any], manifest:Dict[str, Any]):
+        # files row + live manifest + v1 snapshot (its own manifest copy) for a finished upload
+        file_obj = await self.file_repo.create_file(
+                session,
+                user_id=user_id,
+                file_name=file_name,
+                file_path="",  # set after blueprint write
+                file_size=file_size,
+                file_type=file_type,
+                folder_id=folder_id,
+                integrity_hash=integrity_hash,
+                encryption_metadata=json.dumps(meta),
+                is_encrypted=True,
+                version_number=1,
+        )
+
+        manifest_path = await self.chunk_store.write_manifest(user_id, manifest, str(file_obj.file_id))
+        await self.file_repo.set_file_path(session, file_obj, file_path=manifest_path)
+        version_path = await self.chunk_store.copy_manifest(session, user_id, manifest, f"{file_obj.file_id}.v1")
+
+        ver = await self.ver_repo.create_version(
+                session,
+                user_id=user_id,
+                original_file_id=file_obj.file_id,
+                file_name=file_name,
+                file_path=version_path,
+                file_type=file_type,
+                file_size=file_size,
+                integrity_hash=integrity_hash,
+                encryption_metadata=json.dumps(meta),
+                version_number=1,
+        )
+
+        await self.file_repo.set_head_version(session, file_obj, version_id=ver.version_id)
+        return file_obj, ver
+
+    async def create_uploaded_files(self, session:AsyncSession, user_id:str, files:List[FinishedFile]) -> List[Dict[str, Any]]:
+        """
+        create_uploaded_file() for many finished uploads: file ids are chosen up front so every
+        live and v1 manifest is written concurrently, then files and versions go in with one
+        multi-row INSERT each and the heads are linked with one UPDATE.
+        """
+        planned: List[Tuple[UUID, FinishedFile, str, str, Dict[str, Any]]] = []
+        for f in files:
+            integrity_hash = hashlib.sha256("".join(r.sha256 for r in f.receipts).encode("utf-8")).hexdigest()
+            meta: Dict[str, Any] = {
+                "wrapped_fk_b64": f.wrapped_fk_b64,
+                "upload_id": str(f.upload.upload_id),
+                "chunk_size": f.upload.chunk_size,
+                "total_chunks": len(f.receipts),
+                "aad_spec": "upload_id|chunk_index|chunk_size|file_size|file_type",
+            }
+            if f.pack_index is not None:
+                meta["pack_index"] = f.pack_index
+            if f.encryption_metadata:
+                meta.update(f.encryption_metadata)
+
+            manifest = {
+                "upload_id": str(f.upload.upload_id),
+                "chunk_size": f.upload.chunk_size,
+                "total_chunks": len(f.receipts),
+                "file_size": f.file_size,
+                "file_type": f.file_type,
+                "integrity_hash": integrity_hash,
+                "chunks": [{"i": r.chunk_index, "k": r.storage_key, "h": r.sha256, "s": r.total_size} for r in f.receipts],
+            }
+            planned.append((uuid4(), f, integrity_hash, json.dumps(meta), manifest))
+
+        # live manifests take over the receipts' references; the v1 snapshots take their own
+        live_keys = await self.chunk_store.save_manifests(user_id, [(m, str(fid)) for fid, _, _, _, m in planned], self.finalize_concurrency)
+        version_keys = await self.chunk_store.copy_manifests(session, user_id, [(m, f"{fid}.v1") for fid, _, _, _, m in planned], self.finalize_concurrency)
+
+        await self.file_repo.create_files(session, user_id, [
+            {"file_id": fid, "file_name": f.file_name, "file_path": live_key, "file_size": f.file_size, "file_type": f.file_type,
+             "folder_id": f.folder_id, "integrity_hash": integrity_hash, "encryption_metadata": meta}
+            for (fid, f, integrity_hash, meta, _), live_key in zip(planned, live_keys)
+        ])
+        versions = await self.ver_repo.create_versions(session, user_id, [
+            {"original_file_id": fid, "file_name": f.file_name, "file_path": version_key, "file_size": f.file_size, "file_type": f.file_type,
+             "integrity_hash": integrity_hash, "encryption_metadata": meta, "version_number": 1}
+            for (fid, f, integrity_hash, meta, _), version_key in zip(planned, version_keys)
+        ])
+        await self.file_repo.set_head_versions(session, user_id, versions)
+
+        return [{"upload_id": f.upload.upload_id, "pack_index": f.pack_index, "file_id": fid, "version_id": versions[fid],
+                 "file_name": f.file_name, "integrity_hash": integrity_hash}
+                for fid, f, integrity_hash, _, _ in planned]
+
+    def open_for_finalize(self, upload:UploadSession) -> None:
+        if upload.status != "UPLOADING":
+            raise UploadConflictError(f"Upload session cannot be finalized (status={upload.status})")
+        if datetime.utcnow() > upload.expires_at:
+            raise UploadConflictError("Upload session expired")
+
+    async def finish_files(self, session:AsyncSession, user_id:str, uploads:List[UploadSession], files:List[FinishedFile]) -> List[Dict[str, Any]]:
+        """
+        Claims `uploads` (UPLOADING -> FINALIZING, all or none), converts their reservations and
+        creates `files`; counters are applied once for the whole set. Caller holds the transaction.
+        """
+        folder_ids = sorted({int(f.folder_id) for f in files if f.folder_id is not None})
+        if folder_ids:
+            folders = await self.folder_repo.get_active_folders_by_ids(session, user_id, folder_ids)
+            if len(folders) != len(folder_ids):
+                raise FileNotFoundError("Folder not found")
+
+        upload_ids = [u.upload_id for u in uploads]
+        async with session.begin_nested():
+            if await self.session_repo.transition_many(session, user_id, upload_ids, "UPLOADING", "FINALIZING") != len(upload_ids):
+                raise UploadConflictError("Upload session is no longer open")
+            reserved = await self.session_repo.take_reservations(session, user_id, upload_ids)
+            await self.storage_repo.release(session, user_id, reserved)
+
+            out = await self.create_uploaded_files(session, user_id, files)
+
+            await self.folder_stats.apply(session, user_id, [(f.folder_id, f.file_size, 1) for f in files])
+            await self.usage.apply(session, user_id, StorageUsageRepository.deltas(files, ACTIVE, +1))
+            await self.session_repo.set_status_many(session, user_id, upload_ids, "COMPLETE")
+
+        try:
+            await websocket_manager.broadcast_to_user(
+                user_id,
+                {"event": "files-uploaded", "data": [{"file_id": str(o["file_id"]), "file_name": o["file_name"]} for o in out]},
+            )
+        except Exception:
+            logger.exception("upload:finalize websocket failed", extra={"user_id": user_id})
+        return out
+
+    async def finalize_pack(self, session:AsyncSession, user_id:str, upload_id:UUID, files:List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Finalizes every file of a pack session at once. `files` gives each member's pack_index,
+        wrapped_fk_b64 and optional encryption_metadata. Each member becomes its own file whose
+        one-chunk manifest points into the pack object.
+        """
+        upload = await self.session_repo.get_session(session, user_id=user_id, upload_id=upload_id)
+        if not upload:
+            raise FileNotFoundError("Upload session not found")
+
+        if not upload.is_pack:
+            raise ValueError("Not a pack session.")
+        self.open_for_finalize(upload)
+
+        members = await self.item_repo.pack_members(session, user_id, upload_id)
+        requested: Dict[int, Dict[str, Any]] = {}
+        for f in files:
+            idx = int(f["pack_index"])
+            if idx not in members:
+                raise ValueError(f"pack_index {idx} is not a file of this pack.")
+            if idx in requested:
+                raise ValueError(f"pack_index {idx} listed twice.")
+            requested[idx] = f
+        if len(requested) != len(members):
+            raise ValueError("All files of a pack are finalized together.")
+
+        receipts = await self.chunk_repo.list_receipts_ordered(session, upload_id)
+        if len(receipts) != upload.total_chunks:
+            raise UploadConflictError("Not all chunks received")
+
+        finished = [self.finished_file(upload, [r], members[r.chunk_index], requested[r.chunk_index]) for r in receipts]
+        out = await self.finish_files(session, user_id, [upload], finished)
+
+        logger.info("upload:finalize_pack", extra={"user_id": user_id, "upload_id": str(upload_id), "files": len(out)})
+        return out
+
+    @staticmethod
+    def finished_file(upload:UploadSession, receipts:List[UploadChunk], item:UploadItems, req:Dict[str, Any]) -> FinishedFile:
+        return FinishedFile(
+            upload=upload,
+            receipts=receipts,
+            file_name=item.file_name,
+            file_type=item.file_type,
+            folder_id=item.folder_id,
+            file_size=int(item.file_size),
+            wrapped_fk_b64=req["wrapped_fk_b64"],
+            encryption_metadata=req.get("encryption_metadata"),
+            pack_index=item.pack_index,
+        )
+
+    async def finalize_folder(self, session:AsyncSession, user_id:str, folder_upload_id:UUID, files:List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Bulk finalize for a folder upload. `files` names items by upload_id (plus pack_index for
+        packed files) with their wrapped_fk_b64 / encryption_metadata; any subset of the open items
+        may be sent, but a pack's members always go together. Receipts of every listed session are
+        checked with one query, and all files are created in one transaction with one event.
+        The folder upload turns COMPLETE once all of its items are.
+        """
+        folder_upload = await self.folder_upload_repo.get_folder(session, user_id=user_id, folder_upload_id=folder_upload_id)
+        if not folder_upload:
+            raise FileNotFoundError("Folder upload session not found")
+        if folder_upload.status != "UPLOADING":
+            raise UploadConflictError(f"Folder upload cannot be finalized (status={folder_upload.status})")
+        if datetime.utcnow() > folder_upload.expires_at:
+            raise UploadConflictError("Folder upload expired")
+
+        items = await self.item_repo.items_of(session, user_id, folder_upload_id)
+        by_key = {(it.upload_id, it.pack_index): it for it in items if it.upload_id is not None}
+
+        requested: Dict[Tuple[UUID, Optional[int]], Dict[str, Any]] = {}
+        for f in files:
+            pack_index = f.get("pack_index")
+            key = (UUID(str(f["upload_id"])), int(pack_index) if pack_index is not None else None)
+            if key not in by_key:
+                raise ValueError(f"{key[0]} is not a file of this folder upload.")
+            if key in requested:
+                raise ValueError(f"{key[0]} listed twice.")
+            requested[key] = f
+        if not requested:
+            raise ValueError("No files to finalize.")
+
+        upload_ids = list(dict.fromkeys(uid for uid, _ in requested))
+        uploads = await self.session_repo.get_sessions(session, user_id, upload_ids)
+        if len(uploads) != len(upload_ids):
+            raise FileNotFoundError("Upload session not found")
+        for upload in uploads.values():
+            self.open_for_finalize(upload)
+            if upload.is_pack:
+                members = sum(1 for uid, idx in by_key if uid == upload.upload_id)
+                sent = sum(1 for uid, idx in requested if uid == upload.upload_id)
+                if members != sent:
+                    raise ValueError("All files of a pack are finalized together.")
+
+        receipts = await self.chunk_repo.receipts_for_uploads(session, upload_ids)
+        finished: List[FinishedFile] = []
+        for (upload_id, pack_index), req in requested.items():
+            upload = uploads[upload_id]
+            got = receipts[upload_id]
+            if len(got) != upload.total_chunks:
+                raise UploadConflictError(f"Not all chunks received ({by_key[(upload_id, pack_index)].rel_path})")
+            if pack_index is not None:
+                got = [r for r in got if r.chunk_index == pack_index]
+            finished.append(self.finished_file(upload, got, by_key[(upload_id, pack_index)], req))
+
+        out = await self.finish_files(session, user_id, list(uploads.values()), finished)
+
+        completed = await self.item_repo.complete(session, user_id, folder_upload_id)
+        folder_status = folder_upload.status
+        if completed >= int(folder_upload.total_files):
+            await self.folder_upload_repo.set_status(session, user_id, "COMPLETE", folder_upload_id)
+            folder_status = "COMPLETE"
+
+        logger.info("upload:finalize_folder", extra={"user_id": user_id, "folder_upload_id": str(folder_upload_id),
+                                                     "files": len(out), "sessions": len(upload_ids)})
+        return {"folder_upload_id": folder_upload_id, "status": folder_status, "total_files": int(folder_upload.total_files),
+                "completed_files": int(completed), "files": out}
+
+    async def discard(self, session:AsyncSession, upload:UploadSession, status:str) -> Optional[int]:
+        """
+        Ends an unfinished session: releases its quota reservation and the chunk references
+        its receipts hold (the chunk GC reclaims objects nothing else uses). Returns bytes
+        released, or None when finalize/abort/expiry already claimed the session.
+        """
+        if not await self.session_repo.transition(session, upload.user_id, upload.upload_id, "UPLOADING", status):
+            return None
+
+        reserved = await self.session_repo.take_reservation(session, upload.user_id, upload.upload_id)
+        await self.storage_repo.release(session, upload.user_id, reserved)
+
+        receipts = await self.chunk_repo.delete_receipts(session, upload.upload_id)
+        if receipts:
+            await self.chunk_store.release_many(session, upload.user_id, [ChunkStoreService.object_sha(sha, key) for sha, key in receipts])
+        return reserved
+
+    async def abort(self, session:AsyncSession, user_id:str, upload_id:UUID) -> int:
+        upload = await self.session_repo.get_session(session, user_id=user_id, upload_id=upload_id)
+        if not upload:
+            raise FileNotFoundError("Upload session not found")
+        if upload.status == "ABORTED":
+            return 0
+        if upload.status != "UPLOADING":
+            raise UploadConflictError(f"Upload session cannot be aborted (status={upload.status})")
+
+        released = await self.discard(session, upload, "ABORTED")
+        if released is None:
+            raise UploadConflictError("Upload session is no longer open")
+        logger.info("upload:abort", extra={"user_id": user_id, "upload_id": str(upload_id), "released": released})
+        return released
+
+    async def expire_sessions(self, session:AsyncSession) -> int:
+        async with session.begin():
+            uploads = await self.session_repo.list_expired(session, datetime.utcnow(), self.sweep_batch)
+            for upload in uploads:
+                await self.discard(session, upload, "EXPIRED")
+        if uploads:
+            logger.info("upload:expired", extra={"sessions": len(uploads)})
+        return len(uploads)
+
+
+async def run_upload_expiry_loop(service: UploadServices, session_factory, interval_seconds: int) -> None:
+    while True:
+        try:
+            async with session_factory() as session:
+                expired = await service.expire_sessions(session)
+            if expired >= service.sweep_batch:
+                continue  # backlog: go again without sleeping
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("upload:expiry sweep failed")
+        await asyncio.sleep(interval_seconds)
@@ -4,15 +4,18 @@ import os
 import shutil
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 from uuid import UUID
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.repositories.file_repository import FileRepository
 from app.repositories.version_repository import VersionRepository
+from app.repositories.folder_stats_repository import FolderStatsRepository
+from app.repositories.storage_usage_repository import StorageUsageRepository, ACTIVE
 from app.security.path_sanitizer import safe_path_join, UnsafePathError
 from app.services.preview_services import PreviewService
+from app.services.chunk_store_service import ChunkStoreService
 
 logger = logging.getLogger(__name__)
 
@@ -41,9 +44,17 @@ class VersionItem:
     created_at: str
 
 class VersionService:
-    def __init__(self,file_repo : FileRepository, ver_repo:VersionRepository):
+    def __init__(self,file_repo : FileRepository, ver_repo:VersionRepository, chunk_store: Optional[ChunkStoreService] = None,
+                 folder_stats: Optional[FolderStatsRepository] = None, usage: Optional[StorageUsageRepository] = None):
         self.file_repo = file_repo
         self.ver_repo = ver_repo
+        self.chunk_store = chunk_store
+        self.folder_stats = folder_stats or FolderStatsRepository()
+        self.usage = usage or StorageUsageRepository()
+
+    def is_manifest(self, file_path:str) -> bool:
+        # chunked uploads: file_path is a blueprint manifest, versions are manifest copies (no chunk bytes copied)
+        return self.chunk_store is not None and self.chunk_store.is_manifest_key(file_path)
 
     def _version_blob_path(self, *, user_id: str, file_id: UUID, version_id: int) -> Path:
         # versions/<user_id>/<file_id>/<version_id>.enc
@@ -75,29 +86,30 @@ class VersionService:
         if not file:
             raise LookupError("File not Found.")
         
-        live_file_cipher_path = PreviewService.resolve_path(UPLOAD_ROOT,file.file_path)
-        if not live_file_cipher_path:
-            raise FileNotFoundError(f"Live ciphertext missing: {live_file_cipher_path}")
-        
-        fpath = str(self._version_blob_path(user_id=user_id,file_id=file_id,version_id=0))
-        entry = self.ver_repo.create_version(
+        entry = await self.ver_repo.create_version(
             session,
             user_id=user_id,
             original_file_id=file_id,
             file_name=file.file_name,
-            file_path=fpath,
+            file_path="",  # set below, needs version_id
             file_type=file.file_type,
             file_size=int(file.file_size),
-            integrity_hash=file.integrity_hash
+            integrity_hash=file.integrity_hash,
+            encryption_metadata=file.encryption_metadata,
         )
-        
-        await session.flush()
         version_id = int(entry.version_id)
-        version_blob_path = self._version_blob_path(user_id=user_id, file_id=file_id, version_id=version_id)
 
-        await copy_atomic(live_file_cipher_path, version_blob_path)
+        if self.is_manifest(file.file_path):
+            entry.file_path = await self.chunk_store.clone_manifest(session, user_id, file.file_path, f"{file_id}.s{version_id}")
+        else:
+            live_file_cipher_path = PreviewService.resolve_path(UPLOAD_ROOT,file.file_path)
+            if not live_file_cipher_path.exists():
+                raise FileNotFoundError(f"Live ciphertext missing: {live_file_cipher_path}")
+
+            version_blob_path = self._version_blob_path(user_id=user_id, file_id=file_id, version_id=version_id)
+            await copy_atomic(live_file_cipher_path, version_blob_path)
+            entry.file_path = str(version_blob_path)
 
-        entry.file_path = str(version_blob_path)
         session.add(entry)
         return version_id
 
@@ -112,21 +124,34 @@ class VersionService:
         
         snapshot_version_id = await self.snapshot_of_current_live_file(session, user_id=user_id, file_id=file_id)
 
-        version_file_path = PreviewService.resolve_path(VERSIONS_ROOT,ver_file.file_path)
-        if not version_file_path.exists():
-            raise FileNotFoundError(f"Version of this file is not exist : {version_file_path}")
-        
-        live_file_cipher_path = PreviewService.resolve_path(UPLOAD_ROOT,file.file_path)
-        if not live_file_cipher_path.parent.exists():
-            live_file_cipher_path.parent.mkdir(parents=True, exist_ok=True)
-
-        await copy_atomic(version_file_path,live_file_cipher_path)
-
+        if self.is_manifest(ver_file.file_path):
+            # live manifest now lives on in the snapshot copy; replace it with a copy of the version's
+            await self.chunk_store.release_manifest(session, user_id, file.file_path)
+            live_path = await self.chunk_store.clone_manifest(session, user_id, ver_file.file_path, self.chunk_store.live_manifest_name(file_id))
+            self.chunk_store.swap_manifest(session, file.file_path, live_path)
+            file.file_path = live_path
+        else:
+            version_file_path = PreviewService.resolve_path(VERSIONS_ROOT,ver_file.file_path)
+            if not version_file_path.exists():
+                raise FileNotFoundError(f"Version of this file is not exist : {version_file_path}")
+            
+            live_file_cipher_path = PreviewService.resolve_path(UPLOAD_ROOT,file.file_path)
+            if not live_file_cipher_path.parent.exists():
+                live_file_cipher_path.parent.mkdir(parents=True, exist_ok=True)
+
+            await copy_atomic(version_file_path,live_file_cipher_path)
+
+        size_delta = int(ver_file.file_size or 0) - int(file.file_size or 0)
+        usage = StorageUsageRepository.deltas([file], ACTIVE, -1) + StorageUsageRepository.deltas([ver_file], ACTIVE, +1)
         file.file_name = ver_file.file_name
         file.file_size = ver_file.file_size
         file.file_type = ver_file.file_type
         file.integrity_hash = ver_file.integrity_hash
         session.add(file)
+        if not file.is_deleted:
+            # a trashed file's bin entry keeps the size it was trashed with
+            await self.folder_stats.apply(session, user_id, [(file.folder_id, size_delta, 0)])
+            await self.usage.apply(session, user_id, usage)
 
         return {
             "restored": True,
@@ -144,16 +169,19 @@ class VersionService:
         if not ver_file:
             raise LookupError("Version Of File not Found.")
         
-        version_file_path = PreviewService.resolve_path(VERSIONS_ROOT,ver_file.file_path)
-        try:
-            await remove_file(version_file_path)
-        except UnsafePathError:
-            raise
-        except Exception:
-            logger.exception("Failed removing version blob", extra={"file_id": str(file_id), "version_id": version_id})
+        if self.is_manifest(ver_file.file_path):
+            await self.chunk_store.discard_manifest(session, user_id, ver_file.file_path)
+        else:
+            version_file_path = PreviewService.resolve_path(VERSIONS_ROOT,ver_file.file_path)
+            try:
+                await remove_file(version_file_path)
+            except UnsafePathError:
+                raise
+            except Exception:
+                logger.exception("Failed removing version blob", extra={"file_id": str(file_id), "version_id": version_id})
 
         deleted_rows = await self.ver_repo.delete_version(
-            session, original_file_id=file_id, version_id=version_id
+            session, user_id=user_id, original_file_id=file_id, version_id=version_id
         )
 
         return {
@@ -0,0 +1,136 @@
+import hashlib
+import mmap
+import tempfile
+from typing import AsyncIterator, Iterator, List, Optional, Union
+
+from app.storage.chunk_package import BytesLike, encode_chunk_header
+from app.storage.storage_io import StorageIO, get_storage_io
+
+# past the spool threshold, network reads are written to disk in batches of about this size
+WRITE_BATCH_BYTES = 1 << 20
+# package_pieces() reads a spooled body back in blocks of this size
+READ_BLOCK_BYTES = 1 << 20
+
+
+class ChunkIngest:
+    """
+    Receives one chunk body as it arrives on the socket.
+
+    - The receipt SHA-256 (aad | nonce | ciphertext | tag) is updated per network read,
+      so the body is never concatenated with its prefix/suffix.
+    - The body is kept in memory up to `spool_threshold` bytes and spilled to a temp
+      file past that, so slow or many concurrent uploads don't pin chunk-sized buffers.
+      Once spilling, reads are batched and written on the storage I/O pool, never on
+      the event loop.
+    - package_pieces() yields the SDC1 header and then the body block by block, so the
+      package can be wrapped (ServerCipherWrap.wrap_pieces) without being materialized.
+    - contents() hands a whole body (e.g. a batch of packages) to an in-place parser.
+    """
+
+    def __init__(self, max_bytes: int, spool_threshold: int, prefix: BytesLike = b"", spool_dir: Optional[str] = None,
+                 io: Optional[StorageIO] = None, digest: bool = True, too_large: str = "Chunk is too large."):
+        self.max_bytes = int(max_bytes)
+        self.spool_threshold = int(spool_threshold)
+        self.size = 0
+        self.too_large = too_large
+        self._hash = hashlib.sha256(prefix) if digest else None
+        self._spool = tempfile.SpooledTemporaryFile(max_size=self.spool_threshold, dir=spool_dir)
+        self._io = io
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+
+    @property
+    def io(self) -> StorageIO:
+        if self._io is None:
+            self._io = get_storage_io()
+        return self._io
+
+    async def consume(self, stream: AsyncIterator[bytes]) -> int:
+        async for piece in stream:
+            if not piece:
+                continue
+            self.size += len(piece)
+            if self.size > self.max_bytes:
+                raise ValueError(self.too_large)
+            if self._hash is not None:
+                self._hash.update(piece)
+            if self.size <= self.spool_threshold:
+                self._spool.write(piece)  # still in memory
+                continue
+            # this write rolls the spool over to disk (or appends to it): off the loop
+            self._pending.append(piece)
+            self._pending_size += len(piece)
+            if self._pending_size >= WRITE_BATCH_BYTES:
+                await self.flush()
+        await self.flush()
+        return self.size
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending, self._pending_size = self._pending, [], 0
+        await self.io.run(self._spool.writelines, pending)
+
+    def feed(self, data: BytesLike) -> int:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise ValueError(self.too_large)
+        if self._hash is not None:
+            self._hash.update(data)
+        self._spool.write(data)
+        return self.size
+
+    def hexdigest(self, suffix: BytesLike = b"") -> str:
+        h = self._hash.copy()
+        h.update(suffix)
+        return h.hexdigest()
+
+    @property
+    def spilled(self) -> bool:
+        return bool(getattr(self._spool, "_rolled", False))
+
+    async def contents(self) -> Union[bytes, mmap.mmap]:
+        """
+        The whole body, for parsing in place: a copy while it is still in memory (at most
+        `spool_threshold` bytes), otherwise a read-only mmap of the spool file, i.e. page
+        cache the kernel can reclaim rather than heap. The mapping outlives close() and is
+        released with the last view into it.
+        """
+        if not self.spilled:
+            self._spool.seek(0)
+            return self._spool.read()
+        return await self.io.run(self._map)
+
+    def _map(self) -> mmap.mmap:
+        self._spool.flush()
+        return mmap.mmap(self._spool.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def package_pieces(self, chunk_index: int, nonce: BytesLike, tag: BytesLike) -> Iterator[BytesLike]:
+        """
+        The SDC1 package as consecutive pieces: header, then the body. Meant for a worker
+        thread (a spilled body is read back from disk). Each yielded block is reused for the
+        next one, so consumers must copy it before advancing (wrap_pieces encrypts it out).
+        """
+        yield encode_chunk_header(chunk_index, nonce, tag, self.size)
+
+        self._spool.seek(0)
+        block = memoryview(bytearray(min(READ_BLOCK_BYTES, self.size) or 1))
+        left = self.size
+        while left:
+            n = self._spool.readinto(block[:min(left, len(block))])
+            if not n:
+                raise IOError("Spooled chunk body truncated")
+            left -= n
+            yield block[:n]
+
+    def close(self) -> None:
+        try:
+            self._spool.close()
+        except Exception:
+            pass
+
+    def __enter__(self) -> "ChunkIngest":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
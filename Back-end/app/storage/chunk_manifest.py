@@ -0,0 +1,171 @@
+import hashlib
+import struct
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from uuid import UUID
+
+MAGIC = b"SDM1"  # StormDrive Manifest v1
+VERSION = 1
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+# MAGIC | version:u16 | entry_size:u16 | chunk_size:u32 | total_chunks:u32 | file_size:u64 | upload_id:16 |
+# integrity:32 | table_off:u64 | keys_off:u64 | key_count:u32 | type_len:u16, then file_type (utf-8)
+HEADER = struct.Struct(">4sHHIIQ16s32sQQIH")
+
+# chunk_index:u32 | size:u32 | sha256:32 | key_id:u32 | span_off:u64 | span_len:u32
+# span_len == NO_SPAN: the key is the whole object; SHA_NAMED: the key is a content-addressed
+# directory and the object is "<key><sha[:2]>/<sha>.c2"; otherwise a pack member "<key>#<span_off>:<span_len>"
+ENTRY = struct.Struct(">II32sIQI")
+NO_SPAN = 0xFFFFFFFF
+SHA_NAMED = 0xFFFFFFFE
+
+# keys: (key_count + 1) u64 offsets into the key blob that follows them, then the utf-8 keys
+KEY_OFFSET = struct.Struct(">Q")
+
+_NO_SHA = bytes(32)
+
+
+@dataclass(frozen=True)
+class ManifestChunk:
+    chunk_index: int
+    size: int
+    sha256: Optional[str]
+    storage_key: str
+
+
+def _split_key(storage_key: str, sha: Optional[str]) -> Tuple[str, int, int]:
+    key, sep, span = storage_key.partition("#")
+    if sep:
+        off, _, length = span.partition(":")
+        return key, int(off), int(length)
+    if sha:
+        tail = f"{sha[:2]}/{sha}.c2"
+        if key.endswith("/" + tail):
+            return key[:-len(tail)], 0, SHA_NAMED
+    return key, 0, NO_SPAN
+
+
+def encode_manifest(manifest: Dict[str, Any]) -> bytes:
+    """
+    Binary form of a manifest dict (the shape finalize builds and JSON blueprints hold):
+    upload_id, chunk_size, total_chunks, file_size, file_type, integrity_hash and
+    chunks [{"i", "k", "h", "s"}] (legacy "c2_rel" / "sha256" names accepted).
+    Storage keys are stored once each and a chunk refers to its key by id; content-addressed
+    objects share one directory key, pack members their pack's key.
+    """
+    chunks = list(manifest.get("chunks") or [])
+    total_chunks = int(manifest["total_chunks"])
+    if total_chunks <= 0 or len(chunks) != total_chunks:
+        raise ValueError("Manifest chunk count mismatch")
+
+    file_type = str(manifest["file_type"]).encode("utf-8")
+    integrity = manifest.get("integrity_hash")
+
+    key_ids: Dict[str, int] = {}
+    table = bytearray(ENTRY.size * total_chunks)
+    for pos, c in enumerate(chunks):
+        key = c.get("k") or c.get("c2_rel")
+        if not key:
+            raise ValueError(f"Missing storage key for chunk {pos}")
+        sha = c.get("h") or c.get("sha256")
+        base, span_off, span_len = _split_key(str(key), sha)
+        key_id = key_ids.setdefault(base, len(key_ids))
+        ENTRY.pack_into(table, pos * ENTRY.size, int(c.get("i", pos)), int(c.get("s") or manifest["chunk_size"]),
+                        bytes.fromhex(sha) if sha else _NO_SHA, key_id, span_off, span_len)
+
+    keys = [k.encode("utf-8") for k in key_ids]
+    offsets = bytearray(KEY_OFFSET.size * (len(keys) + 1))
+    pos = 0
+    for n, k in enumerate(keys):
+        KEY_OFFSET.pack_into(offsets, n * KEY_OFFSET.size, pos)
+        pos += len(k)
+    KEY_OFFSET.pack_into(offsets, len(keys) * KEY_OFFSET.size, pos)
+
+    table_off = HEADER.size + len(file_type)
+    table_off += -table_off % 8
+    keys_off = table_off + len(table)
+
+    header = HEADER.pack(MAGIC, VERSION, ENTRY.size, int(manifest["chunk_size"]), total_chunks, int(manifest["file_size"]),
+                         UUID(str(manifest["upload_id"])).bytes, bytes.fromhex(integrity) if integrity else _NO_SHA,
+                         table_off, keys_off, len(keys), len(file_type))
+    pad = bytes(table_off - HEADER.size - len(file_type))
+    return b"".join([header, file_type, pad, bytes(table), bytes(offsets), *keys])
+
+
+def is_binary_manifest(data: BytesLike) -> bool:
+    return bytes(data[:4]) == MAGIC
+
+
+class ManifestView:
+    """
+    Read-only view over an encoded manifest (bytes or an mmap). Only the header is parsed up
+    front; chunk(k) unpacks one table entry and one key, so a reader can start at any chunk
+    without touching the rest of the table.
+    """
+
+    def __init__(self, buf: BytesLike):
+        self.buf = buf
+        self.mv = memoryview(buf)
+        if len(self.mv) < HEADER.size:
+            raise ValueError("Manifest truncated")
+        (magic, version, entry_size, self.chunk_size, self.total_chunks, self.file_size, upload_id, integrity,
+         self.table_off, self.keys_off, self.key_count, type_len) = HEADER.unpack_from(self.mv, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a binary manifest")
+        if version != VERSION or entry_size != ENTRY.size:
+            raise ValueError(f"Unsupported manifest version {version}")
+
+        self.upload_id = str(UUID(bytes=upload_id))
+        self.integrity_hash = integrity.hex() if integrity != _NO_SHA else None
+        self.file_type = bytes(self.mv[HEADER.size:HEADER.size + type_len]).decode("utf-8")
+
+        self.blob_off = self.keys_off + KEY_OFFSET.size * (self.key_count + 1)
+        if self.keys_off != self.table_off + ENTRY.size * self.total_chunks or len(self.mv) < self.blob_off:
+            raise ValueError("Manifest truncated")
+        self._keys: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return self.total_chunks
+
+    def key(self, key_id: int) -> str:
+        found = self._keys.get(key_id)
+        if found is None:
+            if not 0 <= key_id < self.key_count:
+                raise ValueError(f"Invalid manifest key id {key_id}")
+            start, = KEY_OFFSET.unpack_from(self.mv, self.keys_off + key_id * KEY_OFFSET.size)
+            end, = KEY_OFFSET.unpack_from(self.mv, self.keys_off + (key_id + 1) * KEY_OFFSET.size)
+            found = self._keys[key_id] = bytes(self.mv[self.blob_off + start:self.blob_off + end]).decode("utf-8")
+        return found
+
+    def chunk(self, pos: int) -> ManifestChunk:
+        if not 0 <= pos < self.total_chunks:
+            raise IndexError(pos)
+        idx, size, sha, key_id, span_off, span_len = ENTRY.unpack_from(self.mv, self.table_off + pos * ENTRY.size)
+        key = self.key(key_id)
+        sha256 = sha.hex() if sha != _NO_SHA else None
+        if span_len == SHA_NAMED:
+            key = f"{key}{sha256[:2]}/{sha256}.c2"
+        elif span_len != NO_SPAN:
+            key = f"{key}#{span_off}:{span_len}"
+        return ManifestChunk(chunk_index=idx, size=size, sha256=sha256, storage_key=key)
+
+    def chunks(self, start: int = 0, stop: Optional[int] = None) -> Iterator[ManifestChunk]:
+        for pos in range(start, self.total_chunks if stop is None else min(stop, self.total_chunks)):
+            yield self.chunk(pos)
+
+    def receipts_digest(self) -> str:
+        # sha256 over the chunks' receipt hex digests in order: what finalize stores as integrity_hash
+        table = self.mv[self.table_off:self.keys_off].hex()
+        step = ENTRY.size * 2
+        return hashlib.sha256("".join([table[p + 16:p + 80] for p in range(0, len(table), step)]).encode("ascii")).hexdigest()
+
+    def objects(self) -> List[Tuple[str, str]]:
+        # (sha256, storage_key) of every chunk that has a receipt
+        return [(c.sha256, c.storage_key) for c in self.chunks() if c.sha256]
+
+    def close(self) -> None:
+        self.mv.release()
+        close = getattr(self.buf, "close", None)
+        if close is not None:
+            close()
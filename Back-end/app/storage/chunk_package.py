@@ -1,68 +1,162 @@
 import struct
 from dataclasses import dataclass
+from typing import Iterator, Tuple, Union
 
 MAGIC = b"SDC1"  # StormDrive Chunk v1
 
+BytesLike = Union[bytes, bytearray, memoryview]
 
-def encode_chunk_package(chunk_index: int, nonce: bytes, tag: bytes, ciphertext: bytes) -> bytes:
+# MAGIC | chunk_index:u32 | nonce_len:u16 | nonce | tag_len:u16 | tag | ct_len:u32 | ciphertext
+HEADER_FIXED = 4 + 4 + 2 + 2 + 4
+
+
+def header_size(nonce_len: int, tag_len: int) -> int:
+    return HEADER_FIXED + nonce_len + tag_len
+
+
+def package_size(nonce_len: int, tag_len: int, ct_len: int) -> int:
+    return header_size(nonce_len, tag_len) + ct_len
+
+
+def encode_chunk_header_into(out: memoryview, chunk_index: int, nonce: BytesLike, tag: BytesLike, ct_len: int) -> int:
+    """
+    Writes everything up to the ciphertext and returns the ciphertext offset, so callers
+    can fill the ciphertext region themselves (e.g. readinto from a spooled body).
+    """
     if chunk_index < 0:
         raise ValueError("chunk_index must be >= 0")
 
-    header = bytearray()
-    header += MAGIC
-    header += struct.pack(">I", chunk_index)
-    header += struct.pack(">H", len(nonce)) + nonce
-    header += struct.pack(">H", len(tag)) + tag
-    header += struct.pack(">I", len(ciphertext)) + ciphertext
-    return bytes(header)
+    n, t = len(nonce), len(tag)
+    if len(out) < header_size(n, t):
+        raise ValueError("Output buffer too small for chunk header")
+
+    off = 0
+    out[off:off + 4] = MAGIC
+    off += 4
+    struct.pack_into(">IH", out, off, chunk_index, n)
+    off += 6
+    out[off:off + n] = nonce
+    off += n
+    struct.pack_into(">H", out, off, t)
+    off += 2
+    out[off:off + t] = tag
+    off += t
+    struct.pack_into(">I", out, off, ct_len)
+    off += 4
+    return off
+
+
+def encode_chunk_package_into(out: memoryview, chunk_index: int, nonce: BytesLike, tag: BytesLike, ciphertext: BytesLike) -> int:
+    """
+    Writes one package into a caller-owned buffer and returns the number of bytes written.
+    The ciphertext is copied exactly once, straight into its final position.
+    """
+    c = len(ciphertext)
+    if len(out) < package_size(len(nonce), len(tag), c):
+        raise ValueError("Output buffer too small for chunk package")
+    off = encode_chunk_header_into(out, chunk_index, nonce, tag, c)
+    out[off:off + c] = ciphertext
+    return off + c
+
+
+def encode_chunk_header(chunk_index: int, nonce: BytesLike, tag: BytesLike, ct_len: int) -> bytearray:
+    # just the framing in front of the ciphertext, for writers that stream the ciphertext themselves
+    buf = bytearray(header_size(len(nonce), len(tag)))
+    encode_chunk_header_into(memoryview(buf), chunk_index, nonce, tag, ct_len)
+    return buf
+
+
+def encode_chunk_package(chunk_index: int, nonce: BytesLike, tag: BytesLike, ciphertext: BytesLike) -> bytearray:
+    buf = bytearray(package_size(len(nonce), len(tag), len(ciphertext)))
+    encode_chunk_package_into(memoryview(buf), chunk_index, nonce, tag, ciphertext)
+    return buf
 
 
 @dataclass(frozen=True)
 class DecodedChunkPackage:
+    """
+    nonce, tag and ciphertext are memoryviews into the decoded blob (no copies).
+    They can be fed to hashlib / AESGCM / a response writer directly; call bytes()
+    on a field only if it must outlive the blob.
+    """
     chunk_index: int
-    nonce: bytes
-    tag: bytes
-    ciphertext: bytes
+    nonce: memoryview
+    tag: memoryview
+    ciphertext: memoryview
 
 
-def decode_chunk_package(blob: bytes) -> DecodedChunkPackage:
-    """
-    Parses a single package. Useful for server-side SHA256 verification and debugging.
-    """
-    if not blob or len(blob) < 4 + 4 + 2 + 2 + 4:
+def _as_view(blob: BytesLike) -> memoryview:
+    view = memoryview(blob)
+    if view.ndim != 1 or view.itemsize != 1:
+        view = view.cast("B")
+    return view
+
+
+def _decode_at(view: memoryview, off: int) -> Tuple[DecodedChunkPackage, int]:
+    # one package starting at `off`; returns it with the offset just past its ciphertext
+    size = len(view)
+    if size - off < HEADER_FIXED:
         raise ValueError("Chunk package too small")
 
-    off = 0
-    if blob[off:off + 4] != MAGIC:
+    if view[off:off + 4] != MAGIC:
         raise ValueError("Invalid chunk package magic")
     off += 4
 
-    (chunk_index,) = struct.unpack_from(">I", blob, off)
+    (chunk_index,) = struct.unpack_from(">I", view, off)
     off += 4
 
-    (nonce_len,) = struct.unpack_from(">H", blob, off)
+    (nonce_len,) = struct.unpack_from(">H", view, off)
     off += 2
-    if nonce_len <= 0 or off + nonce_len > len(blob):
+    if nonce_len <= 0 or off + nonce_len > size:
         raise ValueError("Invalid nonce length")
-    nonce = blob[off:off + nonce_len]
+    nonce = view[off:off + nonce_len]
     off += nonce_len
 
-    (tag_len,) = struct.unpack_from(">H", blob, off)
+    if off + 2 > size:
+        raise ValueError("Invalid tag length")
+    (tag_len,) = struct.unpack_from(">H", view, off)
     off += 2
-    if tag_len <= 0 or off + tag_len > len(blob):
+    if tag_len <= 0 or off + tag_len > size:
         raise ValueError("Invalid tag length")
-    tag = blob[off:off + tag_len]
+    tag = view[off:off + tag_len]
     off += tag_len
 
-    (ct_len,) = struct.unpack_from(">I", blob, off)
+    if off + 4 > size:
+        raise ValueError("Invalid ciphertext length")
+    (ct_len,) = struct.unpack_from(">I", view, off)
     off += 4
-    if ct_len < 0 or off + ct_len > len(blob):
+    if ct_len < 0 or off + ct_len > size:
         raise ValueError("Invalid ciphertext length")
-    ciphertext = blob[off:off + ct_len]
+    ciphertext = view[off:off + ct_len]
 
-    return DecodedChunkPackage(
+    pkg = DecodedChunkPackage(
         chunk_index=int(chunk_index),
         nonce=nonce,
         tag=tag,
         ciphertext=ciphertext,
     )
+    return pkg, off + ct_len
+
+
+def decode_chunk_package(blob: BytesLike) -> DecodedChunkPackage:
+    """
+    Parses a single package. Useful for server-side SHA256 verification and debugging.
+    """
+    if not blob or len(blob) < HEADER_FIXED:
+        raise ValueError("Chunk package too small")
+    pkg, _ = _decode_at(_as_view(blob), 0)
+    return pkg
+
+
+def iter_chunk_packages(blob: BytesLike) -> Iterator[Tuple[DecodedChunkPackage, memoryview]]:
+    """
+    Walks back-to-back packages (a batch body). Yields each decoded package together with
+    a view of its full framed bytes, which is exactly what encode_chunk_package would
+    produce for it. Trailing bytes that don't form a package raise ValueError.
+    """
+    view = _as_view(blob)
+    off = 0
+    while off < len(view):
+        pkg, end = _decode_at(view, off)
+        yield pkg, view[off:end]
+        off = end
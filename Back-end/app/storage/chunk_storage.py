@@ -1,48 +1,128 @@
-import os , uuid ,anyio
+import os ,anyio, json, mmap, time
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple, Union
 from app.security.path_sanitizer import safe_path_join
+from app.storage.storage_io import StorageIO, get_storage_io, unlink_if_exists
+from app.storage.chunk_manifest import ManifestView, encode_manifest
+from app.observability.metrics import STORAGE_BYTES, STORAGE_SECONDS
+
+MANIFEST_SUFFIX = ".sdm"
+LEGACY_MANIFEST_SUFFIX = ".json"
+
+
+def map_file(path: Path) -> mmap.mmap:
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
 class ChunkStorage:
-    def __init__(self, root_dir: Optional[str] = None):
+    def __init__(self, root_dir: Optional[str] = None, io: Optional[StorageIO] = None):
         self.root_dir = root_dir or os.getenv("UPLOAD_FOLDER", "./uploads")
         self._root = Path(self.root_dir).resolve()
+        self._io = io
+
+    @property
+    def io(self) -> StorageIO:
+        if self._io is None:
+            self._io = get_storage_io()
+        return self._io
     
+    async def write(self, final_path: Path, data: Union[str, bytes, bytearray, memoryview]) -> None:
+        with STORAGE_SECONDS.time("write"):
+            await self.io.write_atomic(final_path, data)
+        STORAGE_BYTES.inc("write", amount=len(data))
+
     def chunk_dir(self, user_id: str, upload_id: str) -> Path:
         return safe_path_join(self.root_dir,"chunks", user_id, upload_id)
     
     def dummy_dir(self,user_id:str)->Path:
         return safe_path_join(self.root_dir, "blueprint", user_id)
     
-    def save_chunk_c2(self, user_id: str, upload_id: str, chunk_index: int, sha256_hex: str, cipher2_bytes: bytes) -> str:
+    async def save_chunk_c2(self, user_id: str, upload_id: str, chunk_index: int, sha256_hex: str, cipher2_bytes: Union[bytes, bytearray, memoryview]) -> str:
         chunk_dir = self.chunk_dir(user_id, upload_id)
-        chunk_dir.mkdir(parents=True, exist_ok=True)
-
         filename = f"{chunk_index:08d}-{sha256_hex}.c2"
         final_path = safe_path_join(chunk_dir, filename)
 
-        tmp_path = safe_path_join(chunk_dir, f".{filename}.{uuid.uuid4().hex}.tmp")
-        with open(tmp_path, "wb") as f:
-            f.write(cipher2_bytes)
+        await self.write(final_path, cipher2_bytes)
+
+        return str(Path(final_path).relative_to(self._root))
+    
+    def object_dir(self, user_id: str, sha256_hex: str) -> Path:
+        return safe_path_join(self.root_dir, "objects", user_id, sha256_hex[:2])
+
+    async def save_chunk_object(self, user_id: str, sha256_hex: str, cipher2_bytes: Union[bytes, bytearray, memoryview]) -> str:
+        """
+        Content-addressed layout: objects/<user>/<sha[:2]>/<sha>.c2, shared by every
+        receipt and manifest entry with that SHA (see ChunkStoreService).
+        """
+        final_path = safe_path_join(self.object_dir(user_id, sha256_hex), f"{sha256_hex}.c2")
+
+        await self.write(final_path, cipher2_bytes)
+
+        return str(Path(final_path).relative_to(self._root))
+
+    def pack_dir(self, user_id: str, sha256_hex: str) -> Path:
+        return safe_path_join(self.root_dir, "packs", user_id, sha256_hex[:2])
+
+    async def save_pack_object(self, user_id: str, sha256_hex: str, blob: Union[bytes, bytearray, memoryview]) -> str:
+        """
+        One file holding many small chunk objects back to back: packs/<user>/<sha[:2]>/<sha>.pk.
+        Members are addressed with member_key(), so receipts and manifests keep one storage_key.
+        """
+        final_path = safe_path_join(self.pack_dir(user_id, sha256_hex), f"{sha256_hex}.pk")
+
+        await self.write(final_path, blob)
+
+        return str(Path(final_path).relative_to(self._root))
+
+    @staticmethod
+    def member_key(pack_key: str, offset: int, length: int) -> str:
+        return f"{pack_key}#{int(offset)}:{int(length)}"
 
-        os.replace(tmp_path, final_path) 
+    @staticmethod
+    def split_key(storage_key: str) -> Tuple[str, Optional[Tuple[int, int]]]:
+        # "<pack>#<offset>:<length>" -> (pack key, (offset, length)); plain keys -> (key, None)
+        key, sep, span = (storage_key or "").partition("#")
+        if not sep:
+            return key, None
+        try:
+            offset, length = (int(x) for x in span.split(":", 1))
+        except ValueError:
+            raise ValueError("Invalid storage key range")
+        if offset < 0 or length < 0:
+            raise ValueError("Invalid storage key range")
+        return key, (offset, length)
 
-        return str(Path(final_path).relative_to(Path(self.root_dir).resolve()))
+    async def delete_key(self, storage_key: str) -> bool:
+        path = self.resolve_key(storage_key)
+        return await self.io.run(unlink_if_exists, path)
     
-    def save_blueprint(self, user_id: str, file_id: str, manifest_json: str) -> str:
+    async def save_blueprint(self, user_id: str, file_id: str, manifest_json: str) -> str:
         mdir = self.dummy_dir(user_id)
-        mdir.mkdir(parents=True, exist_ok=True)
-
         final_path = safe_path_join(mdir, f"{file_id}.json")
-        tmp_path = safe_path_join(mdir, f".{file_id}.{uuid.uuid4().hex}.tmp")
 
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            f.write(manifest_json)
+        await self.write(final_path, manifest_json)
 
-        os.replace(tmp_path, final_path)
-
-        return str(Path(final_path).relative_to(Path(self.root_dir).resolve()))
+        return str(Path(final_path).relative_to(self._root))
     
+    async def save_manifest(self, user_id: str, name: str, data: Union[bytes, bytearray, memoryview]) -> str:
+        # binary manifest (chunk_manifest.encode_manifest): blueprint/<user>/<name>.sdm
+        final_path = safe_path_join(self.dummy_dir(user_id), f"{name}{MANIFEST_SUFFIX}")
+
+        await self.write(final_path, data)
+
+        return str(Path(final_path).relative_to(self._root))
+
+    async def open_manifest(self, storage_key: str) -> ManifestView:
+        """
+        Binary manifests are mmapped, so only the pages of the chunks actually read are loaded.
+        Legacy JSON blueprints are parsed and converted in memory.
+        """
+        path = self.resolve_key(storage_key)
+        if storage_key.endswith(LEGACY_MANIFEST_SUFFIX):
+            text = await self.read_text(storage_key)
+            return ManifestView(await anyio.to_thread.run_sync(lambda: encode_manifest(json.loads(text))))
+        return ManifestView(await anyio.to_thread.run_sync(map_file, path))
+
     def resolve_key(self, storage_key: str) -> Path:
         """
         Resolve a DB-stored storage_key safely under root.
@@ -57,9 +137,21 @@ class ChunkStorage:
         return p
 
     async def read_bytes(self, storage_key: str) -> bytes:
-        path = self.resolve_key(storage_key)
+        key, span = self.split_key(storage_key)
+        path = self.resolve_key(key)
+        started = time.perf_counter()
         async with await anyio.open_file(path, "rb") as f:
-            return await f.read()
+            if span is None:
+                data = await f.read()
+            else:
+                offset, length = span
+                await f.seek(offset)
+                data = await f.read(length)
+        STORAGE_SECONDS.observe(time.perf_counter() - started, "read")
+        STORAGE_BYTES.inc("read", amount=len(data))
+        if span is not None and len(data) != span[1]:
+            raise IOError("Pack member truncated")
+        return data
 
     async def read_text(self, storage_key: str) -> str:
         path = self.resolve_key(storage_key)
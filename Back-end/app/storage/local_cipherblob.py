@@ -1,8 +1,61 @@
+import asyncio
+import logging
 import os
-import tempfile
+import shutil
+import uuid
 from pathlib import Path
 
-import aiofiles
+logger = logging.getLogger(__name__)
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def reflink(src: Path, dst: Path) -> bool:
+    """
+    Copy-on-write clone (btrfs, XFS with reflink=1, bcachefs, ...). False when unsupported.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    try:
+        with open(src, "rb") as r, open(dst, "wb") as w:
+            fcntl.ioctl(w.fileno(), FICLONE, r.fileno())
+        return True
+    except OSError:
+        try:
+            os.unlink(dst)
+        except FileNotFoundError:
+            pass
+        return False
+
+
+def hardlink(src: Path, dst: Path) -> bool:
+    # Blobs are never modified in place (writers use tmp + os.replace), so sharing the inode is safe.
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:
+        return False
+
+
+def clone_blob(src: Path, dst: Path) -> str:
+    """
+    Clone src to dst atomically, cheapest method first: reflink, hard link, byte copy.
+    Returns the method used.
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".tmp-{dst.name}.{uuid.uuid4().hex}")
+
+    method = "reflink" if reflink(src, tmp) else "link" if hardlink(src, tmp) else ""
+    if not method:
+        shutil.copyfile(src, tmp)
+        method = "copy"
+
+    os.replace(tmp, dst)
+    return method
 
 
 class cipherCloneStorage:
@@ -10,21 +63,5 @@ class cipherCloneStorage:
         self.chunk_size = chunk_size
 
     async def clone_ciphertext(self, src: Path, dst: Path) -> None:
-        dst.parent.mkdir(parents=True, exist_ok=True)
-
-        # Atomic write: write to temp and replace
-        tmp = Path(dst.parent) / f".tmp-{dst.name}"
-        if tmp.exists():
-            try:
-                tmp.unlink()
-            except Exception:
-                pass
-
-        async with aiofiles.open(src, "rb") as r, aiofiles.open(tmp, "wb") as w:
-            while True:
-                chunk = await r.read(self.chunk_size)
-                if not chunk:
-                    break
-                await w.write(chunk)
-
-        os.replace(tmp, dst)
+        method = await asyncio.to_thread(clone_blob, Path(src), Path(dst))
+        logger.debug("clone_ciphertext", extra={"src": str(src), "dst": str(dst), "method": method})
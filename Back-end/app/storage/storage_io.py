@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple, TypeVar, Union
+
+from app.config.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+FSYNC_MODES = ("off", "always", "batch")
+
+
+def write_atomic(final_path: Path, data: Union[bytes, bytearray, memoryview, str], fsync: bool = False) -> None:
+    """
+    tmp file + os.replace in the same directory, so readers never see a partial file.
+    With fsync=True the file is flushed before the rename and the directory after it.
+    """
+    final_path = Path(final_path)
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = final_path.with_name(f".{final_path.name}.{uuid.uuid4().hex}.tmp")
+    payload = data.encode("utf-8") if isinstance(data, str) else data
+
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, final_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    if fsync:
+        fsync_dir(final_path.parent)
+
+
+def unlink_if_exists(path: Path) -> bool:
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def fsync_path(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_dir(path: Path) -> None:
+    try:
+        fsync_path(path)
+    except OSError:
+        # Some platforms/filesystems don't allow fsync on a directory fd.
+        pass
+
+
+class StorageIO:
+    """
+    Runs blocking storage writes on a dedicated, bounded thread pool so they never
+    stall the event loop (and don't compete with anyio's default thread limiter).
+
+    - At most `max_pending` writes are queued or running; further callers wait
+      (backpressure instead of an unbounded executor queue).
+    - fsync mode:
+        off    -> rename only (previous behaviour)
+        always -> fsync file + directory on every write
+        batch  -> write + rename now, then fsync files/directories in groups of up to
+                  `fsync_batch_max` or every `fsync_batch_ms`; callers return only after
+                  their batch is durable. One directory fsync covers every chunk of an upload.
+    - stats() exposes queue depth, in-flight count and wait/exec timings.
+    """
+
+    def __init__(self, workers: int = 4, max_pending: int = 64, fsync: str = "off",
+                 fsync_batch_ms: int = 5, fsync_batch_max: int = 32):
+        if fsync not in FSYNC_MODES:
+            raise ValueError(f"fsync must be one of {FSYNC_MODES}")
+
+        self.workers = int(workers)
+        self.max_pending = int(max_pending)
+        self.fsync = fsync
+        self.fsync_batch_s = max(0, int(fsync_batch_ms)) / 1000.0
+        self.fsync_batch_max = max(1, int(fsync_batch_max))
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sd-storage-io")
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+
+        self._batch: List[Tuple[Path, asyncio.Future]] = []
+        self._batch_timer: Optional[asyncio.TimerHandle] = None
+        # running fsync batches: the loop only keeps weak references to tasks
+        self._flushes: Set[asyncio.Task] = set()
+
+        self._queued = 0
+        self._running = 0
+        self._waiting_for_slot = 0
+        self._completed = 0
+        self._failed = 0
+        self._fsync_batches = 0
+        self._fsync_files = 0
+        self._wait_s_total = 0.0
+        self._exec_s_total = 0.0
+        self._max_queue_depth = 0
+
+    def slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        return self._slots
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        slots = self.slots()
+        self._waiting_for_slot += 1
+        try:
+            await slots.acquire()
+        finally:
+            self._waiting_for_slot -= 1
+
+        try:
+            with self._lock:
+                self._queued += 1
+                self._max_queue_depth = max(self._max_queue_depth, self._queued)
+            submitted = time.perf_counter()
+
+            def job():
+                started = time.perf_counter()
+                with self._lock:
+                    self._queued -= 1
+                    self._running += 1
+                    self._wait_s_total += started - submitted
+                try:
+                    return fn(*args)
+                finally:
+                    with self._lock:
+                        self._running -= 1
+                        self._exec_s_total += time.perf_counter() - started
+
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(self._executor, job)
+            except BaseException:
+                with self._lock:
+                    self._failed += 1
+                raise
+            with self._lock:
+                self._completed += 1
+            return result
+        finally:
+            slots.release()
+
+    async def write_atomic(self, final_path: Path, data: Union[bytes, bytearray, memoryview, str]) -> None:
+        if self.fsync == "batch":
+            await self.run(write_atomic, final_path, data, False)
+            await self.durable(final_path)
+        else:
+            await self.run(write_atomic, final_path, data, self.fsync == "always")
+
+    async def durable(self, path: Path) -> None:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._batch.append((Path(path), fut))
+
+        if len(self._batch) >= self.fsync_batch_max:
+            self.flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = loop.call_later(self.fsync_batch_s, self.flush_batch)
+
+        await fut
+
+    def flush_batch(self) -> None:
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        paths = [p for p, _ in batch]
+
+        def sync_all() -> None:
+            for p in paths:
+                fsync_path(p)
+            for d in {p.parent for p in paths}:
+                fsync_dir(d)
+
+        async def flush() -> None:
+            try:
+                await self.run(sync_all)
+            except BaseException as e:
+                logger.exception("storage:fsync_batch_failed", extra={"files": len(paths)})
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                return
+            with self._lock:
+                self._fsync_batches += 1
+                self._fsync_files += len(paths)
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_result(None)
+
+        task = asyncio.ensure_future(flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            done = max(1, self._completed + self._failed)
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "queue_depth": self._queued,
+                "in_flight": self._running,
+                "waiting_for_slot": self._waiting_for_slot,
+                "max_queue_depth": self._max_queue_depth,
+                "completed": self._completed,
+                "failed": self._failed,
+                "fsync_pending": len(self._batch),
+                "fsync_running": len(self._flushes),
+                "fsync_batches": self._fsync_batches,
+                "fsync_files": self._fsync_files,
+                "avg_queue_wait_ms": round(self._wait_s_total / done * 1000, 3),
+                "avg_exec_ms": round(self._exec_s_total / done * 1000, 3),
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+_storage_io: Optional[StorageIO] = None
+_storage_io_lock = threading.Lock()
+
+
+def get_storage_io(settings=None) -> StorageIO:
+    """
+    Process-wide pool: every ChunkStorage shares one bound on concurrent disk writes.
+    """
+    global _storage_io
+    if _storage_io is None:
+        with _storage_io_lock:
+            if _storage_io is None:
+                cfg = settings or get_settings()
+                _storage_io = StorageIO(
+                    workers=cfg.storage_io_workers,
+                    max_pending=cfg.storage_io_max_pending,
+                    fsync=cfg.storage_fsync,
+                    fsync_batch_ms=cfg.storage_fsync_batch_ms,
+                    fsync_batch_max=cfg.storage_fsync_batch_max,
+                )
+    return _storage_io
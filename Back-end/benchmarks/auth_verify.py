@@ -0,0 +1,181 @@
+"""
+Per-request cost of resolving a bearer token: supabase.auth.get_user on every request (what
+get_current_user did before TokenVerifier) against TokenVerifier's local check and per-token
+cache.
+
+Starts a loopback stub of the Supabase auth endpoints (GET /auth/v1/user and the project
+JWKS), points the real supabase AsyncClient and the verifier at it, and times:
+    get_user per request          one stub round trip per call
+    verifier, first request       JWKS fetch + ES256 verify, once per process
+    verifier, cached              the steady state of an upload's chunk PUTs
+    verifier, no cache            local ES256 / HS256 verify on every call
+`--delay-ms` adds latency to each stub response; against a real project the get_user row is a
+WAN round trip rather than loopback.
+
+    cd Back-end
+    python -m benchmarks.auth_verify
+    python -m benchmarks.auth_verify --requests 1000 --delay-ms 20
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec
+from jwt.algorithms import ECAlgorithm
+from supabase import create_async_client
+
+from app.security.token_verifier import TokenVerifier
+
+USER_ID = str(uuid.uuid4())
+KID = "bench-key"
+HS_SECRET = "s" * 40
+# the client only needs something JWT-shaped as its key; the stub never checks it
+SERVICE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.x"
+
+
+class AuthStub:
+    """Just enough HTTP/1.1 (keep-alive, Content-Length bodies) for httpx to talk to."""
+
+    def __init__(self, public_jwk: Dict, delay: float) -> None:
+        self.jwks = json.dumps({"keys": [public_jwk]}).encode()
+        self.user = json.dumps({
+            "id": USER_ID, "aud": "authenticated", "role": "authenticated", "email": "bench@example.com",
+            "app_metadata": {}, "user_metadata": {"name": "Bench"},
+            "created_at": "2025-01-01T00:00:00Z", "last_sign_in_at": "2025-06-01T00:00:00Z",
+        }).encode()
+        self.delay = delay
+        self.hits = {"user": 0, "jwks": 0}
+        self.connections: Dict[asyncio.StreamWriter, asyncio.StreamReader] = {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections[writer] = reader
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            path = line.split()[1].decode()
+            while (await reader.readline()) not in (b"\r\n", b""):
+                pass
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            kind = "jwks" if path.endswith("/jwks.json") else "user"
+            self.hits[kind] += 1
+            body = self.jwks if kind == "jwks" else self.user
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+            await writer.drain()
+        self.connections.pop(writer, None)
+        writer.close()
+
+    def close(self) -> None:
+        # the client keeps its connections alive: hang up so the handlers finish
+        for reader in list(self.connections.values()):
+            reader.feed_eof()
+
+
+class NoRevocations:
+    async def revoked_since(self, session, since, now):
+        return []
+
+
+class NullSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def settings(base: str, cache_ttl: int, hs_secret: bool) -> SimpleNamespace:
+    # a namespace rather than Settings: the stub is plain http, which supabase_url refuses
+    return SimpleNamespace(
+        auth_local_verify=True, auth_cache_ttl_seconds=cache_ttl, auth_cache_max_entries=10_000,
+        auth_jwks_ttl_seconds=600, auth_jwt_audience="authenticated", auth_revocation_poll_seconds=5,
+        supabase_url=base, supabase_service_key=SERVICE_KEY, jwt_secret_key=HS_SECRET, jwt_algorithm="HS256",
+        model_fields_set={"jwt_secret_key"} if hs_secret else set(),
+    )
+
+
+def verifier(base: str, cache_ttl: int = 300, hs_secret: bool = False) -> TokenVerifier:
+    v = TokenVerifier(settings(base, cache_ttl, hs_secret), sessions=NullSession)
+    v.revocations = NoRevocations()
+    return v
+
+
+def claims(base: str) -> Dict:
+    now = int(time.time())
+    return {"sub": USER_ID, "aud": "authenticated", "iss": base + "/auth/v1", "iat": now, "exp": now + 3600,
+            "email": "bench@example.com", "user_metadata": {"name": "Bench"},
+            "amr": [{"method": "password", "timestamp": now - 5}]}
+
+
+async def per_call_us(fn: Callable[[], Awaitable], n: int) -> float:
+    started = time.perf_counter()
+    for _ in range(n):
+        await fn()
+    return (time.perf_counter() - started) / n * 1e6
+
+
+async def run(requests: int, delay_ms: float) -> None:
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    public_jwk = json.loads(ECAlgorithm.to_jwk(private_key.public_key()))
+    public_jwk.update(kid=KID, alg="ES256", use="sig")
+    stub = AuthStub(public_jwk, delay_ms / 1000)
+    server = await asyncio.start_server(stub.handle, "127.0.0.1", 0)
+    base = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    try:
+        supabase = await create_async_client(base, SERVICE_KEY)
+        es_token = jwt.encode(claims(base), private_key, algorithm="ES256", headers={"kid": KID})
+        hs_token = jwt.encode(claims(base), HS_SECRET, algorithm="HS256")
+
+        print(f"loopback auth stub, {delay_ms:g} ms added per response; {requests} requests per row")
+        print(f"{'path':<36} {'us/request':>12} {'stub calls':>11}")
+
+        def row(label: str, us: float, calls: int) -> None:
+            print(f"{label:<36} {us:>12.2f} {calls:>11}")
+
+        await supabase.auth.get_user(es_token)  # connection + client warm-up
+        stub.hits.update(user=0, jwks=0)
+        before = await per_call_us(lambda: supabase.auth.get_user(es_token), requests)
+        row("get_user per request (before)", before, stub.hits["user"])
+
+        cached = verifier(base)
+        stub.hits.update(user=0, jwks=0)
+        started = time.perf_counter()
+        user = await cached.authenticate(es_token, supabase)
+        row("verifier, first request (JWKS)", (time.perf_counter() - started) * 1e6, sum(stub.hits.values()))
+        assert user.user_id == USER_ID and user.name == "Bench"
+
+        # the cache hit is sub-microsecond: more calls for a stable figure
+        after = await per_call_us(lambda: cached.authenticate(es_token, supabase), requests * 10)
+        row("verifier, cached", after, sum(stub.hits.values()) - 1)
+
+        es = verifier(base, cache_ttl=0)
+        await es.authenticate(es_token, supabase)  # JWKS fetch
+        stub.hits.update(user=0, jwks=0)
+        row("verifier, no cache, ES256", await per_call_us(lambda: es.authenticate(es_token, supabase), requests), sum(stub.hits.values()))
+
+        hs = verifier(base, cache_ttl=0, hs_secret=True)
+        row("verifier, no cache, HS256", await per_call_us(lambda: hs.authenticate(hs_token, supabase), requests), sum(stub.hits.values()))
+
+        print(f"cached vs get_user: {before / after:,.0f}x")
+    finally:
+        server.close()
+        stub.close()
+        await asyncio.sleep(0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="latency added to every stub response")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.delay_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Peak allocations of SDC1 chunk package encode / decode across chunk sizes: the zero-copy
+chunk_package module against the slicing implementation it replaced (kept below as
+legacy_encode / legacy_decode).
+
+For every size the inputs are allocated first, then tracemalloc records the peak of:
+    encode            encode_chunk_package(index, nonce, tag, ciphertext)
+    decode + sha256   decode_chunk_package(blob), then sha256 over nonce | ciphertext | tag,
+                      which is what the upload / download receipt checks do with a package
+Peaks are printed in MB and as a multiple of the chunk size. Needs about 4x the largest
+size in free memory.
+
+    cd Back-end
+    python -m benchmarks.chunk_package_alloc
+    python -m benchmarks.chunk_package_alloc --sizes-kb 256 4096 131072
+"""
+import argparse
+import hashlib
+import os
+import struct
+import tracemalloc
+from typing import Callable, List
+
+from app.storage.chunk_package import MAGIC, decode_chunk_package, encode_chunk_package
+
+NONCE = os.urandom(12)
+TAG = os.urandom(16)
+
+
+def legacy_encode(chunk_index: int, nonce: bytes, tag: bytes, ciphertext: bytes) -> bytes:
+    header = bytearray()
+    header += MAGIC
+    header += struct.pack(">I", chunk_index)
+    header += struct.pack(">H", len(nonce)) + nonce
+    header += struct.pack(">H", len(tag)) + tag
+    header += struct.pack(">I", len(ciphertext)) + ciphertext
+    return bytes(header)
+
+
+def legacy_decode(blob: bytes):
+    off = 4 + 4
+    (nonce_len,) = struct.unpack_from(">H", blob, off)
+    off += 2
+    nonce = blob[off:off + nonce_len]
+    off += nonce_len
+    (tag_len,) = struct.unpack_from(">H", blob, off)
+    off += 2
+    tag = blob[off:off + tag_len]
+    off += tag_len
+    (ct_len,) = struct.unpack_from(">I", blob, off)
+    off += 4
+    return nonce, tag, blob[off:off + ct_len]
+
+
+def receipt(nonce, tag, ciphertext) -> str:
+    h = hashlib.sha256()
+    h.update(nonce)
+    h.update(ciphertext)
+    h.update(tag)
+    return h.hexdigest()
+
+
+def peak_bytes(fn: Callable[[], object]) -> int:
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+def run(sizes_kb: List[int]) -> None:
+    print(f"{'chunk':>8} {'encode old':>17} {'encode new':>17} {'decode+sha old':>17} {'decode+sha new':>17}")
+    for kb in sizes_kb:
+        size = kb << 10
+        ciphertext = os.urandom(size)
+        blob = legacy_encode(0, NONCE, TAG, ciphertext)
+        assert bytes(encode_chunk_package(0, NONCE, TAG, ciphertext)) == blob
+
+        def legacy_verify() -> str:
+            nonce, tag, ct = legacy_decode(blob)
+            return receipt(nonce, tag, ct)
+
+        def verify() -> str:
+            pkg = decode_chunk_package(blob)
+            return receipt(pkg.nonce, pkg.tag, pkg.ciphertext)
+
+        assert legacy_verify() == verify()
+        peaks = [
+            peak_bytes(lambda: legacy_encode(0, NONCE, TAG, ciphertext)),
+            peak_bytes(lambda: encode_chunk_package(0, NONCE, TAG, ciphertext)),
+            peak_bytes(legacy_verify),
+            peak_bytes(verify),
+        ]
+        cells = [f"{p / (1 << 20):8.2f} MB {p / size:4.2f}x" for p in peaks]
+        label = f"{kb // 1024} MB" if kb >= 1024 else f"{kb} KB"
+        print(f"{label:>8} {cells[0]:>17} {cells[1]:>17} {cells[2]:>17} {cells[3]:>17}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-kb", type=int, nargs="+", default=[256, 1024, 4096, 16384, 65536, 131072])
+    args = parser.parse_args()
+    run(args.sizes_kb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Download throughput of DownloadService.iter_chunk_packages at prefetch depth 1 (the old
+serial loop: read, unwrap, verify, then write, one chunk at a time) against deeper windows.
+
+Stores N server-wrapped chunk packages in a temp ChunkStorage, then streams them through the
+real read / unwrap / receipt-check path while the consumer simulates the socket with a fixed
+delay per package. Prints the median MB/s per depth. Needs SD_SERVER_STORAGE_KEY_B64 (any
+base64 32-byte key) and the usual settings environment.
+
+    cd Back-end
+    python -m benchmarks.download_prefetch
+    python -m benchmarks.download_prefetch --chunks 32 --chunk-mb 8 --depths 1 2 4 8 --write-ms 5
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from typing import List, Sequence
+
+from app.config.config import get_settings
+from app.security.server_wrapup import ServerCipherWrap
+from app.services.download_services import ChunkRef, DownloadService
+from app.storage.chunk_package import encode_chunk_package
+from app.storage.chunk_storage import ChunkStorage
+
+USER_ID = "bench"
+FILE_TYPE = "application/octet-stream"
+
+
+async def seed(service: DownloadService, upload_id: str, chunks: int, chunk_size: int) -> List[ChunkRef]:
+    plan = []
+    for i in range(chunks):
+        ct, nonce, tag = os.urandom(chunk_size), os.urandom(12), os.urandom(16)
+        aad = service.aad_bytes(upload_id=upload_id, chunk_size=chunk_size, file_size=chunks * chunk_size, file_type=FILE_TYPE, chunk_idx=i)
+        sha = hashlib.sha256(aad + nonce + ct + tag).hexdigest()
+        wrapped = await service.crypto.run(service.wrapper.wrapper, bytes(encode_chunk_package(i, nonce, tag, ct)))
+        key = await service.storage.save_chunk_object(USER_ID, sha, wrapped)
+        plan.append(ChunkRef(chunk_index=i, storage_key=key, sha256=sha, size=chunk_size))
+    return plan
+
+
+async def stream_mb_s(service: DownloadService, plan: Sequence[ChunkRef], upload_id: str, chunk_size: int, file_size: int,
+                      write_ms: float) -> float:
+    def aad_for(i: int) -> bytes:
+        return service.aad_bytes(upload_id=upload_id, chunk_size=chunk_size, file_size=file_size, file_type=FILE_TYPE, chunk_idx=i)
+
+    sent = 0
+    started = time.perf_counter()
+    async for package in service.iter_chunk_packages(plan, aad_for, verify_sha256=True):
+        sent += len(package)
+        await asyncio.sleep(write_ms / 1000)  # the socket drains while the window keeps loading
+    return sent / (time.perf_counter() - started) / (1 << 20)
+
+
+async def run(chunks: int, chunk_mb: int, depths: List[int], write_ms: float, repeat: int) -> None:
+    chunk_size = chunk_mb << 20
+    with tempfile.TemporaryDirectory(prefix="sd-bench-") as root:
+        service = DownloadService(file_repo=None, storage=ChunkStorage(root_dir=root), wrapper=ServerCipherWrap(),
+                                  folder_repo=None, settings=get_settings())
+        upload_id = str(uuid.uuid4())
+        plan = await seed(service, upload_id, chunks, chunk_size)
+        file_size = chunks * chunk_size
+
+        print(f"{chunks} x {chunk_mb} MB chunks, {write_ms:g} ms simulated write per chunk, median of {repeat}")
+        print(f"{'depth':>6} {'MB/s':>9} {'vs depth 1':>11}")
+        baseline = None
+        for depth in depths:
+            service.prefetch_chunks = depth
+            service.prefetch_max_bytes = max(service.prefetch_max_bytes, depth * chunk_size)
+            await stream_mb_s(service, plan[:2], upload_id, chunk_size, file_size, 0)  # warm the crypto pool
+            rate = statistics.median([await stream_mb_s(service, plan, upload_id, chunk_size, file_size, write_ms) for _ in range(repeat)])
+            baseline = baseline or rate
+            print(f"{depth:>6} {rate:>9.1f} {rate / baseline:>10.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=64)
+    parser.add_argument("--chunk-mb", type=int, default=4)
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 2, 4, 8], help="prefetch depths; the first is the baseline")
+    parser.add_argument("--write-ms", type=float, default=12.0, help="simulated socket write time per package")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.chunks, args.chunk_mb, args.depths, args.write_ms, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
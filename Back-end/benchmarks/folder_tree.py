@@ -0,0 +1,177 @@
+"""
+Repository-level benchmark for folder subtree / ancestor queries on a deep, wide tree: the
+heirarchy_path prefix scans FolderRepository uses against the recursive CTEs they replaced.
+
+Seeds one user with a `--depth`-level tree of `--folders` folders (breadth first, `--fanout`
+children per folder), then times for the whole tree, a mid-level subtree and the deepest
+folder:
+    list_subtree_folder_ids   prefix range scan   vs  WITH RECURSIVE down from the root
+    is_ancestor_of            one path lookup     vs  WITH RECURSIVE up from the node
+Against PostgreSQL everything runs in one transaction that is rolled back. SQLite URLs get a
+fresh in-memory schema; SQLite has no ~>=~ / ~<~ operators, so the same byte range is written
+with plain >= / < there (BINARY collation compares bytes, like text_pattern_ops).
+
+    cd Back-end
+    python -m benchmarks.folder_tree                           # DATABASE_POSTGRES_URL from settings
+    python -m benchmarks.folder_tree --url sqlite+aiosqlite://    # needs aiosqlite
+    python -m benchmarks.folder_tree --folders 100000 --depth 10 --repeat 5
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from sqlalchemy import and_, func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.config.config import get_settings
+from app.domain.persistance.models.dash_models import Folder
+from app.repositories.folder_repository import FolderRepository
+
+USER_ID = "bench"
+SEED_BATCH = 5000
+
+
+def build_tree(start_id: int, folders: int, depth: int, fanout: int) -> List[Dict]:
+    now = datetime.utcnow()
+    rows = [{"folder_id": start_id, "parent_folder_id": None, "depth_level": 0, "heirarchy_path": str(start_id)}]
+    level = [rows[0]]
+    next_id = start_id + 1
+    for d in range(1, depth):
+        children = []
+        for parent in level:
+            for _ in range(fanout):
+                if next_id - start_id >= folders:
+                    break
+                children.append({"folder_id": next_id, "parent_folder_id": parent["folder_id"], "depth_level": d,
+                                 "heirarchy_path": f"{parent['heirarchy_path']}/{next_id}"})
+                next_id += 1
+        rows.extend(children)
+        level = children
+    for r in rows:
+        r.update(user_id=USER_ID, folder_name=f"f{r['folder_id']}", is_shared=False, is_deleted=False, created_at=now, updated_at=now)
+    return rows
+
+
+async def seed(session: AsyncSession, folders: int, depth: int, fanout: int) -> List[Dict]:
+    # explicit ids above the current maximum, so paths can be written with the rows
+    start_id = int((await session.execute(select(func.coalesce(func.max(Folder.folder_id), 0)))).scalar_one()) + 1
+    rows = build_tree(start_id, folders, depth, fanout)
+    for i in range(0, len(rows), SEED_BATCH):
+        await session.execute(insert(Folder), rows[i:i + SEED_BATCH])
+    # fresh statistics, as autovacuum / a maintained database would have: without them SQLite walks
+    # the CTE through idx_folders_user_deleted instead of idx_folders_user_parent
+    await session.execute(text("ANALYZE folders"))
+    return rows
+
+
+async def cte_subtree_ids(session: AsyncSession, root_id: int) -> List[int]:
+    # list_subtree_folder_ids before heirarchy_path was maintained
+    t = Folder.__table__
+    tree = (select(t.c.folder_id).where(t.c.user_id == USER_ID).where(t.c.folder_id == root_id)
+            .where(t.c.is_deleted.is_(False)).cte(name="folder_tree", recursive=True))
+    tree = tree.union_all(
+        select(t.c.folder_id).where(t.c.user_id == USER_ID)
+        .where(t.c.parent_folder_id == tree.c.folder_id).where(t.c.is_deleted.is_(False))
+    )
+    return [int(r[0]) for r in (await session.execute(select(tree.c.folder_id))).all()]
+
+
+async def cte_is_ancestor_of(session: AsyncSession, root_id: int, node_id: int) -> bool:
+    # is_ancestor_of before heirarchy_path was maintained
+    t = Folder.__table__
+    up = (select(t.c.folder_id, t.c.parent_folder_id).where(t.c.folder_id == node_id).where(t.c.user_id == USER_ID)
+          .where(t.c.is_deleted.is_(False)).cte(name="root", recursive=True))
+    up = up.union_all(
+        select(t.c.folder_id, t.c.parent_folder_id).where(t.c.folder_id == up.c.parent_folder_id)
+        .where(t.c.user_id == USER_ID).where(t.c.is_deleted.is_(False))
+    )
+    res = await session.execute(select(up.c.folder_id).where(up.c.folder_id == root_id).limit(1))
+    return res.scalar_one_or_none() is not None
+
+
+async def median_ms(fn: Callable[[], Awaitable], repeat: int) -> float:
+    await fn()  # warm the statement / plan caches
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def pick_targets(rows: List[Dict]) -> List[Tuple[str, Dict]]:
+    by_depth: Dict[int, List[Dict]] = {}
+    for r in rows:
+        by_depth.setdefault(r["depth_level"], []).append(r)
+    mid = min(2, max(by_depth))
+    return [("whole tree", rows[0]), (f"depth-{mid} subtree", by_depth[mid][0]), ("deepest folder", by_depth[max(by_depth)][-1])]
+
+
+async def run(url: str, folders: int, depth: int, fanout: int, repeat: int) -> None:
+    engine = create_async_engine(url)
+    sqlite = engine.dialect.name == "sqlite"
+    if sqlite:
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda c: Folder.__table__.create(c))
+        FolderRepository.under_path = staticmethod(
+            lambda path: and_(Folder.heirarchy_path >= f"{path}/", Folder.heirarchy_path < f"{path}0")
+        )
+
+    repo = FolderRepository()
+    try:
+        async with AsyncSession(engine) as session:
+            try:
+                rows = await seed(session, folders, depth, fanout)
+                root_id = rows[0]["folder_id"]
+                print(f"{engine.dialect.name}: {len(rows)} folders, {depth} levels, fanout {fanout}; median of {repeat}")
+                print(f"{'query':<34} {'rows':>7} {'prefix scan':>13} {'recursive CTE':>15}")
+
+                for label, node in pick_targets(rows):
+                    node_id = node["folder_id"]
+
+                    async def prefix() -> List[int]:
+                        return await repo.list_subtree_folder_ids(session, USER_ID, node_id, include_deleted=False)
+
+                    async def cte() -> List[int]:
+                        return await cte_subtree_ids(session, node_id)
+
+                    found = sorted(await prefix())
+                    assert found == sorted(await cte()), "prefix scan and CTE disagree"
+                    new, old = await median_ms(prefix, repeat), await median_ms(cte, repeat)
+                    print(f"{'subtree: ' + label:<34} {len(found):>7} {new:>10.2f} ms {old:>12.2f} ms")
+
+                deepest_row = pick_targets(rows)[-1][1]
+                deepest = deepest_row["folder_id"]
+
+                async def path_lookup() -> bool:
+                    return await repo.is_ancestor_of(session, USER_ID, root_id, deepest)
+
+                async def walk_up() -> bool:
+                    return await cte_is_ancestor_of(session, root_id, deepest)
+
+                assert await path_lookup() and await walk_up()
+                new, old = await median_ms(path_lookup, repeat * 10), await median_ms(walk_up, repeat * 10)
+                label = f"is_ancestor_of: depth {deepest_row['depth_level']}"
+                print(f"{label:<34} {1:>7} {new:>10.3f} ms {old:>12.3f} ms")
+            finally:
+                await session.rollback()  # seeded rows never persist
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="async SQLAlchemy URL (default: settings.database_postgres_url)")
+    parser.add_argument("--folders", type=int, default=100_000)
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.url or get_settings().database_postgres_url, args.folders, args.depth, args.fanout, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Repository-level benchmark for UploadChunkRepository.last_indices on large upload sessions.
+
+Seeds one upload session with N receipt rows per size, times last_indices() through the
+real repository (and, for comparison, the entity select it replaced), and prints the
+median latency. Against PostgreSQL everything runs in one transaction that is rolled back,
+so nothing is left behind; SQLite URLs get a fresh in-memory schema.
+
+    cd Back-end
+    python -m benchmarks.last_indices                         # DATABASE_POSTGRES_URL from settings
+    python -m benchmarks.last_indices --url sqlite+aiosqlite://  # needs aiosqlite
+    python -m benchmarks.last_indices --sizes 10000 100000 --repeat 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, List
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.config.config import get_settings
+from app.domain.persistance.models import dash_models  # noqa: F401  folders, referenced by upload_sessions
+from app.domain.persistance.models.upload_models import UploadChunk, UploadSession
+from app.repositories.upload_chunk_repository import UploadChunkRepository
+
+SEED_BATCH = 5000
+
+
+async def seed(session: AsyncSession, upload_id: uuid.UUID, n: int) -> None:
+    now = datetime.utcnow()
+    await session.execute(insert(UploadSession).values(
+        upload_id=upload_id, user_id="bench", file_name="bench.bin", file_type="application/octet-stream",
+        file_size=n << 20, chunk_size=1 << 20, total_chunks=n, status="UPLOADING", reserved_bytes=0,
+        received_count=0, is_pack=False, created_at=now, updated_at=now, expires_at=UploadSession.default_expiry(),
+    ))
+    for start in range(0, n, SEED_BATCH):
+        await session.execute(insert(UploadChunk), [
+            {"upload_id": upload_id, "chunk_index": i, "total_size": 1 << 20, "sha256": f"{i:064x}",
+             "storage_key": f"objects/bench/{i % 256:02x}/{i:064x}.c2", "created_at": now}
+            for i in range(start, min(n, start + SEED_BATCH))
+        ])
+
+
+async def median_ms(fn: Callable[[], Awaitable[List[int]]], repeat: int) -> float:
+    await fn()  # warm the statement / plan caches
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+async def run(url: str, sizes: List[int], repeat: int) -> None:
+    engine = create_async_engine(url)
+    sqlite = engine.dialect.name == "sqlite"
+    if sqlite:
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda c: UploadSession.__table__.create(c))
+            await conn.run_sync(lambda c: UploadChunk.__table__.create(c))
+
+    repo = UploadChunkRepository()
+    print(f"{engine.dialect.name}: median of {repeat}")
+    print(f"{'chunks':>8} {'last_indices':>14} {'per chunk':>11} {'entities (old)':>16}")
+    try:
+        async with AsyncSession(engine) as session:
+            try:
+                for n in sizes:
+                    upload_id = uuid.uuid4()
+                    await seed(session, upload_id, n)
+
+                    async def current() -> List[int]:
+                        return await repo.last_indices(session, upload_id)
+
+                    async def entities() -> List[int]:
+                        stmt = select(UploadChunk).where(UploadChunk.upload_id == upload_id).order_by(UploadChunk.chunk_index)
+                        rows = (await session.execute(stmt)).scalars().all()
+                        session.expunge_all()
+                        return [r.chunk_index for r in rows]
+
+                    assert await current() == list(range(n))
+                    new = await median_ms(current, repeat)
+                    old = await median_ms(entities, max(1, repeat // 4))
+                    print(f"{n:>8} {new:>11.1f} ms {new * 1000 / n:>8.2f} us {old:>13.1f} ms")
+            finally:
+                await session.rollback()  # seeded rows never persist
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="async SQLAlchemy URL (default: settings.database_postgres_url)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000, 100000])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.url or get_settings().database_postgres_url, args.sizes, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
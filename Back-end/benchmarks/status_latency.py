@@ -0,0 +1,136 @@
+"""
+GET /file/{upload_id}/status latency while chunk writes saturate the disk.
+
+Runs the real files router over ASGI (the DB session and the upload row are faked, so only
+the event loop is under test) and keeps `--probes` clients polling /status while `--writers`
+tasks store `--chunks` x `--chunk-mb` chunk objects. Writes go either through the storage I/O
+pool (ChunkStorage / StorageIO, with the given fsync mode) or inline on the event loop, the
+way ChunkStorage wrote before the pool. Prints /status p50 / p99 / max per mode, plus an idle
+baseline.
+
+    cd Back-end
+    python -m benchmarks.status_latency
+    python -m benchmarks.status_latency --fsync off always batch --writers 16 --chunk-mb 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List, Optional
+
+import httpx
+from fastapi import FastAPI
+
+from app.api.dependencies import get_current_user
+from app.api.routers import files as files_router
+from app.domain.persistance.database import get_db
+from app.storage.chunk_storage import ChunkStorage
+from app.storage.storage_io import StorageIO, write_atomic
+
+USER_ID = "bench"
+TOTAL_CHUNKS = 1000
+
+
+class UploadRow:
+    async def get_progress(self, session, user_id, upload_id):
+        await asyncio.sleep(0)  # stands in for the one-row SELECT
+        return SimpleNamespace(
+            upload_id=upload_id, status="UPLOADING", chunk_size=4 << 20, total_chunks=TOTAL_CHUNKS,
+            received_bitmap=b"\x55" * (TOTAL_CHUNKS // 8), received_count=TOTAL_CHUNKS // 2,
+        )
+
+
+def build_app() -> FastAPI:
+    async def fake_db():
+        yield SimpleNamespace()
+
+    files_router._upload_service.session_repo = UploadRow()
+    app = FastAPI()
+    app.include_router(files_router.router)
+    app.dependency_overrides[get_db] = fake_db
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(user_id=USER_ID)
+    return app
+
+
+async def write_inline(root: Path, sha: str, data: bytes) -> None:
+    write_atomic(root / "inline" / sha[:2] / f"{sha}.c2", data)
+
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event, out: List[float]) -> None:
+    url = f"/file/{uuid.uuid4()}/status"
+    while not stop.is_set():
+        started = time.perf_counter()
+        r = await client.get(url)
+        out.append((time.perf_counter() - started) * 1000)
+        assert r.status_code == 200, r.text
+        await asyncio.sleep(0.005)
+
+
+async def measure(app: FastAPI, root: Path, mode: str, fsync: Optional[str], args) -> None:
+    payload = os.urandom(args.chunk_mb << 20)
+    storage = ChunkStorage(root_dir=str(root), io=StorageIO(workers=args.io_workers, fsync=fsync or "off")) if fsync else None
+
+    async def writer(w: int) -> None:
+        for i in range(args.chunks):
+            sha = f"{w:08x}{i:056x}"
+            if storage is not None:
+                await storage.save_chunk_object(USER_ID, sha, payload)
+            else:
+                await write_inline(root, sha, payload)
+            await asyncio.sleep(0)
+
+    latencies: List[float] = []
+    stop = asyncio.Event()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        probes = [asyncio.create_task(probe(client, stop, latencies)) for _ in range(args.probes)]
+        started = time.perf_counter()
+        if mode == "idle":
+            await asyncio.sleep(args.idle_seconds)
+        else:
+            await asyncio.gather(*(writer(w) for w in range(args.writers)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await asyncio.gather(*probes)
+    if storage is not None:
+        storage.io.shutdown()
+
+    written = 0 if mode == "idle" else args.writers * args.chunks * args.chunk_mb
+    q = statistics.quantiles(latencies, n=100, method="inclusive")
+    label = mode if fsync is None else f"{mode} fsync={fsync}"
+    print(f"{label:<20} {len(latencies):>8} {q[49]:>9.2f} {q[98]:>9.2f} {max(latencies):>9.2f} {written / elapsed:>9.1f}")
+
+
+async def run(args) -> None:
+    app = build_app()
+    print(f"{args.probes} /status pollers; {args.writers} writers x {args.chunks} x {args.chunk_mb} MB; "
+          f"{args.io_workers} I/O workers")
+    print(f"{'mode':<20} {'requests':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'MB/s':>9}")
+    with tempfile.TemporaryDirectory(prefix="sd-bench-") as tmp:
+        root = Path(tmp)
+        await measure(app, root, "idle", None, args)
+        await measure(app, root, "inline", None, args)
+        for fsync in args.fsync:
+            await measure(app, root, "pool", fsync, args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--chunks", type=int, default=12, help="chunks per writer")
+    parser.add_argument("--chunk-mb", type=int, default=4)
+    parser.add_argument("--probes", type=int, default=20, help="concurrent /status pollers")
+    parser.add_argument("--io-workers", type=int, default=4)
+    parser.add_argument("--fsync", nargs="+", default=["off", "always", "batch"], choices=["off", "always", "batch"])
+    parser.add_argument("--idle-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
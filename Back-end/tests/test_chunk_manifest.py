@@ -0,0 +1,148 @@
+"""
+SDM1 binary manifests: every storage key shape finalize writes (content-addressed objects,
+pack members, plain keys) must come back byte-for-byte from ManifestView, the receipts digest
+must equal the JSON manifest's integrity_hash, and damaged headers must be refused rather than
+read past.
+"""
+import hashlib
+import struct
+import uuid
+
+import pytest
+
+from app.storage.chunk_manifest import HEADER, MAGIC, ManifestView, encode_manifest, is_binary_manifest
+
+USER_ID = "user-1"
+CHUNK_SIZE = 4096
+
+
+def _sha(n: int) -> str:
+    return hashlib.sha256(str(n).encode()).hexdigest()
+
+
+def _object_key(sha: str) -> str:
+    return f"objects/{USER_ID}/{sha[:2]}/{sha}.c2"
+
+
+def _manifest(keys, sizes=None):
+    chunks = []
+    for i, key in enumerate(keys):
+        sha = key[1] if isinstance(key, tuple) else _sha(i)
+        key = key[0] if isinstance(key, tuple) else key
+        chunks.append({"i": i, "k": key, "h": sha, "s": (sizes or {}).get(i, CHUNK_SIZE)})
+    return {
+        "upload_id": str(uuid.uuid4()), "chunk_size": CHUNK_SIZE, "total_chunks": len(chunks),
+        "file_size": sum(c["s"] for c in chunks), "file_type": "video/mp4",
+        "integrity_hash": hashlib.sha256("".join(c["h"] for c in chunks).encode()).hexdigest(), "chunks": chunks,
+    }
+
+
+def _mixed():
+    pack_sha = _sha(99)
+    pack = f"packs/{USER_ID}/{pack_sha[:2]}/{pack_sha}.pk"
+    return _manifest([
+        _object_key(_sha(0)),
+        _object_key(_sha(1)),
+        f"{pack}#0:4124",
+        f"{pack}#4124:1000",
+        ("legacy/upload/chunk_4.c2", _sha(4)),
+        _object_key(_sha(5)),
+    ], sizes={3: 1000})
+
+
+def test_round_trip_object_and_pack_keys():
+    manifest = _mixed()
+    view = ManifestView(encode_manifest(manifest))
+
+    assert (view.upload_id, view.chunk_size, view.total_chunks, view.file_size, view.file_type, view.integrity_hash) == (
+        manifest["upload_id"], CHUNK_SIZE, 6, manifest["file_size"], "video/mp4", manifest["integrity_hash"])
+    for pos, c in enumerate(manifest["chunks"]):
+        chunk = view.chunk(pos)
+        assert (chunk.chunk_index, chunk.storage_key, chunk.sha256, chunk.size) == (c["i"], c["k"], c["h"], c["s"])
+    assert view.objects() == [(c["h"], c["k"]) for c in manifest["chunks"]]
+    # the SHA-named objects share one directory key, the pack members their pack's key
+    assert view.key_count == 3
+
+
+def test_chunks_slice_starts_anywhere():
+    manifest = _mixed()
+    view = ManifestView(encode_manifest(manifest))
+
+    assert [c.storage_key for c in view.chunks(2, 4)] == [c["k"] for c in manifest["chunks"][2:4]]
+    assert [c.chunk_index for c in view.chunks(5, 100)] == [5]
+    with pytest.raises(IndexError):
+        view.chunk(6)
+
+
+def test_object_key_not_named_by_its_sha_is_stored_whole():
+    other = _sha(7)
+    manifest = _manifest([(_object_key(other), _sha(0))])
+    view = ManifestView(encode_manifest(manifest))
+
+    assert view.chunk(0).storage_key == _object_key(other)
+    assert view.chunk(0).sha256 == _sha(0)
+
+
+def test_receipts_digest_matches_integrity_hash():
+    manifest = _mixed()
+    view = ManifestView(encode_manifest(manifest))
+
+    assert view.receipts_digest() == manifest["integrity_hash"]
+    expected = hashlib.sha256("".join(c["h"] for c in manifest["chunks"]).encode()).hexdigest()
+    assert view.receipts_digest() == expected
+
+
+def test_legacy_field_names_accepted():
+    manifest = _mixed()
+    manifest["chunks"] = [{"c2_rel": c["k"], "sha256": c["h"], "i": c["i"], "s": c["s"]} for c in manifest["chunks"]]
+    view = ManifestView(encode_manifest(manifest))
+
+    assert [c.storage_key for c in view.chunks()] == [c["c2_rel"] for c in manifest["chunks"]]
+
+
+def test_chunk_count_mismatch_rejected():
+    manifest = _mixed()
+    manifest["total_chunks"] += 1
+    with pytest.raises(ValueError, match="count mismatch"):
+        encode_manifest(manifest)
+
+
+@pytest.mark.parametrize("cut", [0, 4, HEADER.size - 1])
+def test_truncated_header_rejected(cut):
+    data = encode_manifest(_mixed())
+    with pytest.raises(ValueError, match="truncated"):
+        ManifestView(data[:cut])
+
+
+def test_truncated_key_table_rejected():
+    data = encode_manifest(_mixed())
+    view = ManifestView(data)
+    with pytest.raises(ValueError, match="truncated"):
+        ManifestView(data[:view.blob_off - 1])
+
+
+def test_corrupt_magic_rejected():
+    data = bytearray(encode_manifest(_mixed()))
+    data[:4] = b"SDM9"
+    assert not is_binary_manifest(data)
+    with pytest.raises(ValueError, match="Not a binary manifest"):
+        ManifestView(bytes(data))
+
+
+@pytest.mark.parametrize("offset, value", [(4, 2), (6, 40)])
+def test_unsupported_version_or_entry_size_rejected(offset, value):
+    data = bytearray(encode_manifest(_mixed()))
+    assert bytes(data[:4]) == MAGIC
+    struct.pack_into(">H", data, offset, value)
+    with pytest.raises(ValueError, match="Unsupported manifest version"):
+        ManifestView(bytes(data))
+
+
+def test_corrupt_table_offsets_rejected():
+    data = bytearray(encode_manifest(_mixed()))
+    # table_off sits after magic, version, entry_size, chunk_size, total_chunks, file_size, upload_id, integrity
+    table_off_at = 4 + 2 + 2 + 4 + 4 + 8 + 16 + 32
+    (table_off,) = struct.unpack_from(">Q", data, table_off_at)
+    struct.pack_into(">Q", data, table_off_at, table_off + 8)
+    with pytest.raises(ValueError, match="truncated"):
+        ManifestView(bytes(data))
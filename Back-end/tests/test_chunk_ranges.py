@@ -0,0 +1,195 @@
+"""
+"chunks" Range headers on downloads: parse_chunk_ranges turns the header into inclusive chunk
+pairs (None = ignore the header and send the whole file, DownloadRangeError = 416) and
+chunk_spans merges them into the spans that are streamed. The last tests go through the
+download endpoint for the status codes and Content-Range headers a client sees.
+"""
+import asyncio
+import hashlib
+import os
+import uuid
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.api.dependencies import get_current_user
+from app.api.routers import files as files_router
+from app.config.config import get_settings
+from app.domain.persistance.database import get_db
+from app.services.chunk_store_service import ChunkStoreService
+from app.services.download_services import ChunkSpan, DownloadRangeError, DownloadService
+from app.storage.chunk_package import encode_chunk_package
+from app.storage.chunk_storage import ChunkStorage
+
+TOTAL = 10
+USER_ID = "user-1"
+CHUNK_SIZE = 1024
+FILE_TYPE = "application/octet-stream"
+
+parse = DownloadService.parse_chunk_ranges
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("chunks=0-3", [(0, 3)]),
+    ("chunks=2-2", [(2, 2)]),
+    ("chunks=4-9", [(4, 9)]),
+    ("chunks=8-100", [(8, 9)]),
+    ("CHUNKS = 1 - 2 , 5-6", [(1, 2), (5, 6)]),
+    ("chunks=7-8, 0-1", [(7, 8), (0, 1)]),
+])
+def test_closed_ranges(header, expected):
+    assert parse(header, TOTAL) == expected
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("chunks=-1", [(9, 9)]),
+    ("chunks=-3", [(7, 9)]),
+    ("chunks=-10", [(0, 9)]),
+    ("chunks=-50", [(0, 9)]),
+    ("chunks=-0, 2-3", [(2, 3)]),
+])
+def test_suffix_ranges(header, expected):
+    assert parse(header, TOTAL) == expected
+
+
+def test_suffix_zero_alone_not_satisfiable():
+    with pytest.raises(DownloadRangeError) as e:
+        parse("chunks=-0", TOTAL)
+    assert e.value.total_chunks == TOTAL
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("chunks=3-", [(3, 9)]),
+    ("chunks=0-", [(0, 9)]),
+    ("chunks=9-", [(9, 9)]),
+    ("chunks= -0, 3-", [(3, 9)]),
+])
+def test_open_ended_ranges(header, expected):
+    assert parse(header, TOTAL) == expected
+
+
+@pytest.mark.parametrize("header", ["chunks=4-2", "chunks=0-1, 5-3"])
+def test_end_before_start_ignores_header(header):
+    assert parse(header, TOTAL) is None
+
+
+@pytest.mark.parametrize("header", ["chunks=10-", "chunks=10-12", "chunks=15-20, 30-"])
+def test_start_past_total_not_satisfiable(header):
+    with pytest.raises(DownloadRangeError) as e:
+        parse(header, TOTAL)
+    assert e.value.total_chunks == TOTAL
+
+
+def test_unsatisfiable_ranges_dropped_next_to_satisfiable_ones():
+    assert parse("chunks=12-14, 1-2", TOTAL) == [(1, 2)]
+
+
+def test_too_many_ranges_ignores_header():
+    limit = DownloadService.MAX_RANGES
+    at_limit = "chunks=" + ", ".join(["0-0"] * limit)
+    assert parse(at_limit, TOTAL) == [(0, 0)] * limit
+    assert parse(at_limit + ", 1-1", TOTAL) is None
+
+
+@pytest.mark.parametrize("header", [
+    None, "", "bytes=0-99", "bytes=-500", "items=0-1", "chunks", "chunks=", "chunks=,", "chunks=-",
+    "chunks=x-1", "chunks=1-2-3", "chunks=a", "chunks=1",
+])
+def test_other_units_and_malformed_ignored(header):
+    assert parse(header, TOTAL) is None
+
+
+def test_empty_file_ignores_header():
+    assert parse("chunks=0-0", 0) is None
+
+
+@pytest.mark.parametrize("ranges, expected", [
+    ([(0, 3)], [(0, 3)]),
+    ([(5, 6), (0, 1)], [(0, 1), (5, 6)]),
+    ([(0, 3), (2, 5)], [(0, 5)]),
+    ([(0, 1), (2, 3)], [(0, 3)]),
+    ([(4, 4), (0, 9)], [(0, 9)]),
+    ([(0, 0), (0, 0), (8, 9), (7, 7)], [(0, 0), (7, 9)]),
+])
+def test_chunk_spans_merge_in_file_order(ranges, expected):
+    assert DownloadService.chunk_spans(ranges) == [ChunkSpan(first=a, last=b) for a, b in expected]
+
+
+async def _store_file(storage: ChunkStorage):
+    service = files_router._download_service
+    upload_id = str(uuid.uuid4())
+    file_size = CHUNK_SIZE * TOTAL
+    chunks = []
+    for i in range(TOTAL):
+        ct, nonce, tag = os.urandom(CHUNK_SIZE), os.urandom(12), os.urandom(16)
+        aad = service.aad_bytes(upload_id=upload_id, chunk_size=CHUNK_SIZE, file_size=file_size, file_type=FILE_TYPE, chunk_idx=i)
+        sha = hashlib.sha256(aad + nonce + ct + tag).hexdigest()
+        package = service.wrapper.wrapper(bytes(encode_chunk_package(i, nonce, tag, ct)))
+        key = await storage.save_chunk_object(USER_ID, sha, package)
+        chunks.append({"i": i, "k": key, "h": sha, "s": CHUNK_SIZE})
+    integrity_hash = hashlib.sha256("".join(c["h"] for c in chunks).encode()).hexdigest()
+    manifest = {
+        "upload_id": upload_id, "chunk_size": CHUNK_SIZE, "total_chunks": TOTAL, "file_size": file_size,
+        "file_type": FILE_TYPE, "integrity_hash": integrity_hash, "chunks": chunks,
+    }
+    path = await ChunkStoreService(None, storage, settings=get_settings()).write_manifest(USER_ID, manifest, "file.bin")
+    return SimpleNamespace(
+        file_name="file.bin", file_type=FILE_TYPE, file_size=file_size, file_path=path,
+        integrity_hash=integrity_hash, encryption_metadata=None,
+    )
+
+
+@pytest.fixture
+def download(tmp_path, monkeypatch):
+    service = files_router._download_service
+    storage = ChunkStorage(root_dir=str(tmp_path))
+    file = asyncio.run(_store_file(storage))
+
+    class FileRepo:
+        async def get_active_file(self, session, user_id, file_id):
+            return file
+
+    class Session:
+        async def close(self):
+            pass
+
+    async def fake_db():
+        yield Session()
+
+    monkeypatch.setattr(service, "storage", storage)
+    monkeypatch.setattr(service, "filerepo", FileRepo())
+    app = FastAPI()
+    app.include_router(files_router.router)
+    app.dependency_overrides[get_db] = fake_db
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(user_id=USER_ID)
+
+    async def get(range_header):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request("GET", f"/file/download/{uuid.uuid4()}", headers={"Range": range_header},
+                                        json={"file_id": str(uuid.uuid4()), "version_id": None, "verify_sha": True})
+
+    return lambda range_header: asyncio.run(get(range_header))
+
+
+def test_endpoint_range_past_total_is_416(download):
+    r = download("chunks=10-")
+    assert r.status_code == 416
+    assert r.headers["Content-Range"] == f"chunks */{TOTAL}"
+
+
+def test_endpoint_suffix_range_is_206(download):
+    r = download("chunks=-3")
+    assert r.status_code == 206, r.text
+    assert r.headers["Content-Range"] == f"chunks 7-9/{TOTAL}"
+
+
+@pytest.mark.parametrize("header", ["bytes=0-99", "chunks=4-2"])
+def test_endpoint_ignored_header_sends_whole_file(download, header):
+    full = download("")
+    r = download(header)
+    assert r.status_code == 200
+    assert "Content-Range" not in r.headers
+    assert len(r.content) == len(full.content) > 0
@@ -0,0 +1,204 @@
+"""
+Downloads must hand their pooled connection back once the metadata is read, not when the
+body finishes streaming: with the pool sized for short queries, 200 slow downloads would
+otherwise hold 200 connections for the whole transfer.
+
+The endpoints run through ASGI against a counting fake session. Each request remembers its
+session in a context variable (the streaming task inherits the request's context), and storage
+checks that the session of the request it serves is already closed: when the endpoint first
+opens the file, which is before FastAPI exits the get_db dependency, and on every read while
+the body streams.
+"""
+import asyncio
+import contextvars
+import hashlib
+import os
+import uuid
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.api.dependencies import get_current_user
+from app.api.routers import files as files_router
+from app.config.config import get_settings
+from app.domain.persistance.database import get_db
+from app.services.chunk_store_service import ChunkStoreService
+from app.storage.chunk_package import encode_chunk_package
+from app.storage.chunk_storage import ChunkStorage
+
+CONCURRENCY = 200
+TOTAL_CHUNKS = 4
+CHUNK_SIZE = 16 * 1024
+FILE_TYPE = "application/octet-stream"
+USER_ID = "user-1"
+
+_request_session: contextvars.ContextVar["CountingSession"] = contextvars.ContextVar("request_session")
+
+
+class SessionCounter:
+    def __init__(self) -> None:
+        self.opened = 0
+        self.held = 0
+        self.max_held = 0
+        self.reads = 0
+        self.unreleased = 0
+
+    async def get_db(self):
+        session = CountingSession(self)
+        try:
+            yield session
+        finally:
+            await session.close()
+
+    def check_released(self) -> None:
+        # counted rather than raised: the endpoints turn exceptions into a bare 500
+        self.reads += 1
+        if not _request_session.get().closed:
+            self.unreleased += 1
+
+
+class CountingSession:
+    """Checks out a "connection" on the first statement, like AsyncSession does."""
+
+    def __init__(self, counter: SessionCounter) -> None:
+        self.counter = counter
+        self.checked_out = False
+        self.closed = False
+        counter.opened += 1
+
+    async def execute(self, *args, **kwargs):
+        assert not self.closed, "statement on a closed session"
+        if not self.checked_out:
+            self.checked_out = True
+            self.counter.held += 1
+            self.counter.max_held = max(self.counter.max_held, self.counter.held)
+        _request_session.set(self)
+        await asyncio.sleep(0.001)
+
+    async def close(self) -> None:
+        if self.checked_out:
+            self.checked_out = False
+            self.counter.held -= 1
+        self.closed = True
+
+
+@pytest.fixture
+def counter() -> SessionCounter:
+    return SessionCounter()
+
+
+@pytest.fixture
+def app(counter: SessionCounter) -> FastAPI:
+    app = FastAPI()
+    app.include_router(files_router.router)
+    app.dependency_overrides[get_db] = counter.get_db
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(user_id=USER_ID)
+    return app
+
+
+async def _get_all(app: FastAPI, paths, request_kwargs):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+        return await asyncio.gather(*(client.request("GET", path, **request_kwargs(path)) for path in paths))
+
+
+async def _store_file(storage: ChunkStorage):
+    service = files_router._download_service
+    upload_id = str(uuid.uuid4())
+    file_size = CHUNK_SIZE * TOTAL_CHUNKS
+    chunks = []
+    for i in range(TOTAL_CHUNKS):
+        ct, nonce, tag = os.urandom(CHUNK_SIZE), os.urandom(12), os.urandom(16)
+        aad = service.aad_bytes(upload_id=upload_id, chunk_size=CHUNK_SIZE, file_size=file_size, file_type=FILE_TYPE, chunk_idx=i)
+        sha = hashlib.sha256(aad + nonce + ct + tag).hexdigest()
+        package = service.wrapper.wrapper(bytes(encode_chunk_package(i, nonce, tag, ct)))
+        key = await storage.save_chunk_object(USER_ID, sha, package)
+        chunks.append({"i": i, "k": key, "h": sha, "s": CHUNK_SIZE})
+    integrity_hash = hashlib.sha256("".join(c["h"] for c in chunks).encode()).hexdigest()
+    manifest = {
+        "upload_id": upload_id, "chunk_size": CHUNK_SIZE, "total_chunks": TOTAL_CHUNKS, "file_size": file_size,
+        "file_type": FILE_TYPE, "integrity_hash": integrity_hash, "chunks": chunks,
+    }
+    path = await ChunkStoreService(None, storage, settings=get_settings()).write_manifest(USER_ID, manifest, "file.bin")
+    return SimpleNamespace(
+        file_name="file.bin", file_type=FILE_TYPE, file_size=file_size, file_path=path,
+        integrity_hash=integrity_hash, encryption_metadata=None,
+    )
+
+
+def test_download_releases_connection_before_streaming(app, counter, tmp_path, monkeypatch):
+    service = files_router._download_service
+    storage = ChunkStorage(root_dir=str(tmp_path))
+    file = asyncio.run(_store_file(storage))
+
+    class FileRepo:
+        async def get_active_file(self, session, user_id, file_id):
+            await session.execute("SELECT files")
+            return file
+
+    open_manifest, read_bytes = storage.open_manifest, storage.read_bytes
+
+    async def checked_open(path):
+        counter.check_released()
+        return await open_manifest(path)
+
+    async def slow_read(key):
+        counter.check_released()
+        await asyncio.sleep(0.01)
+        return await read_bytes(key)
+
+    monkeypatch.setattr(storage, "open_manifest", checked_open)
+    monkeypatch.setattr(storage, "read_bytes", slow_read)
+    monkeypatch.setattr(service, "storage", storage)
+    monkeypatch.setattr(service, "filerepo", FileRepo())
+
+    paths = [f"/file/download/{uuid.uuid4()}" for _ in range(CONCURRENCY)]
+    body = lambda path: {"json": {"file_id": path.rsplit("/", 1)[1], "version_id": None, "verify_sha": True}}
+    responses = asyncio.run(_get_all(app, paths, body))
+
+    assert counter.unreleased == 0, "storage was read while the request still held its connection"
+    assert [r.status_code for r in responses] == [200] * CONCURRENCY
+    assert counter.opened == CONCURRENCY
+    assert counter.reads == CONCURRENCY * (1 + TOTAL_CHUNKS)
+    assert counter.held == 0
+    assert counter.max_held < CONCURRENCY
+
+
+def test_cipher_stream_releases_connection_before_streaming(app, counter, tmp_path, monkeypatch):
+    preview = files_router._preview_service
+    payload = os.urandom(64 * 1024)
+    cipher_path = tmp_path / "file.enc"
+    cipher_path.write_bytes(payload)
+
+    async def resolve_metadata(session, **kwargs):
+        await session.execute("SELECT files")
+        return SimpleNamespace(cipher_size=len(payload)), cipher_path
+
+    iterate_range = preview.iterate_range
+
+    def checked_iterate(start, end, path):
+        counter.check_released()
+
+        async def slow():
+            counter.check_released()
+            await asyncio.sleep(0.01)
+            async for block in iterate_range(start, end, path):
+                yield block
+
+        return slow()
+
+    monkeypatch.setattr(preview, "resolve_metadata", resolve_metadata)
+    monkeypatch.setattr(preview, "iterate_range", checked_iterate)
+
+    paths = [f"/file/{uuid.uuid4()}/cipher" for _ in range(CONCURRENCY)]
+    responses = asyncio.run(_get_all(app, paths, lambda path: {}))
+
+    assert counter.unreleased == 0, "storage was read while the request still held its connection"
+    assert [r.status_code for r in responses] == [200] * CONCURRENCY
+    assert all(r.content == payload for r in responses)
+    assert counter.opened == CONCURRENCY
+    assert counter.reads == CONCURRENCY * 2
+    assert counter.held == 0
+    assert counter.max_held < CONCURRENCY
@@ -0,0 +1,103 @@
+"""
+Replacing a file's live manifest (finalize with replace_of_file_id, version restore) writes the
+new manifest under a fresh name. The old one is unlinked only after get_db_tx commits; a
+rollback keeps the row's manifest intact and removes the new one.
+"""
+import asyncio
+import uuid
+
+import pytest
+
+from app.domain.persistance import database
+from app.services.chunk_store_service import ChunkStoreService
+from app.storage.chunk_storage import ChunkStorage
+
+USER_ID = "user-1"
+
+
+class FakeTransaction:
+    def __init__(self, session: "FakeSession") -> None:
+        self.session = session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.session.committed = exc_type is None
+        return False
+
+
+class FakeSession:
+    def __init__(self) -> None:
+        self.info = {}
+        self.committed = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def begin(self) -> FakeTransaction:
+        return FakeTransaction(self)
+
+
+def _manifest(n: int):
+    chunks = [
+        {"i": i, "k": f"objects/{USER_ID}/{i:02x}/{i:064x}.c2", "h": f"{i:064x}", "s": 1024}
+        for i in range(n)
+    ]
+    return {
+        "upload_id": str(uuid.uuid4()), "chunk_size": 1024, "total_chunks": n, "file_size": 1024 * n,
+        "file_type": "application/octet-stream", "integrity_hash": "0" * 64, "chunks": chunks,
+    }
+
+
+async def _replace(store: ChunkStoreService, fail: bool):
+    file_id = uuid.uuid4()
+    old_key = await store.write_manifest(USER_ID, _manifest(2), str(file_id))
+
+    dependency = database.get_db_tx()
+    session = await dependency.__anext__()
+    new_key = await store.write_manifest(USER_ID, _manifest(3), store.live_manifest_name(file_id))
+    store.swap_manifest(session, old_key, new_key)
+    assert new_key != old_key
+    assert store.storage.resolve_key(old_key).exists() and store.storage.resolve_key(new_key).exists()
+
+    if fail:
+        with pytest.raises(RuntimeError):
+            await dependency.athrow(RuntimeError("usage.apply failed"))
+    else:
+        with pytest.raises(StopAsyncIteration):
+            await dependency.__anext__()
+    return session, old_key, new_key
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch) -> ChunkStoreService:
+    monkeypatch.setattr(database, "async_session", FakeSession)
+    return ChunkStoreService(None, ChunkStorage(root_dir=str(tmp_path)))
+
+
+def test_old_manifest_removed_after_commit(store):
+    session, old_key, new_key = asyncio.run(_replace(store, fail=False))
+
+    assert session.committed is True
+    assert not store.storage.resolve_key(old_key).exists()
+    view = asyncio.run(store.storage.open_manifest(new_key))
+    try:
+        assert view.total_chunks == 3
+    finally:
+        view.close()
+
+
+def test_rollback_keeps_old_manifest(store):
+    session, old_key, new_key = asyncio.run(_replace(store, fail=True))
+
+    assert session.committed is False
+    assert not store.storage.resolve_key(new_key).exists()
+    view = asyncio.run(store.storage.open_manifest(old_key))
+    try:
+        assert view.total_chunks == 2
+    finally:
+        view.close()